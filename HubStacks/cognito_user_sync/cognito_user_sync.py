@@ -0,0 +1,349 @@
+# Create and delete the Cognito users of non TU Delft users in batches.
+#
+# Runs as the Lambda function of HubStack's Custom::CognitoUsers resource,
+# see HubStacks/cognito_users.py, which receives the full list of users and
+# creates the users that are missing from the user pool and deletes the
+# users that were removed from the list. Also runs from the command line:
+#
+#   python cognito_user_sync.py sync --temp-password ... admins allowed_users
+#   python cognito_user_sync.py cleanup
+#
+# 'sync' creates the missing non TU Delft users of the admins and
+# allowed_users files, and 'cleanup' deletes all users from the user pool.
+# Without --user-pool-id, the account must have exactly one user pool.
+#
+# Users are created and deleted concurrently, at most --rate calls per
+# second, within the Cognito quotas. Calls that are throttled are tried
+# again after a jittered backoff.
+
+import argparse
+import concurrent.futures
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+
+import boto3
+from botocore.exceptions import ClientError
+
+log = logging.getLogger(__name__)
+
+# Cognito allows 50 AdminCreateUser calls per second per account, leave
+# room for the logins and other deployments
+DEFAULT_RATE = 20
+DEFAULT_WORKERS = 10
+RETRIES = 5
+THROTTLING_ERRORS = {
+    'TooManyRequestsException', 'ThrottlingException',
+    'LimitExceededException'
+}
+# Status of users that log in through an identity provider, such as the
+# TU Delft users. They are never deleted by a sync.
+EXTERNAL_PROVIDER = 'EXTERNAL_PROVIDER'
+# Custom resource responses are limited to 4096 bytes
+MAX_FAILURES_LENGTH = 2048
+
+
+def external_users(users):
+    """
+    Return the users that are not TU Delft users, and so need a Cognito
+    user
+    """
+    return {user for user in users if not user.endswith('tudelft.nl')}
+
+
+def read_user_file(path):
+    """
+    Return the set of usernames in a plain text file, one per line
+    """
+    with open(path) as fp:
+        return {line.strip() for line in fp if line.strip()}
+
+
+class RateLimiter:
+    """
+    Let at most rate callers through per second, from any thread
+    """
+
+    def __init__(self, rate, clock=time.monotonic, sleep=time.sleep):
+        self.interval = 1 / rate
+        self.clock = clock
+        self.sleep = sleep
+        self.next = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = self.clock()
+            start = max(self.next, now)
+            self.next = start + self.interval
+        if start > now:
+            self.sleep(start - now)
+
+
+class UserPoolSync:
+    """
+    Create and delete users of a Cognito user pool concurrently
+    ------
+    Inputs
+    ------
+    - client: boto3 cognito-idp client
+    - user_pool_id: str -
+        ID of the user pool
+    - temp_password: str -
+        password given to created users. They will be required to change
+        this the first time they log in
+    - rate: float -
+        largest number of calls per second
+    - workers: int -
+        number of concurrent calls
+    """
+
+    def __init__(
+        self, client, user_pool_id, temp_password=None,
+        rate=DEFAULT_RATE, workers=DEFAULT_WORKERS, sleep=time.sleep
+    ):
+        self.client = client
+        self.user_pool_id = user_pool_id
+        self.temp_password = temp_password
+        self.workers = workers
+        self.sleep = sleep
+        self.limiter = RateLimiter(rate, sleep=sleep)
+
+    def list_users(self):
+        """
+        Return the status of each user in the user pool, by username
+        """
+        users = {}
+        paginator = self.client.get_paginator('list_users')
+        for page in paginator.paginate(
+            UserPoolId=self.user_pool_id,
+            AttributesToGet=[]
+        ):
+            for user in page['Users']:
+                users[user['Username']] = user.get('UserStatus')
+        return users
+
+    def call(self, method, **kwargs):
+        """
+        Call the client method within the rate, trying again when the
+        call is throttled
+        """
+        for attempt in range(RETRIES):
+            self.limiter.wait()
+            try:
+                return getattr(self.client, method)(
+                    UserPoolId=self.user_pool_id, **kwargs
+                )
+            except ClientError as error:
+                code = error.response['Error']['Code']
+                if code not in THROTTLING_ERRORS or attempt == RETRIES - 1:
+                    raise
+                self.sleep(random.uniform(0, 0.2 * 2 ** attempt))
+
+    def create_user(self, user):
+        try:
+            self.call(
+                'admin_create_user',
+                Username=user,
+                TemporaryPassword=self.temp_password,
+                UserAttributes=[
+                    {'Name': 'preferred_username', 'Value': user}
+                ]
+            )
+        except ClientError as error:
+            if error.response['Error']['Code'] == 'UsernameExistsException':
+                return 'unchanged'
+            raise
+        return 'created'
+
+    def delete_user(self, user):
+        try:
+            self.call('admin_delete_user', Username=user)
+        except ClientError as error:
+            if error.response['Error']['Code'] == 'UserNotFoundException':
+                return 'unchanged'
+            raise
+        return 'deleted'
+
+    def run(self, creates=(), deletes=(), unchanged=0):
+        """
+        Create the users in creates and delete the users in deletes, and
+        return the counts and the failures, by username
+        """
+        result = {
+            'created': 0, 'deleted': 0, 'unchanged': unchanged,
+            'failed': 0, 'failures': {}
+        }
+        with concurrent.futures.ThreadPoolExecutor(self.workers) as pool:
+            futures = {
+                pool.submit(self.create_user, user): user
+                for user in sorted(creates)
+            }
+            futures.update({
+                pool.submit(self.delete_user, user): user
+                for user in sorted(deletes)
+            })
+            for future in concurrent.futures.as_completed(futures):
+                user = futures[future]
+                try:
+                    result[future.result()] += 1
+                except ClientError as error:
+                    result['failed'] += 1
+                    result['failures'][user] = \
+                        error.response['Error']['Code']
+                    log.warning('Sync of user %s failed: %s', user, error)
+        return result
+
+    def reconcile(self, users, previous_users=()):
+        """
+        Create the users that are missing from the user pool, and delete the
+        users of previous_users that are no longer in users
+        """
+        existing = self.list_users()
+        users = set(users)
+        creates = users - set(existing)
+        deletes = {
+            user for user in set(previous_users) - users
+            if user in existing and existing[user] != EXTERNAL_PROVIDER
+        }
+        return self.run(creates, deletes, unchanged=len(users) - len(creates))
+
+    def delete(self, users):
+        """
+        Delete the users that are in the user pool
+        """
+        existing = self.list_users()
+        return self.run(deletes={
+            user for user in users
+            if user in existing and existing[user] != EXTERNAL_PROVIDER
+        })
+
+    def delete_all(self):
+        """
+        Delete all users of the user pool
+        """
+        return self.run(deletes=self.list_users())
+
+
+def response_data(result):
+    """
+    Return the result as custom resource attributes
+    """
+    failures = json.dumps(result['failures'], sort_keys=True)
+    if len(failures) > MAX_FAILURES_LENGTH:
+        failures = failures[:MAX_FAILURES_LENGTH - 3] + '...'
+    return {
+        'Created': result['created'],
+        'Deleted': result['deleted'],
+        'Unchanged': result['unchanged'],
+        'Failed': result['failed'],
+        'Failures': failures,
+    }
+
+
+def on_event(event, context, client=None, environ=os.environ):
+    """
+    Custom resource handler: reconcile the user pool with the Users
+    property.
+    Users that leave the resource are only deleted if the resource has the
+    current shard layout, the UserShards property that equals USER_SHARDS
+    in the function's environment. When the layout changes, users move to
+    another resource, which has created them already, and they are kept.
+    """
+    properties = event['ResourceProperties']
+    user_pool_id = properties['UserPoolId']
+    sync = UserPoolSync(
+        client or boto3.client('cognito-idp'), user_pool_id,
+        properties.get('TemporaryPassword')
+    )
+    layout = environ.get('USER_SHARDS', '0')
+    request_type = event['RequestType']
+    if request_type == 'Delete':
+        if str(properties.get('UserShards', '0')) == layout:
+            result = sync.delete(properties['Users'])
+        else:
+            log.warning('Keeping the users of a resource of another shard '
+                        'layout')
+            result = sync.run(unchanged=len(properties['Users']))
+    else:
+        previous_users = []
+        old_properties = event.get('OldResourceProperties', {})
+        # Users of another user pool or shard layout are left alone
+        if request_type == 'Update' and \
+                old_properties.get('UserPoolId') == user_pool_id and \
+                str(old_properties.get('UserShards', '0')) == layout and \
+                str(properties.get('UserShards', '0')) == layout:
+            previous_users = old_properties.get('Users', [])
+        result = sync.reconcile(properties['Users'], previous_users)
+    print(json.dumps(dict(result, request_type=request_type)))
+    return {
+        'PhysicalResourceId': event.get(
+            'PhysicalResourceId', f'{user_pool_id}-users'
+        ),
+        'Data': response_data(result),
+    }
+
+
+def only_user_pool_id(client):
+    """
+    Return the ID of the only user pool of the account
+    """
+    pools = []
+    for page in client.get_paginator('list_user_pools').paginate(
+        MaxResults=60
+    ):
+        pools.extend(page['UserPools'])
+    if len(pools) != 1:
+        raise SystemExit('Without --user-pool-id, there must be exactly one '
+                         f'user pool, there are {len(pools)}')
+    return pools[0]['Id']
+
+
+def main(argv=None):
+    """
+    Create the missing non TU Delft users of the admins and allowed_users
+    files in the user pool, or delete all users of the user pool, for
+    example:
+    python cognito_user_sync.py sync --temp-password ... admins allowed_users
+    python cognito_user_sync.py cleanup
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--user-pool-id')
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE,
+                        help='largest number of calls per second')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    commands = parser.add_subparsers(dest='command', required=True)
+    sync_parser = commands.add_parser(
+        'sync', help='create the missing non TU Delft users'
+    )
+    sync_parser.add_argument('admins', help='file with admin usernames')
+    sync_parser.add_argument('allowed_users',
+                             help='file with other usernames')
+    sync_parser.add_argument('--temp-password', required=True)
+    commands.add_parser('cleanup', help='delete all users of the user pool')
+    args = parser.parse_args(argv)
+
+    client = boto3.client('cognito-idp')
+    user_pool_id = args.user_pool_id or only_user_pool_id(client)
+    sync = UserPoolSync(
+        client, user_pool_id, args.temp_password
+        if args.command == 'sync' else None,
+        rate=args.rate, workers=args.workers
+    )
+    print(f'User pool has ID: {user_pool_id}')
+    if args.command == 'sync':
+        result = sync.reconcile(external_users(
+            read_user_file(args.admins) | read_user_file(args.allowed_users)
+        ))
+    else:
+        result = sync.delete_all()
+    print(json.dumps(result, indent=2, sort_keys=True))
+    return 1 if result['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
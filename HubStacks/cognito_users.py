@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+import hashlib
+import os
+
+from aws_cdk import (
+    custom_resources as cr,
+    aws_iam as iam,
+    aws_lambda as lambda_,
+    aws_logs as logs,
+    CustomResource, Duration, NestedStack, Stack
+)
+from constructs import Construct
+
+SYNC_CODE_DIRECTORY = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'cognito_user_sync'
+)
+
+
+def user_shard(user, shards):
+    """
+    Return the shard of user, out of shards. The shard only depends on the
+    username, so it does not change when other users are added or removed.
+    """
+    digest = hashlib.sha256(user.encode()).digest()
+    return int.from_bytes(digest[:8], 'big') % shards
+
+
+def shard_users(users, shards):
+    """
+    Return a sorted list of the users of each of shards shards
+    """
+    sharded = [[] for _ in range(shards)]
+    for user in sorted(users):
+        sharded[user_shard(user, shards)].append(user)
+    return sharded
+
+
+class CognitoUserSyncProvider(Construct):
+    """
+    Custom resource provider that creates and deletes Cognito users in
+    batches, see cognito_user_sync/cognito_user_sync.py
+    Adds:
+    - a Lambda function that reconciles the user pool with a list of users
+    - the custom resource provider of the function
+    ------
+    Inputs
+    ------
+    - cognito_user_pool_id: str -
+        ID of the Cognito user pool
+    - user_shards: int -
+        number of shards of the users, 0 if they are not sharded. Resources
+        of another number of shards do not delete their users, as these
+        moved to another resource, see cognito_user_sync.on_event
+    ----------
+    Attributes
+    ----------
+    - service_token: str -
+        service token for the Custom::CognitoUsers resources, see
+        add_cognito_users
+    """
+
+    def __init__(
+        self, scope: Construct, id: str, cognito_user_pool_id,
+        user_shards=0
+    ) -> None:
+        super().__init__(scope, id)
+
+        function = lambda_.Function(
+            self, 'Function',
+            runtime=lambda_.Runtime.PYTHON_3_12,
+            handler='cognito_user_sync.on_event',
+            code=lambda_.Code.from_asset(
+                SYNC_CODE_DIRECTORY, exclude=['__pycache__']
+            ),
+            timeout=Duration.minutes(15),
+            environment={'USER_SHARDS': str(user_shards)},
+            log_retention=logs.RetentionDays.ONE_WEEK
+        )
+        function.add_to_role_policy(
+            iam.PolicyStatement(
+                resources=[Stack.of(self).format_arn(
+                    service='cognito-idp',
+                    resource='userpool',
+                    resource_name=cognito_user_pool_id
+                )],
+                actions=[
+                    'cognito-idp:ListUsers',
+                    'cognito-idp:AdminCreateUser',
+                    'cognito-idp:AdminDeleteUser'
+                ]
+            )
+        )
+        provider = cr.Provider(
+            self, 'Provider',
+            on_event_handler=function,
+            log_retention=logs.RetentionDays.ONE_WEEK
+        )
+        self.service_token = provider.service_token
+
+
+def add_cognito_users(
+    scope, id, service_token, cognito_user_pool_id, users, temp_password,
+    user_shards=0
+):
+    """
+    Create the users that are missing from the Cognito user pool, and
+    delete the users that are removed from users or whose resource is
+    deleted, unless user_shards changed. The resource's Created, Deleted,
+    Unchanged and Failed attributes count the users, and Failures has the
+    error of each failed user.
+    """
+    return CustomResource(
+        scope, id,
+        service_token=service_token,
+        resource_type='Custom::CognitoUsers',
+        properties={
+            'UserPoolId': cognito_user_pool_id,
+            'Users': sorted(users),
+            'TemporaryPassword': temp_password,
+            'UserShards': str(user_shards)
+        }
+    )
+
+
+class CognitoUserShard(NestedStack):
+    """
+    Nested stack with the Cognito users of one shard, see user_shard.
+    CloudFormation deploys the shards in parallel, and only updates the
+    shards whose users changed.
+    Adds:
+    - a Custom::CognitoUsers resource with the users, see add_cognito_users
+    ------
+    Inputs
+    ------
+    - service_token: str -
+        service token of a CognitoUserSyncProvider
+    - cognito_user_pool_id: str -
+        ID of the Cognito user pool
+    - users: list -
+        usernames of the users of the shard
+    - temp_password: str -
+        password given to the users. They will be required to change this
+        the first time they log in
+    - user_shards: int -
+        number of shards
+    """
+
+    def __init__(
+        self, scope: Construct, id: str,
+        service_token, cognito_user_pool_id, users, temp_password,
+        user_shards, **kwargs
+    ) -> None:
+        super().__init__(scope, id, **kwargs)
+
+        add_cognito_users(
+            self, 'UserPoolUsers', service_token,
+            cognito_user_pool_id, users, temp_password, user_shards
+        )
@@ -1,15 +1,18 @@
 #!/usr/bin/env python3
 
 from aws_cdk import (
+    aws_cloudwatch as cloudwatch,
     aws_ec2 as ec2,
     aws_elasticloadbalancingv2 as elb,
     aws_route53 as route53,
     aws_route53_targets as route53_targets,
     aws_efs as efs,
     aws_kms as kms,
-    App, CfnOutput, Stack, RemovalPolicy
+    App, CfnOutput, Duration, Stack, RemovalPolicy
 )
 
+from HubStacks.monitoring import Monitoring, monitoring_config
+
 
 class FrameStack(Stack):
     """
@@ -20,6 +23,9 @@ class FrameStack(Stack):
     - Route53 A record
     - EFS file system for persistent storage
     - Security group for an ECS service, allowing internal communication
+    - Optional VPC endpoints for S3, ECR, CloudWatch Logs, ECS and EFS
+    - Optional CloudWatch dashboard and alarms for the load balancer, the
+      file system and the NAT gateways, see Monitoring
     ------
     Inputs
     ------
@@ -31,6 +37,15 @@ class FrameStack(Stack):
     - num_azs: number of Availability Zones to user (must be 2 or more)
     - efs_policy: RETAIN to keep file system after deleting stack or DESTROY
       Reuse of an existing file system is not (yet) implemented
+    - nat_gateways: optional number of NAT gateways, default one per
+      Availability Zone; 1 shares one NAT gateway between all zones
+    - vpc_endpoints: optional, true to add an S3 gateway endpoint and
+      interface endpoints for ECR, CloudWatch Logs, ECS and EFS, that
+      only the ECS service security group can reach
+    - monitoring: optional dashboard and alarm thresholds, true or for
+      example {'alarm_email': 'someone@some-domain.com',
+      'target_response_time': 2, 'efs_burst_credit_balance': 1e12}, see
+      HubStacks/monitoring.py
     ----------
     Attributes
     ----------
@@ -63,7 +78,11 @@ class FrameStack(Stack):
         # An AWS Hosted Zone must already exist and
         # it's ID and name must be specified in the config_yaml.
 
-        vpc = ec2.Vpc(self, "VPC", max_azs=num_azs, vpc_name=f'{base_name}VPC')
+        # One NAT gateway per Availability Zone, unless nat_gateways is set
+        vpc = ec2.Vpc(
+            self, "VPC", max_azs=num_azs, vpc_name=f'{base_name}VPC',
+            nat_gateways=config_yaml.get('nat_gateways')
+        )
 
         load_balancer = elb.ApplicationLoadBalancer(
             self, f'{base_name}LoadBalancer',
@@ -137,6 +156,161 @@ class FrameStack(Stack):
             description='Allow EFS from ECS Service containers'
         )
 
+        # Optional VPC endpoints, so that image pulls, logs and AWS API
+        # calls of the ECS service containers do not pass the NAT gateways
+        if config_yaml.get('vpc_endpoints'):
+            vpc.add_gateway_endpoint(
+                f'{base_name}S3Endpoint',
+                service=ec2.GatewayVpcEndpointAwsService.S3,
+                subnets=[ec2.SubnetSelection(
+                    subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS
+                )]
+            )
+            endpoint_security_group = ec2.SecurityGroup(
+                self,
+                f'{base_name}EndpointSG',
+                vpc=vpc,
+                description='VPC interface endpoints security group',
+                allow_all_outbound=False
+            )
+            endpoint_security_group.connections.allow_from(
+                ecs_service_security_group,
+                port_range=ec2.Port.tcp(443),
+                description='Allow HTTPS from ECS Service containers'
+            )
+            interface_endpoints = {
+                'EcrApi': ec2.InterfaceVpcEndpointAwsService.ECR,
+                'EcrDocker': ec2.InterfaceVpcEndpointAwsService.ECR_DOCKER,
+                'Logs': ec2.InterfaceVpcEndpointAwsService.CLOUDWATCH_LOGS,
+                'Ecs': ec2.InterfaceVpcEndpointAwsService.ECS,
+                'Efs': ec2.InterfaceVpcEndpointAwsService.ELASTIC_FILESYSTEM,
+            }
+            for name, service in interface_endpoints.items():
+                vpc.add_interface_endpoint(
+                    f'{base_name}{name}Endpoint',
+                    service=service,
+                    private_dns_enabled=True,
+                    open=False,
+                    security_groups=[endpoint_security_group],
+                    subnets=ec2.SubnetSelection(
+                        subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS
+                    )
+                )
+
+        # Optional CloudWatch dashboard and alarms
+        monitoring = monitoring_config(config_yaml)
+        if monitoring:
+            frame_monitoring = Monitoring(
+                self, f'{base_name}Monitoring', monitoring,
+                dashboard_name=f'{base_name}-frame'
+            )
+            minute = Duration.minutes(1)
+
+            # Load balancer response time and 5xx responses, of the load
+            # balancer itself and of the hub, proxy and single user targets
+            response_time = load_balancer.metrics.target_response_time(
+                period=minute
+            )
+            http_5xx = cloudwatch.MathExpression(
+                expression='FILL(elb, 0) + FILL(targets, 0)',
+                using_metrics={
+                    'elb': load_balancer.metrics.http_code_elb(
+                        elb.HttpCodeElb.ELB_5XX_COUNT, period=minute
+                    ),
+                    'targets': load_balancer.metrics.http_code_target(
+                        elb.HttpCodeTarget.TARGET_5XX_COUNT, period=minute
+                    )
+                },
+                label='5xx responses',
+                period=minute
+            )
+            frame_monitoring.add_graphs(
+                ('Target response time (s)', [response_time]),
+                ('5xx responses', [http_5xx])
+            )
+            frame_monitoring.add_alarm(
+                'TargetResponseTimeAlarm', response_time,
+                'target_response_time',
+                'The hub or the single user servers respond slowly'
+            )
+            frame_monitoring.add_alarm(
+                'Http5xxAlarm', http_5xx, 'http_5xx_count',
+                'The load balancer returns 5xx responses'
+            )
+
+            # EFS throughput, IOPS and the limits that slow down all users
+            def efs_metric(metric_name, statistic):
+                return cloudwatch.Metric(
+                    namespace='AWS/EFS',
+                    metric_name=metric_name,
+                    dimensions_map={
+                        'FileSystemId': file_system.file_system_id
+                    },
+                    statistic=statistic,
+                    period=minute
+                )
+
+            throughput = cloudwatch.MathExpression(
+                expression='io / PERIOD(io)',
+                using_metrics={'io': efs_metric('TotalIOBytes', 'Sum')},
+                label='Throughput (bytes/s)',
+                period=minute
+            )
+            iops = cloudwatch.MathExpression(
+                expression='operations / PERIOD(operations)',
+                using_metrics={
+                    'operations': efs_metric('TotalIOBytes', 'SampleCount')
+                },
+                label='IOPS',
+                period=minute
+            )
+            burst_credit_balance = efs_metric('BurstCreditBalance', 'Minimum')
+            percent_io_limit = efs_metric('PercentIOLimit', 'Maximum')
+            frame_monitoring.add_graphs(
+                ('EFS throughput (bytes/s)', [throughput]),
+                ('EFS IOPS', [iops]),
+                ('EFS burst credit balance (bytes)', [burst_credit_balance]),
+                ('EFS percent of I/O limit', [percent_io_limit])
+            )
+            frame_monitoring.add_alarm(
+                'EFSBurstCreditBalanceAlarm', burst_credit_balance,
+                'efs_burst_credit_balance',
+                'The file system is running out of burst credits',
+                comparison_operator=(
+                    cloudwatch.ComparisonOperator.LESS_THAN_THRESHOLD
+                )
+            )
+            frame_monitoring.add_alarm(
+                'EFSPercentIOLimitAlarm', percent_io_limit,
+                'efs_percent_io_limit',
+                'The file system is close to its I/O limit'
+            )
+
+            # Traffic through the NAT gateways, one per availability zone
+            nat_gateway_bytes = []
+            for index, subnet in enumerate(vpc.public_subnets):
+                nat_gateway = subnet.node.try_find_child('NATGateway')
+                if nat_gateway is None:
+                    continue
+                bytes_out = cloudwatch.Metric(
+                    namespace='AWS/NATGateway',
+                    metric_name='BytesOutToDestination',
+                    dimensions_map={'NatGatewayId': nat_gateway.ref},
+                    statistic='Sum',
+                    period=Duration.minutes(5),
+                    label=f'Bytes out, NAT gateway {index + 1}'
+                )
+                nat_gateway_bytes.append(bytes_out)
+                frame_monitoring.add_alarm(
+                    f'NATGateway{index + 1}BytesAlarm', bytes_out,
+                    'nat_gateway_bytes',
+                    'Much traffic to the internet through a NAT gateway'
+                )
+            if nat_gateway_bytes:
+                frame_monitoring.add_graphs(
+                    ('NAT gateway bytes out', nat_gateway_bytes)
+                )
+
         # Output the service URL to CloudFormation outputs
         CfnOutput(
             self,
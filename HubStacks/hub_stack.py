@@ -1,4 +1,6 @@
 #!/usr/bin/env python3
+import hashlib
+import json
 
 from aws_cdk import (
     aws_elasticloadbalancingv2 as elb,
@@ -10,10 +12,31 @@ from aws_cdk import (
     aws_logs as logs,
     aws_ecr as ecr,
     aws_efs as efs,
-    App, Stack, Environment
+    aws_ssm as ssm,
+    aws_dynamodb as dynamodb,
+    aws_ec2 as ec2,
+    aws_rds as rds,
+    aws_secretsmanager as secretsmanager,
+    aws_cloudwatch as cloudwatch,
+    App, Stack, Environment, RemovalPolicy, Duration
 )
 from cognito_tudelft.tudelft_idp import CognitoTudelftStack
 
+from HubStacks.cognito_users import (
+    CognitoUserShard, CognitoUserSyncProvider, add_cognito_users,
+    shard_users
+)
+from HubStacks.monitoring import (
+    Monitoring, SPAWN_METRICS_NAMESPACE, monitoring_config
+)
+from HubStacks.package_cache import PackageCache
+from HubStacks.proxy_service import ProxyService
+
+# Shards of the user directory in the ssm backend: standard SSM parameters
+# hold 4 KB, and the number of shards keeps the stack's resources in check
+SSM_SHARD_BYTES = 4096
+MAX_SSM_SHARDS = 50
+
 
 class HubStack(Stack):
     """
@@ -23,10 +46,20 @@ class HubStack(Stack):
     /home/jovyan/work directory.
     Adds:
     - CognitoTudelftStack
+    - Custom resource that creates the Cognito users of non TU Delft users,
+      see HubStacks/cognito_users.py
     - ECS cluster with JupyterHub service
     - JupyterHub Fargate task definition
-    - Single user Fargate task definition for each admin/allowed user
+    - Optional Aurora Serverless PostgreSQL database with RDS Proxy
+    - Optional separate HTTP proxy service, see ProxyService
+    - Optional package cache service for Julia and PyPI packages, see
+      PackageCache
+    - Optional CloudWatch dashboard and alarms for the hub, the single user
+      tasks and the RunTask calls, see Monitoring
+    - Log group for the single user containers
     - IAM roles and policies
+    Single user task definitions and EFS access points are registered by the
+    hub at spawn time, see hub_docker/task_registry.py
     ------
     Inputs
     ------
@@ -41,6 +74,11 @@ class HubStack(Stack):
     - ecs_service_security_group: SecurityGroup
         a security group for an ECS service that allows for communication
         between containers of the service
+    - admins_file: str -
+        optional path of the admins file, default 'hub_docker/admins'
+    - allowed_users_file: str -
+        optional path of the allowed_users file, default
+        'hub_docker/allowed_users'
     ----------------------------
     Inputs from config.yaml file
     ----------------------------
@@ -53,7 +91,11 @@ class HubStack(Stack):
     - hub_container_image_repository_arn: ARN of the ECR for the JupyterHub
       image
     - hub_container_image_tag: tag for the JupyterHub image
-    - num_containers: the desired number of JupyterHub service containers
+    - num_containers: the desired number of JupyterHub service containers,
+      0 or 1; JupyterHub supports only one active hub process
+    - hub_database: optional shared PostgreSQL database for the hub state,
+      true or the Aurora Serverless v2 capacity, for example
+      {'min_capacity': 0.5, 'max_capacity': 2}
     - oauth_login_username_key: key of field to use as username, either
       'preferred_username' (NedID) or 'email'
     - oauth_login_service_name: a name for the Cognito login service
@@ -61,9 +103,53 @@ class HubStack(Stack):
     - single_user_container_image_repository_arn: ARN of the ECR for the
       single user image
     - single_user_container_image_tag: tag for the single user image
+    - single_user_container_image_digest: optional digest of the single
+      user image, 'sha256:...', used instead of the tag, see
+      single_user_docker/build_image.py
     - s3_arn: optional ARN of S3 bucket, for read-only access to data
     - temp_password: password given to non TU Delft users. They will be
       required to change this the first time they log in
+    - warm_pool: optional pool sizes of pre-started single user tasks of
+      returning users,
+      for example {'timezone': 'Europe/Amsterdam', 'default': 0,
+      'windows': [{'start': '08:30', 'end': '17:30', 'size': 20}],
+      'max_unclaimed': 3600}; 'max_unclaimed' is the seconds after which
+      a pooled task that was not claimed is stopped
+    - speculative_spawn: optionally start the server of a returning user
+      while the user logs in: true, or {'timeout': 120}, the seconds after
+      which a server that was not claimed by a login is stopped
+    - prespawn: optionally start the servers of a session's users ahead
+      of the session, for example {'rate': 5, 'sessions': [{'cron':
+      '0 9 * * 1', 'timezone': 'Europe/Amsterdam', 'lead_minutes': 15,
+      'group': 'some-course', 'users': ['someone']}]}; 'group' is a hub
+      group
+    - culler: optional idle culler policies, for example {'interval': 300,
+      'policies': {'default': {'timeout': 1800, 'signals': ['hub',
+      'pluto', 'kernels', 'cpu'], 'cpu_percent': 10}, 'groups':
+      {'some-course': {'timeout': 7200}}}}
+    - system_users: 'batch' (default) to create the hub's system users
+      in batches in the background, or 'skip' to not create them
+    - monitoring: optional dashboard and alarm thresholds, true or for
+      example {'alarm_email': 'someone@some-domain.com',
+      'hub_cpu_percent': 80, 'single_user_tasks': 400}, see
+      HubStacks/monitoring.py; also enables Container Insights
+    - proxy_service: optional separate proxy service, for example
+      {'type': 'traefik', 'cpu': 512, 'memory': 1024, 'min_count': 1,
+      'max_count': 4}; 'type' is 'chp' (one task), 'traefik' or 'alb'
+      (no proxy: a listener rule per single user server)
+    - user_directory_backend: optional store for the admins and allowed
+      users that the hub reads and refreshes while running: 'ssm'
+      (default), 'dynamodb' or 'file' (JSON file on EFS)
+    - user_shards: optional number of nested stacks to create the Cognito
+      users of non TU Delft users in, see HubStacks/cognito_users.py
+    - package_cache: optional caching proxy for Julia packages and PyPI in
+      the VPC, for example {'pkg_server_image':
+      'juliapackaging/pkgserver.jl@sha256:<digest>', 'cpu': 1024,
+      'memory': 2048, 'pypi_cache_gb': 50}, see HubStacks/package_cache.py
+    - julia_depot: optional shared, precompiled Julia depot on EFS that
+      the single user servers layer under the user's own depot, true to
+      enable; administrators maintain it, see
+      single_user_docker/julia_depot.py
 
     -----------------------
     Inputs from admins file
@@ -80,7 +166,8 @@ class HubStack(Stack):
     def __init__(
         self, app: App, id: str,
         config_yaml, vpc, load_balancer, file_system,
-        ecs_service_security_group, **kwargs
+        ecs_service_security_group, admins_file='hub_docker/admins',
+        allowed_users_file='hub_docker/allowed_users', **kwargs
     ) -> None:
         super().__init__(app, id, **kwargs)
 
@@ -94,17 +181,27 @@ class HubStack(Stack):
         hub_container_image_tag = config_yaml['hub_container_image_tag']
         single_user_container_image_repository_arn = \
             config_yaml['single_user_container_image_repository_arn']
-        single_user_container_image_tag = \
-            config_yaml['single_user_container_image_tag']
+        # The image is referenced by its digest if there is one
+        single_user_container_image_tag = config_yaml.get(
+            'single_user_container_image_digest'
+        ) or config_yaml['single_user_container_image_tag']
         s3_arn = config_yaml['s3_arn']
         hosted_zone_name = config_yaml['hosted_zone_name']
 
         domain_name = application_prefix + '.' + hosted_zone_name
 
+        # JupyterHub runs as one active hub process. The shared database only
+        # keeps its state when the hub container is replaced.
+        if config_yaml['num_containers'] > 1:
+            raise ValueError(
+                f"num_containers is {config_yaml['num_containers']}, but "
+                'JupyterHub supports only one active hub process; set it to 1'
+            )
+
         # JupyterHub admin users from file
         admin_users = set()
         try:
-            with open('hub_docker/admins') as fp:
+            with open(admins_file) as fp:
                 for line in fp:
                     if not line:
                         continue
@@ -115,7 +212,7 @@ class HubStack(Stack):
         # JupyterHub allowed users from file
         allowed_users = set()
         try:
-            with open('hub_docker/allowed_users') as fp:
+            with open(allowed_users_file) as fp:
                 for line in fp:
                     if not line:
                         continue
@@ -127,7 +224,7 @@ class HubStack(Stack):
         all_users = admin_users | allowed_users
         external_users = set()
         for user in all_users:
-            if not user.endswith("tudelft.nl"):
+            if user and not user.endswith("tudelft.nl"):
                 external_users.add(user)
 
         # Set up a Cognito Stack for TU Delft authentication
@@ -167,6 +264,16 @@ class HubStack(Stack):
             describe_cognito_user_pool_client.get_response_field(
                 'UserPoolClient.ClientSecret'
             )
+        # Stacks of before the Custom::CognitoUsers resources have an
+        # AwsCustomResource per user, which deletes its user when it is
+        # removed. The users are created again by the Custom::CognitoUsers
+        # resources before that, so the deletes are denied.
+        describe_cognito_user_pool_client.grant_principal.\
+            add_to_principal_policy(iam.PolicyStatement(
+                effect=iam.Effect.DENY,
+                actions=['cognito-idp:AdminDeleteUser'],
+                resources=['*']
+            ))
 
         # Create an EFS access point for shared reference material
         reference_access_pt = efs.AccessPoint(
@@ -184,46 +291,53 @@ class HubStack(Stack):
             )
         )
 
-        # Use the Cognito identity provider for non TU Delft users
-        user_index = 0
-        for user in external_users:
-            user_index += 1
-            cr.AwsCustomResource(
-                self,
-                f'{base_name}UserPoolUser'+str(user_index),
-                install_latest_aws_sdk=False,
-                log_retention=logs.RetentionDays.ONE_WEEK,
-                policy=cr.AwsCustomResourcePolicy.from_sdk_calls(
-                    resources=cr.AwsCustomResourcePolicy.ANY_RESOURCE),
-                on_create=cr.AwsSdkCall(
-                    service='CognitoIdentityServiceProvider',
-                    action='adminCreateUser',
-                    parameters={
-                        'UserPoolId': cognito_user_pool_id,
-                        'Username': user,
-                        'TemporaryPassword': config_yaml[
-                            'temp_password'
-                        ],
-                        'UserAttributes': [
-                            {
-                                'Name': 'preferred_username',
-                                'Value': user
-                            }
-                        ]
-                    },
-                    physical_resource_id=cr.PhysicalResourceId.of(
-                        cognito_user_pool_id)
+        # Optional EFS access point for the shared Julia depot, read-only for
+        # standard users like the reference directory
+        julia_depot = config_yaml.get('julia_depot')
+        if julia_depot:
+            julia_depot_access_pt = efs.AccessPoint(
+                self, "JuliaDepotAccessPt",
+                file_system=file_system,
+                create_acl=efs.Acl(
+                    owner_gid="100",
+                    owner_uid="1000",
+                    permissions="755"
                 ),
-                on_delete=cr.AwsSdkCall(
-                    service='CognitoIdentityServiceProvider',
-                    action='adminDeleteUser',
-                    parameters={
-                        'UserPoolId': cognito_user_pool_id,
-                        'Username': user
-                    },
-                    physical_resource_id=cr.PhysicalResourceId.of(
-                        cognito_user_pool_id)
+                path="/julia-depot",
+                posix_user=efs.PosixUser(
+                    gid="100",
+                    uid="1000"
+                )
+            )
+
+        # Use the Cognito identity provider for non TU Delft users, created
+        # in batches, in nested stacks of user_shards shards if set
+        user_shards = config_yaml.get('user_shards') or 0
+        cognito_user_sync = CognitoUserSyncProvider(
+            self, f'{base_name}CognitoUserSync',
+            cognito_user_pool_id=cognito_user_pool_id,
+            user_shards=user_shards
+        )
+        if user_shards:
+            for shard, users in enumerate(
+                shard_users(external_users, user_shards)
+            ):
+                if not users:
+                    continue
+                CognitoUserShard(
+                    self, f'{base_name}UserShard{shard}',
+                    service_token=cognito_user_sync.service_token,
+                    cognito_user_pool_id=cognito_user_pool_id,
+                    users=users,
+                    temp_password=config_yaml['temp_password'],
+                    user_shards=user_shards
                 )
+        else:
+            add_cognito_users(
+                self, f'{base_name}UserPoolUsers',
+                cognito_user_sync.service_token,
+                cognito_user_pool_id, external_users,
+                config_yaml['temp_password']
             )
 
         # ECS task roles
@@ -262,6 +376,8 @@ class HubStack(Stack):
             )
         )
 
+        # Task role of the hub, which starts and manages the single user
+        # tasks
         ecs_task_role = iam.Role(
             self,
             f'{base_name}TaskRole',
@@ -284,13 +400,33 @@ class HubStack(Stack):
                     'iam:PassRole',
                     'cloudwatch:PutMetricData',
                     'cloudwatch:ListMetrics',
-                    'ec2:DescribeRegions'
+                    'ec2:DescribeRegions',
+                    'ec2:DescribeSubnets'
+                ]
+            )
+        )
+
+        # Task role of the single user tasks, separate from the hub's task
+        # role: the users can read the credentials of their task, so it
+        # only mounts the users' directories and reads the data bucket
+        single_user_task_role = iam.Role(
+            self,
+            f'{base_name}SingleUserTaskRole',
+            assumed_by=iam.ServicePrincipal('ecs-tasks.amazonaws.com')
+        )
+
+        single_user_task_role.add_to_policy(
+            iam.PolicyStatement(
+                resources=[file_system.file_system_arn],
+                actions=[
+                    'elasticfilesystem:ClientWrite',
+                    'elasticfilesystem:ClientMount'
                 ]
             )
         )
 
         if s3_arn:
-            ecs_task_role.add_to_policy(
+            single_user_task_role.add_to_policy(
                 iam.PolicyStatement(
                     resources=[s3_arn],
                     actions=[
@@ -298,7 +434,7 @@ class HubStack(Stack):
                     ]
                 )
             )
-            ecs_task_role.add_to_policy(
+            single_user_task_role.add_to_policy(
                 iam.PolicyStatement(
                     resources=[s3_arn + '/*'],
                     actions=[
@@ -307,107 +443,160 @@ class HubStack(Stack):
                 )
             )
 
+        # User directory with the admins and allowed users, read by the hub
+        user_directory_backend = config_yaml.get(
+            'user_directory_backend', 'ssm'
+        )
+        if user_directory_backend == 'ssm':
+            # The document is split over standard parameters of up to 4 KB,
+            # with an index parameter that is updated last, see
+            # hub_docker/user_directory.py
+            user_directory_value = json.dumps({
+                'admins': sorted(admin_users),
+                'users': sorted(allowed_users - admin_users),
+                'profiles': {}
+            }, separators=(',', ':'))
+            user_directory_shards = [
+                user_directory_value[offset:offset + SSM_SHARD_BYTES]
+                for offset in range(
+                    0, len(user_directory_value), SSM_SHARD_BYTES
+                )
+            ] or ['']
+            if len(user_directory_shards) > MAX_SSM_SHARDS:
+                raise ValueError(
+                    f'The user directory is {len(user_directory_value)} '
+                    f'bytes, more than the {MAX_SSM_SHARDS} SSM parameters '
+                    f'of {SSM_SHARD_BYTES} bytes of the ssm backend; set '
+                    "user_directory_backend to 'dynamodb'"
+                )
+            user_directory_parameter_name = f'/{base_name}/user-directory'
+            user_directory_parameter = ssm.StringParameter(
+                self, f'{base_name}UserDirectory',
+                parameter_name=user_directory_parameter_name,
+                string_value=json.dumps({
+                    'shards': len(user_directory_shards),
+                    'sha256': hashlib.sha256(
+                        user_directory_value.encode()
+                    ).hexdigest()
+                })
+            )
+            for number, shard in enumerate(user_directory_shards):
+                user_directory_parameter.node.add_dependency(
+                    ssm.StringParameter(
+                        self, f'{base_name}UserDirectoryShard{number}',
+                        parameter_name=f'{user_directory_parameter_name}/'
+                        f'{number}',
+                        string_value=shard
+                    )
+                )
+            ecs_task_role.add_to_policy(
+                iam.PolicyStatement(
+                    resources=[
+                        user_directory_parameter.parameter_arn,
+                        f'{user_directory_parameter.parameter_arn}/*'
+                    ],
+                    actions=[
+                        'ssm:GetParameter',
+                        'ssm:GetParameters'
+                    ]
+                )
+            )
+            ecs_task_role.add_to_policy(
+                iam.PolicyStatement(
+                    resources=['*'],
+                    actions=[
+                        'ssm:DescribeParameters'
+                    ]
+                )
+            )
+            user_directory_location = \
+                user_directory_parameter.parameter_name
+        elif user_directory_backend == 'dynamodb':
+            # Fill the table with hub_docker/user_directory.py
+            user_directory_table = dynamodb.Table(
+                self, f'{base_name}UserDirectory',
+                partition_key=dynamodb.Attribute(
+                    name='username',
+                    type=dynamodb.AttributeType.STRING
+                ),
+                billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+                removal_policy=RemovalPolicy.RETAIN
+            )
+            user_directory_table.grant_read_data(ecs_task_role)
+            user_directory_location = user_directory_table.table_name
+        else:
+            # JSON file on the EFS volume mounted on /home in the hub
+            user_directory_location = '/home/user_directory.json'
+
         # ECS cluster with service, Hub task and JupyterHub admin/user tasks
+        monitoring = monitoring_config(config_yaml)
         ecs_cluster = ecs.Cluster(
             self, f'{base_name}Cluster',
-            vpc=vpc
+            vpc=vpc,
+            container_insights=bool(monitoring)
         )
 
-        # single user container task definition
+        # single user container image repository
         single_user_repository = ecr.Repository.from_repository_arn(
             self, "SingleUserRepo",
             single_user_container_image_repository_arn
         )
 
-        task_definitions = {}
-        for user in all_users:
-            username = user.replace("@", "_").replace(".", "_")
+        # Single user task definitions and EFS access points are registered
+        # by the hub when a user's server is spawned, so that the number of
+        # resources in this stack does not depend on the number of users
+        single_user_repository.grant_pull(ecs_task_execution_role)
 
-            single_user_task_definition = ecs.FargateTaskDefinition(
-                self, username + "TaskDef",
-                cpu=2048,
-                memory_limit_mib=5120,
-                execution_role=ecs_task_execution_role,
-                task_role=ecs_task_role
-            )
+        single_user_log_group = logs.LogGroup(
+            self, f'{base_name}SingleUserLogGroup',
+            retention=logs.RetentionDays.ONE_WEEK
+        )
+        single_user_log_group.grant_write(ecs_task_execution_role)
 
-            single_user_access_pt = efs.AccessPoint(
-                self, username + "AccessPt",
-                file_system=file_system,
-                create_acl=efs.Acl(
-                    owner_gid="100",
-                    owner_uid="1000",
-                    permissions="755"
-                ),
-                path="/" + username,
-                posix_user=efs.PosixUser(
-                    gid="100",
-                    uid="1000"
-                )
+        ecs_task_role.add_to_policy(
+            iam.PolicyStatement(
+                resources=['*'],
+                actions=[
+                    'ecs:RegisterTaskDefinition',
+                    'ecs:DescribeTaskDefinition',
+                    'ecr:DescribeImages'
+                ]
             )
+        )
 
-            single_user_container = single_user_task_definition.add_container(
-                "SingleUserContainer",
-                image=ecs.ContainerImage.from_ecr_repository(
-                    repository=single_user_repository,
-                    tag=single_user_container_image_tag
-                ),
-                privileged=False,
-                port_mappings=[
-                    ecs.PortMapping(container_port=8888)
-                ],
-                logging=ecs.LogDrivers.aws_logs(
-                    stream_prefix=f'{base_name}SingleUser-',
-                    log_retention=logs.RetentionDays.ONE_WEEK
-                )
+        ecs_task_role.add_to_policy(
+            iam.PolicyStatement(
+                resources=[file_system.file_system_arn],
+                actions=[
+                    'elasticfilesystem:CreateAccessPoint',
+                    'elasticfilesystem:DescribeAccessPoints'
+                ]
             )
+        )
 
-            # Add personal storage
-            single_user_task_definition.add_volume(
-                name='efs-' + username + '-volume',
-                efs_volume_configuration=ecs.EfsVolumeConfiguration(
-                    file_system_id=file_system.file_system_id,
-                    authorization_config=ecs.AuthorizationConfig(
-                        access_point_id=single_user_access_pt.access_point_id,
-                        iam="ENABLED"
-                    ),
-                    transit_encryption="ENABLED"
-                )
+        ecs_task_role.add_to_policy(
+            iam.PolicyStatement(
+                resources=['*'],
+                actions=[
+                    'elasticfilesystem:TagResource'
+                ]
             )
+        )
 
-            single_user_container.add_mount_points(ecs.MountPoint(
-                container_path='/home/jovyan/work',
-                source_volume='efs-' + username + '-volume',
-                read_only=False
-            ))
-
-            # Add read only access to reference storage owned by admins
-            if user in admin_users:
-                read_only = False
-            else:
-                read_only = True
-
-            single_user_task_definition.add_volume(
-                name='efs-reference-volume',
-                efs_volume_configuration=ecs.EfsVolumeConfiguration(
-                    file_system_id=file_system.file_system_id,
-                    authorization_config=ecs.AuthorizationConfig(
-                        access_point_id=reference_access_pt.access_point_id,
-                        iam="ENABLED"
-                    ),
-                    transit_encryption="ENABLED"
+        # Optional warm pool of pre-started tasks of returning users. The
+        # pooled tasks run with the users' own task definitions, see
+        # hub_docker/warm_pool.py
+        warm_pool = config_yaml.get('warm_pool')
+        if warm_pool:
+            ecs_task_role.add_to_policy(
+                iam.PolicyStatement(
+                    resources=['*'],
+                    actions=[
+                        'ecs:ListTasks'
+                    ]
                 )
             )
 
-            single_user_container.add_mount_points(ecs.MountPoint(
-                container_path='/home/jovyan/reference',
-                source_volume='efs-reference-volume',
-                read_only=read_only
-            ))
-
-            task_definitions[user] = \
-                single_user_task_definition.task_definition_arn
-
         # JupyterHub hub task definition
         hub_task_definition = ecs.FargateTaskDefinition(
             self,
@@ -450,8 +639,8 @@ class HubStack(Stack):
                 log_retention=logs.RetentionDays.ONE_WEEK
             ),
             environment={
-                'ADMIN_USERS': str(admin_users),
-                'ALLOWED_USERS': str(all_users),
+                'USER_DIRECTORY_BACKEND': user_directory_backend,
+                'USER_DIRECTORY_LOCATION': user_directory_location,
                 'OAUTH_CALLBACK_URL':
                     'https://' + domain_name +
                     '/hub/oauth_callback',
@@ -485,17 +674,29 @@ class HubStack(Stack):
                     'ecs.' + self.region + '.amazonaws.com',
                 'FARGATE_SPAWNER_CLUSTER':
                     ecs_cluster.cluster_name,
-                'FARGATE_SPAWNER_TASK_DEFINITIONS':
-                    str(task_definitions),
+                'FARGATE_SPAWNER_EXECUTION_ROLE_ARN':
+                    ecs_task_execution_role.role_arn,
                 'FARGATE_SPAWNER_TASK_ROLE_ARN':
-                    ecs_task_role.role_arn,
+                    single_user_task_role.role_arn,
                 'FARGATE_SPAWNER_SECURITY_GROUPS':
                     str(security_group_ids),
                 'FARGATE_SPAWNER_SUBNETS':
                     str(subnet_ids),
                 'FARGATE_SPAWNER_CONTAINER_NAME':
                     "SingleUserContainer",
-                'FARGATE_EFS_ID': file_system.file_system_id
+                'FARGATE_SPAWNER_IMAGE_REPOSITORY':
+                    single_user_repository.repository_uri,
+                'FARGATE_SPAWNER_IMAGE_TAG':
+                    single_user_container_image_tag,
+                'FARGATE_SPAWNER_LOG_GROUP':
+                    single_user_log_group.log_group_name,
+                'FARGATE_SPAWNER_LOG_STREAM_PREFIX':
+                    f'{base_name}SingleUser-',
+                'FARGATE_SPAWNER_FAMILY_PREFIX':
+                    f'{base_name}SingleUser',
+                'FARGATE_EFS_ID': file_system.file_system_id,
+                'FARGATE_EFS_REFERENCE_ACCESS_POINT_ID':
+                    reference_access_pt.access_point_id
             }
         )
 
@@ -512,6 +713,241 @@ class HubStack(Stack):
             read_only=False
         ))
 
+        if julia_depot:
+            hub_container.add_environment(
+                'FARGATE_EFS_JULIA_DEPOT_ACCESS_POINT_ID',
+                julia_depot_access_pt.access_point_id
+            )
+
+        if warm_pool:
+            hub_container.add_environment(
+                'WARM_POOL_SCHEDULE', json.dumps(warm_pool)
+            )
+
+        speculative_spawn = config_yaml.get('speculative_spawn')
+        if speculative_spawn:
+            if not isinstance(speculative_spawn, dict):
+                speculative_spawn = {}
+            hub_container.add_environment(
+                'SPECULATIVE_SPAWN_TIMEOUT',
+                str(speculative_spawn.get('timeout', 120))
+            )
+
+        # Secret of the activation requests of pre-started tasks, shared by
+        # the hubs during a rolling deploy and kept across hub restarts
+        if warm_pool or speculative_spawn:
+            warm_start_secret = secretsmanager.Secret(
+                self, f'{base_name}WarmStartSecret',
+                generate_secret_string=secretsmanager.SecretStringGenerator(
+                    exclude_punctuation=True,
+                    password_length=64
+                )
+            )
+            hub_container.add_secret(
+                'WARM_START_SECRET',
+                ecs.Secret.from_secrets_manager(warm_start_secret)
+            )
+
+        prespawn = config_yaml.get('prespawn')
+        if prespawn:
+            hub_container.add_environment(
+                'PRESPAWN_SCHEDULE', json.dumps(prespawn['sessions'])
+            )
+            if 'rate' in prespawn:
+                hub_container.add_environment(
+                    'PRESPAWN_RATE', str(prespawn['rate'])
+                )
+
+        culler = config_yaml.get('culler')
+        if culler:
+            hub_container.add_environment(
+                'ACTIVITY_CULLER_POLICIES',
+                json.dumps(culler.get('policies', {}))
+            )
+            if 'interval' in culler:
+                hub_container.add_environment(
+                    'ACTIVITY_CULLER_INTERVAL', str(culler['interval'])
+                )
+
+        if config_yaml.get('system_users'):
+            hub_container.add_environment(
+                'HUB_SYSTEM_USERS', config_yaml['system_users']
+            )
+
+        # Optional shared PostgreSQL database for the hub state, so that the
+        # state survives hub restarts. The hub connects through an RDS Proxy
+        # that pools the database connections.
+        hub_database = config_yaml.get('hub_database')
+        if hub_database:
+            if not isinstance(hub_database, dict):
+                hub_database = {}
+            hub_database_security_group = ec2.SecurityGroup(
+                self, f'{base_name}HubDatabaseSG',
+                vpc=vpc,
+                description='Hub database security group',
+                allow_all_outbound=False
+            )
+            hub_database_security_group.connections.allow_from(
+                ecs_service_security_group,
+                port_range=ec2.Port.tcp(5432),
+                description='Allow PostgreSQL from ECS Service containers'
+            )
+            hub_database_security_group.connections.allow_internally(
+                port_range=ec2.Port.tcp(5432),
+                description='Allow PostgreSQL from the RDS Proxy'
+            )
+
+            hub_database_cluster = rds.DatabaseCluster(
+                self, f'{base_name}HubDatabase',
+                engine=rds.DatabaseClusterEngine.aurora_postgres(
+                    version=rds.AuroraPostgresEngineVersion.VER_15_4
+                ),
+                credentials=rds.Credentials.from_generated_secret(
+                    'jupyterhub'
+                ),
+                default_database_name='jupyterhub',
+                writer=rds.ClusterInstance.serverless_v2('writer'),
+                serverless_v2_min_capacity=hub_database.get(
+                    'min_capacity', 0.5
+                ),
+                serverless_v2_max_capacity=hub_database.get(
+                    'max_capacity', 2
+                ),
+                vpc=vpc,
+                vpc_subnets=ec2.SubnetSelection(
+                    subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS
+                ),
+                security_groups=[hub_database_security_group],
+                storage_encrypted=True,
+                removal_policy=RemovalPolicy.SNAPSHOT
+            )
+
+            hub_database_proxy = hub_database_cluster.add_proxy(
+                f'{base_name}HubDatabaseProxy',
+                secrets=[hub_database_cluster.secret],
+                vpc=vpc,
+                security_groups=[hub_database_security_group],
+                max_connections_percent=90
+            )
+
+            hub_container.add_environment(
+                'HUB_DB_HOST', hub_database_proxy.endpoint
+            )
+            hub_container.add_environment('HUB_DB_NAME', 'jupyterhub')
+            hub_container.add_secret(
+                'HUB_DB_USER', ecs.Secret.from_secrets_manager(
+                    hub_database_cluster.secret, 'username'
+                )
+            )
+            hub_container.add_secret(
+                'HUB_DB_PASSWORD', ecs.Secret.from_secrets_manager(
+                    hub_database_cluster.secret, 'password'
+                )
+            )
+
+        # Optional separate HTTP proxy service. The hub then only handles
+        # the control plane and registers itself in Cloud Map, so that the
+        # proxy can find it.
+        proxy_service_config = config_yaml.get('proxy_service') or {}
+        alb_routing = proxy_service_config.get('type') == 'alb'
+        proxy_service = None
+        hub_cloud_map_options = None
+        if proxy_service_config and not alb_routing:
+            namespace = ecs_cluster.add_default_cloud_map_namespace(
+                name=f'{base_name}.local'
+            )
+            proxy_service = ProxyService(
+                self, f'{base_name}Proxy',
+                cluster=ecs_cluster,
+                security_group=ecs_service_security_group,
+                hub_host=f'hub.{namespace.namespace_name}',
+                proxy_config=proxy_service_config,
+                base_name=base_name
+            )
+            hub_cloud_map_options = ecs.CloudMapOptions(name='hub')
+
+            hub_container.add_port_mappings(
+                ecs.PortMapping(container_port=8081)
+            )
+            hub_container.add_environment(
+                'PROXY_SERVICE_TYPE', proxy_service.proxy_type
+            )
+            hub_container.add_environment(
+                'PROXY_API_URL', proxy_service.api_url
+            )
+            hub_container.add_environment(
+                'PROXY_REDIS_URL', proxy_service.redis_url
+            )
+            hub_container.add_secret(
+                'PROXY_AUTH_TOKEN',
+                ecs.Secret.from_secrets_manager(proxy_service.auth_token)
+            )
+
+        # Optional package cache service. The single user servers install
+        # Julia packages and Python packages through it, see
+        # hub_docker/jupyterhub_config.py.
+        package_cache_config = config_yaml.get('package_cache')
+        package_cache = None
+        if package_cache_config:
+            if ecs_cluster.default_cloud_map_namespace is None:
+                ecs_cluster.add_default_cloud_map_namespace(
+                    name=f'{base_name}.local'
+                )
+            package_cache = PackageCache(
+                self, f'{base_name}PackageCache',
+                cluster=ecs_cluster,
+                security_group=ecs_service_security_group,
+                file_system=file_system,
+                cache_config=package_cache_config
+                if isinstance(package_cache_config, dict) else {},
+                base_name=base_name
+            )
+            hub_container.add_environment(
+                'PACKAGE_CACHE_JULIA_PKG_SERVER',
+                package_cache.julia_pkg_server
+            )
+            hub_container.add_environment(
+                'PACKAGE_CACHE_PIP_INDEX_URL', package_cache.pip_index_url
+            )
+            hub_container.add_environment(
+                'PACKAGE_CACHE_PIP_TRUSTED_HOST',
+                package_cache.pip_trusted_host
+            )
+
+        # Optional routing from the load balancer straight to the single
+        # user tasks. The hub adds a listener rule and a target group for
+        # every running server, see hub_docker/alb_proxy.py.
+        if alb_routing:
+            hub_container.add_environment('PROXY_SERVICE_TYPE', 'alb')
+            hub_container.add_environment('ALB_PROXY_VPC_ID', vpc.vpc_id)
+            hub_container.add_environment(
+                'ALB_PROXY_TARGET_GROUP_PREFIX', base_name[:20]
+            )
+            ecs_task_role.add_to_policy(
+                iam.PolicyStatement(
+                    resources=['*'],
+                    actions=[
+                        'elasticloadbalancing:CreateTargetGroup',
+                        'elasticloadbalancing:DeleteTargetGroup',
+                        'elasticloadbalancing:ModifyTargetGroup',
+                        'elasticloadbalancing:ModifyTargetGroupAttributes',
+                        'elasticloadbalancing:DescribeTargetGroups',
+                        'elasticloadbalancing:RegisterTargets',
+                        'elasticloadbalancing:DeregisterTargets',
+                        'elasticloadbalancing:CreateRule',
+                        'elasticloadbalancing:DeleteRule',
+                        'elasticloadbalancing:DescribeRules',
+                        'elasticloadbalancing:AddTags',
+                        'elasticloadbalancing:RemoveTags',
+                        'elasticloadbalancing:DescribeTags'
+                    ]
+                )
+            )
+            ecs_service_security_group.connections.allow_from(
+                load_balancer, ec2.Port.tcp(8888),
+                'Allow single user traffic from the load balancer'
+            )
+
         # Create the JupyterHub service
         hub_service = ecs_patterns.ApplicationLoadBalancedFargateService(
             self, f'{base_name}HubService',
@@ -521,23 +957,164 @@ class HubStack(Stack):
             desired_count=config_yaml['num_containers'],
             security_groups=[ecs_service_security_group],
             open_listener=False,
-            enable_ecs_managed_tags=True
+            enable_ecs_managed_tags=True,
+            cloud_map_options=hub_cloud_map_options,
+            # Give a restarting hub time to reload its users and servers
+            # before failed health checks replace it
+            health_check_grace_period=Duration.minutes(5)
         )
 
-        hub_service.target_group.configure_health_check(
-            path='/hub',
-            enabled=True,
-            healthy_http_codes='200-302'
-        )
+        if proxy_service:
+            # Without its own proxy the hub only listens on the hub port
+            hub_service.target_group.configure_health_check(
+                path='/hub/health',
+                port='8081',
+                enabled=True,
+                healthy_http_codes='200'
+            )
+            hub_service.service.connections.allow_from(
+                load_balancer, ec2.Port.tcp(8081),
+                'Allow hub health checks from the load balancer'
+            )
+        elif alb_routing:
+            # The hub listens on the load balancer port itself
+            hub_service.target_group.configure_health_check(
+                path='/hub/health',
+                enabled=True,
+                healthy_http_codes='200'
+            )
+        else:
+            hub_service.target_group.configure_health_check(
+                path='/hub',
+                enabled=True,
+                healthy_http_codes='200-302'
+            )
 
         certificate = acm.Certificate.from_certificate_arn(
             self, "Certificate", certificate_arn
         )
-        load_balancer.add_listener(
-            f'{base_name}HubServiceListener',
-            port=443,
-            protocol=elb.ApplicationProtocol.HTTPS,
-            certificates=[certificate],
-            default_action=elb.ListenerAction.forward(
-                target_groups=[hub_service.target_group])
-        )
+        if proxy_service:
+            https_listener = load_balancer.add_listener(
+                f'{base_name}HubServiceListener',
+                port=443,
+                protocol=elb.ApplicationProtocol.HTTPS,
+                certificates=[certificate]
+            )
+            proxy_service.add_to_listener(https_listener, base_name)
+        else:
+            https_listener = load_balancer.add_listener(
+                f'{base_name}HubServiceListener',
+                port=443,
+                protocol=elb.ApplicationProtocol.HTTPS,
+                certificates=[certificate],
+                default_action=elb.ListenerAction.forward(
+                    target_groups=[hub_service.target_group])
+            )
+            if alb_routing:
+                hub_container.add_environment(
+                    'ALB_PROXY_LISTENER_ARN', https_listener.listener_arn
+                )
+
+        # Optional CloudWatch dashboard and alarms
+        if monitoring:
+            hub_monitoring = Monitoring(
+                self, f'{base_name}Monitoring', monitoring,
+                dashboard_name=f'{base_name}-hub'
+            )
+            minute = Duration.minutes(1)
+
+            hub_cpu = hub_service.service.metric_cpu_utilization(
+                period=minute
+            )
+            hub_memory = hub_service.service.metric_memory_utilization(
+                period=minute
+            )
+            hub_monitoring.add_graphs(
+                ('Hub CPU utilization (%)', [hub_cpu]),
+                ('Hub memory utilization (%)', [hub_memory])
+            )
+            hub_monitoring.add_alarm(
+                'HubCPUAlarm', hub_cpu, 'hub_cpu_percent',
+                'The hub is short of CPU'
+            )
+            hub_monitoring.add_alarm(
+                'HubMemoryAlarm', hub_memory, 'hub_memory_percent',
+                'The hub is short of memory'
+            )
+
+            # The single user tasks are the tasks of the cluster that are
+            # not part of a service
+            services = [hub_service.service]
+            if proxy_service:
+                services.append(proxy_service.service)
+                if proxy_service.redis_service:
+                    services.append(proxy_service.redis_service)
+            if package_cache:
+                services.append(package_cache.service)
+            task_counts = {
+                'tasks': cloudwatch.Metric(
+                    namespace='ECS/ContainerInsights',
+                    metric_name='TaskCount',
+                    dimensions_map={'ClusterName': ecs_cluster.cluster_name},
+                    statistic='Maximum',
+                    period=minute
+                )
+            }
+            for index, service in enumerate(services):
+                task_counts[f'service{index}'] = cloudwatch.Metric(
+                    namespace='ECS/ContainerInsights',
+                    metric_name='RunningTaskCount',
+                    dimensions_map={
+                        'ClusterName': ecs_cluster.cluster_name,
+                        'ServiceName': service.service_name
+                    },
+                    statistic='Maximum',
+                    period=minute
+                )
+            single_user_tasks = cloudwatch.MathExpression(
+                expression=' - '.join(
+                    ['tasks'] + [
+                        f'FILL(service{index}, 0)'
+                        for index in range(len(services))
+                    ]
+                ),
+                using_metrics=task_counts,
+                label='Single user tasks',
+                period=minute
+            )
+
+            # Logged by the hub, see hub_docker/spawn_metrics.py
+            run_task_throttles = cloudwatch.Metric(
+                namespace=SPAWN_METRICS_NAMESPACE,
+                metric_name='RunTaskThrottles',
+                statistic='Sum',
+                period=Duration.minutes(5)
+            )
+            spawn_durations = [
+                cloudwatch.Metric(
+                    namespace=SPAWN_METRICS_NAMESPACE,
+                    metric_name='PhaseDuration',
+                    dimensions_map={'Phase': phase},
+                    statistic='p90',
+                    period=Duration.minutes(5),
+                    label=f'{phase} p90'
+                ) for phase in (
+                    'total', 'run_task', 'image_pull', 'server_responding'
+                )
+            ]
+            hub_monitoring.add_graphs(
+                ('Single user tasks', [single_user_tasks]),
+                ('Throttled RunTask calls', [run_task_throttles]),
+                ('Server start phases (s)', spawn_durations)
+            )
+            hub_monitoring.add_alarm(
+                'SingleUserTasksAlarm', single_user_tasks,
+                'single_user_tasks',
+                'Many single user tasks are running'
+            )
+            hub_monitoring.add_alarm(
+                'RunTaskThrottlesAlarm', run_task_throttles,
+                'run_task_throttles',
+                'RunTask calls of the hub are throttled',
+                evaluation_periods=1
+            )
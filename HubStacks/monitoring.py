@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+from aws_cdk import (
+    aws_cloudwatch as cloudwatch,
+    aws_cloudwatch_actions as cloudwatch_actions,
+    aws_sns as sns,
+    aws_sns_subscriptions as sns_subscriptions
+)
+from constructs import Construct
+
+# Alarm thresholds, overridden by the 'monitoring' settings in config.yaml.
+# A threshold of None leaves out the alarm.
+DEFAULT_THRESHOLDS = {
+    # FrameStack
+    'target_response_time': 2,  # seconds, average
+    'http_5xx_count': 10,  # 5xx responses of the load balancer per minute
+    'efs_burst_credit_balance': 1e12,  # bytes, minimum
+    'efs_percent_io_limit': 90,  # percent, maximum
+    'nat_gateway_bytes': 5e9,  # bytes out to the internet per 5 minutes
+    # HubStack
+    'hub_cpu_percent': 80,
+    'hub_memory_percent': 80,
+    'single_user_tasks': 400,
+    'run_task_throttles': 10,  # throttled RunTask calls per 5 minutes
+}
+
+# Namespace of the metrics that the hub logs, see hub_docker/spawn_metrics.py
+SPAWN_METRICS_NAMESPACE = 'JupyterHub/Spawns'
+
+
+def monitoring_config(config_yaml):
+    """
+    Return the 'monitoring' settings of config_yaml with the default
+    thresholds, or None if there are none. 'monitoring: true' uses the
+    defaults.
+    """
+    monitoring = config_yaml.get('monitoring')
+    if not monitoring:
+        return None
+    if not isinstance(monitoring, dict):
+        monitoring = {}
+    return dict(DEFAULT_THRESHOLDS, **monitoring)
+
+
+class Monitoring(Construct):
+    """
+    CloudWatch dashboard with alarms that notify an SNS topic.
+    Adds:
+    - a dashboard, with graphs added by add_graphs
+    - an SNS topic for the alarms, with an optional e-mail subscription
+    - alarms, added by add_alarm
+    ------
+    Inputs
+    ------
+    - monitoring: dict -
+        alarm thresholds, see DEFAULT_THRESHOLDS, and an optional
+        'alarm_email' address
+    - dashboard_name: str -
+        name of the dashboard
+    ----------
+    Attributes
+    ----------
+    - dashboard: Dashboard -
+        the dashboard
+    - alarm_topic: Topic -
+        SNS topic that the alarms notify
+    """
+
+    def __init__(
+        self, scope: Construct, id: str, monitoring, dashboard_name
+    ) -> None:
+        super().__init__(scope, id)
+
+        self.thresholds = monitoring
+        self.dashboard = cloudwatch.Dashboard(
+            self, 'Dashboard',
+            dashboard_name=dashboard_name
+        )
+        self.alarm_topic = sns.Topic(self, 'AlarmTopic')
+        if monitoring.get('alarm_email'):
+            self.alarm_topic.add_subscription(
+                sns_subscriptions.EmailSubscription(monitoring['alarm_email'])
+            )
+
+    def add_graphs(self, *graphs):
+        """
+        Add a row of graphs, each a (title, list of metrics) pair
+        """
+        self.dashboard.add_widgets(*(
+            cloudwatch.GraphWidget(
+                title=title, left=metrics, width=24 // len(graphs)
+            ) for title, metrics in graphs
+        ))
+
+    def add_alarm(
+        self, id, metric, threshold, description,
+        comparison_operator=(
+            cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD
+        ),
+        evaluation_periods=3
+    ):
+        """
+        Add an alarm on metric with the threshold named threshold, unless
+        that threshold is None
+        """
+        if self.thresholds.get(threshold) is None:
+            return None
+        alarm = metric.create_alarm(
+            self, id,
+            threshold=self.thresholds[threshold],
+            evaluation_periods=evaluation_periods,
+            comparison_operator=comparison_operator,
+            treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING,
+            alarm_description=description
+        )
+        alarm.add_alarm_action(
+            cloudwatch_actions.SnsAction(self.alarm_topic)
+        )
+        return alarm
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+from aws_cdk import (
+    aws_ecs as ecs,
+    aws_efs as efs,
+    aws_logs as logs
+)
+from constructs import Construct
+
+# Repository of the PkgServer image, which is pinned by digest with the
+# pkg_server_image option
+PKG_SERVER_IMAGE = 'juliapackaging/pkgserver.jl'
+PYPI_CACHE_IMAGE = 'epicwink/proxpi:v1.2'
+PKG_SERVER_PORT = 8000
+PYPI_CACHE_PORT = 5000
+
+
+def pinned_image(image):
+    """
+    Return whether the image reference has a digest, or a tag other than
+    latest, so that a replaced task runs the same image
+    """
+    if '@sha256:' in image:
+        return True
+    name = image.rsplit('/', 1)[-1]
+    return ':' in name and not name.endswith(':latest')
+
+
+class PackageCache(Construct):
+    """
+    Run a caching package proxy in the VPC, so that the single user tasks
+    download Julia and Python packages from the internet only once instead
+    of once per user.
+    Adds:
+    - a Fargate service 'package-cache' in the cluster's Cloud Map
+      namespace, with a Julia PkgServer and a proxpi PyPI caching proxy
+    - EFS access points for the caches of both, so that the caches are kept
+      when the task is replaced
+    ------
+    Inputs
+    ------
+    - cluster: Cluster -
+        ECS cluster with a default Cloud Map namespace
+    - security_group: SecurityGroup -
+        security group shared with the hub and the single user tasks
+    - file_system: FileSystem -
+        file system for the caches
+    - cache_config: dict -
+        'pkg_server_image' (the PkgServer image, pinned by digest), and
+        optional 'cpu', 'memory', 'pypi_cache_image', 'pypi_index_url'
+        (upstream index of the PyPI cache) and 'pypi_cache_gb' (size of the
+        PyPI package file cache)
+    - base_name: str -
+        base name to be used in the Stacks
+    ----------
+    Attributes
+    ----------
+    - service: FargateService -
+        the package cache service
+    - julia_pkg_server: str -
+        URL of the PkgServer, for JULIA_PKG_SERVER
+    - pip_index_url: str -
+        URL of the PyPI simple index, for PIP_INDEX_URL
+    - pip_trusted_host: str -
+        host of the PyPI cache, for PIP_TRUSTED_HOST, as it serves HTTP
+    """
+
+    def __init__(
+        self, scope: Construct, id: str,
+        cluster, security_group, file_system, cache_config, base_name
+    ) -> None:
+        super().__init__(scope, id)
+
+        images = {
+            'pkg_server_image': cache_config.get('pkg_server_image'),
+            'pypi_cache_image': cache_config.get(
+                'pypi_cache_image', PYPI_CACHE_IMAGE
+            )
+        }
+        examples = {
+            'pkg_server_image': f'{PKG_SERVER_IMAGE}@sha256:<digest>',
+            'pypi_cache_image': PYPI_CACHE_IMAGE
+        }
+        for option, image in images.items():
+            if not image or not pinned_image(image):
+                raise ValueError(
+                    f'package_cache {option} must be pinned to a version '
+                    f'tag or a digest, for example {examples[option]}, '
+                    f'not {image!r}'
+                )
+
+        namespace = cluster.default_cloud_map_namespace.namespace_name
+        host = f'package-cache.{namespace}'
+        self.julia_pkg_server = f'http://{host}:{PKG_SERVER_PORT}'
+        self.pip_index_url = f'http://{host}:{PYPI_CACHE_PORT}/index/'
+        self.pip_trusted_host = host
+
+        task_definition = ecs.FargateTaskDefinition(
+            self, f'{base_name}PackageCacheTaskDef',
+            cpu=cache_config.get('cpu', 1024),
+            memory_limit_mib=cache_config.get('memory', 2048)
+        )
+        file_system.grant(
+            task_definition.task_role,
+            'elasticfilesystem:ClientMount',
+            'elasticfilesystem:ClientWrite'
+        )
+
+        pkg_server = task_definition.add_container(
+            f'{base_name}PkgServerContainer',
+            image=ecs.ContainerImage.from_registry(
+                images['pkg_server_image']
+            ),
+            environment={
+                'JULIA_PKG_SERVER': f'0.0.0.0:{PKG_SERVER_PORT}',
+                'JULIA_PKG_SERVER_FQDN': host,
+                'JULIA_PKG_SERVER_STORAGE_ROOT': '/cache'
+            },
+            port_mappings=[ecs.PortMapping(container_port=PKG_SERVER_PORT)],
+            logging=ecs.LogDriver.aws_logs(
+                stream_prefix=f'{base_name}PkgServer-',
+                log_retention=logs.RetentionDays.ONE_WEEK
+            )
+        )
+        self._add_cache_volume(
+            task_definition, pkg_server, file_system, 'julia', base_name
+        )
+
+        pypi_cache = task_definition.add_container(
+            f'{base_name}PyPICacheContainer',
+            image=ecs.ContainerImage.from_registry(
+                images['pypi_cache_image']
+            ),
+            environment={
+                'PROXPI_INDEX_URL': cache_config.get(
+                    'pypi_index_url', 'https://pypi.org/simple/'
+                ),
+                'PROXPI_CACHE_DIR': '/cache',
+                # Size of the cache of package files, in bytes
+                'PROXPI_CACHE_SIZE': str(
+                    cache_config.get('pypi_cache_gb', 50) * 1024 ** 3
+                )
+            },
+            port_mappings=[ecs.PortMapping(container_port=PYPI_CACHE_PORT)],
+            logging=ecs.LogDriver.aws_logs(
+                stream_prefix=f'{base_name}PyPICache-',
+                log_retention=logs.RetentionDays.ONE_WEEK
+            )
+        )
+        self._add_cache_volume(
+            task_definition, pypi_cache, file_system, 'pypi', base_name
+        )
+
+        self.service = ecs.FargateService(
+            self, f'{base_name}PackageCacheService',
+            cluster=cluster,
+            task_definition=task_definition,
+            desired_count=1,
+            security_groups=[security_group],
+            cloud_map_options=ecs.CloudMapOptions(name='package-cache'),
+            enable_ecs_managed_tags=True
+        )
+
+    def _add_cache_volume(
+        self, task_definition, container, file_system, name, base_name
+    ):
+        access_point = efs.AccessPoint(
+            self, f'{base_name}{name.capitalize()}CacheAccessPt',
+            file_system=file_system,
+            create_acl=efs.Acl(
+                owner_gid="100",
+                owner_uid="1000",
+                permissions="755"
+            ),
+            path=f'/package-cache/{name}',
+            posix_user=efs.PosixUser(
+                gid="100",
+                uid="1000"
+            )
+        )
+        task_definition.add_volume(
+            name=f'efs-{name}-cache-volume',
+            efs_volume_configuration=ecs.EfsVolumeConfiguration(
+                file_system_id=file_system.file_system_id,
+                authorization_config=ecs.AuthorizationConfig(
+                    access_point_id=access_point.access_point_id,
+                    iam="ENABLED"
+                ),
+                transit_encryption="ENABLED"
+            )
+        )
+        container.add_mount_points(ecs.MountPoint(
+            container_path='/cache',
+            source_volume=f'efs-{name}-cache-volume',
+            read_only=False
+        ))
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+from aws_cdk import (
+    aws_ecs as ecs,
+    aws_elasticloadbalancingv2 as elb,
+    aws_logs as logs,
+    aws_secretsmanager as secretsmanager,
+    Duration
+)
+from constructs import Construct
+
+CHP_IMAGE = 'jupyterhub/configurable-http-proxy:4.6.1'
+TRAEFIK_IMAGE = 'traefik:v2.10'
+REDIS_IMAGE = 'redis:7-alpine'
+
+
+class ProxyService(Construct):
+    """
+    Run the JupyterHub HTTP proxy as its own Fargate service, so that the
+    users' HTTP and websocket traffic does not pass through the hub task.
+    Adds:
+    - 'chp': a configurable-http-proxy service with one task, or
+    - 'traefik': an autoscaled Traefik service that reads its routes from a
+      Redis service, so that all Traefik tasks share the same routes
+    - a target group for the load balancer in front of the proxy, see
+      add_to_listener
+    - a secret for the proxy API
+    ------
+    Inputs
+    ------
+    - cluster: Cluster -
+        ECS cluster with a default Cloud Map namespace
+    - security_group: SecurityGroup -
+        security group shared with the hub and the single user tasks
+    - hub_host: str -
+        Cloud Map host name of the hub
+    - proxy_config: dict -
+        'type' ('chp' or 'traefik'), 'cpu', 'memory', 'min_count' and
+        'max_count'
+    - base_name: str -
+        base name to be used in the Stacks
+    ----------
+    Attributes
+    ----------
+    - service: FargateService -
+        the proxy service
+    - target_group: ApplicationTargetGroup -
+        target group of the proxy port, after add_to_listener
+    - auth_token: Secret -
+        token for the proxy API
+    - api_url: str -
+        URL of the proxy API, for the hub
+    - redis_url: str -
+        URL of the Redis route store ('traefik' only)
+    - redis_service: FargateService -
+        the Redis route store service ('traefik' only)
+    """
+
+    def __init__(
+        self, scope: Construct, id: str,
+        cluster, security_group, hub_host, proxy_config, base_name
+    ) -> None:
+        super().__init__(scope, id)
+
+        self.proxy_type = proxy_config.get('type', 'chp')
+        cpu = proxy_config.get('cpu', 512)
+        memory = proxy_config.get('memory', 1024)
+        namespace = cluster.default_cloud_map_namespace.namespace_name
+        proxy_host = f'proxy.{namespace}'
+
+        self.auth_token = secretsmanager.Secret(
+            self, f'{base_name}ProxyAuthToken',
+            generate_secret_string=secretsmanager.SecretStringGenerator(
+                exclude_punctuation=True,
+                password_length=48
+            )
+        )
+        self.redis_url = ''
+        self.redis_service = None
+
+        task_definition = ecs.FargateTaskDefinition(
+            self, f'{base_name}ProxyTaskDef',
+            cpu=cpu,
+            memory_limit_mib=memory
+        )
+        logging = ecs.LogDriver.aws_logs(
+            stream_prefix=f'{base_name}Proxy-',
+            log_retention=logs.RetentionDays.ONE_WEEK
+        )
+
+        if self.proxy_type == 'traefik':
+            redis_host = self._add_redis(
+                cluster, security_group, namespace, base_name
+            )
+            self.redis_url = f'redis://{redis_host}:6379'
+            self.api_url = f'http://{proxy_host}:8099'
+            task_definition.add_container(
+                f'{base_name}ProxyContainer',
+                image=ecs.ContainerImage.from_registry(TRAEFIK_IMAGE),
+                command=[
+                    '--entrypoints.http.address=:8000',
+                    '--entrypoints.auth_api.address=:8099',
+                    '--api=true',
+                    '--ping=true',
+                    '--ping.entrypoint=http',
+                    f'--providers.redis.endpoints={redis_host}:6379',
+                    '--providers.redis.rootkey=traefik'
+                ],
+                port_mappings=[
+                    ecs.PortMapping(container_port=8000),
+                    ecs.PortMapping(container_port=8099)
+                ],
+                logging=logging
+            )
+            health_check_path = '/ping'
+            min_count = proxy_config.get('min_count', 1)
+            max_count = proxy_config.get('max_count', 4)
+        else:
+            self.api_url = f'http://{proxy_host}:8001'
+            task_definition.add_container(
+                f'{base_name}ProxyContainer',
+                image=ecs.ContainerImage.from_registry(CHP_IMAGE),
+                # The image's entrypoint is configurable-http-proxy
+                command=[
+                    '--ip=0.0.0.0',
+                    '--port=8000',
+                    '--api-ip=0.0.0.0',
+                    '--api-port=8001',
+                    f'--default-target=http://{hub_host}:8081',
+                    f'--error-target=http://{hub_host}:8081/hub/error'
+                ],
+                port_mappings=[
+                    ecs.PortMapping(container_port=8000),
+                    ecs.PortMapping(container_port=8001)
+                ],
+                secrets={
+                    'CONFIGPROXY_AUTH_TOKEN':
+                        ecs.Secret.from_secrets_manager(self.auth_token)
+                },
+                logging=logging
+            )
+            health_check_path = '/_chp_healthz'
+            # configurable-http-proxy keeps its routes in memory, so it
+            # cannot be scaled out
+            min_count = 1
+            max_count = 1
+
+        self.service = ecs.FargateService(
+            self, f'{base_name}ProxyService',
+            cluster=cluster,
+            task_definition=task_definition,
+            desired_count=min_count,
+            security_groups=[security_group],
+            cloud_map_options=ecs.CloudMapOptions(name='proxy'),
+            enable_ecs_managed_tags=True
+        )
+
+        if max_count > min_count:
+            scaling = self.service.auto_scale_task_count(
+                min_capacity=min_count,
+                max_capacity=max_count
+            )
+            scaling.scale_on_cpu_utilization(
+                f'{base_name}ProxyCpuScaling',
+                target_utilization_percent=proxy_config.get(
+                    'target_cpu_percent', 60
+                ),
+                scale_in_cooldown=Duration.minutes(5),
+                scale_out_cooldown=Duration.minutes(1)
+            )
+
+        self.health_check_path = health_check_path
+        self.target_group = None
+
+    def _add_redis(self, cluster, security_group, namespace, base_name):
+        redis_task_definition = ecs.FargateTaskDefinition(
+            self, f'{base_name}RedisTaskDef',
+            cpu=256,
+            memory_limit_mib=512
+        )
+        redis_task_definition.add_container(
+            f'{base_name}RedisContainer',
+            image=ecs.ContainerImage.from_registry(REDIS_IMAGE),
+            # The hub writes all routes again when it starts, so the routes
+            # do not need to be persisted
+            command=['redis-server', '--save', '', '--appendonly', 'no'],
+            port_mappings=[ecs.PortMapping(container_port=6379)],
+            logging=ecs.LogDriver.aws_logs(
+                stream_prefix=f'{base_name}Redis-',
+                log_retention=logs.RetentionDays.ONE_WEEK
+            )
+        )
+        self.redis_service = ecs.FargateService(
+            self, f'{base_name}RedisService',
+            cluster=cluster,
+            task_definition=redis_task_definition,
+            desired_count=1,
+            security_groups=[security_group],
+            cloud_map_options=ecs.CloudMapOptions(name='redis'),
+            enable_ecs_managed_tags=True
+        )
+        return f'redis.{namespace}'
+
+    def add_to_listener(self, listener, base_name):
+        """
+        Forward the listener's requests to the proxy tasks. The target group
+        is created in the listener's scope, like the ECS patterns do, so
+        that the load balancer's stack does not depend on this one.
+        """
+        self.target_group = listener.add_targets(
+            f'{base_name}ProxyTarget',
+            port=8000,
+            protocol=elb.ApplicationProtocol.HTTP,
+            targets=[self.service.load_balancer_target(
+                container_name=f'{base_name}ProxyContainer',
+                container_port=8000
+            )],
+            health_check=elb.HealthCheck(
+                path=self.health_check_path,
+                healthy_http_codes='200'
+            )
+        )
+        return self.target_group
@@ -0,0 +1,158 @@
+# ECS API call benchmark of the task status polling.
+#
+#   python poll_bench.py --users 10,50,100,250,500
+#
+# Simulates a lecture in which all users start their server within the
+# first --arrival seconds, and counts the DescribeTasks calls per minute:
+# - per spawner: as FargateSpawner, one call per second per starting server
+#   and one call per server every --poll-interval seconds once running
+# - shared: the hub-wide TaskPoller of hub_docker/task_poller.py
+# The ECS API is simulated, so no AWS account is needed. Prints JSON.
+
+import argparse
+import collections
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', 'hub_docker'
+))
+
+from task_poller import TaskPoller  # noqa: E402
+
+
+class SimulatedTask:
+    def __init__(self, arn, started, ip_after, running_after):
+        self.arn = arn
+        self.started = started
+        self.ip_after = ip_after
+        self.running_after = running_after
+
+    def describe(self, now):
+        age = now - self.started
+        status = 'RUNNING' if age >= self.running_after else \
+            'PENDING' if age >= self.ip_after else 'PROVISIONING'
+        described = {'taskArn': self.arn, 'lastStatus': status}
+        if age >= self.ip_after:
+            described['attachments'] = [{'details': [{
+                'name': 'privateIPv4Address', 'value': '10.0.0.1'
+            }]}]
+        return described
+
+
+class SimulatedECS:
+    def __init__(self, clock):
+        self.clock = clock
+        self.tasks = {}
+        self.calls = collections.Counter()
+
+    def describe_tasks(self, cluster, tasks):
+        self.calls[int(self.clock() // 60)] += 1
+        return {
+            'tasks': [self.tasks[arn].describe(self.clock())
+                      for arn in tasks],
+            'failures': []
+        }
+
+
+def make_tasks(users, arrival, seed):
+    generator = random.Random(seed)
+    tasks = []
+    for index in range(users):
+        started = generator.uniform(0, arrival)
+        ip_after = generator.uniform(10, 30)
+        tasks.append(SimulatedTask(
+            f'task/{index}', started, ip_after,
+            ip_after + generator.uniform(20, 60)
+        ))
+    return sorted(tasks, key=lambda task: task.started)
+
+
+def per_spawner(tasks, duration, poll_interval):
+    calls = collections.Counter()
+    for task in tasks:
+        # start(): one DescribeTasks per second until the task is RUNNING
+        second = task.started
+        while second - task.started < task.running_after:
+            calls[int(second // 60)] += 1
+            second += 1
+        # poll(): one DescribeTasks per poll interval
+        second += poll_interval
+        while second < duration:
+            calls[int(second // 60)] += 1
+            second += poll_interval
+    return calls
+
+
+def shared(tasks, duration, fast_interval, slow_interval):
+    now = [0.0]
+    ecs = SimulatedECS(lambda: now[0])
+    poller = TaskPoller(ecs, fast_interval=fast_interval,
+                        slow_interval=slow_interval, clock=lambda: now[0])
+    pending = list(tasks)
+    last_poll = None
+    next_poll = 0.0
+    step = 0.5
+    while now[0] < duration:
+        while pending and pending[0].started <= now[0]:
+            task = pending.pop(0)
+            ecs.tasks[task.arn] = task
+            poller.watch('cluster', task.arn)
+            # A new task wakes the poller, at most every fast_interval
+            earliest = 0.0 if last_poll is None \
+                else last_poll + fast_interval
+            next_poll = min(next_poll, max(now[0], earliest))
+        if now[0] >= next_poll:
+            poller.poll()
+            last_poll = now[0]
+            next_poll = now[0] + poller.next_interval()
+        now[0] += step
+    return ecs.calls
+
+
+def summary(calls, duration):
+    minutes = [calls.get(minute, 0) for minute in range(int(duration // 60))]
+    return {
+        'calls': sum(minutes),
+        'peak_calls_per_minute': max(minutes),
+        'mean_calls_per_minute': round(sum(minutes) / len(minutes), 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Count ECS DescribeTasks calls of the task polling'
+    )
+    parser.add_argument('--users', default='10,50,100,250,500',
+                        help='comma separated numbers of users')
+    parser.add_argument('--arrival', type=float, default=120,
+                        help='seconds in which all users start a server')
+    parser.add_argument('--duration', type=float, default=600,
+                        help='simulated seconds')
+    parser.add_argument('--poll-interval', type=float, default=30,
+                        help='JupyterHub Spawner.poll_interval')
+    parser.add_argument('--fast-interval', type=float, default=2)
+    parser.add_argument('--slow-interval', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=1)
+    arguments = parser.parse_args()
+
+    results = []
+    for users in [int(count) for count in arguments.users.split(',')]:
+        tasks = make_tasks(users, arguments.arrival, arguments.seed)
+        results.append({
+            'users': users,
+            'per_spawner': summary(per_spawner(
+                tasks, arguments.duration, arguments.poll_interval
+            ), arguments.duration),
+            'shared': summary(shared(
+                tasks, arguments.duration,
+                arguments.fast_interval, arguments.slow_interval
+            ), arguments.duration)
+        })
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+# Pull-to-start benchmark of single user image variants, against a local
+# registry.
+#
+#   docker compose up -d registry
+#   python3 ../../single_user_docker/build_image.py \
+#       localhost:5000/single-user zstd --insecure --report zstd.json
+#   python3 ../../single_user_docker/build_image.py \
+#       localhost:5000/single-user gzip --compression gzip --insecure \
+#       --report gzip.json
+#   python3 pull_bench.py --image zstd=localhost:5000/single-user:zstd \
+#       --image gzip=localhost:5000/single-user:gzip --runs 3
+#
+# For every run of every image, removes the image locally, pulls it from the
+# registry, and starts the single user server in a container until its API
+# responds, like a Fargate task that starts. Prints the median pull, start
+# and total seconds per image as JSON.
+#
+# Docker pulls images completely, so this measures the effect of the image
+# size and the layer compression. Lazy-loading with a SOCI index only
+# happens on Fargate, or locally with the soci-snapshotter of containerd.
+
+import argparse
+import json
+import statistics
+import subprocess
+import time
+import urllib.request
+
+SERVER = ['start-notebook.sh', '--IdentityProvider.token=',
+          '--ServerApp.password=']
+
+
+def docker(*arguments, **kwargs):
+    return subprocess.run(['docker'] + list(arguments), check=True,
+                          stdout=subprocess.PIPE, text=True, **kwargs).stdout
+
+
+def pull(image):
+    subprocess.run(['docker', 'image', 'rm', '--force', image],
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    started = time.monotonic()
+    docker('pull', '--quiet', image)
+    return time.monotonic() - started
+
+
+def start(image, port, timeout):
+    started = time.monotonic()
+    container = docker('run', '--detach', '--rm', '--publish',
+                       f'{port}:8888', image, *SERVER).strip()
+    try:
+        while time.monotonic() - started < timeout:
+            try:
+                with urllib.request.urlopen(
+                    f'http://127.0.0.1:{port}/api', timeout=1
+                ) as response:
+                    if response.status == 200:
+                        return time.monotonic() - started
+            except OSError:
+                time.sleep(0.2)
+        raise RuntimeError(f'{image} did not start in {timeout} s')
+    finally:
+        subprocess.run(['docker', 'stop', '--time', '1', container],
+                       stdout=subprocess.DEVNULL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--image', action='append', required=True,
+                        help='name=reference, for example '
+                        'zstd=localhost:5000/single-user:zstd')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--port', type=int, default=8899)
+    parser.add_argument('--timeout', type=float, default=300)
+    args = parser.parse_args()
+
+    report = {'runs': args.runs, 'images': {}}
+    for entry in args.image:
+        name, image = entry.split('=', 1)
+        pulls, starts = [], []
+        for _ in range(args.runs):
+            pulls.append(pull(image))
+            starts.append(start(image, args.port, args.timeout))
+        report['images'][name] = {
+            'image': image,
+            'pull_seconds': round(statistics.median(pulls), 2),
+            'start_seconds': round(statistics.median(starts), 2),
+            'pull_to_start_seconds': round(statistics.median(
+                [p + s for p, s in zip(pulls, starts)]
+            ), 2),
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
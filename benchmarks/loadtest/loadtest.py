@@ -0,0 +1,359 @@
+# Load test of the hub: simulated users log in, start their server, use it
+# and log out, all at the same time.
+#
+#   python loadtest.py --hub http://hub:8000 --users 200 --ramp 60 \
+#       --label baseline --output results/baseline.json
+#
+# Run it against loadtest_config.py, see docker-compose.yml. Each user
+# arrives at a random time within --ramp seconds and:
+# - logs in through the stand-in OAuth provider
+# - starts a server and waits until the proxy routes to it
+# - makes --requests requests to the server and to the hub's home page,
+#   --think seconds apart
+# - sends --messages messages over a websocket to the server
+# - logs out, which stops the server
+# The hub's Prometheus metrics are read every --sample-interval seconds
+# for its CPU use and event loop lag. The report is printed and written to
+# --output as JSON, to compare configuration changes.
+
+import argparse
+import asyncio
+import http.cookies
+import json
+import os
+import random
+import statistics
+import time
+import urllib.parse
+
+from prometheus_client.parser import text_string_to_metric_families
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+from tornado.websocket import websocket_connect
+
+# Settings of the hub that are recorded in the report
+HUB_SETTINGS = (
+    'SPAWN_DISPATCHER_RATE', 'SPAWN_DISPATCHER_BURST',
+    'TASK_POLLER_FAST_INTERVAL', 'TASK_POLLER_SLOW_INTERVAL',
+    'LOADTEST_TASK_START_SECONDS', 'HUB_SYSTEM_USERS',
+    'SPECULATIVE_SPAWN_TIMEOUT'
+)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(values):
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'p50': round(percentile(values, 0.5), 4),
+        'p90': round(percentile(values, 0.9), 4),
+        'p99': round(percentile(values, 0.99), 4),
+        'max': round(max(values), 4),
+    }
+
+
+def histogram_quantile(buckets, fraction):
+    """
+    Return the upper bound of the bucket that holds the fraction quantile,
+    from cumulative (upper bound, count) pairs
+    """
+    total = buckets[-1][1] if buckets else 0
+    if not total:
+        return None
+    for bound, count in buckets:
+        if count >= fraction * total:
+            return bound
+    return buckets[-1][0]
+
+
+class Recorder:
+    """
+    Latencies and errors per operation
+    """
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    def add(self, operation, seconds):
+        self.latencies.setdefault(operation, []).append(seconds)
+
+    def error(self, operation, reason):
+        reasons = self.errors.setdefault(operation, {})
+        reasons[reason] = reasons.get(reason, 0) + 1
+
+    def report(self):
+        return {
+            operation: dict(
+                summarize(self.latencies.get(operation, [])),
+                errors=self.errors.get(operation, {})
+            ) for operation in sorted(set(self.latencies) | set(self.errors))
+        }
+
+
+class Browser:
+    """
+    HTTP client with the cookies of one user, that does not follow
+    redirects
+    """
+
+    def __init__(self, http_client):
+        self.http_client = http_client
+        self.cookies = http.cookies.SimpleCookie()
+
+    def cookie_header(self):
+        return '; '.join(
+            f'{name}={morsel.value}' for name, morsel in self.cookies.items()
+        )
+
+    async def get(self, url):
+        response = await self.http_client.fetch(HTTPRequest(
+            url, headers={'Cookie': self.cookie_header()},
+            follow_redirects=False, request_timeout=60
+        ), raise_error=False)
+        for header in response.headers.get_list('Set-Cookie'):
+            self.cookies.load(header)
+        return response
+
+
+class SimulatedUser:
+    def __init__(self, name, args, recorder, http_client):
+        self.name = name
+        self.args = args
+        self.recorder = recorder
+        self.browser = Browser(http_client)
+        self.hub = args.hub.rstrip('/')
+
+    async def timed(self, operation, url, expected=(200,)):
+        started = time.monotonic()
+        response = await self.browser.get(url)
+        if response.code in expected:
+            self.recorder.add(operation, time.monotonic() - started)
+        else:
+            self.recorder.error(operation, str(response.code))
+        return response
+
+    async def login(self):
+        started = time.monotonic()
+        response = await self.browser.get(f'{self.hub}/hub/oauth_login')
+        for _ in range(5):
+            if response.code not in (301, 302):
+                break
+            location = urllib.parse.urljoin(
+                response.effective_url, response.headers['Location']
+            )
+            if '/authorize' in location:
+                location += '&' + urllib.parse.urlencode(
+                    {'username': self.name}
+                )
+            if location.startswith(f'{self.hub}/hub/') and \
+                    'oauth_callback' not in location:
+                # Logged in: redirected to the hub's home page
+                self.recorder.add('login', time.monotonic() - started)
+                return True
+            response = await self.browser.get(location)
+        self.recorder.error('login', str(response.code))
+        return False
+
+    async def start_server(self):
+        started = time.monotonic()
+        await self.browser.get(f'{self.hub}/hub/spawn')
+        deadline = started + self.args.spawn_timeout
+        while time.monotonic() < deadline:
+            response = await self.browser.get(
+                f'{self.hub}/user/{self.name}/api'
+            )
+            if response.code == 200 and \
+                    response.headers.get('X-Loadtest-Server'):
+                self.recorder.add('spawn', time.monotonic() - started)
+                return True
+            await asyncio.sleep(1)
+        self.recorder.error('spawn', 'timeout')
+        return False
+
+    async def use_server(self):
+        for _ in range(self.args.requests):
+            await self.timed(
+                'server_request', f'{self.hub}/user/{self.name}/api'
+            )
+            await self.timed('hub_page', f'{self.hub}/hub/home')
+            await asyncio.sleep(self.args.think)
+
+        url = self.hub.replace('http', 'ws', 1) + \
+            f'/user/{self.name}/api/kernels/loadtest/channels'
+        try:
+            connection = await websocket_connect(HTTPRequest(
+                url, headers={'Cookie': self.browser.cookie_header()},
+                request_timeout=60
+            ))
+        except Exception as error:
+            self.recorder.error('websocket_rtt', type(error).__name__)
+            return
+        message = 'x' * self.args.message_size
+        for _ in range(self.args.messages):
+            started = time.monotonic()
+            await connection.write_message(message)
+            if await connection.read_message() is None:
+                self.recorder.error('websocket_rtt', 'closed')
+                break
+            self.recorder.add('websocket_rtt', time.monotonic() - started)
+        connection.close()
+
+    async def logout(self):
+        await self.timed('logout', f'{self.hub}/hub/logout',
+                         expected=(200, 302))
+
+    async def run(self, delay):
+        await asyncio.sleep(delay)
+        if not await self.login():
+            return None
+        ready = None
+        if await self.start_server():
+            ready = time.monotonic()
+            await self.use_server()
+        await self.logout()
+        return ready
+
+
+class HubSampler:
+    """
+    Read the hub's CPU time and event loop lag from its Prometheus
+    metrics every interval seconds
+    """
+
+    def __init__(self, http_client, hub, interval):
+        self.http_client = http_client
+        self.url = hub.rstrip('/') + '/hub/metrics'
+        self.interval = interval
+        self.samples = []
+        self.lag_buckets = []
+        self.lag_max = None
+
+    async def sample(self):
+        response = await self.http_client.fetch(self.url, raise_error=False)
+        if response.code != 200:
+            return
+        cpu = None
+        buckets = []
+        for family in text_string_to_metric_families(response.body.decode()):
+            for sample in family.samples:
+                if sample.name == 'process_cpu_seconds_total':
+                    cpu = sample.value
+                elif sample.name == 'loadtest_event_loop_lag_seconds_bucket':
+                    buckets.append((float(sample.labels['le']), sample.value))
+                elif sample.name == 'loadtest_event_loop_lag_max_seconds':
+                    self.lag_max = sample.value
+        if cpu is not None:
+            self.samples.append((time.monotonic(), cpu))
+        self.lag_buckets = sorted(buckets)
+
+    async def run(self, done):
+        while not done.is_set():
+            try:
+                await self.sample()
+            except Exception:
+                pass
+            try:
+                await asyncio.wait_for(done.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+        await self.sample()
+
+    def report(self):
+        percents = [
+            100 * (cpu - previous_cpu) / (now - previous_now)
+            for (previous_now, previous_cpu), (now, cpu)
+            in zip(self.samples, self.samples[1:]) if now > previous_now
+        ]
+        cpu = {'cpu_percent_mean': None, 'cpu_percent_max': None}
+        if percents:
+            cpu = {
+                'cpu_percent_mean': round(statistics.mean(percents), 1),
+                'cpu_percent_max': round(max(percents), 1),
+            }
+        return dict(cpu, event_loop_lag_seconds={
+            'p50': histogram_quantile(self.lag_buckets, 0.5),
+            'p99': histogram_quantile(self.lag_buckets, 0.99),
+            'max': self.lag_max,
+        })
+
+
+async def run(args):
+    AsyncHTTPClient.configure(None, max_clients=args.max_connections)
+    http_client = AsyncHTTPClient()
+    recorder = Recorder()
+    sampler = HubSampler(http_client, args.hub, args.sample_interval)
+    generator = random.Random(args.seed)
+
+    done = asyncio.Event()
+    sampling = asyncio.ensure_future(sampler.run(done))
+    started = time.monotonic()
+    users = [
+        SimulatedUser(f'{args.user_prefix}-{index}', args, recorder,
+                      http_client)
+        for index in range(args.users)
+    ]
+    ready = await asyncio.gather(*(
+        user.run(generator.uniform(0, args.ramp)) for user in users
+    ))
+    duration = time.monotonic() - started
+    done.set()
+    await sampling
+
+    ready = sorted(time - started for time in ready if time is not None)
+    spawn_window = ready[-1] if ready else 0
+    spawn_throughput = 60 * len(ready) / spawn_window if spawn_window else 0
+    return {
+        'label': args.label,
+        'settings': {
+            'users': args.users, 'ramp': args.ramp,
+            'requests': args.requests, 'messages': args.messages,
+            'message_size': args.message_size, 'think': args.think,
+        },
+        'hub_settings': {
+            name: os.environ[name] for name in HUB_SETTINGS
+            if name in os.environ
+        },
+        'duration_seconds': round(duration, 1),
+        'servers_ready': len(ready),
+        'spawn_throughput_per_minute': round(spawn_throughput, 1),
+        'latency_seconds': recorder.report(),
+        'hub': sampler.report(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--hub', default='http://hub:8000')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--user-prefix', default='loadtest')
+    parser.add_argument('--ramp', type=float, default=60,
+                        help='seconds over which the users arrive')
+    parser.add_argument('--requests', type=int, default=10)
+    parser.add_argument('--think', type=float, default=1)
+    parser.add_argument('--messages', type=int, default=50)
+    parser.add_argument('--message-size', type=int, default=1024)
+    parser.add_argument('--spawn-timeout', type=float, default=300)
+    parser.add_argument('--sample-interval', type=float, default=5)
+    parser.add_argument('--max-connections', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--label', default='')
+    parser.add_argument('--output', help='file to write the report to')
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as fp:
+            fp.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+# JupyterHub configuration of the load test: the real
+# hub_docker/jupyterhub_config.py, run against a moto server that stands in
+# for ECS, EFS and EC2, the OAuth provider of stubs.py, and the single user
+# server of stubs.py, which answers for every task.
+#
+#   jupyterhub -f loadtest_config.py
+#
+# See docker-compose.yml for the environment. Before the real configuration
+# is loaded, the VPC, ECS cluster and EFS file system that HubStack would
+# create are created in moto. Afterwards:
+# - the spawner's ECS requests go to moto over HTTP, with static keys
+# - tasks report PROVISIONING, PENDING and RUNNING as a Fargate task would,
+#   over LOADTEST_TASK_START_SECONDS
+# - every task's address is the stand-in single user server
+# - the hub's Prometheus metrics can be read without a token, and include
+#   the event loop lag of the hub
+
+import asyncio
+import datetime
+import json
+import os
+
+import boto3
+import fargatespawner.fargatespawner as fargatespawner_module
+from fargatespawner import FargateSpawnerSecretAccessKeyAuthentication
+from jupyterhub.app import JupyterHub
+from prometheus_client import Gauge, Histogram
+from tornado.httpclient import HTTPRequest
+
+root = os.environ.get('OAUTHENTICATOR_DIR', '/srv/oauthenticator')
+region = os.environ['FARGATE_SPAWNER_REGION']
+
+c = get_config()  # noqa: F821
+
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    'loadtest_event_loop_lag_seconds',
+    'Delay of a 100 ms sleep on the hub event loop',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5,
+             float('inf'))
+)
+EVENT_LOOP_LAG_MAX_SECONDS = Gauge(
+    'loadtest_event_loop_lag_max_seconds',
+    'Largest delay of a 100 ms sleep on the hub event loop'
+)
+
+
+def create_stand_in_resources(users):
+    """
+    Create the resources that FrameStack and HubStack would create, and
+    set the environment variables that HubStack would set
+    """
+    ec2 = boto3.client('ec2', region_name=region)
+    vpc_id = ec2.create_vpc(CidrBlock='10.0.0.0/16')['Vpc']['VpcId']
+    subnet_ids = [
+        ec2.create_subnet(
+            VpcId=vpc_id, CidrBlock=f'10.0.{index}.0/20',
+            AvailabilityZone=f'{region}{zone}'
+        )['Subnet']['SubnetId']
+        for index, zone in ((0, 'a'), (16, 'b'))
+    ]
+    security_group_id = ec2.create_security_group(
+        GroupName='loadtest', Description='loadtest', VpcId=vpc_id
+    )['GroupId']
+
+    cluster_arn = boto3.client('ecs', region_name=region).create_cluster(
+        clusterName='loadtest'
+    )['cluster']['clusterArn']
+
+    efs = boto3.client('efs', region_name=region)
+    file_system_id = efs.create_file_system(
+        CreationToken='loadtest'
+    )['FileSystemId']
+    access_point_id = efs.create_access_point(
+        FileSystemId=file_system_id,
+        PosixUser={'Uid': 1000, 'Gid': 100},
+        RootDirectory={'Path': '/home/reference'}
+    )['AccessPointId']
+
+    user_directory = '/tmp/user_directory.json'
+    with open(user_directory, 'w') as fp:
+        json.dump({'admins': [], 'users': users}, fp)
+
+    os.environ.update({
+        'FARGATE_SPAWNER_CLUSTER': cluster_arn,
+        'FARGATE_SPAWNER_SUBNETS': repr(subnet_ids),
+        'FARGATE_SPAWNER_SECURITY_GROUPS': repr([security_group_id]),
+        'FARGATE_EFS_ID': file_system_id,
+        'FARGATE_EFS_REFERENCE_ACCESS_POINT_ID': access_point_id,
+        'USER_DIRECTORY_BACKEND': 'file',
+        'USER_DIRECTORY_LOCATION': user_directory,
+    })
+
+
+class SlowStartECS:
+    """
+    ECS client whose tasks take start_seconds to become RUNNING, as Fargate
+    tasks do, instead of being RUNNING at once as in moto
+    """
+
+    def __init__(self, ecs_client, start_seconds):
+        self.ecs_client = ecs_client
+        self.start_seconds = start_seconds
+
+    def __getattr__(self, name):
+        return getattr(self.ecs_client, name)
+
+    def describe_tasks(self, **kwargs):
+        response = self.ecs_client.describe_tasks(**kwargs)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for task in response['tasks']:
+            if task.get('lastStatus') != 'RUNNING' or 'createdAt' not in task:
+                continue
+            created = task['createdAt']
+            elapsed = (now - created).total_seconds()
+            if elapsed < self.start_seconds / 3:
+                task['lastStatus'] = 'PROVISIONING'
+            elif elapsed < self.start_seconds:
+                task['lastStatus'] = 'PENDING'
+            else:
+                step = datetime.timedelta(seconds=self.start_seconds / 3)
+                task['connectivityAt'] = created + step
+                task['pullStartedAt'] = created + step
+                task['pullStoppedAt'] = created + 2 * step
+                task['startedAt'] = created + 3 * step
+        return response
+
+
+def http_request(url, *args, **kwargs):
+    # moto is served over plain HTTP
+    return HTTPRequest(url.replace('https://', 'http://', 1), *args, **kwargs)
+
+
+async def sample_event_loop_lag(interval=0.1):
+    loop = asyncio.get_running_loop()
+    largest = 0
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag = loop.time() - started - interval
+        EVENT_LOOP_LAG_SECONDS.observe(lag)
+        largest = max(largest, lag)
+        EVENT_LOOP_LAG_MAX_SECONDS.set(largest)
+
+
+def with_event_loop_lag(start):
+    async def start_and_sample(app):
+        await start(app)
+        app.loadtest_lag_sampler = asyncio.ensure_future(
+            sample_event_loop_lag()
+        )
+    return start_and_sample
+
+
+create_stand_in_resources([
+    f"{os.environ.get('LOADTEST_USER_PREFIX', 'loadtest')}-{index}"
+    for index in range(int(os.environ.get('LOADTEST_USERS', '1000')))
+])
+
+load_subconfig(os.path.join(root, 'jupyterhub_config.py'))  # noqa: F821
+
+import spawner  # noqa: E402
+
+c.FargateSpawner.authentication_class = \
+    FargateSpawnerSecretAccessKeyAuthentication
+c.FargateSpawnerSecretAccessKeyAuthentication.aws_access_key_id = \
+    os.environ['AWS_ACCESS_KEY_ID']
+c.FargateSpawnerSecretAccessKeyAuthentication.aws_secret_access_key = \
+    os.environ['AWS_SECRET_ACCESS_KEY']
+fargatespawner_module.HTTPRequest = http_request
+
+task_poller = c.PlutoFargateSpawner.task_poller
+task_poller.ecs_client = SlowStartECS(
+    task_poller.ecs_client,
+    float(os.environ.get('LOADTEST_TASK_START_SECONDS', '30'))
+)
+single_user_host = os.environ.get('LOADTEST_SINGLE_USER_HOST', 'stubs')
+spawner.task_ip = lambda described: described and single_user_host
+
+c.JupyterHub.authenticate_prometheus = False
+JupyterHub.start = with_event_loop_lag(JupyterHub.start)
@@ -0,0 +1,110 @@
+# Stand-ins for the OAuth provider and the single user servers of the load
+# test.
+#
+#   python stubs.py --oauth-port 9000 --server-port 8888
+#
+# The OAuth provider stands in for the Cognito hosted UI: /authorize
+# redirects straight back to the hub with the username in the 'username'
+# query parameter, which the load test adds, as the code; /token returns
+# the code as the access token, and /userinfo returns the token as the
+# username. Each endpoint answers after --provider-latency seconds.
+#
+# The single user server answers every HTTP request under /user/<name>/
+# with a small JSON document, and echoes the messages of websockets under
+# /user/<name>/, like kernel channels. One server stands in for the tasks
+# of all users.
+
+import argparse
+import asyncio
+import json
+import urllib.parse
+
+from tornado.httpserver import HTTPServer
+from tornado.web import Application, RequestHandler
+from tornado.websocket import WebSocketHandler
+
+
+class ProviderHandler(RequestHandler):
+    def initialize(self, latency):
+        self.latency = latency
+
+    async def prepare(self):
+        await asyncio.sleep(self.latency)
+
+
+class AuthorizeHandler(ProviderHandler):
+    def get(self):
+        query = urllib.parse.urlencode({
+            'code': self.get_argument('username'),
+            'state': self.get_argument('state', '')
+        })
+        self.redirect(f"{self.get_argument('redirect_uri')}?{query}")
+
+
+class TokenHandler(ProviderHandler):
+    def post(self):
+        self.write({
+            'access_token': self.get_argument('code'),
+            'token_type': 'Bearer',
+            'expires_in': 3600
+        })
+
+
+class UserInfoHandler(ProviderHandler):
+    def get(self):
+        token = self.request.headers.get('Authorization', '').split()[-1]
+        self.write({'preferred_username': token, 'sub': token})
+
+
+class ServerHandler(RequestHandler):
+    def get(self, path):
+        self.set_header('X-Loadtest-Server', '1')
+        self.write({'path': path})
+
+    post = put = delete = get
+
+
+class ChannelsHandler(WebSocketHandler):
+    def check_origin(self, origin):
+        return True
+
+    def on_message(self, message):
+        self.write_message(message, binary=isinstance(message, bytes))
+
+
+def provider_application(latency):
+    settings = {'latency': latency}
+    return Application([
+        (r'/authorize', AuthorizeHandler, settings),
+        (r'/token', TokenHandler, settings),
+        (r'/userinfo', UserInfoHandler, settings),
+    ])
+
+
+def server_application():
+    return Application([
+        (r'/user/[^/]+/api/kernels/[^/]+/channels', ChannelsHandler),
+        (r'/(.*)', ServerHandler),
+    ])
+
+
+async def serve(oauth_port, server_port, latency):
+    HTTPServer(provider_application(latency)).listen(oauth_port)
+    HTTPServer(server_application()).listen(server_port)
+    print(json.dumps({'oauth_port': oauth_port, 'server_port': server_port}),
+          flush=True)
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--oauth-port', type=int, default=9000)
+    parser.add_argument('--server-port', type=int, default=8888)
+    parser.add_argument('--provider-latency', type=float, default=0.1)
+    args = parser.parse_args()
+    asyncio.run(serve(args.oauth_port, args.server_port,
+                      args.provider_latency))
+
+
+if __name__ == '__main__':
+    main()
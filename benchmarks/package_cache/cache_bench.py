@@ -0,0 +1,145 @@
+# Install time benchmark of the package cache service.
+#
+#   python3 cache_bench.py --julia-server http://pkgserver:8000 \
+#       --pip-index http://pypi:5000/index/ --concurrency 10 --rounds 2
+#
+# Each round installs the same Julia and Python packages --concurrency times
+# in parallel, like a class that installs the packages of an exercise at
+# the same time, every install in an empty Julia depot or pip target
+# directory. The first round against empty caches is the cold round, the
+# next rounds are warm. With --direct, a round against pkg.julialang.org
+# and pypi.org is run first, for comparison. Julia packages are only
+# downloaded, not precompiled. Prints the install times per round as JSON.
+
+import argparse
+import concurrent.futures
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+import venv
+
+DIRECT_JULIA_SERVER = 'https://pkg.julialang.org'
+DIRECT_PIP_INDEX = 'https://pypi.org/simple/'
+JULIA_INSTALL = 'import Pkg; Pkg.add(split(ARGS[1], ","))'
+
+
+def julia_install(server, packages):
+    depot = tempfile.mkdtemp(prefix='depot-')
+    environment = dict(
+        os.environ,
+        JULIA_DEPOT_PATH=depot,
+        JULIA_PKG_SERVER=server,
+        JULIA_PKG_PRECOMPILE_AUTO='0'
+    )
+    try:
+        started = time.monotonic()
+        subprocess.run(
+            ['julia', '--startup-file=no', '-e', JULIA_INSTALL,
+             ','.join(packages)],
+            env=environment, check=True,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        return time.monotonic() - started
+    finally:
+        shutil.rmtree(depot, ignore_errors=True)
+
+
+def pip_install(python, index, packages):
+    target = tempfile.mkdtemp(prefix='pip-')
+    try:
+        started = time.monotonic()
+        subprocess.run(
+            [python, '-m', 'pip', 'install', '--quiet', '--no-cache-dir',
+             '--disable-pip-version-check', '--target', target,
+             '--index-url', index,
+             '--trusted-host', urllib.parse.urlparse(index).hostname]
+            + packages, check=True
+        )
+        return time.monotonic() - started
+    finally:
+        shutil.rmtree(target, ignore_errors=True)
+
+
+def install_round(install, concurrency):
+    started = time.monotonic()
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        seconds = list(executor.map(lambda _: install(), range(concurrency)))
+    return {
+        'median_seconds': round(statistics.median(seconds), 2),
+        'max_seconds': round(max(seconds), 2),
+        'wall_seconds': round(time.monotonic() - started, 2),
+    }
+
+
+def make_python():
+    """
+    Return the python of a virtual environment for the pip installs
+    """
+    directory = tempfile.mkdtemp(prefix='venv-')
+    venv.create(directory, with_pip=True)
+    return os.path.join(directory, 'bin', 'python')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--julia-server', required=True)
+    parser.add_argument('--pip-index', required=True)
+    parser.add_argument('--julia-packages', default='DataFrames,CSV,PlutoUI')
+    parser.add_argument('--pip-packages', default='numpy,pandas,matplotlib')
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--rounds', type=int, default=2)
+    parser.add_argument('--direct', action='store_true',
+                        help='first run a round against the public servers')
+    parser.add_argument('--skip-julia', action='store_true')
+    args = parser.parse_args()
+
+    julia_packages = args.julia_packages.split(',')
+    pip_packages = args.pip_packages.split(',')
+    python = make_python()
+
+    targets = [(f'round{number}', args.julia_server, args.pip_index)
+               for number in range(1, args.rounds + 1)]
+    if args.direct:
+        targets.insert(0, ('direct', DIRECT_JULIA_SERVER, DIRECT_PIP_INDEX))
+
+    report = {
+        'concurrency': args.concurrency,
+        'julia_packages': julia_packages,
+        'pip_packages': pip_packages,
+        'rounds': {},
+    }
+    for name, julia_server, pip_index in targets:
+        result = {}
+        if not args.skip_julia:
+            result['julia'] = install_round(
+                lambda: julia_install(julia_server, julia_packages),
+                args.concurrency
+            )
+        result['pip'] = install_round(
+            lambda: pip_install(python, pip_index, pip_packages),
+            args.concurrency
+        )
+        report['rounds'][name] = result
+        print(f'{name}: {json.dumps(result)}', file=sys.stderr, flush=True)
+
+    # Speed-up of the last (warm) round over the first (cold) round
+    if args.rounds > 1:
+        cold = report['rounds']['round1']
+        warm = report['rounds'][f'round{args.rounds}']
+        report['warm_speedup'] = {
+            ecosystem: round(
+                cold[ecosystem]['median_seconds'] /
+                warm[ecosystem]['median_seconds'], 1
+            ) for ecosystem in cold
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
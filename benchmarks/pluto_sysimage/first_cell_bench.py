@@ -0,0 +1,134 @@
+# Pluto start-up times with and without the Pluto sysimage, inside the
+# single user image.
+#
+#   docker build -t single-user-jupyterlab-pluto single_user_docker
+#   docker run --rm -v "$PWD/benchmarks/pluto_sysimage:/bench" \
+#       single-user-jupyterlab-pluto python3 /bench/first_cell_bench.py
+#
+# Measures --runs times, with the sysimage in PLUTO_SYSIMAGE and with
+# Julia's own sysimage:
+# - server_ready: from starting the Pluto server, as the launcher of
+#   pluto-on-jupyterlab does, until it serves its front page
+# - first_cell: from starting Julia until the cells of a new notebook with
+#   a PlutoUI widget have run, in a notebook process as in a user's session
+# Prints the median times and the speed-up as JSON.
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import time
+import urllib.request
+
+SERVER = (
+    'import Pluto; Pluto.run(host="127.0.0.1", port={port}, '
+    'launch_browser=false, require_secret_for_access=false, '
+    'require_secret_for_open_links=false)'
+)
+FIRST_CELL = '''
+import Pluto
+session = Pluto.ServerSession()
+notebook = Pluto.Notebook([
+    Pluto.Cell("using PlutoUI"),
+    Pluto.Cell("@bind x Slider(1:10)"),
+    Pluto.Cell("x + 1"),
+])
+notebook.path = joinpath(mktempdir(), "first_cell.jl")
+Pluto.update_run!(session, notebook, notebook.cells)
+println("FIRST_CELL ", notebook.cells[end].output.body)
+flush(stdout)
+Pluto.SessionActions.shutdown(session, notebook)
+'''
+
+
+def julia_command(sysimage):
+    if not sysimage:
+        return ['julia']
+    return ['julia', f"--sysimage={os.environ['PLUTO_SYSIMAGE']}"]
+
+
+def server_ready(sysimage, port, timeout):
+    started = time.monotonic()
+    process = subprocess.Popen(
+        julia_command(sysimage) + ['-e', SERVER.format(port=port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.monotonic() - started < timeout:
+            try:
+                with urllib.request.urlopen(
+                    f'http://127.0.0.1:{port}/', timeout=1
+                ) as response:
+                    if response.status == 200:
+                        return time.monotonic() - started
+            except OSError:
+                time.sleep(0.1)
+        raise RuntimeError('Pluto server did not start')
+    finally:
+        process.kill()
+        process.wait()
+
+
+def first_cell(sysimage, timeout):
+    started = time.monotonic()
+    process = subprocess.Popen(
+        julia_command(sysimage) + ['-e', FIRST_CELL],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+    )
+    try:
+        for line in process.stdout:
+            if line.startswith('FIRST_CELL'):
+                seconds = time.monotonic() - started
+                if line.split()[-1] != '2':
+                    raise RuntimeError(f'Unexpected cell output: {line}')
+                return seconds
+            if time.monotonic() - started > timeout:
+                break
+        raise RuntimeError('Notebook did not run')
+    finally:
+        process.kill()
+        process.wait()
+
+
+def summarize(values):
+    return {
+        'median': round(statistics.median(values), 2),
+        'min': round(min(values), 2),
+        'max': round(max(values), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--port', type=int, default=1236)
+    parser.add_argument('--timeout', type=float, default=600)
+    args = parser.parse_args()
+
+    if not os.path.isfile(os.environ.get('PLUTO_SYSIMAGE', '')):
+        raise SystemExit('PLUTO_SYSIMAGE is not set to a sysimage, run this '
+                         'inside the single user image')
+
+    report = {'runs': args.runs}
+    for name, sysimage in (('default', False), ('sysimage', True)):
+        report[name] = {
+            'server_ready_seconds': summarize([
+                server_ready(sysimage, args.port, args.timeout)
+                for _ in range(args.runs)
+            ]),
+            'first_cell_seconds': summarize([
+                first_cell(sysimage, args.timeout) for _ in range(args.runs)
+            ]),
+        }
+    report['speedup'] = {
+        measure: round(
+            report['default'][measure]['median'] /
+            report['sysimage'][measure]['median'], 1
+        ) for measure in ('server_ready_seconds', 'first_cell_seconds')
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+# Websocket benchmark for the JupyterHub proxies.
+#
+#   python ws_bench.py serve --port 9000
+#   python ws_bench.py run --target direct=ws://echo:9000/echo \
+#       --target chp=ws://chp:8000/echo --users 1,10,50
+#
+# 'serve' runs a websocket echo server that stands in for a single user
+# server. 'run' opens one websocket per simulated user against each target,
+# sends messages of the given size in a loop (like kernel messages) and
+# prints the round trip latency and the throughput per number of users as
+# JSON. The latency that a proxy adds is reported against the 'direct'
+# target, if there is one.
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from tornado.httpserver import HTTPServer
+from tornado.web import Application
+from tornado.websocket import WebSocketHandler, websocket_connect
+
+
+class EchoHandler(WebSocketHandler):
+    def on_message(self, message):
+        self.write_message(message, binary=isinstance(message, bytes))
+
+
+async def serve(port):
+    application = Application([(r'/echo', EchoHandler)])
+    HTTPServer(application).listen(port)
+    print(f'Echo server listening on port {port}', flush=True)
+    await asyncio.Event().wait()
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def user_session(url, messages, payload, latencies):
+    connection = await websocket_connect(url)
+    try:
+        for _ in range(messages):
+            start = time.perf_counter()
+            await connection.write_message(payload)
+            await connection.read_message()
+            latencies.append(time.perf_counter() - start)
+    finally:
+        connection.close()
+
+
+async def measure(url, users, messages, size):
+    payload = 'x' * size
+    latencies = []
+    start = time.perf_counter()
+    results = await asyncio.gather(*(
+        user_session(url, messages, payload, latencies)
+        for _ in range(users)
+    ), return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    errors = [str(result) for result in results
+              if isinstance(result, Exception)]
+    if not latencies:
+        return {'users': users, 'errors': errors}
+    return {
+        'users': users,
+        'messages': len(latencies),
+        'errors': errors,
+        'messages_per_second': round(len(latencies) / elapsed, 1),
+        'megabytes_per_second': round(
+            2 * size * len(latencies) / elapsed / 1e6, 3
+        ),
+        'latency_ms': {
+            'mean': round(1000 * statistics.mean(latencies), 3),
+            'p50': round(1000 * percentile(latencies, 0.50), 3),
+            'p95': round(1000 * percentile(latencies, 0.95), 3),
+            'p99': round(1000 * percentile(latencies, 0.99), 3)
+        }
+    }
+
+
+def add_overhead(report):
+    # Latency added by each proxy compared with the direct connection
+    direct = {
+        result['users']: result
+        for result in report['targets'].get('direct', [])
+        if 'latency_ms' in result
+    }
+    for name, results in report['targets'].items():
+        if name == 'direct':
+            continue
+        for result in results:
+            baseline = direct.get(result['users'])
+            if baseline and 'latency_ms' in result:
+                result['added_latency_ms'] = {
+                    key: round(result['latency_ms'][key] -
+                               baseline['latency_ms'][key], 3)
+                    for key in ('mean', 'p50', 'p95', 'p99')
+                }
+    return report
+
+
+async def run(targets, users, messages, size):
+    report = {
+        'messages_per_user': messages,
+        'message_bytes': size,
+        'targets': {}
+    }
+    for name, url in targets:
+        report['targets'][name] = []
+        for count in users:
+            report['targets'][name].append(
+                await measure(url, count, messages, size)
+            )
+    return add_overhead(report)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Websocket benchmark for the JupyterHub proxies'
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve_parser = commands.add_parser('serve', help='run the echo server')
+    serve_parser.add_argument('--port', type=int, default=9000)
+    run_parser = commands.add_parser('run', help='run the benchmark')
+    run_parser.add_argument(
+        '--target', action='append', required=True,
+        help='name=websocket URL, may be repeated'
+    )
+    run_parser.add_argument(
+        '--users', default='1,10,50,100',
+        help='comma separated numbers of concurrent users'
+    )
+    run_parser.add_argument('--messages', type=int, default=200,
+                            help='messages per user')
+    run_parser.add_argument('--size', type=int, default=1024,
+                            help='message size in bytes')
+    arguments = parser.parse_args()
+
+    if arguments.command == 'serve':
+        asyncio.run(serve(arguments.port))
+        return
+    targets = [target.split('=', 1) for target in arguments.target]
+    users = [int(count) for count in arguments.users.split(',')]
+    report = asyncio.run(
+        run(targets, users, arguments.messages, arguments.size)
+    )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+# Microbenchmark of building RunTask requests.
+#
+#   python build_bench.py --requests 10000
+#
+# Builds --requests RunTask requests for a spawner with a typical
+# environment, with the get_run_task_args lambda that jupyterhub_config.py
+# used before (os.environ lookups and eval() per request) and with
+# hub_docker/run_task_builder.py. Prints the microseconds per request as
+# JSON.
+
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', 'hub_docker'
+))
+
+from run_task_builder import RunTaskBuilder  # noqa: E402
+
+ENVIRONMENT = {
+    'FARGATE_SPAWNER_CLUSTER': 'somebasename-cluster',
+    'FARGATE_SPAWNER_CONTAINER_NAME': 'SingleUserContainer',
+    'FARGATE_SPAWNER_TASK_ROLE_ARN':
+        'arn:aws:iam::123456789012:role/somebasename-task-role',
+    'FARGATE_SPAWNER_SECURITY_GROUPS': "['sg-0123456789abcdef0']",
+    'FARGATE_SPAWNER_SUBNETS':
+        "['subnet-0123456789abcdef0', 'subnet-0123456789abcdef1']",
+}
+
+
+class Spawner:
+    task_definition_arn = \
+        'arn:aws:ecs:eu-central-1:123456789012:task-definition/user-1:1'
+
+    def get_env(self):
+        # The environment that JupyterHub gives a single user server
+        environment = {
+            'PATH': '/usr/local/bin:/usr/bin',
+            'JUPYTERHUB_API_TOKEN': '0' * 32,
+            'JPY_API_TOKEN': '0' * 32,
+            'JUPYTERHUB_CLIENT_ID': 'jupyterhub-user-someone',
+            'JUPYTERHUB_HOST': '',
+            'JUPYTERHUB_OAUTH_CALLBACK_URL':
+                '/user/someone/oauth_callback',
+            'JUPYTERHUB_OAUTH_SCOPES': '["access:servers!server=someone/"]',
+            'JUPYTERHUB_OAUTH_ACCESS_SCOPES':
+                '["access:servers!server=someone/"]',
+            'JUPYTERHUB_USER': 'someone',
+            'JUPYTERHUB_SERVER_NAME': '',
+            'JUPYTERHUB_API_URL': 'http://10.0.0.10:8081/hub/api',
+            'JUPYTERHUB_ACTIVITY_URL':
+                'http://10.0.0.10:8081/hub/api/users/someone/activity',
+            'JUPYTERHUB_BASE_URL': '/',
+            'JUPYTERHUB_SERVICE_PREFIX': '/user/someone/',
+            'JUPYTERHUB_SERVICE_URL': 'http://0.0.0.0:8888/user/someone/',
+        }
+        return environment
+
+
+def old_get_run_task_args(spawner):
+    # The lambda that jupyterhub_config.py used before RunTaskBuilder
+    return {
+        'cluster': os.environ.get('FARGATE_SPAWNER_CLUSTER'),
+        'taskDefinition': spawner.task_definition_arn,
+        'overrides': {
+            'taskRoleArn': os.environ.get('FARGATE_SPAWNER_TASK_ROLE_ARN'),
+            'containerOverrides': [{
+                'command': [
+                    '/opt/conda/bin/jupyterhub-singleuser',
+                    '--config=jupyter_server_config.py'
+                ],
+                'environment': [
+                    {
+                        'name': name,
+                        'value': value,
+                    } for name, value in
+                    ([n, v] for [n, v] in spawner.get_env().items()
+                     if n != 'PATH')
+                ],
+                'name': os.environ.get('FARGATE_SPAWNER_CONTAINER_NAME')
+            }],
+        },
+        'count': 1,
+        'launchType': 'FARGATE',
+        'networkConfiguration': {
+            'awsvpcConfiguration': {
+                'assignPublicIp': 'DISABLED',
+                'securityGroups':
+                    eval(os.environ.get('FARGATE_SPAWNER_SECURITY_GROUPS')),
+                'subnets': eval(os.environ.get('FARGATE_SPAWNER_SUBNETS'))
+            },
+        },
+    }
+
+
+class EC2:
+    def describe_subnets(self, SubnetIds):
+        return {'Subnets': [
+            {'SubnetId': subnet_id, 'AvailableIpAddressCount': 4000}
+            for subnet_id in SubnetIds
+        ]}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Microbenchmark of building RunTask requests'
+    )
+    parser.add_argument('--requests', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    arguments = parser.parse_args()
+
+    os.environ.update(ENVIRONMENT)
+    spawner = Spawner()
+    builder = RunTaskBuilder.from_environment(ENVIRONMENT)
+    balanced = RunTaskBuilder.from_environment(ENVIRONMENT, EC2())
+
+    def per_request(function):
+        seconds = min(timeit.repeat(
+            lambda: function(spawner), number=arguments.requests,
+            repeat=arguments.repeat
+        ))
+        return round(seconds / arguments.requests * 1e6, 2)
+
+    print(json.dumps({
+        'requests': arguments.requests,
+        'us_per_request': {
+            'lambda': per_request(old_get_run_task_args),
+            'builder': per_request(builder),
+            'builder_balanced_subnets': per_request(balanced),
+        }
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+# Simulated login burst against the RunTask spawn dispatcher.
+#
+#   python burst_bench.py --users 150
+#
+# All users start a server at the same moment. The ECS API is simulated:
+# RunTask is throttled above --api-rate calls per second, a fraction
+# --capacity-failures of the calls fails with a Fargate capacity error and
+# a started task takes 40 to 90 seconds to become RUNNING. The burst is run
+# twice:
+# - direct: every spawner calls RunTask at once, without retries, as
+#   FargateSpawner does
+# - dispatcher: through hub_docker/spawn_dispatcher.py
+# Prints the p50/p95/p99 time to running and the number of failed spawns
+# as JSON. Simulated time runs --time-scale times as fast as real time.
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', 'hub_docker'
+))
+
+from spawn_dispatcher import SpawnDispatcher, TokenBucket  # noqa: E402
+
+
+class ThrottlingException(Exception):
+    pass
+
+
+class SimulatedECS:
+    def __init__(self, api_rate, api_burst, capacity_failures, scale,
+                 generator):
+        self.scale = scale
+        self.capacity_failures = capacity_failures
+        self.generator = generator
+        self.bucket = TokenBucket(
+            api_rate / scale, api_burst, asyncio.get_running_loop().time
+        )
+        self.calls = 0
+
+    async def run_task(self):
+        self.calls += 1
+        await asyncio.sleep(0.3 * self.scale)
+        if self.bucket.take():
+            raise ThrottlingException('ThrottlingException: Rate exceeded')
+        if self.generator.random() < self.capacity_failures:
+            return {'tasks': [], 'failures': [{
+                'reason': 'Capacity is unavailable at this time'
+            }]}
+        return {'tasks': [{'taskArn': f'task/{self.calls}'}], 'failures': []}
+
+    async def wait_running(self):
+        await asyncio.sleep(self.generator.uniform(40, 90) * self.scale)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def burst(arguments, use_dispatcher):
+    scale = 1 / arguments.time_scale
+    loop = asyncio.get_running_loop()
+    ecs = SimulatedECS(
+        arguments.api_rate, arguments.api_burst,
+        arguments.capacity_failures, scale,
+        random.Random(arguments.seed)
+    )
+    dispatcher = SpawnDispatcher(
+        rate=arguments.rate / scale, burst=arguments.burst,
+        base_delay=1 * scale, max_delay=30 * scale
+    )
+    started = loop.time()
+
+    async def spawn():
+        if use_dispatcher:
+            await dispatcher.run_task(ecs.run_task)
+        else:
+            response = await ecs.run_task()
+            if not response['tasks']:
+                raise Exception(response['failures'])
+        await ecs.wait_running()
+        return (loop.time() - started) / scale
+
+    async def spawn_with_timeout():
+        return await asyncio.wait_for(spawn(), arguments.timeout * scale)
+
+    results = await asyncio.gather(
+        *(spawn_with_timeout() for _ in range(arguments.users)),
+        return_exceptions=True
+    )
+    times = [result for result in results if isinstance(result, float)]
+    report = {
+        'users': arguments.users,
+        'failed': arguments.users - len(times),
+        'run_task_calls': ecs.calls
+    }
+    if times:
+        report['time_to_running_s'] = {
+            'p50': round(percentile(times, 0.50), 1),
+            'p95': round(percentile(times, 0.95), 1),
+            'p99': round(percentile(times, 0.99), 1)
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Simulated login burst against the spawn dispatcher'
+    )
+    parser.add_argument('--users', type=int, default=150)
+    parser.add_argument('--rate', type=float, default=5,
+                        help='dispatcher RunTask calls per second')
+    parser.add_argument('--burst', type=int, default=10,
+                        help='dispatcher burst')
+    parser.add_argument('--api-rate', type=float, default=10,
+                        help='simulated RunTask calls per second before '
+                             'throttling')
+    parser.add_argument('--api-burst', type=int, default=20)
+    parser.add_argument('--capacity-failures', type=float, default=0.05,
+                        help='fraction of RunTask calls without capacity')
+    parser.add_argument('--timeout', type=float, default=180,
+                        help='spawn timeout in seconds')
+    parser.add_argument('--time-scale', type=float, default=100)
+    parser.add_argument('--seed', type=int, default=1)
+    arguments = parser.parse_args()
+
+    print(json.dumps({
+        'direct': asyncio.run(burst(arguments, False)),
+        'dispatcher': asyncio.run(burst(arguments, True))
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
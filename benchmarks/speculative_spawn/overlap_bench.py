@@ -0,0 +1,234 @@
+# Time to a ready server with and without speculative spawns.
+#
+#   python overlap_bench.py --users 20
+#
+# Each user logs in through a stand-in OAuth provider (a local tornado
+# server with authorize, token and userinfo endpoints that answer after
+# --provider-latency seconds) and spends --login-seconds entering
+# credentials. The ECS API is simulated: a task becomes RUNNING 30 to 60
+# seconds after RunTask. The logins are run twice:
+# - sequential: the task is started after the OAuth exchange, as without
+#   speculative spawns
+# - speculative: the task is started when the login starts, with
+#   hub_docker/speculative_spawn.py
+# Prints the p50/p95 time from the login click until the task is running,
+# and the login time that overlapped with the task start, as JSON.
+# Simulated time runs --time-scale times as fast as real time.
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import socket
+import sys
+import time
+import urllib.parse
+
+from tornado.httpclient import AsyncHTTPClient
+from tornado.web import Application, RequestHandler
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', 'hub_docker'
+))
+
+from speculative_spawn import SpeculativeSpawns  # noqa: E402
+from task_poller import TaskPoller  # noqa: E402
+
+
+class SimulatedECS:
+    def __init__(self, scale, generator):
+        self.scale = scale
+        self.generator = generator
+        self.ready_at = {}
+        self.arns = itertools.count()
+
+    def run_task(self, **run_task_args):
+        time.sleep(0.5 * self.scale)
+        arn = f'task/{next(self.arns)}'
+        self.ready_at[arn] = time.monotonic() + \
+            self.generator.uniform(30, 60) * self.scale
+        return {'tasks': [{'taskArn': arn, 'clusterArn': 'cluster'}]}
+
+    def describe_tasks(self, cluster, tasks):
+        now = time.monotonic()
+        return {'tasks': [{
+            'taskArn': arn,
+            'lastStatus': 'RUNNING' if now >= self.ready_at[arn]
+            else 'PENDING',
+            'attachments': [{'details': [
+                {'name': 'privateIPv4Address', 'value': '10.0.0.1'}
+            ]}]
+        } for arn in tasks]}
+
+    def stop_task(self, **stop_task_args):
+        pass
+
+
+class AllowAll:
+    def is_allowed(self, username):
+        return True
+
+    def is_admin(self, username):
+        return False
+
+    def profile(self, username):
+        return 'default'
+
+
+class Registry:
+    def get_task_definition(self, username, admin, profile):
+        return f'arn:aws:ecs:task-definition/{username}'
+
+
+class ProviderHandler(RequestHandler):
+    def initialize(self, latency):
+        self.latency = latency
+
+    async def prepare(self):
+        await asyncio.sleep(self.latency)
+
+
+class AuthorizeHandler(ProviderHandler):
+    def get(self):
+        self.redirect('{}?{}'.format(
+            self.get_argument('redirect_uri'), urllib.parse.urlencode({
+                'code': self.get_argument('login_hint'),
+                'state': self.get_argument('state')
+            })
+        ))
+
+
+class TokenHandler(ProviderHandler):
+    def post(self):
+        self.write({'access_token': self.get_argument('code')})
+
+
+class UserinfoHandler(ProviderHandler):
+    def get(self):
+        token = self.request.headers['Authorization'].split()[1]
+        self.write({'preferred_username': token})
+
+
+def start_provider(latency):
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    Application([
+        ('/authorize', AuthorizeHandler, {'latency': latency}),
+        ('/token', TokenHandler, {'latency': latency}),
+        ('/userinfo', UserinfoHandler, {'latency': latency}),
+    ]).listen(port, '127.0.0.1')
+    return f'http://127.0.0.1:{port}'
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def logins(arguments, speculative):
+    scale = 1 / arguments.time_scale
+    generator = random.Random(arguments.seed)
+    provider = start_provider(arguments.provider_latency * scale)
+    client = AsyncHTTPClient()
+    poller = TaskPoller(SimulatedECS(scale, generator))
+    spawns = SpeculativeSpawns(
+        ecs_client=poller.ecs_client,
+        task_definition_registry=Registry(),
+        user_directory=AllowAll(),
+        run_task_args=lambda username, arn: {'taskDefinition': arn},
+        task_poller=poller,
+        timeout=arguments.login_seconds * 10 * scale,
+        poll_interval=scale
+    )
+
+    async def poll():
+        loop = asyncio.get_running_loop()
+        while True:
+            await loop.run_in_executor(None, poller.poll)
+            await asyncio.sleep(poller.fast_interval * scale)
+
+    async def login(username):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        if speculative:
+            spawns.start(username)
+        response = await client.fetch(
+            f'{provider}/authorize?' + urllib.parse.urlencode({
+                'redirect_uri': 'http://hub/oauth_callback',
+                'state': username, 'login_hint': username
+            }), follow_redirects=False, raise_error=False
+        )
+        code = urllib.parse.parse_qs(urllib.parse.urlparse(
+            response.headers['Location']
+        ).query)['code'][0]
+        # The user enters credentials at the provider
+        await asyncio.sleep(
+            generator.uniform(0.5, 1.5) * arguments.login_seconds * scale
+        )
+        response = await client.fetch(
+            f'{provider}/token', method='POST',
+            body=urllib.parse.urlencode({'code': code})
+        )
+        token = json.loads(response.body)['access_token']
+        response = await client.fetch(
+            f'{provider}/userinfo',
+            headers={'Authorization': f'Bearer {token}'}
+        )
+        name = json.loads(response.body)['preferred_username']
+        logged_in = loop.time()
+        if not speculative:
+            spawns.start(name)
+        task = await spawns.claim(name)
+        await spawns.wait_until_running(task, 600 * scale)
+        ready = loop.time()
+        return (logged_in - started) / scale, (ready - started) / scale
+
+    poller_task = asyncio.ensure_future(poll())
+    results = await asyncio.gather(
+        *(login(f'user{index}') for index in range(arguments.users))
+    )
+    poller_task.cancel()
+    login_times = [login_time for login_time, _ in results]
+    ready_times = [ready_time for _, ready_time in results]
+    return {
+        'login_s': round(sum(login_times) / len(login_times), 1),
+        'time_to_running_s': {
+            'p50': round(percentile(ready_times, 0.50), 1),
+            'p95': round(percentile(ready_times, 0.95), 1)
+        },
+        'run_task_calls': next(poller.ecs_client.arns)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Time to a ready server with speculative spawns'
+    )
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--login-seconds', type=float, default=15,
+                        help='mean time a user spends at the provider')
+    parser.add_argument('--provider-latency', type=float, default=0.3,
+                        help='seconds per OAuth provider request')
+    parser.add_argument('--time-scale', type=float, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    arguments = parser.parse_args()
+
+    sequential = asyncio.run(logins(arguments, False))
+    speculative = asyncio.run(logins(arguments, True))
+    print(json.dumps({
+        'sequential': sequential,
+        'speculative': speculative,
+        'overlap_s': round(
+            sequential['time_to_running_s']['p50'] -
+            speculative['time_to_running_s']['p50'], 1
+        )
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,320 @@
+# Synth time and template size of FrameStack and HubStack per number of
+# users.
+#
+#   python synth_bench.py --users 10 100 500 2000 --output synth.json
+#
+# For each number of users, writes synthetic admins and allowed_users files,
+# of which --external-fraction are not TU Delft users, and synthesizes
+# FrameStack and HubStack from --config in a separate process. HubStack
+# lists every external user in its Cognito users resource, and stores all
+# users in the user directory SSM parameters. Records per number of users:
+# - the wall time of creating and synthesizing the stacks
+# - the peak memory of the largest process, Python or the jsii node process
+# - the resource count and size of each template
+# - the size of the user directory, over all its SSM parameters
+# The report has a linear projection of the largest number of users within
+# each limit, and the script exits with status 1 if a measurement is over
+# budget:
+# - --max-resources: CloudFormation allows 500 resources per template
+# - --max-template-bytes: CloudFormation allows templates of 1 MB in S3
+# - --max-directory-bytes: the ssm backend holds 50 shards of 4 KB
+# - --max-seconds and --max-memory-mb: synth time and memory of the CI job
+
+import argparse
+import glob
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+)
+
+
+def write_users(directory, count, external_fraction, admins):
+    """
+    Write admins and allowed_users files with count users, and return
+    their paths
+    """
+    external = int(round(count * external_fraction))
+    users = [
+        f'external-user-{index}@example.com' for index in range(external)
+    ] + [
+        f'user{index}@tudelft.nl' for index in range(count - external)
+    ]
+    paths = (
+        os.path.join(directory, 'admins'),
+        os.path.join(directory, 'allowed_users')
+    )
+    for path, names in zip(paths, (users[:admins], users[admins:])):
+        with open(path, 'w') as fp:
+            fp.writelines(f'{name}\n' for name in names)
+    return paths
+
+
+def synthesize(config, admins_file, allowed_users_file, outdir):
+    """
+    Create and synthesize the stacks into outdir, in this process, and
+    return the seconds it took
+    """
+    import yaml
+    from aws_cdk import App, Environment
+
+    sys.path.insert(0, ROOT)
+    from HubStacks.frame_stack import FrameStack
+    from HubStacks.hub_stack import HubStack
+
+    with open(config) as fp:
+        config_yaml = yaml.load(fp, Loader=yaml.FullLoader)
+    env = Environment(account='123456789012', region='eu-central-1')
+
+    started = time.monotonic()
+    app = App(outdir=outdir)
+    frame = FrameStack(app, 'FrameStack', config_yaml, env=env)
+    HubStack(
+        app, 'HubStack',
+        config_yaml,
+        vpc=frame.vpc,
+        load_balancer=frame.load_balancer,
+        file_system=frame.file_system,
+        ecs_service_security_group=frame.ecs_service_security_group,
+        admins_file=admins_file,
+        allowed_users_file=allowed_users_file,
+        env=env
+    )
+    app.synth()
+    return time.monotonic() - started
+
+
+def measure_templates(outdir):
+    """
+    Return the resource count and size of each template in the cloud
+    assembly, and the size of the user directory shard parameters
+    """
+    templates = {}
+    directory_bytes = 0
+    for path in sorted(glob.glob(os.path.join(outdir, '*.template.json'))):
+        with open(path, 'rb') as fp:
+            body = fp.read()
+        resources = json.loads(body).get('Resources', {})
+        templates[os.path.basename(path).split('.')[0]] = {
+            'resources': len(resources),
+            'bytes': len(body),
+        }
+        for resource in resources.values():
+            if resource['Type'] == 'AWS::SSM::Parameter' and \
+                    re.search(r'/user-directory/\d+$',
+                              str(resource['Properties'].get('Name'))):
+                directory_bytes += len(
+                    resource['Properties']['Value'].encode()
+                )
+    return templates, directory_bytes
+
+
+def run(count, args, directory):
+    """
+    Synthesize the stacks for count users in a worker process, and return
+    the measurements
+    """
+    users_dir = os.path.join(directory, f'users-{count}')
+    outdir = os.path.join(directory, f'cdk.out-{count}')
+    os.makedirs(users_dir)
+    admins_file, allowed_users_file = write_users(
+        users_dir, count, args.external_fraction, args.admins
+    )
+    # The CDK deprecation warnings of the worker are left out
+    worker = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--worker',
+         args.config, admins_file, allowed_users_file, outdir],
+        cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    output = worker.stdout.read()
+    # The rusage of the worker includes the jsii node process it waited for
+    _, status, usage = os.wait4(worker.pid, 0)
+    worker.returncode = os.waitstatus_to_exitcode(status)
+    if worker.returncode:
+        raise RuntimeError(f'synth worker for {count} users exited with '
+                           f'status {worker.returncode}')
+    result = json.loads(output)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    templates, directory_bytes = measure_templates(outdir)
+    measurement = {
+        'users': count,
+        'external_users': int(round(count * args.external_fraction)),
+        'synth_seconds': round(result['seconds'], 2),
+        'peak_memory_mb': round(peak / 2 ** 20, 1),
+        'templates': templates,
+        'user_directory_bytes': directory_bytes,
+    }
+    if 'error' in result:
+        measurement['error'] = result['error']
+        # A stack with too many resources is not written, but the error
+        # has its resource count
+        for name, resources in re.findall(
+            r"Number of resources in stack '([^']+)': (\d+)", result['error']
+        ):
+            templates.setdefault(name, {})['resources'] = int(resources)
+    return measurement
+
+
+def over_budget(measurement, args):
+    """
+    Return a description of each budget that measurement exceeds
+    """
+    users = measurement['users']
+    exceeded = []
+    if 'error' in measurement:
+        exceeded.append(f"{users} users: {measurement['error']}")
+    if measurement['synth_seconds'] > args.max_seconds:
+        exceeded.append(f"{users} users: synth took "
+                        f"{measurement['synth_seconds']} s")
+    if measurement['peak_memory_mb'] > args.max_memory_mb:
+        exceeded.append(f"{users} users: synth used "
+                        f"{measurement['peak_memory_mb']} MB")
+    for name, template in measurement['templates'].items():
+        if template.get('resources', 0) > args.max_resources:
+            exceeded.append(f"{users} users: {name} has "
+                            f"{template['resources']} resources")
+        if template.get('bytes', 0) > args.max_template_bytes:
+            exceeded.append(f"{users} users: {name} is "
+                            f"{template['bytes']} bytes")
+    if measurement['user_directory_bytes'] > args.max_directory_bytes:
+        exceeded.append(f"{users} users: the user directory is "
+                        f"{measurement['user_directory_bytes']} "
+                        "bytes")
+    return exceeded
+
+
+def max_users(points, limit):
+    """
+    Return the largest number of users for which the least squares line
+    through the (users, value) points stays within limit, or None if the
+    value does not grow with the number of users
+    """
+    if len(points) < 2:
+        return None
+    mean_users = sum(users for users, _ in points) / len(points)
+    mean_value = sum(value for _, value in points) / len(points)
+    variance = sum((users - mean_users) ** 2 for users, _ in points)
+    if not variance:
+        return None
+    slope = sum(
+        (users - mean_users) * (value - mean_value) for users, value in points
+    ) / variance
+    if slope <= 0:
+        return None
+    intercept = mean_value - slope * mean_users
+    return max(0, int((limit - intercept) / slope))
+
+
+def projection(measurements, args):
+    """
+    Return the projected largest number of users per limit, and the limit
+    that is reached first
+    """
+    limits = {}
+    names = sorted(set().union(*(
+        measurement['templates'] for measurement in measurements
+    )))
+    for name in names:
+        for key, limit in (('resources', args.max_resources),
+                           ('bytes', args.max_template_bytes)):
+            limits[f'{name}.{key}'] = max_users([
+                (measurement['users'], measurement['templates'][name][key])
+                for measurement in measurements
+                if key in measurement['templates'].get(name, {})
+            ], limit)
+    # Stacks that failed to synthesize have no user directory parameters
+    limits['user_directory_bytes'] = max_users([
+        (measurement['users'], measurement['user_directory_bytes'])
+        for measurement in measurements if 'error' not in measurement
+    ], args.max_directory_bytes)
+    reached = {
+        name: users for name, users in limits.items() if users is not None
+    }
+    first = min(reached, key=reached.get) if reached else None
+    return {
+        'max_users': reached.get(first),
+        'limited_by': first,
+        'per_limit': limits,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, nargs='+',
+                        default=[10, 100, 500, 2000])
+    parser.add_argument('--external-fraction', type=float, default=0.5,
+                        help='share of the users that are not TU Delft '
+                        'users and get a Cognito user')
+    parser.add_argument('--admins', type=int, default=2)
+    parser.add_argument('--config',
+                        default=os.path.join(ROOT, 'example_config.yaml'))
+    parser.add_argument('--max-seconds', type=float, default=600)
+    parser.add_argument('--max-memory-mb', type=float, default=4096)
+    parser.add_argument('--max-resources', type=int, default=500)
+    parser.add_argument('--max-template-bytes', type=int, default=1000000)
+    parser.add_argument('--max-directory-bytes', type=int,
+                        default=50 * 4096)
+    parser.add_argument('--output', help='file to write the report to')
+    parser.add_argument('--worker', nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        started = time.monotonic()
+        try:
+            result = {'seconds': synthesize(*args.worker)}
+        except Exception as error:
+            # For example TooManyResourcesInStack: CDK checks the resource
+            # count of each stack when it synthesizes it
+            result = {
+                'seconds': time.monotonic() - started,
+                'error': str(error).strip().splitlines()[0],
+            }
+        print(json.dumps(result))
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        measurements = []
+        for count in args.users:
+            measurements.append(run(count, args, directory))
+            print(json.dumps(measurements[-1]), file=sys.stderr, flush=True)
+
+    exceeded = [
+        description for measurement in measurements
+        for description in over_budget(measurement, args)
+    ]
+    report = {
+        'settings': {
+            'external_fraction': args.external_fraction,
+            'admins': args.admins,
+            'config': os.path.relpath(args.config, ROOT),
+        },
+        'budgets': {
+            'max_seconds': args.max_seconds,
+            'max_memory_mb': args.max_memory_mb,
+            'max_resources': args.max_resources,
+            'max_template_bytes': args.max_template_bytes,
+            'max_directory_bytes': args.max_directory_bytes,
+        },
+        'measurements': measurements,
+        'projection': projection(measurements, args),
+        'over_budget': exceeded,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as fp:
+            fp.write(text + '\n')
+    if exceeded:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
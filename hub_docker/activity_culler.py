@@ -0,0 +1,301 @@
+# Hub service that stops idle single user servers, using the activity
+# signals of the servers as well as the hub's last activity
+
+import asyncio
+import datetime
+import json
+import logging
+import os
+import sys
+import zoneinfo
+
+import boto3
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+
+from prespawn import CronSchedule, HubClient
+from task_poller import TaskPoller, task_ip
+
+log = logging.getLogger(__name__)
+
+SIGNALS = ('hub', 'pluto', 'kernels', 'cpu')
+
+# Policy for users that are not in a group with a policy of its own:
+# - timeout: seconds without activity after which a server is stopped
+# - signals: the signals that count as activity
+# - cpu_percent: CPU utilization, in percent of one vCPU, that counts as
+#   activity
+# - max_age: optional seconds after which a server is stopped, also if it
+#   is active
+DEFAULT_POLICY = {
+    'timeout': 1800,
+    'signals': list(SIGNALS),
+    'cpu_percent': 10,
+    'max_age': None
+}
+
+PAGINATION_MEDIA_TYPE = 'application/jupyterhub-pagination+json'
+
+
+def parse_time(timestamp):
+    if not timestamp:
+        return None
+    return datetime.datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+
+
+def last_active(server, signals, policy, now):
+    """
+    Return the last time that any of the policy's signals showed activity,
+    or None. server is the hub's server model, signals the server's
+    activity signals, or None if they could not be read.
+    """
+    enabled = policy['signals']
+    times = []
+    if 'hub' in enabled or signals is None:
+        times.append(parse_time(server.get('last_activity')))
+    if signals is not None:
+        if 'pluto' in enabled:
+            times.append(parse_time(signals.get('pluto_last_activity')))
+        if 'kernels' in enabled:
+            if signals.get('kernels_busy'):
+                times.append(now)
+            times.append(parse_time(signals.get('kernel_last_activity')))
+        if 'cpu' in enabled:
+            times += [
+                parse_time(sampled) for sampled, percent in
+                signals.get('cpu', []) if percent >= policy['cpu_percent']
+            ]
+    times = [time for time in times if time is not None]
+    return max(times) if times else None
+
+
+def policy_for(user, policies):
+    """
+    Return the policy of the first group of user that has one, merged onto
+    the default policy
+    """
+    policy = dict(DEFAULT_POLICY, **policies.get('default', {}))
+    groups = policies.get('groups', {})
+    for group in user.get('groups', []):
+        if group in groups:
+            return dict(policy, **groups[group])
+    return policy
+
+
+def cull_reason(user, signals, policy, now):
+    """
+    Return why the server of user should be stopped, or None
+    """
+    server = user['servers']['']
+    started = parse_time(server.get('started'))
+    if policy['max_age'] and started and \
+            (now - started).total_seconds() > policy['max_age']:
+        return 'older than max_age'
+    active = last_active(server, signals, policy, now) or started
+    if active and (now - active).total_seconds() > policy['timeout']:
+        return f'inactive since {active.isoformat()}'
+    return None
+
+
+def held_for_session(user, sessions, now):
+    """
+    Return the start of the prespawn session that the server of user was
+    started for, if the session has not started yet, or None. The server
+    was started for a session if the user is in the session and the
+    session starts at most lead_minutes after the server.
+    """
+    started = parse_time(user['servers'][''].get('started'))
+    if started is None:
+        return None
+    for session in sessions:
+        if user['name'] not in session.get('users', []) and \
+                session.get('group') not in user.get('groups', []):
+            continue
+        timezone = zoneinfo.ZoneInfo(session.get('timezone', 'UTC'))
+        moment = started.astimezone(timezone).replace(
+            second=0, microsecond=0
+        )
+        for minute in range(session.get('lead_minutes', 15) + 1):
+            start = moment + datetime.timedelta(minutes=minute)
+            if start > now and session['schedule'].matches(start):
+                return start
+    return None
+
+
+class ServerSignals:
+    """
+    Read the activity signals of the single user servers from the
+    activity_signals extension of the servers. The IP addresses of the
+    servers' tasks are described in batches of up to 100 tasks.
+    ------
+    Inputs
+    ------
+    - ecs_client: boto3 ECS client
+    - token: API token with access to the servers
+    - port: port of the single user servers
+    - concurrency: servers that are read at a time
+    """
+
+    def __init__(self, ecs_client, token, port=8888, concurrency=20,
+                 http_client=None):
+        self.ecs_client = ecs_client
+        self.token = token
+        self.port = port
+        self.concurrency = concurrency
+        self.http_client = http_client or AsyncHTTPClient()
+
+    async def fetch(self, users):
+        """
+        Return a dict of username to activity signals, or None if they
+        could not be read
+        """
+        poller = TaskPoller(self.ecs_client)
+        for user in users:
+            state = user['servers'][''].get('state') or {}
+            if state.get('task_arn'):
+                poller.watch(state['task_cluster_arn'], state['task_arn'])
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                None, poller.poll
+            )
+        except Exception:
+            # Fall back to the hub's last activity of all users
+            log.exception('Failed to describe the servers\' tasks')
+            return {user['name']: None for user in users}
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch_one(user):
+            server = user['servers']['']
+            state = server.get('state') or {}
+            ip = task_ip(poller.get(state.get('task_arn')))
+            if not ip:
+                return None
+            async with semaphore:
+                try:
+                    response = await self.http_client.fetch(HTTPRequest(
+                        f"http://{ip}:{self.port}{server['url']}"
+                        'api/activity-signals',
+                        headers={'Authorization': f'token {self.token}'},
+                        request_timeout=10
+                    ))
+                except Exception as error:
+                    log.info('No activity signals for %s: %s',
+                             user['name'], error)
+                    return None
+            return json.loads(response.body)
+
+        results = await asyncio.gather(*(fetch_one(user) for user in users))
+        return {user['name']: result for user, result in zip(users, results)}
+
+
+class ActivityCuller:
+    """
+    Stop the servers that have been inactive for longer than the timeout
+    of their user's policy. Only users with a running server are listed,
+    in pages that are read concurrently. Servers that the prespawn service
+    started for a session are kept until the session starts, also when
+    lead_minutes is longer than the timeout.
+    ------
+    Inputs
+    ------
+    - hub: HubClient
+    - fetch_signals: coroutine function that returns a dict of username to
+      activity signals for a list of user models
+    - policies: dict with the 'default' policy and a dict of 'groups' to
+      their policies, see DEFAULT_POLICY
+    - page_size: users per page
+    - sessions: the prespawn sessions, see prespawn.Prespawner
+    """
+
+    def __init__(self, hub, fetch_signals, policies=None, page_size=200,
+                 sessions=None):
+        self.hub = hub
+        self.fetch_signals = fetch_signals
+        self.policies = policies or {}
+        self.page_size = page_size
+        self.sessions = [
+            dict(session, schedule=CronSchedule(session['cron']))
+            for session in sessions or []
+        ]
+
+    async def _page(self, offset):
+        code, body = await self.hub.request(
+            'GET', f'/users?state=ready&offset={offset}'
+                   f'&limit={self.page_size}',
+            headers={'Accept': PAGINATION_MEDIA_TYPE}
+        )
+        if code != 200:
+            raise Exception(f'Cannot list the users: {code}')
+        return json.loads(body)
+
+    async def users(self):
+        """
+        Return the users with a running server
+        """
+        first = await self._page(0)
+        total = first['_pagination']['total']
+        pages = await asyncio.gather(*(
+            self._page(offset)
+            for offset in range(self.page_size, total, self.page_size)
+        ))
+        return [
+            user for page in [first] + pages for user in page['items']
+            if user.get('servers', {}).get('', {}).get('ready')
+        ]
+
+    async def scan(self, now=None):
+        """
+        Stop the inactive servers and return a dict of their users to the
+        reason
+        """
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        users = await self.users()
+        signals = await self.fetch_signals(users)
+        culled = {}
+        for user in users:
+            if held_for_session(user, self.sessions, now):
+                continue
+            reason = cull_reason(
+                user, signals.get(user['name']),
+                policy_for(user, self.policies), now
+            )
+            if reason:
+                culled[user['name']] = reason
+        await asyncio.gather(*(
+            self.hub.stop_server(username) for username in culled
+        ), return_exceptions=True)
+        for username, reason in culled.items():
+            log.info('Stopped the server of %s: %s', username, reason)
+        return culled
+
+    async def run(self, interval):
+        while True:
+            try:
+                await self.scan()
+            except Exception:
+                log.exception('Failed to cull the idle servers')
+            await asyncio.sleep(interval)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    token = os.environ['JUPYTERHUB_API_TOKEN']
+    server_signals = ServerSignals(
+        boto3.client(
+            'ecs', region_name=os.environ.get('FARGATE_SPAWNER_REGION')
+        ),
+        token
+    )
+    culler = ActivityCuller(
+        HubClient(os.environ['JUPYTERHUB_API_URL'], token),
+        server_signals.fetch,
+        json.loads(os.environ.get('ACTIVITY_CULLER_POLICIES', '{}')),
+        sessions=json.loads(os.environ.get('PRESPAWN_SCHEDULE', '[]'))
+    )
+    asyncio.run(culler.run(
+        int(os.environ.get('ACTIVITY_CULLER_INTERVAL', '300'))
+    ))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
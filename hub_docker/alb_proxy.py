@@ -0,0 +1,463 @@
+# JupyterHub proxy that routes users straight from the load balancer to their
+# single user tasks
+
+import asyncio
+import base64
+import json
+import logging
+import re
+import threading
+import urllib.parse
+
+import boto3
+from botocore.exceptions import ClientError
+from jupyterhub.proxy import Proxy
+from traitlets import Any, Bool, Integer, Unicode
+
+log = logging.getLogger(__name__)
+
+# Tags on the target groups that record the route they serve
+ROUTESPEC_TAG = 'jupyterhub:routespec'
+TARGET_TAG = 'jupyterhub:target'
+DATA_TAG = 'jupyterhub:data'
+
+# Listener rule priorities are 1 to 50000
+MAX_PRIORITY = 50000
+
+# Maximum number of target groups per DescribeTags call
+DESCRIBE_TAGS_BATCH = 20
+
+# Tag values are at most 256 letters, numbers, spaces and _.:/=+-@; other
+# values, such as the data and escaped usernames, are stored base64 encoded
+MAX_TAG_VALUE = 256
+PLAIN_TAG_VALUE = re.compile(r'[\w .:/=+\-@]*')
+ENCODED_TAG_PREFIX = 'b64:'
+
+
+class ALBRoute:
+    def __init__(self, routespec, target, data, target_group_arn,
+                 rule_arn=None, priority=None):
+        self.routespec = routespec
+        self.target = target
+        self.data = data
+        self.target_group_arn = target_group_arn
+        self.rule_arn = rule_arn
+        self.priority = priority
+
+    def as_dict(self):
+        return {
+            'routespec': self.routespec,
+            'target': self.target,
+            'data': self.data
+        }
+
+
+def split_target(target):
+    """
+    Return the (ip, port) of a target URL like 'http://10.0.1.23:8888'
+    """
+    url = urllib.parse.urlparse(target)
+    return url.hostname, url.port or 80
+
+
+def encode_tag_value(value):
+    """
+    Return value as an ELBv2 tag value, base64 encoded if it has characters
+    that tags do not allow
+    """
+    if not PLAIN_TAG_VALUE.fullmatch(value) or \
+            value.startswith(ENCODED_TAG_PREFIX):
+        value = ENCODED_TAG_PREFIX + \
+            base64.urlsafe_b64encode(value.encode()).decode()
+    if len(value) > MAX_TAG_VALUE:
+        raise ValueError(
+            f'Route tag value of {len(value)} characters is longer than '
+            f'{MAX_TAG_VALUE}: {value[:50]}...'
+        )
+    return value
+
+
+def decode_tag_value(value):
+    if value.startswith(ENCODED_TAG_PREFIX):
+        return base64.urlsafe_b64decode(
+            value[len(ENCODED_TAG_PREFIX):]
+        ).decode()
+    return value
+
+
+def path_patterns(routespec):
+    """
+    Return the listener rule path patterns for a routespec like
+    '/user/name/', matching the prefix with and without the trailing '/'
+    """
+    prefix = routespec.rstrip('/')
+    return [prefix, prefix + '/*']
+
+
+class ALBRouteTable:
+    """
+    Route the paths of single user servers to their tasks with a listener
+    rule and an IP target group per route.
+    The routes are recorded in tags on the target groups, so that the table
+    can be loaded again when the hub restarts. Target groups of deleted
+    routes are kept for reuse, because creating them is slower than
+    re-registering a target and is limited per account.
+    The '/' route of the hub is kept in memory only: the listener's default
+    action already forwards to the hub.
+    ------
+    Inputs
+    ------
+    - elbv2_client: boto3 elbv2 client
+    - listener_arn: ARN of the load balancer listener for the users
+    - vpc_id: ID of the VPC of the single user tasks
+    - name_prefix: prefix of the target group names
+    - first_priority: lowest listener rule priority to use
+    - max_free_target_groups: number of unused target groups kept for reuse
+    - health_check_interval: seconds between target health checks
+    """
+
+    def __init__(self, elbv2_client, listener_arn, vpc_id,
+                 name_prefix='jupyter', first_priority=1,
+                 max_free_target_groups=50, health_check_interval=5):
+        self.elbv2_client = elbv2_client
+        self.listener_arn = listener_arn
+        self.vpc_id = vpc_id
+        # Target group names have at most 32 characters
+        self.name_prefix = name_prefix[:25]
+        self.first_priority = first_priority
+        self.max_free_target_groups = max_free_target_groups
+        self.health_check_interval = health_check_interval
+
+        self.routes = {}
+        self.local_routes = {}
+        self.free_target_groups = []
+        self.used_priorities = set()
+        self.used_names = set()
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Load the routes from the target groups and the listener rules
+        """
+        rules = self._describe_rules()
+        rule_by_target_group = {}
+        with self._lock:
+            for rule in rules:
+                if rule.get('IsDefault'):
+                    continue
+                self.used_priorities.add(int(rule['Priority']))
+                for action in rule.get('Actions', []):
+                    if action.get('TargetGroupArn'):
+                        rule_by_target_group[action['TargetGroupArn']] = rule
+
+        target_groups = self._describe_target_groups()
+        tags = self._describe_tags(list(target_groups))
+        for arn, name in target_groups.items():
+            route_tags = {
+                key: decode_tag_value(value)
+                for key, value in tags.get(arn, {}).items()
+            }
+            routespec = route_tags.get(ROUTESPEC_TAG)
+            rule = rule_by_target_group.get(arn)
+            with self._lock:
+                self.used_names.add(name)
+                if routespec and rule:
+                    self.routes[routespec] = ALBRoute(
+                        routespec, route_tags.get(TARGET_TAG, ''),
+                        json.loads(route_tags.get(DATA_TAG, '{}')), arn,
+                        rule['RuleArn'], int(rule['Priority'])
+                    )
+                elif not rule:
+                    self.free_target_groups.append(arn)
+        return self
+
+    def get_routes(self):
+        with self._lock:
+            routes = {
+                routespec: route.as_dict()
+                for routespec, route in self.routes.items()
+            }
+            routes.update(self.local_routes)
+        return routes
+
+    def add_route(self, routespec, target, data):
+        if routespec == '/':
+            with self._lock:
+                self.local_routes[routespec] = {
+                    'routespec': routespec, 'target': target, 'data': data
+                }
+            return
+
+        with self._lock:
+            existing = self.routes.get(routespec)
+        if existing:
+            if existing.target != target:
+                self._register(existing.target_group_arn, target,
+                               previous=existing.target)
+            if (existing.target, existing.data) != (target, data):
+                self._tag(existing.target_group_arn, routespec, target, data)
+            existing.target = target
+            existing.data = data
+            return
+
+        target_group_arn = self._acquire_target_group()
+        route = ALBRoute(routespec, target, data, target_group_arn)
+        try:
+            self._configure_target_group(target_group_arn, routespec)
+            self._tag(target_group_arn, routespec, target, data)
+            self._register(target_group_arn, target)
+            self._create_rule(route)
+        except Exception:
+            self._release_target_group(target_group_arn)
+            raise
+        with self._lock:
+            self.routes[routespec] = route
+
+    def delete_route(self, routespec):
+        with self._lock:
+            self.local_routes.pop(routespec, None)
+            route = self.routes.pop(routespec, None)
+        if route is None:
+            return
+
+        try:
+            self.elbv2_client.delete_rule(RuleArn=route.rule_arn)
+        except ClientError as error:
+            if error.response['Error']['Code'] != 'RuleNotFound':
+                raise
+        with self._lock:
+            self.used_priorities.discard(route.priority)
+        self._deregister(route.target_group_arn, route.target)
+        self._release_target_group(route.target_group_arn)
+
+    def _acquire_target_group(self):
+        with self._lock:
+            if self.free_target_groups:
+                return self.free_target_groups.pop()
+            index = 0
+            while f'{self.name_prefix}-{index:05d}' in self.used_names:
+                index += 1
+            name = f'{self.name_prefix}-{index:05d}'
+            self.used_names.add(name)
+
+        try:
+            response = self.elbv2_client.create_target_group(
+                Name=name,
+                Protocol='HTTP',
+                Port=8888,
+                VpcId=self.vpc_id,
+                TargetType='ip',
+                HealthCheckIntervalSeconds=self.health_check_interval,
+                HealthCheckTimeoutSeconds=self.health_check_interval - 1,
+                HealthyThresholdCount=2,
+                Matcher={'HttpCode': '200-399'}
+            )
+        except Exception:
+            with self._lock:
+                self.used_names.discard(name)
+            raise
+        target_group_arn = response['TargetGroups'][0]['TargetGroupArn']
+        # Stopped servers do not need their connections drained
+        self.elbv2_client.modify_target_group_attributes(
+            TargetGroupArn=target_group_arn,
+            Attributes=[{
+                'Key': 'deregistration_delay.timeout_seconds',
+                'Value': '5'
+            }]
+        )
+        return target_group_arn
+
+    def _release_target_group(self, target_group_arn):
+        self.elbv2_client.remove_tags(
+            ResourceArns=[target_group_arn],
+            TagKeys=[ROUTESPEC_TAG, TARGET_TAG, DATA_TAG]
+        )
+        with self._lock:
+            if len(self.free_target_groups) < self.max_free_target_groups:
+                self.free_target_groups.append(target_group_arn)
+                return
+        self.elbv2_client.delete_target_group(TargetGroupArn=target_group_arn)
+
+    def _configure_target_group(self, target_group_arn, routespec):
+        # The single user server answers on its API without authentication
+        self.elbv2_client.modify_target_group(
+            TargetGroupArn=target_group_arn,
+            HealthCheckPath=routespec.rstrip('/') + '/api'
+        )
+
+    def _tag(self, target_group_arn, routespec, target, data):
+        self.elbv2_client.add_tags(
+            ResourceArns=[target_group_arn],
+            Tags=[
+                {'Key': key, 'Value': encode_tag_value(value)}
+                for key, value in (
+                    (ROUTESPEC_TAG, routespec),
+                    (TARGET_TAG, target),
+                    (DATA_TAG, json.dumps(data, separators=(',', ':')))
+                )
+            ]
+        )
+
+    def _register(self, target_group_arn, target, previous=None):
+        if previous:
+            self._deregister(target_group_arn, previous)
+        ip, port = split_target(target)
+        self.elbv2_client.register_targets(
+            TargetGroupArn=target_group_arn,
+            Targets=[{'Id': ip, 'Port': port}]
+        )
+
+    def _deregister(self, target_group_arn, target):
+        ip, port = split_target(target)
+        try:
+            self.elbv2_client.deregister_targets(
+                TargetGroupArn=target_group_arn,
+                Targets=[{'Id': ip, 'Port': port}]
+            )
+        except ClientError:
+            log.warning('Failed to deregister %s from %s', target,
+                        target_group_arn)
+
+    def _allocate_priority(self):
+        with self._lock:
+            priority = self.first_priority
+            while priority in self.used_priorities:
+                priority += 1
+            if priority > MAX_PRIORITY:
+                raise RuntimeError('No free listener rule priority')
+            self.used_priorities.add(priority)
+        return priority
+
+    def _create_rule(self, route):
+        # The priority can be taken by a rule that was created by someone
+        # else after the rules were loaded; then try the next free one
+        for _ in range(10):
+            priority = self._allocate_priority()
+            try:
+                response = self.elbv2_client.create_rule(
+                    ListenerArn=self.listener_arn,
+                    Priority=priority,
+                    Conditions=[{
+                        'Field': 'path-pattern',
+                        'PathPatternConfig': {
+                            'Values': path_patterns(route.routespec)
+                        }
+                    }],
+                    Actions=[{
+                        'Type': 'forward',
+                        'TargetGroupArn': route.target_group_arn
+                    }]
+                )
+            except ClientError as error:
+                if error.response['Error']['Code'] != 'PriorityInUse':
+                    with self._lock:
+                        self.used_priorities.discard(priority)
+                    raise
+                continue
+            route.rule_arn = response['Rules'][0]['RuleArn']
+            route.priority = priority
+            return
+        raise RuntimeError('No free listener rule priority')
+
+    def _describe_rules(self):
+        rules = []
+        kwargs = {'ListenerArn': self.listener_arn}
+        while True:
+            response = self.elbv2_client.describe_rules(**kwargs)
+            rules.extend(response['Rules'])
+            if not response.get('NextMarker'):
+                return rules
+            kwargs['Marker'] = response['NextMarker']
+
+    def _describe_target_groups(self):
+        target_groups = {}
+        kwargs = {}
+        while True:
+            response = self.elbv2_client.describe_target_groups(**kwargs)
+            for target_group in response['TargetGroups']:
+                name = target_group['TargetGroupName']
+                if name.startswith(self.name_prefix + '-'):
+                    target_groups[target_group['TargetGroupArn']] = name
+            if not response.get('NextMarker'):
+                return target_groups
+            kwargs['Marker'] = response['NextMarker']
+
+    def _describe_tags(self, target_group_arns):
+        tags = {}
+        for offset in range(0, len(target_group_arns), DESCRIBE_TAGS_BATCH):
+            response = self.elbv2_client.describe_tags(
+                ResourceArns=target_group_arns[
+                    offset:offset + DESCRIBE_TAGS_BATCH
+                ]
+            )
+            for description in response['TagDescriptions']:
+                tags[description['ResourceArn']] = {
+                    tag['Key']: tag['Value'] for tag in description['Tags']
+                }
+        return tags
+
+
+class ALBProxy(Proxy):
+    """
+    Proxy that adds a load balancer listener rule for every single user
+    server, so that the users' traffic goes from the load balancer straight
+    to their tasks and the hub is not in the data path.
+    The load balancer is managed by the HubStack, so the proxy is never
+    started by the hub.
+    """
+
+    should_start = Bool(False)
+
+    route_table = Any(
+        help="ALBRouteTable; created from the other settings if not set"
+    ).tag(config=True)
+
+    listener_arn = Unicode(
+        help="ARN of the load balancer listener for the users"
+    ).tag(config=True)
+
+    vpc_id = Unicode(
+        help="ID of the VPC of the single user tasks"
+    ).tag(config=True)
+
+    region = Unicode(help="AWS region of the load balancer").tag(config=True)
+
+    target_group_prefix = Unicode(
+        'jupyter', help="Prefix of the target group names"
+    ).tag(config=True)
+
+    first_priority = Integer(
+        1, help="Lowest listener rule priority to use"
+    ).tag(config=True)
+
+    _loaded = None
+
+    async def _call(self, method, *args):
+        # boto3 calls block, so keep them off the event loop
+        loop = asyncio.get_running_loop()
+        if self._loaded is None:
+            if self.route_table is None:
+                self.route_table = ALBRouteTable(
+                    boto3.client('elbv2', region_name=self.region or None),
+                    self.listener_arn, self.vpc_id,
+                    name_prefix=self.target_group_prefix,
+                    first_priority=self.first_priority
+                )
+            self._loaded = loop.run_in_executor(None, self.route_table.load)
+        try:
+            await self._loaded
+        except Exception:
+            self._loaded = None
+            raise
+        return await loop.run_in_executor(
+            None, getattr(self.route_table, method), *args
+        )
+
+    async def add_route(self, routespec, target, data):
+        await self._call('add_route', routespec, target, data)
+
+    async def delete_route(self, routespec):
+        await self._call('delete_route', routespec)
+
+    async def get_all_routes(self):
+        return await self._call('get_routes')
@@ -0,0 +1,156 @@
+# OAuthenticator that takes admins and allowed users from the user directory
+
+import asyncio
+import shlex
+import subprocess
+import time
+
+from jupyterhub.auth import LocalAuthenticator
+from oauthenticator.generic import LocalGenericOAuthenticator
+from oauthenticator.oauth2 import OAuthLoginHandler
+from traitlets import Any, Enum
+
+from speculative_spawn import RETURNING_USER_COOKIE, RETURNING_USER_DAYS
+
+
+def add_system_users(usernames, add_user_cmd):
+    """
+    Create the system users usernames with add_user_cmd, in which USERNAME
+    is replaced by the username, in a single shell process
+    """
+    script = '\n'.join(
+        ' '.join(shlex.quote(arg.replace('USERNAME', username))
+                 for arg in add_user_cmd + [username]) + ' || true'
+        for username in usernames
+    )
+    subprocess.run(['sh', '-c', script], check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+
+
+class SpeculativeLoginHandler(OAuthLoginHandler):
+    """
+    OAuthLoginHandler that starts the task of the returning user of this
+    browser before redirecting to the OAuth provider
+    """
+
+    def get(self):
+        speculative_spawns = self.authenticator.speculative_spawns
+        if speculative_spawns is not None:
+            username = self.get_secure_cookie(
+                RETURNING_USER_COOKIE, max_age_days=RETURNING_USER_DAYS
+            )
+            user = self.find_user(username.decode()) if username else None
+            # Users without a hub account yet, or with a server that is
+            # already running or starting, are not started speculatively
+            if user is not None and not user.spawner.active:
+                speculative_spawns.start(user.name)
+        return super().get()
+
+
+class DirectoryOAuthenticator(LocalGenericOAuthenticator):
+    """
+    LocalGenericOAuthenticator that checks membership and admin status in a
+    UserDirectory instead of the static allowed_users and admin_users sets,
+    so changes to the users are picked up without restarting the hub.
+    If speculative spawns are configured, the login of a returning user
+    starts the user's task while the user authenticates.
+    Missing system users are created in batches in the background, or not
+    at all, so that a hub restart does not run adduser for every user.
+    """
+
+    login_handler = SpeculativeLoginHandler
+
+    user_directory = Any(
+        help="UserDirectory with the admins and allowed users"
+    ).tag(config=True)
+
+    speculative_spawns = Any(
+        help="SpeculativeSpawns that start tasks while users log in"
+    ).tag(config=True)
+
+    spawn_metrics = Any(
+        help="SpawnMetrics that records how long the OAuth login takes"
+    ).tag(config=True)
+
+    system_users = Enum(
+        ['batch', 'skip'], 'batch',
+        help="""
+        'batch' creates the missing system users in the background, in one
+        shell process per batch instead of one adduser call per user while
+        the hub starts. 'skip' does not create system users: the single
+        user servers run as uid 1000 in their own task, on the user's EFS
+        access point.
+        """
+    ).tag(config=True)
+
+    _missing_system_users = None
+
+    async def add_user(self, user):
+        # LocalAuthenticator.add_user creates each missing system user with
+        # its own blocking adduser call
+        if self.system_users == 'batch' and self.create_system_users and \
+                not self.system_user_exists(user):
+            self._queue_system_user(user.name)
+        super(LocalAuthenticator, self).add_user(user)
+
+    def _queue_system_user(self, username):
+        if self._missing_system_users is None:
+            self._missing_system_users = set()
+            # Users that are added within a second go in the same batch
+            asyncio.get_running_loop().call_later(
+                1, lambda: asyncio.ensure_future(self._add_system_users())
+            )
+        self._missing_system_users.add(username)
+
+    async def _add_system_users(self):
+        usernames = sorted(self._missing_system_users)
+        self._missing_system_users = None
+        self.log.info('Creating %s system users', len(usernames))
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                None, add_system_users, usernames, list(self.add_user_cmd)
+            )
+        except Exception:
+            self.log.exception('Failed to create system users')
+
+    async def authenticate(self, handler, data=None):
+        returning_user = None
+        if self.speculative_spawns is not None:
+            returning_user = handler.get_secure_cookie(
+                RETURNING_USER_COOKIE, max_age_days=RETURNING_USER_DAYS
+            )
+            returning_user = returning_user.decode() if returning_user \
+                else None
+
+        started = time.monotonic()
+        try:
+            auth_model = await super().authenticate(handler, data)
+        except Exception:
+            if returning_user:
+                self.speculative_spawns.cancel(
+                    returning_user, 'Authentication failed'
+                )
+            raise
+
+        if auth_model and self.spawn_metrics is not None:
+            self.spawn_metrics.observe('oauth', time.monotonic() - started)
+        if auth_model:
+            auth_model['admin'] = self.user_directory.is_admin(
+                auth_model['name']
+            )
+        if returning_user and (
+            not auth_model or auth_model['name'] != returning_user
+        ):
+            self.speculative_spawns.cancel(
+                returning_user, 'Another user logged in'
+                if auth_model else 'Authentication failed'
+            )
+        if auth_model and self.speculative_spawns is not None:
+            handler._set_cookie(
+                RETURNING_USER_COOKIE, auth_model['name'],
+                expires_days=RETURNING_USER_DAYS
+            )
+        return auth_model
+
+    async def check_allowed(self, username, auth_model=None):
+        return self.user_directory.is_allowed(username)
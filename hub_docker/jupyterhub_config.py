@@ -1,10 +1,17 @@
 # Configuration file for Jupyter Hub
 
+import json
 import os
+import secrets
 import sys
-from oauthenticator.generic import LocalGenericOAuthenticator
-from fargatespawner import FargateSpawner, FargateSpawnerECSRoleAuthentication
+import urllib.parse
+import urllib.request
+import zoneinfo
+import boto3
+from fargatespawner import FargateSpawnerECSRoleAuthentication
 from jupyter_client.localinterfaces import public_ips
+from jupyterhub.app import JupyterHub
+from jupyterhub.proxy import Proxy
 
 
 join = os.path.join
@@ -13,23 +20,73 @@ here = os.path.dirname(__file__)
 root = os.environ.get('OAUTHENTICATOR_DIR', here)
 sys.path.insert(0, root)
 
+from alb_proxy import ALBProxy  # noqa: E402
+from authenticator import DirectoryOAuthenticator  # noqa: E402
+from spawn_dispatcher import SpawnDispatcher  # noqa: E402
+from run_task_builder import RunTaskBuilder  # noqa: E402
+from spawn_metrics import SpawnMetrics  # noqa: E402
+from spawner import PlutoFargateSpawner  # noqa: E402
+from speculative_spawn import SpeculativeSpawns  # noqa: E402
+from startup_timing import StartupTimer  # noqa: E402
+from task_poller import TaskPoller  # noqa: E402
+from task_registry import (  # noqa: E402
+    TaskDefinitionRegistry, resolve_image_digest
+)
+from user_directory import (  # noqa: E402
+    UserDirectory, backend_from_environment
+)
+from warm_pool import WarmPool, hub_task_id  # noqa: E402
+
 c = get_config()
 
 c.JupyterHub.log_level = 10
 
-c.Authenticator.admin_users = eval(os.environ.get('ADMIN_USERS'))
+# Log how long each step of the hub's startup takes
+StartupTimer().instrument(JupyterHub)
+
+# Time the phases of server starts, from the OAuth login until the proxy
+# route is added. The histograms are served on /hub/metrics, and logged as
+# CloudWatch embedded metrics unless SPAWN_METRICS_EMF is 'false'.
+spawn_metrics = SpawnMetrics(
+    emf=os.environ.get('SPAWN_METRICS_EMF', 'true') == 'true'
+).instrument_proxy(Proxy)
+c.DirectoryOAuthenticator.spawn_metrics = spawn_metrics
+c.PlutoFargateSpawner.spawn_metrics = spawn_metrics
+
+# Keep the hub state in the shared PostgreSQL database, if there is one,
+# instead of in an SQLite file that is lost when the hub container stops.
+# The RDS Proxy pools connections, so the hub keeps only a few open.
+if os.environ.get('HUB_DB_HOST'):
+    c.JupyterHub.db_url = 'postgresql+psycopg2://{}:{}@{}:5432/{}'.format(
+        urllib.parse.quote(os.environ.get('HUB_DB_USER'), safe=''),
+        urllib.parse.quote(os.environ.get('HUB_DB_PASSWORD'), safe=''),
+        os.environ.get('HUB_DB_HOST'),
+        os.environ.get('HUB_DB_NAME', 'jupyterhub')
+    )
+    c.JupyterHub.db_kwargs = {
+        'pool_size': int(os.environ.get('HUB_DB_POOL_SIZE', '5')),
+        'max_overflow': int(os.environ.get('HUB_DB_MAX_OVERFLOW', '10')),
+        'pool_timeout': 10,
+        # connections through the proxy can be closed when idle
+        'pool_pre_ping': True,
+        'pool_recycle': 300
+    }
+
+# Admins and allowed users are read from the user directory, which is
+# refreshed in the background, so user changes do not need a hub restart
+user_directory = UserDirectory(
+    backend_from_environment(),
+    refresh_interval=int(os.environ.get('USER_DIRECTORY_REFRESH', '10'))
+).start()
 
-c.JupyterHub.authenticator_class = LocalGenericOAuthenticator
+c.JupyterHub.authenticator_class = DirectoryOAuthenticator
+c.DirectoryOAuthenticator.user_directory = user_directory
 c.JupyterHub.shutdown_on_logout = True
 
 c.OAuthenticator.oauth_callback_url = os.environ.get('OAUTH_CALLBACK_URL')
 c.OAuthenticator.client_id = os.environ.get('OAUTH_CLIENT_ID')
 c.OAuthenticator.client_secret = os.environ.get('OAUTH_CLIENT_SECRET')
 
-c.LocalGenericOAuthenticator.allowed_users = eval(
-    os.environ.get('ALLOWED_USERS')
-)
-
 c.LocalGenericOAuthenticator.auto_login = True
 c.LocalGenericOAuthenticator.create_system_users = True
 c.LocalGenericOAuthenticator.add_user_cmd = [
@@ -37,6 +94,11 @@ c.LocalGenericOAuthenticator.add_user_cmd = [
     '--home', '$(echo /home/USERNAME | sed "s/[@,.]/_/"g)',
     '--disabled-password', '--force-badname'
 ]
+# Missing system users are created in batches in the background ('batch'),
+# or not at all ('skip')
+c.DirectoryOAuthenticator.system_users = os.environ.get(
+    'HUB_SYSTEM_USERS', 'batch'
+)
 
 c.LocalGenericOAuthenticator.login_service = os.environ.get(
     'OAUTH_LOGIN_SERVICE_NAME'
@@ -73,65 +135,181 @@ c.JupyterHub.hub_port = 8081
 # the hostname/ip that should be used to connect to the hub
 c.JupyterHub.hub_connect_ip = ip
 
+# Optional proxy that runs as its own service. The hub then only configures
+# the routes through the proxy API and the users' traffic bypasses the hub.
+proxy_service_type = os.environ.get('PROXY_SERVICE_TYPE')
+if proxy_service_type == 'chp':
+    c.ConfigurableHTTPProxy.should_start = False
+    c.ConfigurableHTTPProxy.api_url = os.environ.get('PROXY_API_URL')
+    c.ConfigurableHTTPProxy.auth_token = os.environ.get('PROXY_AUTH_TOKEN')
+elif proxy_service_type == 'traefik':
+    # Routes are stored in Redis, so that every Traefik task serves them
+    c.JupyterHub.proxy_class = 'traefik_redis'
+    c.TraefikProxy.should_start = False
+    c.TraefikProxy.traefik_api_url = os.environ.get('PROXY_API_URL')
+    c.TraefikProxy.traefik_api_username = 'jupyterhub'
+    c.TraefikProxy.traefik_api_password = os.environ.get('PROXY_AUTH_TOKEN')
+    c.TraefikProxy.traefik_entrypoint = 'http'
+    c.TraefikRedisProxy.redis_url = os.environ.get('PROXY_REDIS_URL')
+elif proxy_service_type == 'alb':
+    # No proxy: the load balancer routes straight to the single user tasks
+    # and forwards everything else to the hub, which listens on its port
+    c.JupyterHub.proxy_class = ALBProxy
+    c.JupyterHub.hub_port = 8000
+    c.ALBProxy.listener_arn = os.environ.get('ALB_PROXY_LISTENER_ARN')
+    c.ALBProxy.vpc_id = os.environ.get('ALB_PROXY_VPC_ID')
+    c.ALBProxy.region = os.environ.get('FARGATE_SPAWNER_REGION')
+    c.ALBProxy.target_group_prefix = os.environ.get(
+        'ALB_PROXY_TARGET_GROUP_PREFIX', 'jupyter'
+    )
+
 c.Spawner.start_timeout = 180
 c.Spawner.http_timeout = 180
 c.Spawner.ip = '0.0.0.0'
 c.Spawner.port = 8888
 
-c.JupyterHub.spawner_class = FargateSpawner
+c.JupyterHub.spawner_class = PlutoFargateSpawner
 c.FargateSpawner.authentication_class = FargateSpawnerECSRoleAuthentication
 
 c.FargateSpawner.aws_region = os.environ.get('FARGATE_SPAWNER_REGION')
 c.FargateSpawner.aws_ecs_host = os.environ.get('FARGATE_SPAWNER_ECS_HOST')
 c.FargateSpawner.notebook_port = 8888
 c.FargateSpawner.notebook_scheme = "http"
-# #PATH seems to get mangled when starting a single user container from
-# jupyterhub container. /opt/conda/bin does not appear and this is
-# exactly what is needed for the command jupyterhub-singleuser
-task_definition_arns = eval(os.environ.get('FARGATE_SPAWNER_TASK_DEFINITIONS'))
-
-c.FargateSpawner.get_run_task_args = lambda spawner: {
-    'cluster': os.environ.get('FARGATE_SPAWNER_CLUSTER'),
-    'taskDefinition':
-        task_definition_arns[spawner.get_env()["JUPYTERHUB_USER"]],
-    'overrides': {
-        'taskRoleArn': os.environ.get('FARGATE_SPAWNER_TASK_ROLE_ARN'),
-        'containerOverrides': [{
-            'command': [
-                '/opt/conda/bin/jupyterhub-singleuser',
-                '--config=jupyter_server_config.py'
-            ],
-            'environment': [
-                {
-                    'name': name,
-                    'value': value,
-                } for name, value in
-                ([n, v] for [n, v] in spawner.get_env().items() if n != 'PATH')
-            ],
-            'name': os.environ.get('FARGATE_SPAWNER_CONTAINER_NAME')
-        }],
-    },
-    'count': 1,
-    'launchType': 'FARGATE',
-    'networkConfiguration': {
-        'awsvpcConfiguration': {
-            'assignPublicIp': 'DISABLED',
-            'securityGroups':
-                eval(os.environ.get('FARGATE_SPAWNER_SECURITY_GROUPS')),
-            'subnets': eval(os.environ.get('FARGATE_SPAWNER_SUBNETS'))
-        },
-    },
 
-}
+# Single user task definitions and access points are registered on demand
+region = os.environ.get('FARGATE_SPAWNER_REGION')
+c.PlutoFargateSpawner.user_directory = user_directory
+c.PlutoFargateSpawner.task_definition_registry = TaskDefinitionRegistry(
+    ecs_client=boto3.client('ecs', region_name=region),
+    efs_client=boto3.client('efs', region_name=region),
+    file_system_id=os.environ.get('FARGATE_EFS_ID'),
+    reference_access_point_id=os.environ.get(
+        'FARGATE_EFS_REFERENCE_ACCESS_POINT_ID'
+    ),
+    execution_role_arn=os.environ.get('FARGATE_SPAWNER_EXECUTION_ROLE_ARN'),
+    task_role_arn=os.environ.get('FARGATE_SPAWNER_TASK_ROLE_ARN'),
+    image=resolve_image_digest(
+        boto3.client('ecr', region_name=region),
+        os.environ.get('FARGATE_SPAWNER_IMAGE_REPOSITORY'),
+        os.environ.get('FARGATE_SPAWNER_IMAGE_TAG')
+    ),
+    container_name=os.environ.get('FARGATE_SPAWNER_CONTAINER_NAME'),
+    log_group=os.environ.get('FARGATE_SPAWNER_LOG_GROUP'),
+    log_stream_prefix=os.environ.get('FARGATE_SPAWNER_LOG_STREAM_PREFIX'),
+    region=region,
+    family_prefix=os.environ.get('FARGATE_SPAWNER_FAMILY_PREFIX'),
+    julia_depot_access_point_id=os.environ.get(
+        'FARGATE_EFS_JULIA_DEPOT_ACCESS_POINT_ID'
+    )
+)
+
+# The status of all single user tasks is polled together, in DescribeTasks
+# calls of up to 100 tasks, instead of by every spawner separately
+c.PlutoFargateSpawner.task_poller = TaskPoller(
+    boto3.client('ecs', region_name=region),
+    fast_interval=int(os.environ.get('TASK_POLLER_FAST_INTERVAL', '2')),
+    slow_interval=int(os.environ.get('TASK_POLLER_SLOW_INTERVAL', '30'))
+).start()
+
+# RunTask calls are queued first come first served and rate-limited, and
+# retried after throttling and Fargate capacity errors
+c.PlutoFargateSpawner.spawn_dispatcher = SpawnDispatcher(
+    rate=float(os.environ.get('SPAWN_DISPATCHER_RATE', '5')),
+    burst=int(os.environ.get('SPAWN_DISPATCHER_BURST', '10')),
+    on_throttle=spawn_metrics.count_throttle
+)
+
+# The static parts of the RunTask requests are built once; the tasks are
+# spread over the subnets by their free IP addresses
+run_task_builder = RunTaskBuilder.from_environment(
+    os.environ, ec2_client=boto3.client('ec2', region_name=region)
+)
+c.FargateSpawner.get_run_task_args = run_task_builder
+
+# Optional package cache service in the VPC, through which the single user
+# servers install Julia and Python packages
+if os.environ.get('PACKAGE_CACHE_JULIA_PKG_SERVER'):
+    c.Spawner.environment.update({
+        'JULIA_PKG_SERVER': os.environ['PACKAGE_CACHE_JULIA_PKG_SERVER'],
+        'PIP_INDEX_URL': os.environ.get('PACKAGE_CACHE_PIP_INDEX_URL'),
+        'PIP_TRUSTED_HOST': os.environ.get('PACKAGE_CACHE_PIP_TRUSTED_HOST')
+    })
 
-# Cull single-user processes that are idle (1800 seconds = half hour)
+# Pre-started tasks run the warm_start.py agent, which expects this secret
+# in activation requests. It is shared by all hubs of the stack, so that
+# tasks started by one hub can be activated by another.
+warm_start_secret = os.environ.get('WARM_START_SECRET') or \
+    secrets.token_hex(32)
+c.PlutoFargateSpawner.warm_pool_secret = warm_start_secret
+
+# Optional warm pool of pre-started single user tasks of returning users
+if os.environ.get('WARM_POOL_SCHEDULE'):
+    warm_pool_schedule = json.loads(os.environ.get('WARM_POOL_SCHEDULE'))
+
+    def warm_task_ready(ip):
+        with urllib.request.urlopen(f'http://{ip}:8888/ready', timeout=2):
+            return True
+
+    def warm_pool_run_task_args(username):
+        # Pooled tasks run with the user's own task definition, so that they
+        # only mount the user's own directory
+        task_definition_arn = c.PlutoFargateSpawner.task_definition_registry \
+            .get_task_definition(username, False, 'default')
+        return run_task_builder.build(
+            task_definition_arn, {'WARM_POOL_SECRET': warm_start_secret},
+            command=['/opt/conda/bin/python3', '/usr/local/bin/warm_start.py']
+        )
+
+    c.PlutoFargateSpawner.warm_pool = WarmPool(
+        ecs_client=boto3.client('ecs', region_name=region),
+        cluster=os.environ.get('FARGATE_SPAWNER_CLUSTER'),
+        run_task_args=warm_pool_run_task_args,
+        schedule=warm_pool_schedule,
+        probe=warm_task_ready,
+        hub_task_id=hub_task_id(os.environ),
+        timezone=zoneinfo.ZoneInfo(
+            warm_pool_schedule.get('timezone', 'UTC')
+        ),
+        max_unclaimed=int(warm_pool_schedule.get('max_unclaimed', 3600))
+    ).start()
+
+# Optionally start the task of a returning user while the user logs in
+if os.environ.get('SPECULATIVE_SPAWN_TIMEOUT'):
+    def speculative_run_task_args(username, task_definition_arn):
+        return run_task_builder.build(
+            task_definition_arn, {'WARM_POOL_SECRET': warm_start_secret},
+            command=['/opt/conda/bin/python3', '/usr/local/bin/warm_start.py']
+        )
+
+    spawner_config = c.PlutoFargateSpawner
+    speculative_spawns = SpeculativeSpawns(
+        ecs_client=boto3.client('ecs', region_name=region),
+        task_definition_registry=spawner_config.task_definition_registry,
+        user_directory=user_directory,
+        run_task_args=speculative_run_task_args,
+        task_poller=spawner_config.task_poller,
+        timeout=int(os.environ.get('SPECULATIVE_SPAWN_TIMEOUT')),
+        spawn_dispatcher=spawner_config.spawn_dispatcher
+    )
+    c.DirectoryOAuthenticator.speculative_spawns = speculative_spawns
+    c.PlutoFargateSpawner.speculative_spawns = speculative_spawns
+
+# Cull single-user servers that are idle, by default for 1800 seconds (half
+# an hour). Pluto traffic, busy kernels and CPU use count as activity.
 c.JupyterHub.services = [
     {
-        'name': 'idle-culler',
-        'command': [
-            sys.executable, '-m',
-            'jupyterhub_idle_culler', '--timeout=1800'
-        ],
+        'name': 'activity-culler',
+        'command': [sys.executable, join(root, 'activity_culler.py')],
+        # Managed services only get these environment variables, so pass
+        # the task role credentials for the DescribeTasks calls
+        'environment': {
+            name: os.environ[name] for name in (
+                'ACTIVITY_CULLER_POLICIES', 'ACTIVITY_CULLER_INTERVAL',
+                'PRESPAWN_SCHEDULE', 'FARGATE_SPAWNER_REGION', 'AWS_REGION',
+                'AWS_DEFAULT_REGION',
+                'AWS_CONTAINER_CREDENTIALS_RELATIVE_URI'
+            ) if name in os.environ
+        },
     }
 ]
 
@@ -139,13 +317,39 @@ c.JupyterHub.load_roles = [
     {
         "name": "list-and-cull",  # name the role
         "services": [
-            "idle-culler",  # assign the service to this role
+            "activity-culler",  # assign the service to this role
         ],
         "scopes": [
             # declare what permissions the service should have
             "list:users",  # list users
             "read:users:activity",  # read user last-activity
-            "admin:servers",  # start/stop servers
+            "read:users:groups",  # read the groups that have a policy
+            "admin:servers",  # start/stop servers, read their task
+            "access:servers",  # read the servers' activity signals
         ],
     }
 ]
+
+# Optionally start the servers of scheduled sessions' users ahead of time
+if os.environ.get('PRESPAWN_SCHEDULE'):
+    c.JupyterHub.services.append({
+        'name': 'prespawn',
+        'command': [
+            sys.executable, join(root, 'prespawn.py'), 'schedule'
+        ],
+        'environment': {
+            name: os.environ[name] for name in (
+                'PRESPAWN_SCHEDULE', 'PRESPAWN_RATE', 'PRESPAWN_CONCURRENCY'
+            ) if name in os.environ
+        },
+    })
+    c.JupyterHub.load_roles.append({
+        "name": "prespawn",
+        "services": ["prespawn"],
+        "scopes": [
+            "read:groups",  # read the users of a session's group
+            "admin:users",  # create users that did not log in yet
+            "users:activity",  # keep pre-started servers from being culled
+            "admin:servers",  # start/stop servers
+        ],
+    })
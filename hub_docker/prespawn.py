@@ -0,0 +1,353 @@
+# Hub service that starts the servers of a course's users ahead of a
+# scheduled session, and a command to start or stop many servers at once
+
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import sys
+import urllib.parse
+import zoneinfo
+
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+
+from spawn_dispatcher import TokenBucket
+from user_directory import read_user_file
+
+log = logging.getLogger(__name__)
+
+# Ranges of the cron fields: minute, hour, day of month, month, day of week
+CRON_FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+
+def parse_cron_field(field, low, high):
+    """
+    Return the set of values of a cron field such as '*', '1-5', '*/15' or
+    '0,30'
+    """
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/')
+            step = int(step)
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = (int(value) for value in part.split('-'))
+        else:
+            start = end = int(part)
+        if start < low or end > high or start > end or step < 1:
+            raise ValueError(f'Invalid cron field: {field}')
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSchedule:
+    """
+    Five field cron expression: minute, hour, day of month, month and day
+    of week (0 or 7 is Sunday)
+    """
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f'Cron expression needs 5 fields: {expression}')
+        (self.minutes, self.hours, self.days, self.months,
+         self.weekdays) = (
+            parse_cron_field(field, low, high)
+            for field, (low, high) in zip(fields, CRON_FIELDS)
+        )
+        if 7 in self.weekdays:
+            self.weekdays.add(0)
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def matches(self, moment):
+        if moment.minute not in self.minutes or \
+                moment.hour not in self.hours or \
+                moment.month not in self.months:
+            return False
+        day = moment.day in self.days
+        weekday = (moment.isoweekday() % 7) in self.weekdays
+        # As in cron, a restricted day of month and day of week match
+        # either
+        if self.any_day:
+            return weekday
+        if self.any_weekday:
+            return day
+        return day or weekday
+
+
+class HubClient:
+    """
+    Client of the hub REST API
+    ------
+    Inputs
+    ------
+    - api_url: URL of the hub API, for example http://hub:8081/hub/api
+    - token: API token with the scopes of the prespawn role
+    """
+
+    def __init__(self, api_url, token, http_client=None):
+        self.api_url = api_url.rstrip('/')
+        self.token = token
+        self.http_client = http_client or AsyncHTTPClient()
+
+    async def request(self, method, path, body=None, headers=None):
+        response = await self.http_client.fetch(HTTPRequest(
+            f'{self.api_url}{path}', method=method,
+            headers=dict(headers or {}, Authorization=f'token {self.token}'),
+            body=None if body is None else json.dumps(body),
+            allow_nonstandard_methods=True, request_timeout=60
+        ), raise_error=False)
+        return response.code, response.body
+
+    async def group_users(self, group):
+        code, body = await self.request(
+            'GET', f'/groups/{urllib.parse.quote(group)}'
+        )
+        if code != 200:
+            raise Exception(f'Cannot read group {group}: {code}')
+        return json.loads(body)['users']
+
+    async def start_server(self, username):
+        """
+        Start the server of username, creating the user if needed. Return
+        'started', 'pending' or 'running'.
+        """
+        path = f'/users/{urllib.parse.quote(username)}/server'
+        code, body = await self.request('POST', path, {})
+        if code == 404:
+            await self.request(
+                'POST', f'/users/{urllib.parse.quote(username)}'
+            )
+            code, body = await self.request('POST', path, {})
+        if code == 201:
+            return 'started'
+        # The hub answers 400 for a server that is still starting or
+        # stopping
+        if code == 202 or (code == 400 and b'is pending' in body):
+            return 'pending'
+        if code == 400 and b'already running' in body:
+            return 'running'
+        raise Exception(f'Cannot start the server of {username}: {code}')
+
+    async def stop_server(self, username):
+        """
+        Stop the server of username. Return 'stopped', 'pending' or
+        'not running'.
+        """
+        code, _ = await self.request(
+            'DELETE', f'/users/{urllib.parse.quote(username)}/server'
+        )
+        if code == 204:
+            return 'stopped'
+        if code == 202:
+            return 'pending'
+        if code in (400, 404):
+            return 'not running'
+        raise Exception(f'Cannot stop the server of {username}: {code}')
+
+    async def touch(self, username, moment):
+        """
+        Report activity on the server of username at moment, so that the
+        idle culler does not stop it
+        """
+        timestamp = moment.astimezone(datetime.timezone.utc).isoformat()
+        timestamp = timestamp.replace('+00:00', 'Z')
+        await self.request(
+            'POST', f'/users/{urllib.parse.quote(username)}/activity', {
+                'last_activity': timestamp,
+                'servers': {'': {'last_activity': timestamp}}
+            }
+        )
+
+
+async def bulk(hub, usernames, action, rate=5, concurrency=20):
+    """
+    Start or stop the servers of usernames, at most rate requests per
+    second and concurrency at a time. Return a dict of username to result;
+    errors are returned as the result of their user.
+    """
+    loop = asyncio.get_running_loop()
+    bucket = TokenBucket(rate, 1, loop.time)
+    semaphore = asyncio.Semaphore(concurrency)
+    call = hub.start_server if action == 'start' else hub.stop_server
+    results = {}
+
+    async def run(username):
+        async with semaphore:
+            try:
+                results[username] = await call(username)
+            except Exception as error:
+                results[username] = f'error: {error}'
+
+    tasks = []
+    for username in usernames:
+        while True:
+            delay = bucket.take()
+            if not delay:
+                break
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(run(username)))
+    await asyncio.gather(*tasks)
+    return results
+
+
+class Prespawner:
+    """
+    Start the servers of the users of each session lead_minutes before the
+    session starts, and report activity on them until it starts, so that
+    the idle culler keeps them.
+    Each session is a dict with a 'cron' expression of the start of the
+    session in 'timezone' (default UTC), 'lead_minutes' (default 15) and
+    the hub 'group' and/or list of 'users' whose servers are started.
+    ------
+    Inputs
+    ------
+    - hub: HubClient
+    - sessions: list of session dicts
+    - rate: server starts per second
+    - concurrency: server start requests at a time
+    - touch_interval: seconds between activity reports
+    """
+
+    def __init__(self, hub, sessions, rate=5, concurrency=20,
+                 touch_interval=300):
+        self.hub = hub
+        self.sessions = [
+            dict(session, schedule=CronSchedule(session['cron']))
+            for session in sessions
+        ]
+        self.rate = rate
+        self.concurrency = concurrency
+        self.touch_interval = touch_interval
+        # username -> start of the session the server was started for
+        self.held = {}
+        self._touched = None
+
+    def due(self, now):
+        """
+        Return the sessions that start lead_minutes after the minute now,
+        with their start time
+        """
+        due = []
+        for session in self.sessions:
+            timezone = zoneinfo.ZoneInfo(session.get('timezone', 'UTC'))
+            start = now.astimezone(timezone).replace(
+                second=0, microsecond=0
+            ) + datetime.timedelta(minutes=session.get('lead_minutes', 15))
+            if session['schedule'].matches(start):
+                due.append((session, start))
+        return due
+
+    async def usernames(self, session):
+        usernames = list(session.get('users', []))
+        if session.get('group'):
+            usernames += await self.hub.group_users(session['group'])
+        return list(dict.fromkeys(usernames))
+
+    async def prespawn(self, session, start):
+        usernames = await self.usernames(session)
+        log.info('Starting %s servers for the session at %s',
+                 len(usernames), start)
+        for username in usernames:
+            self.held[username] = max(start, self.held.get(username, start))
+        results = await bulk(self.hub, usernames, 'start', self.rate,
+                             self.concurrency)
+        for username, result in results.items():
+            if result.startswith('error'):
+                log.warning('%s: %s', username, result)
+                self.held.pop(username, None)
+        # Report activity on the new servers at once
+        self._touched = None
+        return results
+
+    async def keep_active(self, now):
+        """
+        Report activity on the servers of sessions that have not started
+        yet, and stop holding the others
+        """
+        self.held = {username: start for username, start in self.held.items()
+                     if start > now}
+        if self._touched is not None and \
+                (now - self._touched).total_seconds() < self.touch_interval:
+            return
+        self._touched = now
+        await asyncio.gather(*(
+            self.hub.touch(username, now) for username in self.held
+        ), return_exceptions=True)
+
+    async def tick(self, now):
+        await asyncio.gather(*(
+            self.prespawn(session, start)
+            for session, start in self.due(now)
+        ))
+        await self.keep_active(now)
+
+    async def run(self):
+        ticks = set()
+        while True:
+            now = datetime.datetime.now(datetime.timezone.utc)
+            # Sessions are started in the background, so that a slow start
+            # does not skip the next minute
+            tick = asyncio.ensure_future(self.tick(now))
+            ticks.add(tick)
+            tick.add_done_callback(ticks.discard)
+            await asyncio.sleep(60 - now.second - now.microsecond / 1e6)
+
+
+def main(argv=None):
+    """
+    Start or stop many servers at once with an admin API token, for
+    example:
+    JUPYTERHUB_API_URL=https://hub.example.org/hub/api \\
+    JUPYTERHUB_API_TOKEN=... python prespawn.py start --users-file users
+    Run as a hub service with 'schedule', which reads the sessions from
+    the PRESPAWN_SCHEDULE environment variable.
+    """
+    parser = argparse.ArgumentParser(
+        description=main.__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('action', choices=['start', 'stop', 'schedule'])
+    parser.add_argument('usernames', nargs='*')
+    parser.add_argument('--users-file',
+                        help='file with usernames, one per line')
+    parser.add_argument('--rate', type=float, default=float(
+        os.environ.get('PRESPAWN_RATE', '5')
+    ), help='requests per second')
+    parser.add_argument('--concurrency', type=int, default=int(
+        os.environ.get('PRESPAWN_CONCURRENCY', '20')
+    ), help='requests at a time')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    hub = HubClient(os.environ['JUPYTERHUB_API_URL'],
+                    os.environ['JUPYTERHUB_API_TOKEN'])
+
+    if args.action == 'schedule':
+        prespawner = Prespawner(
+            hub, json.loads(os.environ['PRESPAWN_SCHEDULE']),
+            rate=args.rate, concurrency=args.concurrency
+        )
+        asyncio.run(prespawner.run())
+        return
+
+    usernames = list(args.usernames)
+    if args.users_file:
+        usernames += sorted(read_user_file(args.users_file))
+    results = asyncio.run(
+        bulk(hub, usernames, args.action, args.rate, args.concurrency)
+    )
+    for username, result in results.items():
+        print(f'{username}: {result}')
+    if any(result.startswith('error') for result in results.values()):
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
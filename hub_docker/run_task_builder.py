@@ -0,0 +1,195 @@
+# Builder of the RunTask requests of the single user servers
+
+import ast
+import json
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+# RunTask rejects overrides of more than 8192 bytes
+MAX_OVERRIDES_BYTES = 8192
+
+# Command of the single user container. PATH seems to get mangled when
+# starting a single user container from the jupyterhub container, so
+# /opt/conda/bin/jupyterhub-singleuser is given in full.
+SINGLE_USER_COMMAND = [
+    '/opt/conda/bin/jupyterhub-singleuser',
+    '--config=jupyter_server_config.py'
+]
+
+
+class OverridesTooLarge(ValueError):
+    """
+    The RunTask overrides are larger than MAX_OVERRIDES_BYTES
+    """
+
+
+class SubnetBalancer:
+    """
+    Spread tasks over the subnets, and so over the availability zones, by
+    picking the subnet with the most free IP addresses. The free IP counts
+    are read with DescribeSubnets every refresh_interval seconds in a
+    background thread, and counted down for each task in between, so that
+    picking a subnet does not wait for EC2. Until the first refresh, the
+    tasks are spread evenly.
+    ------
+    Inputs
+    ------
+    - ec2_client: boto3 EC2 client
+    - subnet_ids: IDs of the subnets
+    - refresh_interval: seconds between DescribeSubnets calls
+    """
+
+    def __init__(self, ec2_client, subnet_ids, refresh_interval=60):
+        self.ec2_client = ec2_client
+        self.subnet_ids = list(subnet_ids)
+        self.refresh_interval = refresh_interval
+        self.free = {subnet_id: 0 for subnet_id in self.subnet_ids}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def refresh(self):
+        response = self.ec2_client.describe_subnets(SubnetIds=self.subnet_ids)
+        with self._lock:
+            for subnet in response['Subnets']:
+                self.free[subnet['SubnetId']] = \
+                    subnet['AvailableIpAddressCount']
+
+    def pick(self):
+        """
+        Return the subnet with the most free IP addresses
+        """
+        with self._lock:
+            subnet_id = max(self.subnet_ids, key=lambda s: self.free[s])
+            self.free[subnet_id] -= 1
+        return subnet_id
+
+    def start(self):
+        """
+        Refresh in a daemon thread
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._refresh_loop, name='subnet-balancer',
+                daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _refresh_loop(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception:
+                # Keep spreading with the counts that are known
+                log.exception('Failed to describe the subnets')
+            self._stop.wait(self.refresh_interval)
+
+
+class RunTaskBuilder:
+    """
+    Build the RunTask request of a spawner. The parts that are the same
+    for every request are built once; only the task definition, subnet
+    and environment differ per request. Use as
+    c.FargateSpawner.get_run_task_args = RunTaskBuilder(...).
+    ------
+    Inputs
+    ------
+    - cluster: name or ARN of the ECS cluster
+    - container_name: name of the single user container
+    - task_role_arn: ARN of the task role of the single user tasks
+    - security_groups: IDs of the security groups of the tasks
+    - subnets: IDs of the subnets, or a SubnetBalancer
+    - command: command of the single user container
+    """
+
+    def __init__(self, cluster, container_name, task_role_arn,
+                 security_groups, subnets, command=SINGLE_USER_COMMAND):
+        self.cluster = cluster
+        self.container_name = container_name
+        self.task_role_arn = task_role_arn
+        self.command = list(command)
+        self.subnet_balancer = subnets \
+            if isinstance(subnets, SubnetBalancer) else None
+        subnet_ids = self.subnet_balancer.subnet_ids \
+            if self.subnet_balancer else list(subnets)
+        # One network configuration per subnet, and one with all subnets
+        # when there is no balancer
+        self._network = {
+            subnet_id: {'awsvpcConfiguration': {
+                'assignPublicIp': 'DISABLED',
+                'securityGroups': list(security_groups),
+                'subnets': [subnet_id]
+            }} for subnet_id in subnet_ids
+        }
+        self._all_subnets = {'awsvpcConfiguration': {
+            'assignPublicIp': 'DISABLED',
+            'securityGroups': list(security_groups),
+            'subnets': subnet_ids
+        }}
+
+    @classmethod
+    def from_environment(cls, environ, ec2_client=None):
+        """
+        Create a builder from the FARGATE_SPAWNER_* environment variables.
+        Subnets are balanced by their free IP addresses if ec2_client is
+        given, refreshed in the background.
+        """
+        subnet_ids = ast.literal_eval(environ['FARGATE_SPAWNER_SUBNETS'])
+        return cls(
+            cluster=environ.get('FARGATE_SPAWNER_CLUSTER'),
+            container_name=environ.get('FARGATE_SPAWNER_CONTAINER_NAME'),
+            task_role_arn=environ.get('FARGATE_SPAWNER_TASK_ROLE_ARN'),
+            security_groups=ast.literal_eval(
+                environ['FARGATE_SPAWNER_SECURITY_GROUPS']
+            ),
+            subnets=SubnetBalancer(ec2_client, subnet_ids).start()
+            if ec2_client is not None else subnet_ids
+        )
+
+    def network_configuration(self):
+        if self.subnet_balancer is None:
+            return self._all_subnets
+        return self._network[self.subnet_balancer.pick()]
+
+    def build(self, task_definition_arn, environment, command=None):
+        """
+        Return the RunTask arguments of a task with the environment
+        variables in the environment dict, except PATH
+        """
+        overrides = {
+            'taskRoleArn': self.task_role_arn,
+            'containerOverrides': [{
+                'command': command or self.command,
+                'environment': [
+                    {'name': name, 'value': value}
+                    for name, value in environment.items() if name != 'PATH'
+                ],
+                'name': self.container_name
+            }],
+        }
+        size = len(json.dumps(overrides, separators=(',', ':')))
+        if size > MAX_OVERRIDES_BYTES:
+            largest = sorted(
+                environment, key=lambda name: -len(str(environment[name]))
+            )[:3]
+            raise OverridesTooLarge(
+                f'RunTask overrides are {size} bytes, more than '
+                f'{MAX_OVERRIDES_BYTES}; largest variables: {largest}'
+            )
+        return {
+            'cluster': self.cluster,
+            'taskDefinition': task_definition_arn,
+            'overrides': overrides,
+            'count': 1,
+            'launchType': 'FARGATE',
+            'networkConfiguration': self.network_configuration(),
+        }
+
+    def __call__(self, spawner):
+        return self.build(spawner.task_definition_arn, spawner.get_env())
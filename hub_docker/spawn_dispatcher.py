@@ -0,0 +1,298 @@
+# Rate-limited, first come first served dispatcher of the RunTask calls
+
+import asyncio
+import itertools
+import logging
+import random
+
+log = logging.getLogger(__name__)
+
+# Errors of API throttling
+THROTTLING_ERRORS = (
+    'ThrottlingException',
+    'Rate exceeded'
+)
+
+# Errors after which RunTask is tried again: API throttling, and Fargate
+# capacity or ENI shortages that are reported as RunTask failures
+RETRYABLE_ERRORS = THROTTLING_ERRORS + (
+    'ServerException',
+    'ServiceUnavailable',
+    'Capacity is unavailable',
+    'RESOURCE:'
+)
+
+
+def _error_text(error):
+    # The ECS error code of a tornado HTTPClientError is in the response
+    # body only
+    if isinstance(error, BaseException):
+        response = getattr(error, 'response', None)
+        body = getattr(response, 'body', None) or b''
+        error = str(error) + ' ' + body.decode('utf-8', 'replace')
+    return error
+
+
+def is_retryable(error):
+    """
+    Return True if the error text or exception is a throttling or capacity
+    error after which RunTask can be tried again
+    """
+    error = _error_text(error)
+    return any(marker in error for marker in RETRYABLE_ERRORS)
+
+
+def is_throttle(error):
+    """
+    Return True if the error text or exception is an API throttling error
+    """
+    error = _error_text(error)
+    return any(marker in error for marker in THROTTLING_ERRORS)
+
+
+class RunTaskFailed(Exception):
+    """
+    RunTask returned no task
+    """
+
+    def __init__(self, failures):
+        super().__init__(f'RunTask failed: {failures}')
+        self.failures = failures
+
+
+class TokenBucket:
+    """
+    Token bucket that allows rate calls per second, with bursts of up to
+    burst calls
+    """
+
+    def __init__(self, rate, burst, clock):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    def take(self):
+        """
+        Take a token and return 0, or return the seconds until a token is
+        available
+        """
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def drain(self):
+        """
+        Empty the bucket, after the API throttled a call
+        """
+        self._refill()
+        self.tokens = min(self.tokens, 0)
+
+
+class _Ticket:
+    def __init__(self, sequence, call, future, stop=None):
+        self.sequence = sequence
+        self.call = call
+        self.future = future
+        self.stop = stop
+        self.attempts = 0
+        self.not_before = 0
+
+    def __lt__(self, other):
+        return self.sequence < other.sequence
+
+
+class SpawnDispatcher:
+    """
+    Queue the RunTask calls of all spawners and dispatch them in order of
+    arrival, at most rate calls per second. Calls that fail with a
+    throttling or capacity error are tried again after a jittered,
+    exponential backoff, and keep their place in the queue.
+    ------
+    Inputs
+    ------
+    - rate: RunTask calls per second
+    - burst: RunTask calls that can be made at once
+    - max_attempts: attempts per RunTask call
+    - base_delay: backoff in seconds after the first failed attempt
+    - max_delay: maximum backoff in seconds
+    - clock: callable that returns the time in seconds, by default the
+      event loop's time
+    - jitter: callable that returns a random number in [0, 1)
+    - on_throttle: optional callable that is called when a RunTask call is
+      throttled
+    """
+
+    def __init__(self, rate=5, burst=10, max_attempts=8, base_delay=1,
+                 max_delay=30, clock=None, jitter=random.random,
+                 on_throttle=None):
+        self.rate = rate
+        self.burst = burst
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.clock = clock
+        self.jitter = jitter
+        self.on_throttle = on_throttle
+
+        self._queue = []
+        self._in_flight = set()
+        self._sequence = itertools.count()
+        self._bucket = None
+        self._wake = None
+        self._worker = None
+
+    def position(self, ticket):
+        """
+        Return the number of queued calls before ticket, plus one
+        """
+        return 1 + sum(
+            1 for queued in self._queue if queued.sequence < ticket.sequence
+        )
+
+    def estimated_wait(self, position):
+        return position / self.rate
+
+    async def run_task(self, call, progress=None, stop=None):
+        """
+        Queue call, a coroutine function that makes the RunTask call, and
+        return its response once it started a task. progress(position,
+        estimated_wait) is called every second while the call is queued.
+        stop(task), a coroutine function, stops a task that RunTask started
+        after the spawn was cancelled, as nothing else knows the task then.
+        """
+        self._ensure_worker()
+        ticket = _Ticket(
+            next(self._sequence), call,
+            asyncio.get_running_loop().create_future(), stop
+        )
+        self._queue.append(ticket)
+        self._wake.set()
+
+        try:
+            while True:
+                if progress is not None and ticket in self._queue:
+                    position = self.position(ticket)
+                    progress(position, self.estimated_wait(position))
+                try:
+                    return await asyncio.wait_for(
+                        asyncio.shield(ticket.future), timeout=1
+                    )
+                except asyncio.TimeoutError:
+                    continue
+        except asyncio.CancelledError:
+            # The spawn was cancelled; do not start a task for it, and stop
+            # the task if RunTask started one just before
+            if ticket in self._queue:
+                self._queue.remove(ticket)
+            if not ticket.future.cancel() and \
+                    ticket.future.exception() is None:
+                stop = asyncio.ensure_future(self._stop_tasks(
+                    ticket, ticket.future.result()['tasks']
+                ))
+                self._in_flight.add(stop)
+                stop.add_done_callback(self._in_flight.discard)
+            raise
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            loop = asyncio.get_running_loop()
+            if self.clock is None:
+                self.clock = loop.time
+            self._bucket = TokenBucket(self.rate, self.burst, self.clock)
+            self._wake = asyncio.Event()
+            self._worker = loop.create_task(self._dispatch())
+
+    def _next_ready(self):
+        # Tickets of cancelled spawns are dropped
+        self._queue = [
+            ticket for ticket in self._queue if not ticket.future.done()
+        ]
+        now = self.clock()
+        ready = [ticket for ticket in self._queue if ticket.not_before <= now]
+        return min(ready) if ready else None
+
+    async def _dispatch(self):
+        while True:
+            ticket = self._next_ready()
+            if ticket is None:
+                # Wait for a new call or for the first backoff to end
+                timeout = None
+                if self._queue:
+                    timeout = max(0, min(
+                        queued.not_before for queued in self._queue
+                    ) - self.clock())
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            delay = self._bucket.take()
+            if delay:
+                await asyncio.sleep(delay)
+                continue
+
+            self._queue.remove(ticket)
+            call = asyncio.ensure_future(self._call(ticket))
+            self._in_flight.add(call)
+            call.add_done_callback(self._in_flight.discard)
+
+    async def _call(self, ticket):
+        ticket.attempts += 1
+        try:
+            response = await ticket.call()
+            if not response.get('tasks'):
+                raise RunTaskFailed(response.get('failures'))
+        except Exception as error:
+            if is_retryable(error) and ticket.attempts < self.max_attempts:
+                self._retry(ticket, error)
+            elif not ticket.future.done():
+                ticket.future.set_exception(error)
+            return
+        if ticket.future.cancelled():
+            await self._stop_tasks(ticket, response['tasks'])
+        elif not ticket.future.done():
+            ticket.future.set_result(response)
+
+    async def _stop_tasks(self, ticket, tasks):
+        for task in tasks:
+            log.info('Stopping task %s of a cancelled spawn', task['taskArn'])
+            if ticket.stop is None:
+                log.warning('Cannot stop task %s: no stop callable',
+                            task['taskArn'])
+                continue
+            try:
+                await ticket.stop(task)
+            except Exception:
+                log.exception('Failed to stop task %s', task['taskArn'])
+
+    def _retry(self, ticket, error):
+        if is_throttle(error):
+            self._bucket.drain()
+            if self.on_throttle is not None:
+                self.on_throttle()
+        if ticket.future.done():
+            # The spawn was cancelled, nothing waits for the retry
+            return
+        backoff = min(
+            self.max_delay, self.base_delay * 2 ** (ticket.attempts - 1)
+        )
+        # Jitter spreads the retries of a burst of failed calls
+        backoff *= 0.5 + self.jitter() / 2
+        log.info('RunTask attempt %s failed with %s, retrying in %.1f s',
+                 ticket.attempts, error, backoff)
+        ticket.not_before = self.clock() + backoff
+        self._queue.append(ticket)
+        self._wake.set()
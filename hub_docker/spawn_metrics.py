@@ -0,0 +1,219 @@
+# Timings of the phases of single user server starts, and RunTask
+# throttles, as Prometheus metrics on the hub's /hub/metrics endpoint and as
+# CloudWatch Embedded Metric Format (EMF) log lines
+
+import functools
+import json
+import sys
+import time
+
+from prometheus_client import Counter, Histogram
+
+# Phases of a server start:
+# - oauth: token exchange and user info request of the login
+# - run_task: from the start of the spawn until RunTask accepted the task
+# - provisioning: from task creation until the task's ENI was attached
+# - image_pull: pulling the single user image
+# - pending: from ENI attachment until the task was RUNNING
+# - activation: activating a warm pool or speculative task
+# - server_responding: from RUNNING until jupyterhub-singleuser responded
+# - proxy_route: adding the route of the server to the proxy
+# - total: from the start of the spawn until the route was added
+PHASES = (
+    'oauth', 'run_task', 'provisioning', 'image_pull', 'pending',
+    'activation', 'server_responding', 'proxy_route', 'total'
+)
+
+EMF_NAMESPACE = 'JupyterHub/Spawns'
+
+SPAWN_PHASE_DURATION_SECONDS = Histogram(
+    'pluto_spawn_phase_duration_seconds',
+    'Duration of the phases of single user server starts',
+    ['phase', 'task_definition', 'availability_zone'],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 45, 60, 90, 120, 180,
+             300, float('inf'))
+)
+
+RUN_TASK_THROTTLES = Counter(
+    'pluto_run_task_throttles',
+    'RunTask calls that were throttled by the ECS API'
+)
+
+
+def task_definition_label(image, profile):
+    """
+    Return the task definition label of a spawn: the size profile and the
+    image, without the registry. Every user has a task definition of their
+    own, so the task definition ARN would give a label value per user.
+    """
+    return f"{profile}:{image.rsplit('/', 1)[-1][:40]}"
+
+
+def emf_line(phase, seconds, task_definition, availability_zone,
+             timestamp=None, namespace=EMF_NAMESPACE):
+    """
+    Return a CloudWatch Embedded Metric Format log line with the duration of
+    a phase
+    """
+    return json.dumps({
+        '_aws': {
+            'Timestamp': int((timestamp or time.time()) * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': namespace,
+                'Dimensions': [
+                    ['Phase'], ['Phase', 'TaskDefinition'],
+                    ['Phase', 'AvailabilityZone']
+                ],
+                'Metrics': [{'Name': 'PhaseDuration', 'Unit': 'Seconds'}]
+            }]
+        },
+        'Phase': phase,
+        'TaskDefinition': task_definition,
+        'AvailabilityZone': availability_zone,
+        'PhaseDuration': round(seconds, 3)
+    })
+
+
+def emf_count_line(name, count, timestamp=None, namespace=EMF_NAMESPACE):
+    """
+    Return a CloudWatch Embedded Metric Format log line with a count without
+    dimensions
+    """
+    return json.dumps({
+        '_aws': {
+            'Timestamp': int((timestamp or time.time()) * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': namespace,
+                'Dimensions': [[]],
+                'Metrics': [{'Name': name, 'Unit': 'Count'}]
+            }]
+        },
+        name: count
+    })
+
+
+class SpawnMetrics:
+    """
+    Record the duration of the phases of server starts
+    ------
+    Inputs
+    ------
+    - emf: whether to write the durations as EMF log lines as well
+    - emit: callable that writes an EMF log line, by default to stdout,
+      which goes to the hub's CloudWatch log group
+    - namespace: CloudWatch namespace of the EMF metrics
+    """
+
+    def __init__(self, emf=True, emit=None, namespace=EMF_NAMESPACE):
+        self.emf = emf
+        self.emit = emit or self._print
+        self.namespace = namespace
+
+    @staticmethod
+    def _print(line):
+        print(line, file=sys.stdout, flush=True)
+
+    def observe(self, phase, seconds, task_definition='',
+                availability_zone=''):
+        if seconds is None or seconds < 0:
+            return
+        SPAWN_PHASE_DURATION_SECONDS.labels(
+            phase=phase, task_definition=task_definition,
+            availability_zone=availability_zone
+        ).observe(seconds)
+        if self.emf:
+            self.emit(emf_line(
+                phase, seconds, task_definition, availability_zone,
+                namespace=self.namespace
+            ))
+
+    def count_throttle(self):
+        """
+        Count a throttled RunTask call, see SpawnDispatcher.on_throttle
+        """
+        RUN_TASK_THROTTLES.inc()
+        if self.emf:
+            self.emit(emf_count_line(
+                'RunTaskThrottles', 1, namespace=self.namespace
+            ))
+
+    def observe_task(self, described_task, task_definition):
+        """
+        Record the provisioning, image_pull and pending phases from the
+        timestamps of a RUNNING task
+        """
+        def between(start, end):
+            if described_task.get(start) and described_task.get(end):
+                return (described_task[end] -
+                        described_task[start]).total_seconds()
+            return None
+
+        availability_zone = described_task.get('availabilityZone', '')
+        for phase, start, end in (
+            ('provisioning', 'createdAt', 'connectivityAt'),
+            ('image_pull', 'pullStartedAt', 'pullStoppedAt'),
+            ('pending', 'connectivityAt', 'startedAt'),
+        ):
+            self.observe(phase, between(start, end), task_definition,
+                         availability_zone)
+
+    def instrument_proxy(self, proxy_class):
+        """
+        Wrap proxy_class.add_user to record the server_responding,
+        proxy_route and total phases of spawners with a SpawnTiming
+        """
+        add_user = proxy_class.add_user
+
+        @functools.wraps(add_user)
+        async def timed_add_user(proxy, user, server_name='', client=None):
+            spawner = user.spawners[server_name]
+            timing = getattr(spawner, 'spawn_timing', None)
+            if timing is None:
+                # Not a server start, or one that is not timed
+                return await add_user(proxy, user, server_name, client)
+            # Routes are added again when the hub checks them, which is
+            # not part of the start
+            spawner.spawn_timing = None
+            timing.mark('server_responding')
+            result = await add_user(proxy, user, server_name, client)
+            timing.mark('proxy_route')
+            timing.finish()
+            return result
+
+        proxy_class.add_user = timed_add_user
+        return self
+
+
+class SpawnTiming:
+    """
+    Timing of one server start: each mark records the time since the
+    previous mark as a phase
+    """
+
+    def __init__(self, metrics, task_definition, clock=time.monotonic):
+        self.metrics = metrics
+        self.task_definition = task_definition
+        self.availability_zone = ''
+        self.clock = clock
+        self.started = self.last = clock()
+
+    def mark(self, phase):
+        now = self.clock()
+        self.metrics.observe(phase, now - self.last, self.task_definition,
+                             self.availability_zone)
+        self.last = now
+
+    def skip(self):
+        """
+        Start the next phase now, for phases that are recorded from task
+        timestamps
+        """
+        self.last = self.clock()
+
+    def task(self, described_task):
+        self.availability_zone = described_task.get('availabilityZone', '')
+        self.metrics.observe_task(described_task, self.task_definition)
+
+    def finish(self):
+        self.metrics.observe('total', self.clock() - self.started,
+                             self.task_definition, self.availability_zone)
@@ -0,0 +1,305 @@
+# Fargate spawner for the single user Pluto/JupyterLab containers
+
+import asyncio
+import functools
+
+from fargatespawner import FargateSpawner
+from fargatespawner.fargatespawner import _ensure_stopped_task, _run_task
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+from traitlets import Any, Unicode
+
+from spawn_metrics import SpawnTiming, task_definition_label
+from task_poller import task_ip
+from warm_pool import ACTIVE_STATUSES, activation_request
+
+
+class PlutoFargateSpawner(FargateSpawner):
+    """
+    FargateSpawner that looks up, or registers, the user's task definition
+    when the server is started. The ARN is available to get_run_task_args
+    as spawner.task_definition_arn.
+    If a warm pool is configured, the server of a non-admin user with the
+    default size profile is started by activating the task that the pool
+    pre-started for the user, and the user becomes a candidate for a
+    pooled task when the server stops.
+    A task that was started speculatively while the user logged in is
+    activated in the same way.
+    If a task poller is configured, the task status is read from the
+    poller's cache instead of with a DescribeTasks call per spawner, and
+    the RunTask call goes through the spawn dispatcher, if there is one.
+    If spawn metrics are configured, the phases of the start are timed.
+    """
+
+    task_definition_registry = Any(
+        help="TaskDefinitionRegistry used to find the user's task definition"
+    ).tag(config=True)
+
+    user_directory = Any(
+        help="UserDirectory with the users' admin status and size profile"
+    ).tag(config=True)
+
+    size_profile = Unicode(
+        'default',
+        help="Size profile for users that are not in the user directory"
+    ).tag(config=True)
+
+    warm_pool = Any(
+        help="WarmPool with pre-started single user tasks of returning users"
+    ).tag(config=True)
+
+    warm_pool_secret = Unicode(
+        help="Secret that the pooled tasks expect in activation requests"
+    ).tag(config=True)
+
+    task_poller = Any(
+        help="TaskPoller shared by all spawners"
+    ).tag(config=True)
+
+    speculative_spawns = Any(
+        help="SpeculativeSpawns with tasks started while users log in"
+    ).tag(config=True)
+
+    spawn_dispatcher = Any(
+        help="SpawnDispatcher that queues and rate-limits RunTask calls"
+    ).tag(config=True)
+
+    spawn_metrics = Any(
+        help="SpawnMetrics that records the phases of server starts"
+    ).tag(config=True)
+
+    task_definition_arn = Unicode('')
+
+    # SpawnTiming of the current start, read by the instrumented proxy
+    spawn_timing = None
+
+    def _user_settings(self):
+        # Admin status and size profile of the user
+        admin = self.user.admin
+        profile = self.size_profile
+        if self.user_directory is not None and \
+                self.user_directory.is_allowed(self.user.name):
+            admin = self.user_directory.is_admin(self.user.name)
+            profile = self.user_directory.profile(self.user.name)
+        return admin, profile
+
+    def _uses_warm_pool(self, admin, profile):
+        # Pooled tasks run with the task definition of a non-admin user
+        # with the default size profile
+        return self.warm_pool is not None and not admin and \
+            profile == 'default'
+
+    async def start(self):
+        admin, profile = self._user_settings()
+        self.spawn_timing = None
+        if self.spawn_metrics is not None:
+            self.spawn_timing = SpawnTiming(
+                self.spawn_metrics, task_definition_label(
+                    self.task_definition_registry.image, profile
+                )
+            )
+
+        if self.speculative_spawns is not None:
+            url = await self._start_speculative_task()
+            if url:
+                return url
+
+        if self._uses_warm_pool(admin, profile):
+            url = await self._start_from_warm_pool()
+            if url:
+                return url
+
+        # boto3 calls block, so keep them off the event loop
+        loop = asyncio.get_running_loop()
+        self.task_definition_arn = await loop.run_in_executor(
+            None,
+            self.task_definition_registry.get_task_definition,
+            self.user.name, admin, profile
+        )
+        if self.task_poller is None:
+            # The phases of FargateSpawner.start cannot be told apart
+            self.spawn_timing = None
+            return await super().start()
+        return await self._start_with_poller()
+
+    async def _start_with_poller(self):
+        # As FargateSpawner.start, but waits for the task's IP address and
+        # RUNNING status in the poller's cache
+        progress_buffer = self.progress_buffer
+        progress_buffer.write({'progress': 0.5,
+                               'message': 'Starting server...'})
+        try:
+            self.calling_run_task = True
+            run_task_args = self.get_run_task_args(self)
+            run_task = functools.partial(
+                _run_task, self.log, self._aws_endpoint(), run_task_args
+            )
+            if self.spawn_dispatcher is None:
+                run_response = await run_task()
+            else:
+                run_response = await self.spawn_dispatcher.run_task(
+                    run_task, progress=self._queue_progress,
+                    stop=self._stop_started_task
+                )
+            if not run_response.get('tasks'):
+                raise Exception('RunTask failed: {}'.format(
+                    run_response.get('failures')
+                ))
+            task = run_response['tasks'][0]
+        finally:
+            self.calling_run_task = False
+        if self.spawn_timing is not None:
+            self.spawn_timing.mark('run_task')
+
+        self.task_arn = task['taskArn']
+        self.task_cluster_arn = task['clusterArn']
+        self.task_poller.watch(self.task_cluster_arn, self.task_arn)
+        progress_buffer.write({'progress': 1})
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        while True:
+            described = self.task_poller.get(self.task_arn)
+            status = (described or {}).get('lastStatus', '')
+            # The status is '' until the task is first described
+            if status and status not in ACTIVE_STATUSES:
+                raise Exception(
+                    'Task {} is {}'.format(self.task_arn, status)
+                )
+            ip = task_ip(described)
+            if status == 'RUNNING' and ip:
+                if self.spawn_timing is not None:
+                    # Provisioning, image pull and pending are timed from
+                    # the task's timestamps
+                    self.spawn_timing.task(described)
+                    self.spawn_timing.skip()
+                break
+            elapsed = loop.time() - started
+            if elapsed > self.start_timeout:
+                raise Exception('Task {} took too long to become running'
+                                .format(self.task_arn))
+            progress_buffer.write({
+                'progress': 2 + elapsed / self.start_timeout * 98
+            })
+            await asyncio.sleep(1)
+
+        progress_buffer.write({'progress': 100, 'message': 'Server started'})
+        progress_buffer.close()
+        return f'{self.notebook_scheme}://{ip}:{self.notebook_port}'
+
+    async def _stop_started_task(self, task):
+        # Task that RunTask started after the spawn was cancelled, of which
+        # the spawner has no ARN
+        await _ensure_stopped_task(
+            self.log, self._aws_endpoint(), task['clusterArn'],
+            task['taskArn']
+        )
+
+    def _queue_progress(self, position, estimated_wait):
+        self.progress_buffer.write({
+            'progress': 0.5,
+            'message': 'Waiting to start your server: number {} in the '
+                       'queue, about {:.0f} seconds'.format(
+                           position, estimated_wait
+                       )
+        })
+
+    async def poll(self):
+        if self.task_poller is None:
+            return await super().poll()
+        if self.calling_run_task:
+            return None
+        if not self.task_arn:
+            return 0
+        # Tasks of servers that were running when the hub restarted are
+        # watched from their first poll. All spawners are polled at once
+        # then, so wait for the poller to describe them in batches.
+        self.task_poller.watch(self.task_cluster_arn, self.task_arn)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + 2 * self.task_poller.fast_interval + 5
+        while self.task_poller.get(self.task_arn) is None and \
+                loop.time() < deadline:
+            await asyncio.sleep(0.2)
+        status = self.task_poller.status(self.task_arn)
+        if not status or status in ACTIVE_STATUSES:
+            return None
+        return 1
+
+    async def stop(self, now=False):
+        if self.task_poller is not None and self.task_arn:
+            self.task_poller.unwatch(self.task_arn)
+        await super().stop(now=now)
+        if self._uses_warm_pool(*self._user_settings()):
+            self.warm_pool.release(self.user.name)
+
+    async def _start_speculative_task(self):
+        task = await self.speculative_spawns.claim(self.user.name)
+        if task is None:
+            return None
+
+        self.progress_buffer.write({
+            'progress': 25, 'message': 'Waiting for your server...'
+        })
+        if not await self.speculative_spawns.wait_until_running(
+            task, self.start_timeout / 2
+        ):
+            self.log.warning('Speculative task %s did not start',
+                             task.task_arn)
+            await self._stop_task(task, 'Speculative task did not start')
+            return None
+        return await self._activate(task)
+
+    async def _start_from_warm_pool(self):
+        task = self.warm_pool.claim(self.user.name)
+        if task is None:
+            self.log.info('No warm task available for %s', self.user.name)
+            return None
+        return await self._activate(task)
+
+    async def _stop_task(self, task, reason):
+        if self.task_poller is not None:
+            self.task_poller.unwatch(task.task_arn)
+        self.log.info('Stopping task %s: %s', task.task_arn, reason)
+        await _ensure_stopped_task(
+            self.log, self._aws_endpoint(), task.cluster_arn, task.task_arn
+        )
+
+    async def _activate(self, task):
+        # Start the server of the user in a task that runs the warm_start.py
+        # agent
+        self.progress_buffer.write({
+            'progress': 50, 'message': 'Activating a pre-started server...'
+        })
+        headers, body = activation_request(
+            self.warm_pool_secret, self.user.name,
+            {n: v for n, v in self.get_env().items() if n != 'PATH'}
+        )
+        # The agent can still be starting when the task is RUNNING
+        for _ in range(5):
+            try:
+                await AsyncHTTPClient().fetch(HTTPRequest(
+                    f'http://{task.ip}:{self.notebook_port}/activate',
+                    method='POST', headers=headers, body=body,
+                    request_timeout=10
+                ))
+                break
+            except ConnectionError:
+                await asyncio.sleep(1)
+            except Exception:
+                self.log.exception('Failed to activate task %s',
+                                   task.task_arn)
+                await self._stop_task(task, 'Activation failed')
+                return None
+        else:
+            await self._stop_task(task, 'Activation failed')
+            return None
+
+        if self.spawn_timing is not None:
+            self.spawn_timing.mark('activation')
+        self.task_arn = task.task_arn
+        self.task_cluster_arn = task.cluster_arn
+        if self.task_poller is not None:
+            self.task_poller.watch(task.cluster_arn, task.task_arn)
+        self.progress_buffer.write({'progress': 100,
+                                    'message': 'Server started'})
+        self.progress_buffer.close()
+        return f'{self.notebook_scheme}://{task.ip}:{self.notebook_port}'
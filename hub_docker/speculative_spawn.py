@@ -0,0 +1,181 @@
+# Start a returning user's single user task while the user logs in
+
+import asyncio
+import functools
+import logging
+
+from task_poller import task_ip
+from warm_pool import ACTIVE_STATUSES, WarmTask
+
+log = logging.getLogger(__name__)
+
+# Signed cookie with the name of the user that last logged in with this
+# browser
+RETURNING_USER_COOKIE = 'jupyterhub-returning-user'
+RETURNING_USER_DAYS = 30
+
+# Value of the RunTask startedBy field of speculative tasks
+STARTED_BY = 'speculative-spawn'
+
+
+class _Speculation:
+    def __init__(self, username, future, timer):
+        self.username = username
+        self.future = future
+        self.timer = timer
+
+
+class SpeculativeSpawns:
+    """
+    Start the single user task of a returning user when the login starts,
+    so that the task starts while the user authenticates with the OAuth
+    provider instead of after it.
+    The task runs the warm_start.py agent of the single user image with the
+    user's own task definition; the spawner claims it when the login
+    succeeds and activates it, as a warm pool task. The task is stopped if
+    the login fails, is for another user, or is not completed within
+    timeout seconds.
+    ------
+    Inputs
+    ------
+    - ecs_client: boto3 ECS client
+    - task_definition_registry: TaskDefinitionRegistry of the single user
+      task definitions
+    - user_directory: UserDirectory; only allowed users are started
+    - run_task_args: callable(username, task_definition_arn) that returns
+      the RunTask arguments of a speculative task
+    - task_poller: TaskPoller that follows the tasks' status
+    - timeout: seconds after which an unclaimed task is stopped
+    - spawn_dispatcher: optional SpawnDispatcher for the RunTask calls
+    - poll_interval: seconds between reads of the task poller's cache
+    """
+
+    def __init__(self, ecs_client, task_definition_registry, user_directory,
+                 run_task_args, task_poller, timeout=120,
+                 spawn_dispatcher=None, poll_interval=1):
+        self.ecs_client = ecs_client
+        self.task_definition_registry = task_definition_registry
+        self.user_directory = user_directory
+        self.run_task_args = run_task_args
+        self.task_poller = task_poller
+        self.timeout = timeout
+        self.spawn_dispatcher = spawn_dispatcher
+        self.poll_interval = poll_interval
+        self.speculations = {}
+        self.counts = {'started': 0, 'claimed': 0, 'cancelled': 0}
+
+    def start(self, username):
+        """
+        Start a task for username in the background, unless one was already
+        started or the user is not allowed
+        """
+        if username in self.speculations or \
+                not self.user_directory.is_allowed(username):
+            return
+        loop = asyncio.get_running_loop()
+        future = asyncio.ensure_future(self._run_task(username))
+        timer = loop.call_later(
+            self.timeout, self.cancel, username, 'Login timed out'
+        )
+        self.speculations[username] = _Speculation(username, future, timer)
+        self.counts['started'] += 1
+
+    async def claim(self, username):
+        """
+        Return the WarmTask started for username, or None if there is none
+        or it failed to start
+        """
+        speculation = self.speculations.pop(username, None)
+        if speculation is None:
+            return None
+        speculation.timer.cancel()
+        try:
+            task = await speculation.future
+        except Exception:
+            log.exception('Speculative task for %s failed to start',
+                          username)
+            return None
+        self.counts['claimed'] += 1
+        return task
+
+    def cancel(self, username, reason):
+        """
+        Stop the task started for username, also if it is still starting
+        """
+        speculation = self.speculations.pop(username, None)
+        if speculation is None:
+            return
+        speculation.timer.cancel()
+        self.counts['cancelled'] += 1
+        log.info('Cancelling the speculative task for %s: %s',
+                 username, reason)
+        speculation.future.add_done_callback(
+            functools.partial(self._stop, reason=reason)
+        )
+
+    async def wait_until_running(self, task, timeout):
+        """
+        Wait until task is RUNNING and has an IP address. Return False if
+        it stopped or did not run within timeout seconds.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while loop.time() < deadline:
+            described = self.task_poller.get(task.task_arn)
+            task.status = (described or {}).get('lastStatus', '')
+            if task.status and task.status not in ACTIVE_STATUSES:
+                return False
+            task.ip = task_ip(described)
+            if task.status == 'RUNNING' and task.ip:
+                return True
+            await asyncio.sleep(self.poll_interval)
+        return False
+
+    async def _run_task(self, username):
+        loop = asyncio.get_running_loop()
+        task_definition_arn = await loop.run_in_executor(
+            None, self.task_definition_registry.get_task_definition,
+            username, self.user_directory.is_admin(username),
+            self.user_directory.profile(username)
+        )
+        run_task = functools.partial(
+            loop.run_in_executor, None, functools.partial(
+                self.ecs_client.run_task,
+                **self.run_task_args(username, task_definition_arn),
+                startedBy=STARTED_BY
+            )
+        )
+        if self.spawn_dispatcher is None:
+            response = await run_task()
+        else:
+            response = await self.spawn_dispatcher.run_task(
+                run_task, stop=self._stop_started_task
+            )
+        if not response.get('tasks'):
+            raise Exception(f"RunTask failed: {response.get('failures')}")
+        started = response['tasks'][0]
+        task = WarmTask(started['taskArn'], started['clusterArn'])
+        self.task_poller.watch(task.cluster_arn, task.task_arn)
+        return task
+
+    async def _stop_started_task(self, task):
+        # Task that RunTask started after the speculative spawn was
+        # cancelled
+        await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(
+                self.ecs_client.stop_task, cluster=task['clusterArn'],
+                task=task['taskArn'], reason='Speculative spawn cancelled'
+            )
+        )
+
+    def _stop(self, future, reason):
+        if future.cancelled() or future.exception() is not None:
+            return
+        task = future.result()
+        self.task_poller.unwatch(task.task_arn)
+        asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(
+                self.ecs_client.stop_task, cluster=task.cluster_arn,
+                task=task.task_arn, reason=reason
+            )
+        )
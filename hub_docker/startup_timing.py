@@ -0,0 +1,87 @@
+# Startup time breakdown of the hub
+
+import functools
+import inspect
+import time
+
+# JupyterHub.initialize steps that are timed, and JupyterHub.start
+STARTUP_STEPS = (
+    'init_db', 'init_hub', 'init_proxy', 'init_role_creation', 'init_users',
+    'init_groups', 'init_services', 'init_api_tokens',
+    'init_role_assignment', 'init_spawners', 'start'
+)
+
+# Steps that can finish in either order; the report is logged after both
+FINAL_STEPS = ('init_spawners', 'start')
+
+# Steps that return a count, and what they count
+COUNTED_STEPS = {'init_spawners': 'servers checked'}
+
+
+class StartupTimer:
+    """
+    Time the startup steps of the hub, from when the configuration file was
+    loaded, and log the breakdown when the hub is running and the spawners
+    have been checked
+    ------
+    Inputs
+    ------
+    - clock: callable that returns the time in seconds
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.started = clock()
+        # step name -> seconds
+        self.steps = {}
+        self.counts = {}
+
+    def instrument(self, cls, names=STARTUP_STEPS):
+        """
+        Wrap the methods names of cls, which can be coroutine functions
+        """
+        for name in names:
+            setattr(cls, name, self._timed(getattr(cls, name), name))
+        return self
+
+    def _timed(self, method, name):
+        if inspect.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def timed(app, *args, **kwargs):
+                started = self.clock()
+                result = None
+                try:
+                    result = await method(app, *args, **kwargs)
+                    return result
+                finally:
+                    self._done(app, name, started, result)
+        else:
+            @functools.wraps(method)
+            def timed(app, *args, **kwargs):
+                started = self.clock()
+                result = None
+                try:
+                    result = method(app, *args, **kwargs)
+                    return result
+                finally:
+                    self._done(app, name, started, result)
+        return timed
+
+    def _done(self, app, name, started, result):
+        self.steps[name] = self.clock() - started
+        if name in COUNTED_STEPS and isinstance(result, int):
+            self.counts[COUNTED_STEPS[name]] = result
+        if all(step in self.steps for step in FINAL_STEPS):
+            app.log.info(self.report())
+
+    def report(self):
+        total = self.clock() - self.started
+        steps = ', '.join(
+            f'{name} {seconds:.2f} s' for name, seconds in sorted(
+                self.steps.items(), key=lambda step: -step[1]
+            )
+        )
+        counts = ''.join(
+            f', {count} {name}' for name, count in self.counts.items()
+        )
+        return f'Hub started in {total:.2f} s{counts}: {steps}'
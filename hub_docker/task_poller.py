@@ -0,0 +1,169 @@
+# Hub-wide poller of the status of the single user Fargate tasks
+
+import collections
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# DescribeTasks accepts at most 100 tasks per call
+MAX_DESCRIBE_TASKS = 100
+
+# Statuses of a task that is still starting
+STARTING_STATUSES = ('', 'PROVISIONING', 'PENDING', 'ACTIVATING')
+
+
+def task_ip(described_task):
+    """
+    Return the private IP address of a described task, or ''
+    """
+    for attachment in (described_task or {}).get('attachments', []):
+        for detail in attachment.get('details', []):
+            if detail['name'] == 'privateIPv4Address':
+                return detail['value']
+    return ''
+
+
+class TaskPoller:
+    """
+    Describe the tasks of all spawners together, instead of one
+    DescribeTasks call per spawner per poll.
+    The tasks that are watched are described in calls of up to 100 tasks
+    per cluster. Every fast_interval seconds while any task is starting,
+    and every slow_interval seconds while all tasks are running. The
+    spawners read the results from the cache.
+    Stopped tasks are no longer described, but stay in the cache until they
+    are unwatched.
+    ------
+    Inputs
+    ------
+    - ecs_client: boto3 ECS client
+    - fast_interval: seconds between polls while a task is starting
+    - slow_interval: seconds between polls while all tasks are running
+    - clock: callable that returns the time in seconds
+    """
+
+    def __init__(self, ecs_client, fast_interval=2, slow_interval=30,
+                 clock=time.monotonic):
+        self.ecs_client = ecs_client
+        self.fast_interval = fast_interval
+        self.slow_interval = slow_interval
+        self.clock = clock
+        self.api_calls = 0
+
+        # task ARN -> cluster ARN
+        self.watched = {}
+        # task ARN -> (time, described task)
+        self.cache = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def watch(self, cluster_arn, task_arn):
+        """
+        Describe task_arn from now on; a new task is described at the next
+        fast poll
+        """
+        with self._lock:
+            if task_arn in self.watched:
+                return
+            self.watched[task_arn] = cluster_arn
+        self._wake.set()
+
+    def unwatch(self, task_arn):
+        with self._lock:
+            self.watched.pop(task_arn, None)
+            self.cache.pop(task_arn, None)
+
+    def get(self, task_arn):
+        """
+        Return the last description of task_arn, or None if the task has
+        not been described yet
+        """
+        with self._lock:
+            cached = self.cache.get(task_arn)
+        return cached[1] if cached else None
+
+    def status(self, task_arn):
+        """
+        Return the last known status of task_arn, '' if it is not known yet
+        """
+        return (self.get(task_arn) or {}).get('lastStatus', '')
+
+    def next_interval(self):
+        with self._lock:
+            starting = any(
+                self._status(task_arn) in STARTING_STATUSES
+                for task_arn in self.watched
+            )
+        return self.fast_interval if starting else self.slow_interval
+
+    def poll(self):
+        """
+        Describe all watched tasks that have not stopped
+        """
+        by_cluster = collections.defaultdict(list)
+        with self._lock:
+            for task_arn, cluster_arn in self.watched.items():
+                if self._status(task_arn) != 'STOPPED':
+                    by_cluster[cluster_arn].append(task_arn)
+
+        for cluster_arn, task_arns in by_cluster.items():
+            for offset in range(0, len(task_arns), MAX_DESCRIBE_TASKS):
+                self.api_calls += 1
+                response = self.ecs_client.describe_tasks(
+                    cluster=cluster_arn,
+                    tasks=task_arns[offset:offset + MAX_DESCRIBE_TASKS]
+                )
+                now = self.clock()
+                with self._lock:
+                    for described_task in response.get('tasks', []):
+                        if described_task['taskArn'] in self.watched:
+                            self.cache[described_task['taskArn']] = (
+                                now, described_task
+                            )
+                    # New tasks can be missing for a short time after
+                    # RunTask; tasks that were seen before are gone
+                    for failure in response.get('failures', []):
+                        task_arn = failure.get('arn')
+                        if task_arn in self.cache:
+                            self.cache[task_arn] = (
+                                now, {'taskArn': task_arn,
+                                      'lastStatus': 'STOPPED'}
+                            )
+
+    def _status(self, task_arn):
+        cached = self.cache.get(task_arn)
+        return cached[1].get('lastStatus', '') if cached else ''
+
+    def start(self):
+        """
+        Poll in a daemon thread
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._poll_loop, name='task-poller', daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _poll_loop(self):
+        while not self._stop.is_set():
+            started = self.clock()
+            try:
+                self.poll()
+            except Exception:
+                log.exception('Failed to describe the single user tasks')
+            # A new task wakes the poller up early, but polls stay at least
+            # fast_interval apart when many tasks are started at once
+            self._wake.wait(self.next_interval())
+            self._wake.clear()
+            remaining = self.fast_interval - (self.clock() - started)
+            if remaining > 0:
+                self._stop.wait(remaining)
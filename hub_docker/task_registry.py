@@ -0,0 +1,309 @@
+# Register single user task definitions and EFS access points on demand
+
+import collections
+import hashlib
+import threading
+
+# Fargate task sizes that can be given to a single user container
+SIZE_PROFILES = {
+    'default': {'cpu': '2048', 'memory': '5120'},
+}
+# Mount point of the shared Julia depot, see single_user_docker/julia_depot.py
+JULIA_DEPOT_MOUNT = '/opt/julia-depot'
+
+
+def safe_username(username):
+    """
+    Return a version of username that can be used in directory, volume and
+    task definition family names. The '@' and '.' characters are replaced
+    by '_', as for the users' home directories.
+    """
+    return username.replace("@", "_").replace(".", "_")
+
+
+def resolve_image_digest(ecr_client, repository_uri, tag):
+    """
+    Return the image reference 'repository_uri@sha256:...' for the image
+    with the given tag, so that pushing a new image under the same tag
+    results in new task definitions. A tag that is a digest, 'sha256:...',
+    is used as is.
+    Falls back to 'repository_uri:tag' if the digest cannot be found.
+    """
+    if tag.startswith('sha256:'):
+        return f'{repository_uri}@{tag}'
+    repository_name = repository_uri.split('/', 1)[-1]
+    try:
+        response = ecr_client.describe_images(
+            repositoryName=repository_name,
+            imageIds=[{'imageTag': tag}]
+        )
+        digest = response['imageDetails'][0]['imageDigest']
+    except Exception:
+        return f'{repository_uri}:{tag}'
+    return f'{repository_uri}@{digest}'
+
+
+class TaskDefinitionRegistry:
+    """
+    Register or reuse the single user task definition and EFS access point
+    of a user when the user's server is spawned, instead of creating them
+    for every user in the HubStack.
+    Task definition ARNs are kept in an in-memory LRU cache, keyed by user,
+    image and size profile.
+    ------
+    Inputs
+    ------
+    - ecs_client: boto3 ECS client
+    - efs_client: boto3 EFS client
+    - file_system_id: ID of the EFS file system with the users' storage
+    - reference_access_point_id: ID of the access point of the shared
+      /reference directory
+    - execution_role_arn: ARN of the single user task execution role
+    - task_role_arn: ARN of the single user task role
+    - image: single user container image, preferably by digest
+    - container_name: name of the single user container
+    - log_group: name of the CloudWatch log group for the single user
+      containers
+    - log_stream_prefix: prefix of the single user log streams
+    - region: AWS region of the log group
+    - family_prefix: prefix of the task definition family names
+    - max_entries: maximum number of task definitions kept in the cache
+    - size_profiles: mapping of size profile name to Fargate cpu and memory
+    - julia_depot_access_point_id: optional ID of the access point of the
+      shared Julia depot, mounted on JULIA_DEPOT_MOUNT
+    """
+
+    def __init__(
+        self, ecs_client, efs_client, file_system_id,
+        reference_access_point_id, execution_role_arn, task_role_arn,
+        image, container_name, log_group, log_stream_prefix, region,
+        family_prefix='SingleUser', max_entries=512, size_profiles=None,
+        julia_depot_access_point_id=None
+    ):
+        self.ecs_client = ecs_client
+        self.efs_client = efs_client
+        self.file_system_id = file_system_id
+        self.reference_access_point_id = reference_access_point_id
+        self.execution_role_arn = execution_role_arn
+        self.task_role_arn = task_role_arn
+        self.image = image
+        self.container_name = container_name
+        self.log_group = log_group
+        self.log_stream_prefix = log_stream_prefix
+        self.region = region
+        self.family_prefix = family_prefix
+        self.max_entries = max_entries
+        self.size_profiles = size_profiles or SIZE_PROFILES
+        self.julia_depot_access_point_id = julia_depot_access_point_id
+
+        self._cache = collections.OrderedDict()
+        self._access_points = None
+        self._lock = threading.Lock()
+
+    def get_task_definition(self, username, admin=False, profile='default'):
+        """
+        Return the ARN of the task definition for username, registering
+        the task definition and the user's access point if necessary.
+        Admins get read/write access to the reference directory and the
+        shared Julia depot.
+        """
+        key = (username, self.image, profile, admin)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        access_point_id = self.get_access_point(username)
+        task_definition_arn = self._find_or_register(
+            username, admin, profile, access_point_id
+        )
+
+        with self._lock:
+            self._cache[key] = task_definition_arn
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return task_definition_arn
+
+    def get_access_point(self, username):
+        """
+        Return the ID of the access point for the user's private storage,
+        creating it if it does not yet exist.
+        """
+        path = '/' + safe_username(username)
+        with self._lock:
+            if self._access_points is None:
+                self._access_points = self._load_access_points()
+            if path in self._access_points:
+                return self._access_points[path]
+
+        response = self.efs_client.create_access_point(
+            ClientToken=hashlib.sha256(
+                (self.file_system_id + path).encode('utf-8')
+            ).hexdigest()[:64],
+            FileSystemId=self.file_system_id,
+            PosixUser={'Uid': 1000, 'Gid': 100},
+            RootDirectory={
+                'Path': path,
+                'CreationInfo': {
+                    'OwnerUid': 1000,
+                    'OwnerGid': 100,
+                    'Permissions': '755'
+                }
+            },
+            Tags=[{'Key': 'Name', 'Value': safe_username(username)}]
+        )
+        with self._lock:
+            self._access_points[path] = response['AccessPointId']
+        return response['AccessPointId']
+
+    def _load_access_points(self):
+        access_points = {}
+        kwargs = {'FileSystemId': self.file_system_id}
+        while True:
+            response = self.efs_client.describe_access_points(**kwargs)
+            for access_point in response['AccessPoints']:
+                path = access_point.get('RootDirectory', {}).get('Path')
+                if path:
+                    access_points[path] = access_point['AccessPointId']
+            if not response.get('NextToken'):
+                return access_points
+            kwargs['NextToken'] = response['NextToken']
+
+    def family(self, username, profile='default'):
+        return f'{self.family_prefix}-{safe_username(username)}-{profile}'
+
+    def _find_or_register(self, username, admin, profile, access_point_id):
+        family = self.family(username, profile)
+        wanted = self.task_definition(username, admin, profile,
+                                      access_point_id)
+        try:
+            existing = self.ecs_client.describe_task_definition(
+                taskDefinition=family
+            )['taskDefinition']
+        except Exception:
+            existing = None
+        if existing and _matches(existing, wanted):
+            return existing['taskDefinitionArn']
+
+        return self.ecs_client.register_task_definition(
+            **wanted
+        )['taskDefinition']['taskDefinitionArn']
+
+    def task_definition(self, username, admin, profile, access_point_id):
+        """
+        Return the RegisterTaskDefinition arguments for a single user task
+        """
+        username = safe_username(username)
+        size = self.size_profiles[profile]
+        task_definition = {
+            'family': self.family(username, profile),
+            'taskRoleArn': self.task_role_arn,
+            'executionRoleArn': self.execution_role_arn,
+            'networkMode': 'awsvpc',
+            'requiresCompatibilities': ['FARGATE'],
+            'cpu': size['cpu'],
+            'memory': size['memory'],
+            'containerDefinitions': [{
+                'name': self.container_name,
+                'image': self.image,
+                'essential': True,
+                'privileged': False,
+                'portMappings': [{
+                    'containerPort': 8888,
+                    'protocol': 'tcp'
+                }],
+                'logConfiguration': {
+                    'logDriver': 'awslogs',
+                    'options': {
+                        'awslogs-group': self.log_group,
+                        'awslogs-region': self.region,
+                        'awslogs-stream-prefix': self.log_stream_prefix
+                    }
+                },
+                'mountPoints': [{
+                    'containerPath': '/home/jovyan/work',
+                    'sourceVolume': 'efs-' + username + '-volume',
+                    'readOnly': False
+                }, {
+                    'containerPath': '/home/jovyan/reference',
+                    'sourceVolume': 'efs-reference-volume',
+                    'readOnly': not admin
+                }]
+            }],
+            'volumes': [{
+                'name': 'efs-' + username + '-volume',
+                'efsVolumeConfiguration': {
+                    'fileSystemId': self.file_system_id,
+                    'transitEncryption': 'ENABLED',
+                    'authorizationConfig': {
+                        'accessPointId': access_point_id,
+                        'iam': 'ENABLED'
+                    }
+                }
+            }, {
+                'name': 'efs-reference-volume',
+                'efsVolumeConfiguration': {
+                    'fileSystemId': self.file_system_id,
+                    'transitEncryption': 'ENABLED',
+                    'authorizationConfig': {
+                        'accessPointId': self.reference_access_point_id,
+                        'iam': 'ENABLED'
+                    }
+                }
+            }]
+        }
+        if self.julia_depot_access_point_id:
+            task_definition['containerDefinitions'][0]['mountPoints'].append({
+                'containerPath': JULIA_DEPOT_MOUNT,
+                'sourceVolume': 'efs-julia-depot-volume',
+                'readOnly': not admin
+            })
+            task_definition['volumes'].append({
+                'name': 'efs-julia-depot-volume',
+                'efsVolumeConfiguration': {
+                    'fileSystemId': self.file_system_id,
+                    'transitEncryption': 'ENABLED',
+                    'authorizationConfig': {
+                        'accessPointId': self.julia_depot_access_point_id,
+                        'iam': 'ENABLED'
+                    }
+                }
+            })
+        return task_definition
+
+
+def _matches(existing, wanted):
+    """
+    Check whether a registered task definition is the same as the wanted
+    one in the fields that the registry sets
+    """
+    if existing.get('status', 'ACTIVE') != 'ACTIVE':
+        return False
+    for field in ('cpu', 'memory', 'taskRoleArn', 'executionRoleArn'):
+        if str(existing.get(field)) != str(wanted[field]):
+            return False
+    existing_container = existing['containerDefinitions'][0]
+    wanted_container = wanted['containerDefinitions'][0]
+    if existing_container.get('image') != wanted_container['image']:
+        return False
+    existing_mounts = [
+        (m['containerPath'], m['sourceVolume'], m.get('readOnly', False))
+        for m in existing_container.get('mountPoints', [])
+    ]
+    wanted_mounts = [
+        (m['containerPath'], m['sourceVolume'], m['readOnly'])
+        for m in wanted_container['mountPoints']
+    ]
+    if existing_mounts != wanted_mounts:
+        return False
+    existing_access_points = [
+        v['efsVolumeConfiguration']['authorizationConfig']['accessPointId']
+        for v in existing.get('volumes', [])
+        if 'efsVolumeConfiguration' in v
+    ]
+    wanted_access_points = [
+        v['efsVolumeConfiguration']['authorizationConfig']['accessPointId']
+        for v in wanted['volumes']
+    ]
+    return existing_access_points == wanted_access_points
@@ -0,0 +1,443 @@
+# Hot-reloadable directory of the hub's admins and allowed users
+
+import argparse
+import collections
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+
+log = logging.getLogger(__name__)
+
+UserRecord = collections.namedtuple('UserRecord', ['admin', 'profile'])
+
+# Partition key of the DynamoDB item that holds the directory version
+DYNAMODB_META_KEY = '#directory'
+
+# Size of the shards of the SSM backend: standard SSM parameters hold 4 KB
+SSM_SHARD_BYTES = 4096
+
+
+def read_user_file(path):
+    """
+    Return the set of usernames in a plain text file, one per line
+    """
+    users = set()
+    try:
+        with open(path) as fp:
+            for line in fp:
+                if line.strip():
+                    users.add(line.strip())
+    except IOError:
+        pass
+    return users
+
+
+def make_document(admins, users, profiles=None):
+    """
+    Return the directory document stored by the file and SSM backends:
+    {"admins": [...], "users": [...], "profiles": {username: profile}}
+    """
+    return {
+        'admins': sorted(admins),
+        'users': sorted(set(users) - set(admins)),
+        'profiles': dict(sorted((profiles or {}).items()))
+    }
+
+
+def shard_document(value, size=None):
+    """
+    Split the JSON text of a directory document into SSM parameter values
+    of up to size characters. json.dumps escapes non-ASCII characters, so
+    characters are bytes.
+    """
+    size = size or SSM_SHARD_BYTES
+    return [value[offset:offset + size]
+            for offset in range(0, len(value), size)] or ['']
+
+
+def shard_index(value, shards):
+    """
+    Return the index document of the shards of the JSON text value
+    """
+    return {
+        'shards': len(shards),
+        'sha256': hashlib.sha256(value.encode()).hexdigest()
+    }
+
+
+def records_from_document(document):
+    profiles = document.get('profiles', {})
+    records = {}
+    for username in document.get('users', []):
+        records[username] = UserRecord(
+            False, profiles.get(username, 'default'))
+    for username in document.get('admins', []):
+        records[username] = UserRecord(
+            True, profiles.get(username, 'default'))
+    return records
+
+
+class FileBackend:
+    """
+    Directory document in a JSON file, for example on the EFS volume
+    mounted in the hub container. The file's modification time and size
+    are used as its version.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def fetch(self, version):
+        """
+        Return (version, records, is_delta). records is None if the
+        directory has not changed since version.
+        """
+        stat = os.stat(self.path)
+        new_version = f'{stat.st_mtime_ns}-{stat.st_size}'
+        if new_version == version:
+            return version, None, False
+        with open(self.path) as fp:
+            return new_version, records_from_document(json.load(fp)), False
+
+    def store(self, document):
+        # Write to a temporary file and rename, so readers never see a
+        # partially written file
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as fp:
+            json.dump(document, fp, indent=1)
+        os.replace(tmp_path, self.path)
+
+
+class SSMParameterBackend:
+    """
+    Directory document in SSM parameters. The JSON text is split over
+    shard parameters '<name>/0', '<name>/1', ... of up to SSM_SHARD_BYTES
+    each, and the parameter name holds the index: the number of shards and
+    the SHA-256 of the document. The index version is checked with
+    DescribeParameters, so the shards are only downloaded when the
+    directory has changed. An index that holds the document itself is read
+    as well.
+    """
+
+    def __init__(self, ssm_client, name):
+        self.ssm_client = ssm_client
+        self.name = name
+
+    def fetch(self, version):
+        parameters = self.ssm_client.describe_parameters(
+            ParameterFilters=[{'Key': 'Name', 'Values': [self.name]}]
+        )['Parameters']
+        new_version = str(parameters[0]['Version'])
+        if new_version == version:
+            return version, None, False
+        parameter = self.ssm_client.get_parameter(Name=self.name)['Parameter']
+        index = json.loads(parameter['Value'])
+        if 'shards' not in index:
+            return (
+                str(parameter['Version']), records_from_document(index),
+                False
+            )
+        value = self._read_shards(index['shards'])
+        if hashlib.sha256(value.encode()).hexdigest() != index['sha256']:
+            # The shards are being updated; read them at the next refresh
+            log.info('User directory shards do not match their index yet')
+            return version, None, False
+        return (
+            str(parameter['Version']),
+            records_from_document(json.loads(value)),
+            False
+        )
+
+    def _read_shards(self, count):
+        names = [f'{self.name}/{number}' for number in range(count)]
+        values = {}
+        # GetParameters reads at most 10 parameters per call
+        for offset in range(0, len(names), 10):
+            response = self.ssm_client.get_parameters(
+                Names=names[offset:offset + 10]
+            )
+            if response.get('InvalidParameters'):
+                return ''
+            for parameter in response['Parameters']:
+                values[parameter['Name']] = parameter['Value']
+        return ''.join(values[name] for name in names)
+
+    def store(self, document):
+        value = json.dumps(document, separators=(',', ':'))
+        shards = shard_document(value)
+        for number, shard in enumerate(shards):
+            self.ssm_client.put_parameter(
+                Name=f'{self.name}/{number}', Value=shard, Type='String',
+                Overwrite=True
+            )
+        # Write the index last, so readers see complete changes
+        self.ssm_client.put_parameter(
+            Name=self.name,
+            Value=json.dumps(shard_index(value, shards)),
+            Type='String',
+            Overwrite=True
+        )
+        # Delete the shards of a larger previous directory
+        used = {f'{self.name}/{number}' for number in range(len(shards))}
+        unused = []
+        kwargs = {'ParameterFilters': [{
+            'Key': 'Name', 'Option': 'BeginsWith', 'Values': [self.name + '/']
+        }]}
+        while True:
+            response = self.ssm_client.describe_parameters(**kwargs)
+            unused.extend(
+                parameter['Name'] for parameter in response['Parameters']
+                if parameter['Name'] not in used
+            )
+            if not response.get('NextToken'):
+                break
+            kwargs['NextToken'] = response['NextToken']
+        for offset in range(0, len(unused), 10):
+            self.ssm_client.delete_parameters(
+                Names=unused[offset:offset + 10]
+            )
+
+
+class DynamoDBBackend:
+    """
+    One item per user in a DynamoDB table with partition key 'username'.
+    Every item carries the directory version in which it last changed and
+    removed users are kept as 'deleted' items, so a refresh only reads the
+    items changed since the previous refresh.
+    """
+
+    def __init__(self, dynamodb_client, table_name):
+        self.dynamodb_client = dynamodb_client
+        self.table_name = table_name
+
+    def _directory_version(self):
+        item = self.dynamodb_client.get_item(
+            TableName=self.table_name,
+            Key={'username': {'S': DYNAMODB_META_KEY}},
+            ConsistentRead=True
+        ).get('Item')
+        return int(item['version']['N']) if item else 0
+
+    def _scan(self, since):
+        kwargs = {
+            'TableName': self.table_name,
+            'FilterExpression': '#v > :since AND username <> :meta',
+            'ExpressionAttributeNames': {'#v': 'version'},
+            'ExpressionAttributeValues': {
+                ':since': {'N': str(since)},
+                ':meta': {'S': DYNAMODB_META_KEY}
+            },
+            'ConsistentRead': True
+        }
+        while True:
+            response = self.dynamodb_client.scan(**kwargs)
+            yield from response['Items']
+            if 'LastEvaluatedKey' not in response:
+                return
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def fetch(self, version):
+        new_version = self._directory_version()
+        if str(new_version) == version:
+            return version, None, False
+        since = int(version) if version else 0
+        records = {}
+        for item in self._scan(since):
+            username = item['username']['S']
+            if item.get('deleted', {}).get('BOOL', False):
+                records[username] = None
+            else:
+                records[username] = UserRecord(
+                    item.get('admin', {}).get('BOOL', False),
+                    item.get('profile', {}).get('S', 'default')
+                )
+        # After the first load, apply the changed items to the directory
+        return str(new_version), records, since > 0
+
+    def store(self, document):
+        current = {}
+        for item in self._scan(0):
+            if not item.get('deleted', {}).get('BOOL', False):
+                current[item['username']['S']] = UserRecord(
+                    item.get('admin', {}).get('BOOL', False),
+                    item.get('profile', {}).get('S', 'default')
+                )
+        wanted = records_from_document(document)
+        version = self._directory_version() + 1
+
+        for username, record in wanted.items():
+            if current.get(username) == record:
+                continue
+            self.dynamodb_client.put_item(
+                TableName=self.table_name,
+                Item={
+                    'username': {'S': username},
+                    'admin': {'BOOL': record.admin},
+                    'profile': {'S': record.profile},
+                    'version': {'N': str(version)}
+                }
+            )
+        for username in set(current) - set(wanted):
+            self.dynamodb_client.put_item(
+                TableName=self.table_name,
+                Item={
+                    'username': {'S': username},
+                    'deleted': {'BOOL': True},
+                    'version': {'N': str(version)}
+                }
+            )
+        # Bump the directory version last, so readers see complete changes
+        self.dynamodb_client.put_item(
+            TableName=self.table_name,
+            Item={
+                'username': {'S': DYNAMODB_META_KEY},
+                'version': {'N': str(version)}
+            }
+        )
+
+
+class UserDirectory:
+    """
+    In-memory copy of the user directory, indexed by username, that is
+    refreshed in a background thread. Lookups never call AWS.
+    ------
+    Inputs
+    ------
+    - backend: FileBackend, SSMParameterBackend or DynamoDBBackend
+    - refresh_interval: seconds between checks for changes
+    """
+
+    def __init__(self, backend, refresh_interval=10):
+        self.backend = backend
+        self.refresh_interval = refresh_interval
+        self.version = None
+        self._records = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def refresh(self):
+        """
+        Check the backend for changes and apply them. Returns True if the
+        directory changed.
+        """
+        version, records, is_delta = self.backend.fetch(self.version)
+        if records is None:
+            return False
+        if is_delta:
+            merged = dict(self._records)
+            for username, record in records.items():
+                if record is None:
+                    merged.pop(username, None)
+                else:
+                    merged[username] = record
+            records = merged
+        # Replace the index in one assignment, so readers in other threads
+        # always see a consistent directory
+        self._records = records
+        self.version = version
+        log.info('User directory version %s: %d users',
+                 version, len(records))
+        return True
+
+    def start(self):
+        """
+        Load the directory and keep it up to date in a daemon thread
+        """
+        try:
+            self.refresh()
+        except Exception:
+            log.exception('Failed to load the user directory')
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._refresh_loop, name='user-directory',
+                daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception:
+                log.exception('Failed to refresh the user directory')
+
+    def is_allowed(self, username):
+        return username in self._records
+
+    def is_admin(self, username):
+        record = self._records.get(username)
+        return bool(record and record.admin)
+
+    def profile(self, username):
+        record = self._records.get(username)
+        return record.profile if record else 'default'
+
+    def usernames(self):
+        return set(self._records)
+
+    def admins(self):
+        return {name for name, record in self._records.items()
+                if record.admin}
+
+
+def backend_from_environment(environ=os.environ):
+    """
+    Create the backend named in USER_DIRECTORY_BACKEND ('file', 'ssm' or
+    'dynamodb') with the path, parameter or table name in
+    USER_DIRECTORY_LOCATION
+    """
+    kind = environ.get('USER_DIRECTORY_BACKEND', 'file')
+    location = environ['USER_DIRECTORY_LOCATION']
+    if kind == 'file':
+        return FileBackend(location)
+
+    import boto3
+    region = environ.get('FARGATE_SPAWNER_REGION')
+    if kind == 'ssm':
+        return SSMParameterBackend(
+            boto3.client('ssm', region_name=region), location)
+    if kind == 'dynamodb':
+        return DynamoDBBackend(
+            boto3.client('dynamodb', region_name=region), location)
+    raise ValueError(f'Unknown user directory backend: {kind}')
+
+
+def main(argv=None):
+    """
+    Store the users in the admins and allowed_users files in the user
+    directory, for example:
+    USER_DIRECTORY_BACKEND=ssm USER_DIRECTORY_LOCATION=/some-basename/users \\
+        python user_directory.py admins allowed_users
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('admins', help='file with admin usernames')
+    parser.add_argument('allowed_users', help='file with other usernames')
+    parser.add_argument(
+        '--profiles',
+        help='optional JSON file mapping usernames to size profiles'
+    )
+    args = parser.parse_args(argv)
+
+    profiles = {}
+    if args.profiles:
+        with open(args.profiles) as fp:
+            profiles = json.load(fp)
+    document = make_document(
+        read_user_file(args.admins),
+        read_user_file(args.allowed_users),
+        profiles
+    )
+    backend_from_environment().store(document)
+    print(f"Stored {len(document['admins'])} admins and "
+          f"{len(document['users'])} users")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
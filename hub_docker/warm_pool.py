@@ -0,0 +1,346 @@
+# Pool of pre-started single user Fargate tasks of returning users
+
+import collections
+import datetime
+import itertools
+import json
+import logging
+import secrets
+import threading
+import urllib.request
+
+log = logging.getLogger(__name__)
+
+# Prefix of the RunTask startedBy field of the pool's tasks, followed by
+# the ID of the hub's task
+STARTED_BY = 'warm-pool'
+
+ACTIVE_STATUSES = ('PROVISIONING', 'PENDING', 'ACTIVATING', 'RUNNING')
+
+
+def parse_schedule(schedule):
+    """
+    Return a list of (start, end, size) windows from a schedule like:
+    {"default": 0, "windows": [{"start": "08:30", "end": "17:30",
+                                "size": 20}]}
+    start and end are datetime.time objects; a window with end before
+    start runs over midnight.
+    """
+    windows = []
+    for window in schedule.get('windows', []):
+        windows.append((
+            datetime.time.fromisoformat(window['start']),
+            datetime.time.fromisoformat(window['end']),
+            int(window['size'])
+        ))
+    return int(schedule.get('default', 0)), windows
+
+
+def target_size(schedule, now):
+    """
+    Return the pool size of the first window that contains the time now,
+    or the default size
+    """
+    default, windows = schedule
+    moment = now.time()
+    for start, end, size in windows:
+        if start <= end:
+            if start <= moment < end:
+                return size
+        elif moment >= start or moment < end:
+            return size
+    return default
+
+
+def hub_task_id(environ, fetch=None):
+    """
+    Return the ID of the hub's own ECS task, from the task metadata
+    endpoint, or a random ID outside ECS
+    """
+    metadata_uri = environ.get('ECS_CONTAINER_METADATA_URI_V4')
+    if not metadata_uri:
+        return secrets.token_hex(16)
+    fetch = fetch or _fetch_json
+    return fetch(f'{metadata_uri}/task')['TaskARN'].rsplit('/', 1)[-1]
+
+
+def _fetch_json(url):
+    with urllib.request.urlopen(url, timeout=5) as response:
+        return json.load(response)
+
+
+class WarmTask:
+    def __init__(self, task_arn, cluster_arn, username=None, started=None):
+        self.task_arn = task_arn
+        self.cluster_arn = cluster_arn
+        self.username = username
+        self.started = started
+        self.ip = ''
+        self.status = 'PROVISIONING'
+        self.ready = False
+
+
+class WarmPool:
+    """
+    Keep the single user tasks of returning users running, so that a
+    user's server can be started by claiming the user's pre-started task
+    instead of waiting for RunTask, the ENI and the image pull.
+    The candidates are the users whose server stopped most recently; the
+    pool is refilled in a background thread up to the size given by the
+    schedule for the time of day.
+    Pooled tasks run with the user's own task definition, so they only
+    mount the user's own directory. They run the warm_start.py agent of
+    the single user image, which waits to be activated by the hub and then
+    starts jupyterhub-singleuser.
+    Only users whose server stopped while the hub was running are
+    candidates, so a user's first login, and the first login after a hub
+    restart, never finds a pooled task. A pooled task that is not claimed
+    within max_unclaimed seconds is stopped, and its user is no longer a
+    candidate until the user's server stops again.
+    ------
+    Inputs
+    ------
+    - ecs_client: boto3 ECS client
+    - cluster: cluster of the pooled tasks
+    - run_task_args: callable(username) that returns the RunTask arguments
+      of a pooled task for username
+    - schedule: pool sizes, see parse_schedule
+    - probe: callable(ip) that returns True when the agent on a RUNNING
+      task is ready to be activated
+    - timezone: tzinfo for the schedule windows
+    - hub_task_id: ID of the hub's task, which the startedBy field of the
+      pooled tasks ends with
+    - refresh_interval: seconds between refills
+    - orphan_interval: seconds between checks for pooled tasks of hubs that
+      are no longer running
+    - max_candidates: number of recently stopped users that are remembered
+    - max_unclaimed: seconds after which a pooled task that was not claimed
+      is stopped
+    """
+
+    def __init__(self, ecs_client, cluster, run_task_args, schedule, probe,
+                 hub_task_id, timezone=None, refresh_interval=15,
+                 orphan_interval=300, clock=None, max_candidates=1000,
+                 max_unclaimed=3600):
+        self.ecs_client = ecs_client
+        self.cluster = cluster
+        self.hub_task_id = hub_task_id
+        self.started_by = f'{STARTED_BY}-{hub_task_id}'
+        self.run_task_args = run_task_args
+        self.schedule = parse_schedule(schedule)
+        self.probe = probe
+        self.timezone = timezone
+        self.refresh_interval = refresh_interval
+        self.orphan_interval = orphan_interval
+        self.clock = clock or (
+            lambda: datetime.datetime.now(self.timezone)
+        )
+        self.max_candidates = max_candidates
+        self.max_unclaimed = datetime.timedelta(seconds=max_unclaimed)
+        self.tasks = {}
+        # Usernames of recently stopped servers, the most recent last
+        self.candidates = collections.OrderedDict()
+        # Claimed tasks that were not ready, stopped by the next refill
+        self.abandoned = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def target_size(self):
+        return target_size(self.schedule, self.clock())
+
+    def ready_count(self):
+        with self._lock:
+            return sum(1 for task in self.tasks.values() if task.ready)
+
+    def release(self, username):
+        """
+        Make username, whose server stopped, a candidate for a pooled task
+        """
+        with self._lock:
+            self.candidates.pop(username, None)
+            self.candidates[username] = None
+            while len(self.candidates) > self.max_candidates:
+                self.candidates.popitem(last=False)
+
+    def claim(self, username):
+        """
+        Remove the task of username from the pool and return it if it is
+        ready, or return None
+        """
+        with self._lock:
+            self.candidates.pop(username, None)
+            for task_arn, task in self.tasks.items():
+                if task.username == username:
+                    del self.tasks[task_arn]
+                    if task.ready:
+                        return task
+                    self.abandoned.append(task)
+                    break
+        return None
+
+    def stop_orphans(self):
+        """
+        Stop pooled tasks of hubs that are no longer running, such as the
+        hub before a restart. The pools of other running hubs, for example
+        during a rolling deploy, are kept.
+        """
+        task_arns = []
+        kwargs = {'cluster': self.cluster}
+        while True:
+            response = self.ecs_client.list_tasks(**kwargs)
+            task_arns.extend(response.get('taskArns', []))
+            if not response.get('nextToken'):
+                break
+            kwargs['nextToken'] = response['nextToken']
+        running = {task_arn.rsplit('/', 1)[-1] for task_arn in task_arns}
+        prefix = STARTED_BY + '-'
+        for offset in range(0, len(task_arns), 100):
+            described = self.ecs_client.describe_tasks(
+                cluster=self.cluster, tasks=task_arns[offset:offset + 100]
+            )
+            for task in described.get('tasks', []):
+                started_by = task.get('startedBy', '')
+                if started_by.startswith(prefix) and \
+                        started_by != self.started_by and \
+                        started_by[len(prefix):] not in running:
+                    self.ecs_client.stop_task(
+                        cluster=self.cluster, task=task['taskArn'],
+                        reason='Hub of the warm pool stopped'
+                    )
+
+    def refill(self):
+        """
+        Update the state of the pooled tasks, then start or stop tasks so
+        that the most recent candidates up to the target size have one.
+        Tasks that were not claimed within max_unclaimed are stopped, and
+        their users are no longer candidates.
+        """
+        self._update_tasks()
+        target = self.target_size()
+        now = self.clock()
+        with self._lock:
+            expired = [
+                task for task in self.tasks.values()
+                if now - task.started >= self.max_unclaimed
+            ]
+            for task in expired:
+                self.tasks.pop(task.task_arn)
+                self.candidates.pop(task.username, None)
+            wanted = list(self.candidates)[::-1][:target]
+            pooled = {task.username for task in self.tasks.values()}
+            surplus = [
+                task for task in self.tasks.values()
+                if task.username not in wanted
+            ] + self.abandoned
+            self.abandoned = []
+            for task in surplus:
+                self.tasks.pop(task.task_arn, None)
+        missing = [username for username in wanted if username not in pooled]
+
+        for task in expired:
+            self.ecs_client.stop_task(
+                cluster=self.cluster, task=task.task_arn,
+                reason='Warm pool task not claimed'
+            )
+        for task in surplus:
+            self.ecs_client.stop_task(
+                cluster=self.cluster, task=task.task_arn,
+                reason='Warm pool scaled down'
+            )
+        for username in missing:
+            try:
+                response = self.ecs_client.run_task(
+                    **self.run_task_args(username),
+                    startedBy=self.started_by
+                )
+            except Exception:
+                log.exception('Failed to start a pooled task for %s',
+                              username)
+                continue
+            with self._lock:
+                for started in response.get('tasks', []):
+                    self.tasks[started['taskArn']] = WarmTask(
+                        started['taskArn'], started['clusterArn'], username,
+                        now
+                    )
+            for failure in response.get('failures', []):
+                log.warning('Warm pool RunTask failure: %s', failure)
+        return target
+
+    def _update_tasks(self):
+        with self._lock:
+            task_arns = list(self.tasks)
+        for offset in range(0, len(task_arns), 100):
+            described = self.ecs_client.describe_tasks(
+                cluster=self.cluster, tasks=task_arns[offset:offset + 100]
+            )
+            # New tasks can be missing for a short time after RunTask,
+            # so only the status of the described tasks is used
+            for described_task in described.get('tasks', []):
+                self._update_task(described_task)
+
+    def _update_task(self, described_task):
+        with self._lock:
+            task = self.tasks.get(described_task['taskArn'])
+        if task is None:
+            return
+        task.status = described_task.get('lastStatus', '')
+        if task.status not in ACTIVE_STATUSES:
+            with self._lock:
+                self.tasks.pop(task.task_arn, None)
+            return
+        for attachment in described_task.get('attachments', []):
+            for detail in attachment.get('details', []):
+                if detail['name'] == 'privateIPv4Address':
+                    task.ip = detail['value']
+        if task.status == 'RUNNING' and task.ip and not task.ready:
+            try:
+                task.ready = bool(self.probe(task.ip))
+            except Exception:
+                task.ready = False
+
+    def start(self):
+        """
+        Stop orphaned pooled tasks and keep the pool filled in a daemon
+        thread
+        """
+        self.stop_orphans()
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._refill_loop, name='warm-pool', daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _refill_loop(self):
+        # Hubs that stop during a rolling deploy leave their pool behind
+        checks = max(1, round(self.orphan_interval / self.refresh_interval))
+        for number in itertools.count(1):
+            try:
+                self.refill()
+                if number % checks == 0:
+                    self.stop_orphans()
+            except Exception:
+                log.exception('Failed to refill the warm pool')
+            if self._stop.wait(self.refresh_interval):
+                return
+
+
+def activation_request(secret, username, environment):
+    """
+    Return the (headers, body) of the request that activates a pooled or
+    speculative task for username with the single user server environment
+    """
+    headers = {
+        'Authorization': f'token {secret}',
+        'Content-Type': 'application/json'
+    }
+    body = json.dumps({
+        'username': username,
+        'environment': environment
+    })
+    return headers, body
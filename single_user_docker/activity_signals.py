@@ -0,0 +1,135 @@
+# Jupyter server extension that reports the activity signals of the single
+# user server to the hub's activity culler: Pluto traffic through
+# jupyter-server-proxy, kernel busy state and the task's CPU utilization.
+
+import datetime
+import functools
+import json
+import os
+import time
+import urllib.request
+
+from jupyter_server.base.handlers import JupyterHandler
+from tornado import web
+from tornado.ioloop import PeriodicCallback
+
+# Seconds between CPU samples, and the number of samples that are kept
+CPU_SAMPLE_INTERVAL = 60
+CPU_SAMPLES = 60
+
+signals = {'pluto_last_activity': None, 'cpu': []}
+# Time and CPU usage of the previous CPU sample
+previous_cpu_sample = {}
+
+
+def isoformat(timestamp):
+    if timestamp is None:
+        return None
+    return datetime.datetime.fromtimestamp(
+        timestamp, datetime.timezone.utc
+    ).isoformat().replace('+00:00', 'Z')
+
+
+def record_pluto_activity(handler):
+    if '/pluto' in handler.request.path:
+        signals['pluto_last_activity'] = time.time()
+
+
+def track_proxy_traffic():
+    """
+    Record the time of the last request and websocket message of Pluto
+    through jupyter-server-proxy, which does not update the server's
+    last activity for websocket messages
+    """
+    from jupyter_server_proxy.handlers import ProxyHandler
+
+    for name in ('on_message', 'proxy'):
+        method = getattr(ProxyHandler, name, None)
+        if method is None:
+            continue
+
+        def tracked(self, *args, method=method, **kwargs):
+            record_pluto_activity(self)
+            return method(self, *args, **kwargs)
+
+        setattr(ProxyHandler, name, functools.wraps(method)(tracked))
+
+
+def read_cpu_usage(metadata_uri):
+    """
+    Return the total CPU time of the container in nanoseconds, from the ECS
+    task metadata endpoint
+    """
+    with urllib.request.urlopen(f'{metadata_uri}/stats', timeout=2) as r:
+        stats = json.load(r)
+    return stats['cpu_stats']['cpu_usage']['total_usage']
+
+
+def sample_cpu(metadata_uri):
+    """
+    Add the CPU utilization since the previous sample, in percent of one
+    vCPU, to the samples
+    """
+    now = time.time()
+    usage = read_cpu_usage(metadata_uri)
+    previous = previous_cpu_sample
+    if previous:
+        elapsed = now - previous['time']
+        percent = (usage - previous['usage']) / 1e9 / elapsed * 100
+        signals['cpu'] = (
+            signals['cpu'] + [(isoformat(now), round(percent, 1))]
+        )[-CPU_SAMPLES:]
+    previous.update(time=now, usage=usage)
+
+
+class ActivitySignalsHandler(JupyterHandler):
+
+    @web.authenticated
+    def get(self):
+        kernels = [
+            self.kernel_manager.get_kernel(kernel_id)
+            for kernel_id in self.kernel_manager.list_kernel_ids()
+        ]
+        kernel_activity = [
+            kernel.last_activity for kernel in kernels
+            if getattr(kernel, 'last_activity', None)
+        ]
+        self.finish({
+            'pluto_last_activity': isoformat(signals['pluto_last_activity']),
+            'kernels_busy': sum(
+                1 for kernel in kernels
+                if getattr(kernel, 'execution_state', '') == 'busy'
+            ),
+            'kernel_last_activity': isoformat(
+                max(kernel_activity).timestamp()
+            ) if kernel_activity else None,
+            'cpu': signals['cpu'],
+        })
+
+
+def _jupyter_server_extension_points():
+    return [{'module': 'activity_signals'}]
+
+
+def _load_jupyter_server_extension(serverapp):
+    try:
+        track_proxy_traffic()
+    except ImportError:
+        serverapp.log.warning('jupyter-server-proxy is not installed')
+
+    metadata_uri = os.environ.get('ECS_CONTAINER_METADATA_URI_V4')
+    if metadata_uri:
+        def sample():
+            try:
+                sample_cpu(metadata_uri)
+            except Exception:
+                serverapp.log.exception('Failed to sample the CPU usage')
+
+        sample()
+        PeriodicCallback(sample, CPU_SAMPLE_INTERVAL * 1000).start()
+
+    base_url = serverapp.web_app.settings['base_url']
+    serverapp.web_app.add_handlers('.*$', [(
+        base_url.rstrip('/') + '/api/activity-signals',
+        ActivitySignalsHandler
+    )])
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# Build and push the single user image, and record its size per layer.
+#
+#   python3 build_image.py <repository URI> <tag>
+#   python3 build_image.py <repository URI> <tag> --soci
+#
+# The image is built with docker buildx for linux/amd64 and pushed with OCI
+# media types and zstd compressed layers, which Fargate decompresses faster
+# than gzip. With --soci, the layers are gzip compressed instead, as SOCI
+# indexes only support gzip layers, and a SOCI index is added with the
+# soci CLI (run as root, with containerd), so that Fargate lazy-loads the
+# image instead of pulling it completely before the container starts.
+#
+# Writes the digest, the compressed size and the layers of the image, with
+# the Dockerfile step of each layer, to --report, and prints the
+# single_user_container_image_digest setting for config.yaml.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+CONTEXT = os.path.dirname(os.path.abspath(__file__))
+PLATFORM = 'linux/amd64'
+# Layers smaller than this are pulled completely, as they start fast anyway
+SOCI_MIN_LAYER_SIZE = 10 * 1024 * 1024
+
+
+def run(command, **kwargs):
+    print('+', ' '.join(command), file=sys.stderr, flush=True)
+    return subprocess.run(command, check=True, **kwargs)
+
+
+def output(command):
+    return run(command, stdout=subprocess.PIPE, text=True).stdout
+
+
+def build(reference, compression, insecure):
+    """
+    Build and push the image, and return its digest
+    """
+    outputs = [
+        'type=image', f'name={reference}', 'push=true',
+        'oci-mediatypes=true', f'compression={compression}',
+        'force-compression=true'
+    ]
+    if compression == 'zstd':
+        outputs.append('compression-level=3')
+    if insecure:
+        outputs.append('registry.insecure=true')
+    with tempfile.TemporaryDirectory() as directory:
+        metadata_file = os.path.join(directory, 'metadata.json')
+        run(['docker', 'buildx', 'build', '--platform', PLATFORM,
+             '--output', ','.join(outputs),
+             '--metadata-file', metadata_file, CONTEXT])
+        with open(metadata_file) as fp:
+            return json.load(fp)['containerimage.digest']
+
+
+def add_soci_index(repository, digest, reference, insecure):
+    """
+    Convert the pushed image to one with a SOCI index, push it under the
+    same tag, and return the new digest
+    """
+    registry_options = ['--insecure-registry'] if insecure else []
+    source = f'{repository}@{digest}'
+    run(['nerdctl', 'pull', '--quiet', '--platform', PLATFORM]
+        + registry_options + [source])
+    run(['soci', 'convert', '--min-layer-size', str(SOCI_MIN_LAYER_SIZE),
+         source, reference])
+    run(['nerdctl', 'push', '--quiet', '--platform', PLATFORM]
+        + registry_options + [reference])
+    return inspect(reference, '{{json .Manifest}}')['digest']
+
+
+def inspect(reference, template):
+    return json.loads(output([
+        'docker', 'buildx', 'imagetools', 'inspect', reference,
+        '--format', template
+    ]))
+
+
+def raw_manifest(reference):
+    return json.loads(output([
+        'docker', 'buildx', 'imagetools', 'inspect', '--raw', reference
+    ]))
+
+
+def image_manifest(repository, digest):
+    """
+    Return the linux/amd64 image manifest of the image or image index
+    """
+    manifest = raw_manifest(f'{repository}@{digest}')
+    for entry in manifest.get('manifests', []):
+        platform = entry.get('platform', {})
+        if f"{platform.get('os')}/{platform.get('architecture')}" == PLATFORM:
+            return raw_manifest(f"{repository}@{entry['digest']}")
+    return manifest
+
+
+def layer_report(manifest, config):
+    """
+    Return the layers of the image, largest first, with the Dockerfile step
+    that created each layer
+    """
+    steps = [
+        step.get('created_by', '') for step in config.get('history', [])
+        if not step.get('empty_layer')
+    ]
+    layers = [{
+        'digest': layer['digest'],
+        'bytes': layer['size'],
+        'media_type': layer['mediaType'],
+        'created_by': steps[index] if len(steps) == len(manifest['layers'])
+        else None,
+    } for index, layer in enumerate(manifest['layers'])]
+    return sorted(layers, key=lambda layer: -layer['bytes'])
+
+
+def main(argv=None):
+    """
+    Build the single user image and push it with zstd compressed layers,
+    or with gzip compressed layers and a SOCI index
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('repository', help='repository URI')
+    parser.add_argument('tag')
+    parser.add_argument('--soci', action='store_true',
+                        help='add a SOCI index for lazy-loading')
+    parser.add_argument('--compression', choices=['zstd', 'gzip'],
+                        help='default zstd, or gzip with --soci')
+    parser.add_argument('--insecure', action='store_true',
+                        help='push to an HTTP registry, such as a local one')
+    parser.add_argument('--report', default='image_report.json')
+    args = parser.parse_args(argv)
+
+    compression = args.compression or ('gzip' if args.soci else 'zstd')
+    if args.soci and compression != 'gzip':
+        parser.error('SOCI indexes only support gzip compressed layers')
+
+    reference = f'{args.repository}:{args.tag}'
+    digest = build(reference, compression, args.insecure)
+    if args.soci:
+        digest = add_soci_index(args.repository, digest, reference,
+                                args.insecure)
+
+    manifest = image_manifest(args.repository, digest)
+    config = inspect(f'{args.repository}@{digest}', '{{json .Image}}')
+    if PLATFORM in config:
+        # Image indexes are inspected per platform
+        config = config[PLATFORM]
+    layers = layer_report(manifest, config)
+    report = {
+        'image': reference,
+        'digest': digest,
+        'compression': compression,
+        'soci': args.soci,
+        'bytes': sum(layer['bytes'] for layer in layers),
+        'layers': layers,
+    }
+    with open(args.report, 'w') as fp:
+        json.dump(report, fp, indent=2)
+
+    print(f"{report['bytes'] / 1024 ** 2:.0f} MiB compressed, "
+          f'{len(layers)} layers:', file=sys.stderr)
+    for layer in layers:
+        print(f"  {layer['bytes'] / 1024 ** 2:8.1f} MiB  "
+              f"{(layer['created_by'] or '')[:100]}", file=sys.stderr)
+    print(f"single_user_container_image_digest: '{digest}'")
+
+
+if __name__ == '__main__':
+    main()
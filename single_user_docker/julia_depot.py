@@ -0,0 +1,154 @@
+# Shared, precompiled Julia depot, mounted from EFS on /opt/julia-depot when
+# the HubStack has the julia_depot option.
+#
+# jupyter_server_config.py layers the depots of the single user server, so
+# that Julia, the Pluto server and its notebook processes install and
+# compile packages in the user's own depot, /home/jovyan/work/.julia, and
+# use the packages and precompile files of the shared depot and of the
+# image's depot, /home/jovyan/.julia, in that order.
+#
+# The packages of the shared depot's 'shared' environment can be loaded in
+# the REPL and in Jupyter notebooks. Administrators, who have write access
+# to the shared depot, curate it from their own server:
+#
+#   python3 ~/.jupyter/julia_depot.py add DataFrames CSV
+#   python3 ~/.jupyter/julia_depot.py remove CSV
+#   python3 ~/.jupyter/julia_depot.py update
+#   python3 ~/.jupyter/julia_depot.py precompile
+#   python3 ~/.jupyter/julia_depot.py status
+
+import argparse
+import glob
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+
+SHARED_DEPOT = os.environ.get('JULIA_SHARED_DEPOT', '/opt/julia-depot')
+USER_DEPOT = '/home/jovyan/work/.julia'
+IMAGE_DEPOT = '/home/jovyan/.julia'
+SHARED_ENVIRONMENT = 'shared'
+# File in a copied environment with the hash of the image's Manifest.toml
+# that it was copied from
+MANIFEST_HASH_FILE = '.image-manifest-sha256'
+# Same targets as the Pluto sysimage, so that the precompiled package images
+# can be used on all Fargate CPU types
+CPU_TARGET = 'generic;sandybridge,-xsaveopt,clone_all;haswell,-rdrnd,base(1)'
+
+COMMANDS = {
+    'add': 'import Pkg; Pkg.add(ARGS); Pkg.precompile()',
+    'remove': 'import Pkg; Pkg.rm(ARGS)',
+    'update': 'import Pkg; Pkg.update(ARGS); Pkg.precompile()',
+    'precompile': 'import Pkg; Pkg.precompile()',
+    'status': 'import Pkg; Pkg.status()',
+}
+
+
+def layered_environment(environ):
+    """
+    Return the Julia environment variables that put the user's depot on
+    top of the shared depot, or nothing if the shared depot is not mounted
+    or JULIA_DEPOT_PATH is set already
+    """
+    if 'JULIA_DEPOT_PATH' in environ or not os.path.isdir(SHARED_DEPOT):
+        return {}
+    return {
+        'JULIA_DEPOT_PATH': os.pathsep.join(
+            [USER_DEPOT, SHARED_DEPOT, IMAGE_DEPOT]
+        ),
+        'JULIA_LOAD_PATH': os.pathsep.join(
+            ['@', '@v#.#', '@' + SHARED_ENVIRONMENT, '@stdlib']
+        ),
+    }
+
+
+def manifest_hash(environment):
+    """
+    Return the SHA-256 of the Manifest.toml of environment, or '' if it has
+    none
+    """
+    try:
+        with open(os.path.join(environment, 'Manifest.toml'), 'rb') as file:
+            return hashlib.sha256(file.read()).hexdigest()
+    except FileNotFoundError:
+        return ''
+
+
+def prepare_user_depot():
+    """
+    Copy the default environments of the image, with Pluto, to the user's
+    depot, so that packages that the user adds are kept in the user's own
+    environment. The copy records the hash of the image's Manifest.toml.
+    When a new image has another Manifest.toml, the environment is copied
+    again, and the user's previous environment is kept next to it with an
+    '.old' suffix.
+    """
+    for environment in glob.glob(os.path.join(IMAGE_DEPOT, 'environments',
+                                              'v*')):
+        target = os.path.join(USER_DEPOT, 'environments',
+                              os.path.basename(environment))
+        image_hash = manifest_hash(environment)
+        try:
+            with open(os.path.join(target, MANIFEST_HASH_FILE)) as file:
+                copied_hash = file.read().strip()
+        except FileNotFoundError:
+            copied_hash = None
+        if copied_hash == image_hash:
+            continue
+        if os.path.exists(target):
+            shutil.rmtree(target + '.old', ignore_errors=True)
+            os.rename(target, target + '.old')
+        shutil.copytree(environment, target)
+        with open(os.path.join(target, MANIFEST_HASH_FILE), 'w') as file:
+            file.write(image_hash + '\n')
+
+
+def curation_environment():
+    """
+    Return the environment in which administrators change the shared depot
+    """
+    environment = dict(os.environ)
+    environment.update({
+        # Install and compile in the shared depot, reusing the packages of
+        # the image
+        'JULIA_DEPOT_PATH': os.pathsep.join([SHARED_DEPOT, IMAGE_DEPOT]),
+        'JULIA_PROJECT': os.path.join(
+            SHARED_DEPOT, 'environments', SHARED_ENVIRONMENT
+        ),
+        'JULIA_LOAD_PATH': os.pathsep.join(['@', '@stdlib']),
+        'JULIA_CPU_TARGET': CPU_TARGET,
+        'JULIA_PKG_PRECOMPILE_AUTO': '0',
+    })
+    return environment
+
+
+def main(argv=None):
+    """
+    Add, remove, update or precompile the packages of the shared Julia
+    depot
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('command', choices=sorted(COMMANDS))
+    parser.add_argument('packages', nargs='*')
+    args = parser.parse_args(argv)
+
+    if args.command == 'add' and not args.packages:
+        parser.error('add needs one or more packages')
+    if args.command == 'remove' and not args.packages:
+        parser.error('remove needs one or more packages')
+    if not os.path.isdir(SHARED_DEPOT):
+        parser.exit(1, f'The shared Julia depot {SHARED_DEPOT} is not '
+                       'mounted\n')
+    if args.command != 'status' and not os.access(SHARED_DEPOT, os.W_OK):
+        parser.exit(1, f'The shared Julia depot {SHARED_DEPOT} is read-only; '
+                       'only administrators can change it\n')
+
+    return subprocess.call(
+        ['julia', '-e', COMMANDS[args.command]] + args.packages,
+        env=curation_environment()
+    )
+
+
+if __name__ == '__main__':
+    sys.exit(main())
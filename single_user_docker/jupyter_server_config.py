@@ -1,5 +1,8 @@
 # Configuration file for jupyter-server.
 
+import os
+import sys
+
 c = get_config()
 
 # Set ip to '*' to bind on all interfaces (ips) for the hub server
@@ -10,3 +13,24 @@ c.ServerApp.port = 8888
 
 # Allow requests where the Host header doesn't point to a local server
 c.ServerApp.allow_remote_access = True
+
+# Report Pluto traffic, kernel busy state and CPU utilization to the hub's
+# activity culler
+sys.path.insert(0, os.path.dirname(__file__))
+c.ServerApp.jpserver_extensions = {'activity_signals': True}
+
+# Layer the user's Julia depot over the shared, precompiled depot if it is
+# mounted, see julia_depot.py
+from julia_depot import layered_environment, prepare_user_depot  # noqa: E402
+julia_environment = layered_environment(os.environ)
+if julia_environment:
+    os.environ.update(julia_environment)
+    prepare_user_depot()
+
+# Start the Pluto server in the background when the server starts, and let
+# the Pluto launcher attach to it, see pluto_prelaunch.py. The launcher
+# starts the Pluto server, with the Pluto sysimage, if it is not running.
+from pluto_prelaunch import PROXY_NAME, server_proxy_config  # noqa: E402
+c.ServerProxy.servers = {PROXY_NAME: server_proxy_config()}
+if os.environ.get('PLUTO_PRELAUNCH', 'true') == 'true':
+    c.ServerApp.jpserver_extensions['pluto_prelaunch'] = True
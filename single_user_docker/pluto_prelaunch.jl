@@ -0,0 +1,57 @@
+# Pluto server started by pluto_prelaunch.py when the single user server
+# starts.
+#
+#   julia pluto_prelaunch.jl <port> [--warmup]
+#
+# With --warmup, runs a notebook with a PlutoUI widget in the background, in
+# its own session, while the server starts, so that the first notebook of
+# the user does not wait for compilation. Timings are printed as
+# "PLUTO_PRELAUNCH <name>=<seconds>" lines.
+
+const STARTED = time()
+
+import Pluto
+
+const PORT = parse(Int, ARGS[1])
+const WARMUP = "--warmup" in ARGS
+
+const WARMUP_CELLS = [
+    "using PlutoUI",
+    "@bind x Slider(1:10)",
+    "x + 1",
+]
+
+function report(name, seconds)
+    println("PLUTO_PRELAUNCH $(name)=$(round(seconds; digits=2))")
+    flush(stdout)
+end
+
+function warmup()
+    started = time()
+    session = Pluto.ServerSession()
+    notebook = Pluto.Notebook([Pluto.Cell(code) for code in WARMUP_CELLS])
+    notebook.path = joinpath(mktempdir(), "warmup.jl")
+    try
+        Pluto.update_run!(session, notebook, notebook.cells)
+    finally
+        Pluto.SessionActions.shutdown(session, notebook)
+    end
+    report("warmup_seconds", time() - started)
+end
+
+options = Pluto.Configuration.from_flat_kwargs(
+    host="127.0.0.1", port=PORT, launch_browser=false,
+    require_secret_for_access=false, require_secret_for_open_links=false
+)
+session = Pluto.ServerSession(; options=options)
+report("loaded_seconds", time() - STARTED)
+
+if WARMUP
+    @async try
+        warmup()
+    catch e
+        @warn "Pluto warm-up notebook failed" exception=e
+    end
+end
+
+Pluto.run(session)
@@ -0,0 +1,211 @@
+# Jupyter server extension that starts the Pluto server in the background
+# as soon as the single user server starts, instead of when the user first
+# opens Pluto.
+#
+# The Pluto server, pluto_prelaunch.jl, listens on PLUTO_PRELAUNCH_PORT and
+# runs a warm-up notebook in the background. The extension probes the
+# server until it serves its front page and logs the startup timings. The
+# 'pluto' server of jupyter-server-proxy, see server_proxy_config, takes
+# the place of the one of pluto-on-jupyterlab: its command attaches to the
+# running Pluto server, or starts one if there is none, and the proxy
+# waits for the same port.
+#
+# Only the Pluto server, and the notebook processes that it starts, run
+# with the Pluto sysimage in PLUTO_SYSIMAGE. Other julia processes, such as
+# the REPL, Jupyter kernels and Pkg commands, use Julia's own sysimage, so
+# that they can load other versions of the packages in the sysimage.
+#
+#   python pluto_prelaunch.py attach
+
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+# Name of the server of pluto-on-jupyterlab, whose URL and launcher entry
+# are kept
+PROXY_NAME = 'pluto'
+PORT = int(os.environ.get('PLUTO_PRELAUNCH_PORT', '1234'))
+WARMUP = os.environ.get('PLUTO_PRELAUNCH_WARMUP', 'true') == 'true'
+# Seconds that the proxy waits for the Pluto server
+READY_TIMEOUT = 300
+PROBE_INTERVAL = 0.5
+STATE_FILE = os.environ.get(
+    'PLUTO_PRELAUNCH_STATE', '/tmp/pluto_prelaunch.json'
+)
+SERVER_SCRIPT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'pluto_prelaunch.jl'
+)
+# Sysimage with Pluto and PlutoUI compiled in, see
+# pluto_sysimage/build_sysimage.jl; empty for Julia's own sysimage
+SYSIMAGE = os.environ.get('PLUTO_SYSIMAGE', '')
+
+
+def server_command(warmup):
+    command = ['julia']
+    if SYSIMAGE and os.path.isfile(SYSIMAGE):
+        command.append(f'--sysimage={SYSIMAGE}')
+    return command + [SERVER_SCRIPT, str(PORT)] + (
+        ['--warmup'] if warmup else []
+    )
+
+
+def server_proxy_config():
+    """
+    Return the jupyter-server-proxy configuration of the Pluto server
+    """
+    return {
+        'command': [sys.executable, os.path.abspath(__file__), 'attach'],
+        'port': PORT,
+        'timeout': READY_TIMEOUT,
+        # The launcher entry of pluto-on-jupyterlab opens this server
+        'launcher_entry': {'enabled': False},
+    }
+
+
+def process_age():
+    """
+    Return the seconds since this process started, from /proc, or None
+    """
+    try:
+        with open('/proc/self/stat') as fp:
+            start_ticks = int(fp.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as fp:
+            uptime = float(fp.read().split()[0])
+    except (OSError, IndexError, ValueError):
+        return None
+    return uptime - start_ticks / os.sysconf('SC_CLK_TCK')
+
+
+def is_ready(port=PORT):
+    try:
+        with urllib.request.urlopen(
+            f'http://127.0.0.1:{port}/', timeout=2
+        ) as response:
+            return response.status == 200
+    except OSError:
+        return False
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def read_state():
+    try:
+        with open(STATE_FILE) as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_state(state):
+    with open(STATE_FILE + '.tmp', 'w') as fp:
+        json.dump(state, fp)
+    os.replace(STATE_FILE + '.tmp', STATE_FILE)
+
+
+class PrelaunchedPluto:
+    """
+    Pluto server started in the background, with a readiness probe that
+    logs the startup timings
+    """
+
+    def __init__(self, log, warmup=WARMUP):
+        self.log = log
+        self.warmup = warmup
+        self.process = None
+        self.state = {}
+
+    def start(self):
+        # Seconds between the start of jupyterhub-singleuser and this
+        # extension
+        server_age = process_age()
+        self.process = subprocess.Popen(
+            server_command(self.warmup),
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+        )
+        self.state = {
+            'pid': self.process.pid,
+            'port': PORT,
+            'launched_at': time.time(),
+            'server_age': server_age,
+        }
+        write_state(self.state)
+        self.log.info(
+            'Pluto server launched on port %s, %s s after the single user '
+            'server started', PORT,
+            'unknown' if server_age is None else round(server_age, 2)
+        )
+        threading.Thread(target=self.read_output, daemon=True).start()
+        threading.Thread(target=self.probe, daemon=True).start()
+
+    def elapsed(self):
+        return round(time.time() - self.state['launched_at'], 2)
+
+    def probe(self):
+        while self.process.poll() is None:
+            if is_ready():
+                self.state['ready_at'] = time.time()
+                write_state(self.state)
+                self.log.info('Pluto server ready %s s after launch',
+                              self.elapsed())
+                break
+            time.sleep(PROBE_INTERVAL)
+        # Reap the process, so that the launcher sees when it has stopped
+        self.process.wait()
+        self.log.warning('Pluto server exited with status %s',
+                         self.process.returncode)
+
+    def read_output(self):
+        for line in self.process.stdout:
+            line = line.rstrip()
+            if line.startswith('PLUTO_PRELAUNCH '):
+                # Timings of pluto_prelaunch.jl, such as warmup_seconds
+                self.log.info('Pluto server %s, %s s after launch',
+                              line.split(' ', 1)[1], self.elapsed())
+            elif line:
+                self.log.debug('Pluto: %s', line)
+
+
+def attach():
+    """
+    Command of the jupyter-server-proxy server: wait while the pre-launched
+    Pluto server runs, or run a Pluto server if there is none
+    """
+    state = read_state()
+    if state.get('pid') and is_running(state['pid']):
+        now = time.time()
+        if state.get('ready_at'):
+            timing = (f"{round(now - state['ready_at'], 2)} s after it was "
+                      'ready')
+        else:
+            timing = 'before it was ready'
+        print(f'Pluto launcher attached to the pre-launched Pluto server '
+              f"{round(now - state['launched_at'], 2)} s after launch, "
+              f'{timing}', file=sys.stderr, flush=True)
+        while is_running(state['pid']):
+            time.sleep(5)
+        return 1
+    print('No pre-launched Pluto server, starting one', file=sys.stderr,
+          flush=True)
+    os.execvp('julia', server_command(warmup=False))
+
+
+def _jupyter_server_extension_points():
+    return [{'module': 'pluto_prelaunch'}]
+
+
+def _load_jupyter_server_extension(serverapp):
+    PrelaunchedPluto(serverapp.log).start()
+
+
+if __name__ == '__main__' and sys.argv[1:] == ['attach']:
+    sys.exit(attach())
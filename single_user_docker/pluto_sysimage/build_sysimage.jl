@@ -0,0 +1,24 @@
+# Build a Julia sysimage with Pluto and PlutoUI compiled in:
+#
+#   julia --project=<environment with PackageCompiler> build_sysimage.jl \
+#       <sysimage path>
+#
+# Compiles Pluto and PlutoUI, as installed in the default environment, with
+# the code that precompile_pluto.jl runs. The sysimage is built for the
+# same generic x86-64 targets as the Julia binaries, so that it runs on
+# every CPU type that Fargate may give a task.
+
+using PackageCompiler
+
+sysimage_path = ARGS[1]
+default_environment = joinpath(
+    first(DEPOT_PATH), "environments", "v$(VERSION.major).$(VERSION.minor)"
+)
+
+create_sysimage(
+    ["Pluto", "PlutoUI"];
+    sysimage_path=sysimage_path,
+    project=default_environment,
+    precompile_execution_file=joinpath(@__DIR__, "precompile_pluto.jl"),
+    cpu_target=PackageCompiler.default_app_cpu_target()
+)
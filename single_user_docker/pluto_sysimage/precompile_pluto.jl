@@ -0,0 +1,61 @@
+# Precompile workload of the Pluto sysimage, see build_sysimage.jl.
+#
+# Runs what a user's first Pluto session runs, so that PackageCompiler
+# compiles it into the sysimage:
+# - start the Pluto server and load its front page, as the launcher of
+#   pluto-on-jupyterlab does
+# - open a notebook and run its cells, including PlutoUI widgets, in this
+#   process, so that the code of PlutoRunner and PlutoUI is traced too
+# - render the notebook as HTML
+
+import Pluto
+import PlutoUI
+
+const HTTP = Pluto.HTTP
+const PORT = 1235
+
+const CELLS = [
+    "using PlutoUI",
+    "md\"Number of points: \$(@bind n Slider(1:100; default=10, show_value=true))\"",
+    "@bind name TextField(default=\"Pluto\")",
+    "@bind check CheckBox(default=true)",
+    "@bind choice Select([\"a\" => \"A\", \"b\" => \"B\"])",
+    "xs = [sin(x) for x in range(0, 2pi; length=n)]",
+    "md\"Hello **\$(name)**, the mean is \$(sum(xs) / length(xs))\"",
+    "PlutoUI.TableOfContents()",
+]
+
+# Server and front page
+server = @async Pluto.run(
+    host="127.0.0.1", port=PORT, launch_browser=false,
+    require_secret_for_access=false, require_secret_for_open_links=false
+)
+for _ in 1:120
+    try
+        HTTP.get("http://127.0.0.1:$(PORT)/"; retry=false)
+        HTTP.get("http://127.0.0.1:$(PORT)/new"; retry=false,
+                 redirect=false, status_exception=false)
+        break
+    catch
+        sleep(0.5)
+    end
+end
+
+# A notebook with PlutoUI widgets, run in this process
+session = Pluto.ServerSession()
+session.options.evaluation.workspace_use_distributed = false
+notebook = Pluto.Notebook([Pluto.Cell(code) for code in CELLS])
+notebook.path = joinpath(mktempdir(), "precompile.jl")
+Pluto.update_run!(session, notebook, notebook.cells)
+for cell in notebook.cells
+    cell.errored && error("Cell failed: $(cell.code)\n$(cell.output.body)")
+end
+
+# Change a cell, as moving a slider does, and save the notebook
+notebook.cells[2].code = replace(notebook.cells[2].code, "10" => "20")
+Pluto.update_run!(session, notebook, notebook.cells[2:2])
+Pluto.save_notebook(notebook)
+Pluto.load_notebook(notebook.path)
+
+# Export
+Pluto.generate_html(notebook)
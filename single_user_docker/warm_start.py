@@ -0,0 +1,79 @@
+# Agent for pre-started (warm pool and speculative) single user containers.
+#
+# Waits for the hub to activate the container and then replaces itself with
+# jupyterhub-singleuser on the same port. The containers run with the
+# user's own task definition, which mounts the user's directory.
+
+import hmac
+import json
+import os
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+PORT = 8888
+WORK_DIRECTORY = '/home/jovyan/work'
+COMMAND = [
+    '/opt/conda/bin/jupyterhub-singleuser',
+    '--config=jupyter_server_config.py'
+]
+
+activation = {}
+
+
+class ActivationHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        # Readiness probe of the warm pool
+        self.send_response(200 if self.path == '/ready' else 404)
+        self.end_headers()
+
+    def do_POST(self):
+        if self.path != '/activate' or activation:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        expected = 'token ' + os.environ.get('WARM_POOL_SECRET', '')
+        if not os.environ.get('WARM_POOL_SECRET') or not hmac.compare_digest(
+            self.headers.get('Authorization', ''), expected
+        ):
+            self.send_response(403)
+            self.end_headers()
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            request = json.loads(self.rfile.read(length))
+        except ValueError:
+            request = None
+        if not valid_request(request):
+            self.send_response(400)
+            self.end_headers()
+            return
+
+        activation.update(request)
+        self.send_response(200)
+        self.end_headers()
+
+
+def valid_request(request):
+    return isinstance(request, dict) and \
+        isinstance(request.get('username'), str) and \
+        bool(request['username']) and \
+        isinstance(request.get('environment'), dict)
+
+
+def main():
+    server = HTTPServer(('0.0.0.0', PORT), ActivationHandler)
+    while not activation:
+        server.handle_request()
+    server.server_close()
+
+    environment = dict(os.environ)
+    environment.pop('WARM_POOL_SECRET', None)
+    environment.update(activation['environment'])
+    os.chdir(WORK_DIRECTORY)
+    os.execve(COMMAND[0], COMMAND, environment)
+
+
+if __name__ == '__main__':
+    main()
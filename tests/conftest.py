@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The hub modules are copied next to jupyterhub_config.py in the hub image,
+# and the single user modules next to jupyter_server_config.py in the
+# single user image, make them importable in the same way for the tests
+ROOT = os.path.dirname(os.path.dirname(__file__))
+for directory in ('single_user_docker', 'hub_docker'):
+    sys.path.insert(0, os.path.join(ROOT, directory))
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+import asyncio
+import datetime
+import json
+
+from activity_culler import (
+    ActivityCuller, ServerSignals, cull_reason, held_for_session,
+    last_active, policy_for
+)
+
+START = datetime.datetime(2024, 9, 2, 9, 0, tzinfo=datetime.timezone.utc)
+
+
+def minutes(value):
+    return START + datetime.timedelta(minutes=value)
+
+
+def timestamp(value):
+    if value is None:
+        return None
+    return minutes(value).isoformat().replace("+00:00", "Z")
+
+
+def last(times, now):
+    """
+    Last minute of times that is not after now
+    """
+    past = [time for time in times if time <= now]
+    return max(past) if past else None
+
+
+# Synthetic activity traces: the minutes at which each signal shows
+# activity during four hours
+TRACES = {
+    # Works in JupyterLab for an hour
+    "lab": {"hub": range(0, 60)},
+    # Works in Pluto for two hours; only the start reaches the hub
+    "pluto": {"hub": [0], "pluto": range(0, 120)},
+    # Runs a notebook for three hours without touching it
+    "compute": {"hub": [0], "busy": range(0, 180)},
+    # Pluto run that uses the CPU for 100 minutes
+    "cpu": {"hub": [0], "cpu": range(0, 100)},
+    # Logs in and leaves
+    "idle": {"hub": [0]},
+    # Logs in and leaves, in a group with a longer timeout
+    "exam": {"hub": [0], "groups": ["exam"]},
+}
+
+POLICIES = {
+    "default": {"timeout": 1800},
+    "groups": {"exam": {"timeout": 7200}},
+}
+
+
+class FakeHub:
+    def __init__(self, users):
+        self.users = users
+        self.requests = []
+        self.stopped = []
+
+    async def request(self, method, path, body=None, headers=None):
+        self.requests.append(path)
+        query = dict(part.split("=") for part in path.split("?")[1].split("&"))
+        offset, limit = int(query["offset"]), int(query["limit"])
+        ready = [user for user in self.users if user["servers"]]
+        return 200, json.dumps({
+            "items": ready[offset:offset + limit],
+            "_pagination": {"offset": offset, "limit": limit,
+                            "total": len(ready)},
+        }).encode()
+
+    async def stop_server(self, username):
+        self.stopped.append(username)
+        for user in self.users:
+            if user["name"] == username:
+                user["servers"] = {}
+        return "stopped"
+
+
+def simulate(policies, scan_interval=10, duration=240):
+    """
+    Scan every scan_interval minutes and return the minute at which each
+    server was stopped
+    """
+    users = [{
+        "name": name, "groups": trace.get("groups", []),
+        "servers": {"": {"ready": True, "started": timestamp(0)}}
+    } for name, trace in TRACES.items()]
+    hub = FakeHub(users)
+    now = [0]
+
+    async def fetch_signals(listed):
+        signals = {}
+        for user in listed:
+            trace = TRACES[user["name"]]
+            user["servers"][""]["last_activity"] = timestamp(
+                last(trace["hub"], now[0])
+            )
+            signals[user["name"]] = {
+                "pluto_last_activity": timestamp(
+                    last(trace.get("pluto", []), now[0])
+                ),
+                "kernels_busy": int(now[0] in trace.get("busy", [])),
+                "kernel_last_activity": timestamp(
+                    last(trace.get("busy", []), now[0])
+                ),
+                "cpu": [
+                    [timestamp(minute), 150.0 if minute in trace.get(
+                        "cpu", []) else 1.0]
+                    for minute in range(max(0, now[0] - 59), now[0] + 1)
+                ],
+            }
+        return signals
+
+    culler = ActivityCuller(hub, fetch_signals, policies)
+    culled = {}
+
+    async def run():
+        for minute in range(0, duration + 1, scan_interval):
+            now[0] = minute
+            for username in await culler.scan(minutes(minute)):
+                culled[username] = minute
+
+    asyncio.run(run())
+    return culled
+
+
+def test_simulated_traces():
+    culled = simulate(POLICIES)
+    # Stopped at the first scan more than 30 minutes after the last activity
+    assert culled["lab"] == 90
+    assert culled["pluto"] == 150
+    assert culled["cpu"] == 130
+    assert culled["idle"] == 40
+    assert culled["compute"] == 210
+    assert culled["exam"] == 130
+
+
+def test_hub_activity_only():
+    # With only the hub's last activity, Pluto and compute users are
+    # stopped while they work
+    culled = simulate({
+        "default": {"timeout": 1800, "signals": ["hub"]}
+    })
+    assert culled["pluto"] == 40
+    assert culled["compute"] == 40
+    assert culled["lab"] == 90
+
+
+def test_max_age():
+    culled = simulate({"default": {"timeout": 1800, "max_age": 3 * 3600}})
+    assert culled["compute"] == 190
+
+
+def test_prespawned_servers_kept_until_session():
+    # The session starts at 10:30, 90 minutes after the servers, and the
+    # timeout is 30 minutes
+    sessions = [{"cron": "30 10 * * *", "lead_minutes": 90,
+                 "group": "course", "users": ["teacher"]}]
+    users = [{
+        "name": name, "groups": groups,
+        "servers": {"": {"ready": True, "started": timestamp(0),
+                         "last_activity": timestamp(0)}}
+    } for name, groups in (("student", ["course"]), ("teacher", []),
+                           ("other", []))]
+    hub = FakeHub(users)
+
+    async def fetch_signals(listed):
+        return {}
+
+    culler = ActivityCuller(hub, fetch_signals, POLICIES, sessions=sessions)
+    assert asyncio.run(culler.scan(minutes(40))) == {
+        "other": f"inactive since {minutes(0).isoformat()}"
+    }
+    assert held_for_session(users[0], culler.sessions, minutes(89)) == \
+        minutes(90)
+    # Once the session started, the servers are culled as usual
+    assert sorted(asyncio.run(culler.scan(minutes(130)))) == [
+        "student", "teacher"
+    ]
+
+
+def test_policy_for():
+    assert policy_for({"groups": ["other", "exam"]}, POLICIES)[
+        "timeout"] == 7200
+    policy = policy_for({"groups": []}, POLICIES)
+    assert policy["timeout"] == 1800
+    assert policy["signals"] == ["hub", "pluto", "kernels", "cpu"]
+
+
+def test_unreadable_signals_fall_back_to_hub_activity():
+    now = minutes(60)
+    user = {"servers": {"": {
+        "last_activity": timestamp(45), "started": timestamp(0)
+    }}}
+    policy = policy_for(user, {"default": {"signals": ["pluto"]}})
+    assert last_active(user["servers"][""], None, policy, now) == minutes(45)
+    assert cull_reason(user, None, policy, now) is None
+    assert cull_reason(user, {}, policy, now).startswith("inactive")
+
+
+def test_failed_task_lookup_falls_back_to_hub_activity():
+    class FailingECS:
+        def describe_tasks(self, **kwargs):
+            raise Exception("Unable to locate credentials")
+
+    users = [{"name": "user", "servers": {"": {
+        "url": "/user/user/",
+        "state": {"task_arn": "arn:task", "task_cluster_arn": "arn:cluster"}
+    }}}]
+    signals = ServerSignals(FailingECS(), "token", http_client=object())
+    assert asyncio.run(signals.fetch(users)) == {"user": None}
+
+
+def test_pages_are_read_concurrently():
+    users = [{
+        "name": f"user{index}",
+        "servers": {"": {"ready": True, "started": timestamp(0),
+                         "last_activity": timestamp(0)}}
+    } for index in range(450)]
+    hub = FakeHub(users)
+
+    async def fetch_signals(listed):
+        return {}
+
+    culler = ActivityCuller(hub, fetch_signals, POLICIES, page_size=200)
+    listed = asyncio.run(culler.users())
+    assert len(listed) == 450
+    assert len(hub.requests) == 3
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+import datetime
+import importlib
+import sys
+import types
+
+import pytest
+
+
+class FakeJupyterHandler:
+    """
+    JupyterHandler of a logged in user, that keeps the finished response
+    """
+
+    def __init__(self, kernel_manager):
+        self.kernel_manager = kernel_manager
+        self.current_user = "guest"
+        self.response = None
+
+    def finish(self, response):
+        self.response = response
+
+
+class FakeKernelManager:
+    def __init__(self, kernels):
+        self.kernels = kernels
+
+    def list_kernel_ids(self):
+        return list(self.kernels)
+
+    def get_kernel(self, kernel_id):
+        return self.kernels[kernel_id]
+
+
+@pytest.fixture
+def activity_signals(monkeypatch):
+    # jupyter_server is only installed in the single user image
+    handlers = types.ModuleType("jupyter_server.base.handlers")
+    handlers.JupyterHandler = FakeJupyterHandler
+    for name in ("jupyter_server", "jupyter_server.base"):
+        monkeypatch.setitem(sys.modules, name, types.ModuleType(name))
+    monkeypatch.setitem(sys.modules, "jupyter_server.base.handlers", handlers)
+    monkeypatch.delitem(sys.modules, "activity_signals", raising=False)
+    return importlib.import_module("activity_signals")
+
+
+def test_sample_cpu(activity_signals, monkeypatch):
+    now = [1700000000.0]
+    usage = [0]
+    monkeypatch.setattr(activity_signals.time, "time", lambda: now[0])
+    monkeypatch.setattr(
+        activity_signals, "read_cpu_usage", lambda metadata_uri: usage[0]
+    )
+
+    # The first sample has nothing to compare with
+    activity_signals.sample_cpu("http://metadata")
+    assert activity_signals.signals["cpu"] == []
+
+    # Half a vCPU for a minute
+    now[0] += 60
+    usage[0] += 30 * 10 ** 9
+    activity_signals.sample_cpu("http://metadata")
+    assert activity_signals.signals["cpu"] == [
+        (activity_signals.isoformat(now[0]), 50.0)
+    ]
+
+    # Only the last CPU_SAMPLES samples are kept
+    for _ in range(activity_signals.CPU_SAMPLES):
+        now[0] += 60
+        usage[0] += 6 * 10 ** 9
+        activity_signals.sample_cpu("http://metadata")
+    assert len(activity_signals.signals["cpu"]) == \
+        activity_signals.CPU_SAMPLES
+    assert {percent for _, percent in activity_signals.signals["cpu"]} == \
+        {10.0}
+
+
+def test_isoformat(activity_signals):
+    assert activity_signals.isoformat(None) is None
+    assert activity_signals.isoformat(0) == "1970-01-01T00:00:00Z"
+
+
+def test_record_pluto_activity(activity_signals, monkeypatch):
+    monkeypatch.setattr(activity_signals.time, "time", lambda: 1234.0)
+    handler = types.SimpleNamespace(
+        request=types.SimpleNamespace(path="/user/guest/lab")
+    )
+    activity_signals.record_pluto_activity(handler)
+    assert activity_signals.signals["pluto_last_activity"] is None
+    handler.request.path = "/user/guest/pluto/edit"
+    activity_signals.record_pluto_activity(handler)
+    assert activity_signals.signals["pluto_last_activity"] == 1234.0
+
+
+def test_handler_payload(activity_signals):
+    last_activity = datetime.datetime(
+        2024, 1, 1, 12, tzinfo=datetime.timezone.utc
+    )
+    kernels = {
+        "busy": types.SimpleNamespace(
+            execution_state="busy", last_activity=last_activity
+        ),
+        "idle": types.SimpleNamespace(
+            execution_state="idle",
+            last_activity=last_activity - datetime.timedelta(hours=1)
+        ),
+        "starting": types.SimpleNamespace(),
+    }
+    activity_signals.signals.update(
+        pluto_last_activity=0, cpu=[("1970-01-01T00:01:00Z", 12.5)]
+    )
+    handler = activity_signals.ActivitySignalsHandler(
+        FakeKernelManager(kernels)
+    )
+    handler.get()
+    assert handler.response == {
+        "pluto_last_activity": "1970-01-01T00:00:00Z",
+        "kernels_busy": 1,
+        "kernel_last_activity": "2024-01-01T12:00:00Z",
+        "cpu": [("1970-01-01T00:01:00Z", 12.5)],
+    }
+
+    handler = activity_signals.ActivitySignalsHandler(FakeKernelManager({}))
+    handler.get()
+    assert handler.response["kernels_busy"] == 0
+    assert handler.response["kernel_last_activity"] is None
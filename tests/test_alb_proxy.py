@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+import unicodedata
+
+import boto3
+import botocore.session
+import pytest
+from moto import mock_aws
+
+from alb_proxy import (
+    ALBRouteTable, decode_tag_value, encode_tag_value, path_patterns,
+    split_target
+)
+
+REGION = "eu-central-1"
+
+
+def make_listener():
+    ec2 = boto3.client("ec2", region_name=REGION)
+    elbv2 = boto3.client("elbv2", region_name=REGION)
+    vpc_id = ec2.create_vpc(CidrBlock="10.0.0.0/16")["Vpc"]["VpcId"]
+    subnets = [
+        ec2.create_subnet(
+            VpcId=vpc_id, CidrBlock=f"10.0.{index}.0/24",
+            AvailabilityZone=f"{REGION}{zone}"
+        )["Subnet"]["SubnetId"]
+        for index, zone in enumerate("ab")
+    ]
+    load_balancer_arn = elbv2.create_load_balancer(
+        Name="hub", Subnets=subnets
+    )["LoadBalancers"][0]["LoadBalancerArn"]
+    hub_target_group_arn = elbv2.create_target_group(
+        Name="hub", Protocol="HTTP", Port=8000, VpcId=vpc_id,
+        TargetType="ip"
+    )["TargetGroups"][0]["TargetGroupArn"]
+    listener_arn = elbv2.create_listener(
+        LoadBalancerArn=load_balancer_arn, Protocol="HTTP", Port=80,
+        DefaultActions=[{
+            "Type": "forward", "TargetGroupArn": hub_target_group_arn
+        }]
+    )["Listeners"][0]["ListenerArn"]
+    return elbv2, listener_arn, vpc_id
+
+
+def make_table(max_free_target_groups=50):
+    elbv2, listener_arn, vpc_id = make_listener()
+    return ALBRouteTable(
+        elbv2, listener_arn, vpc_id,
+        max_free_target_groups=max_free_target_groups
+    ).load()
+
+
+def user_rules(table):
+    return [
+        rule for rule in table._describe_rules() if not rule["IsDefault"]
+    ]
+
+
+def jupyter_target_groups(table):
+    return [
+        target_group for target_group in
+        table.elbv2_client.describe_target_groups()["TargetGroups"]
+        if target_group["TargetGroupName"].startswith("jupyter-")
+    ]
+
+
+class TagRecorder:
+    """
+    elbv2 client that records the tags that are added
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.tags = []
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def add_tags(self, **kwargs):
+        self.tags.extend(kwargs["Tags"])
+        return self.client.add_tags(**kwargs)
+
+
+def valid_tag_value(value):
+    # ^([\p{L}\p{Z}\p{N}_.:/=+\-@]*)$, which moto does not check
+    return len(value) <= 256 and all(
+        unicodedata.category(character)[0] in "LZN" or
+        character in "_.:/=+-@"
+        for character in value
+    )
+
+
+def test_split_target():
+    assert split_target("http://10.0.1.23:8888") == ("10.0.1.23", 8888)
+
+
+def test_path_patterns():
+    assert path_patterns("/user/jupyter%40tudelft.nl/") == [
+        "/user/jupyter%40tudelft.nl", "/user/jupyter%40tudelft.nl/*"
+    ]
+
+
+@mock_aws
+def test_add_route_creates_rule_and_target_group():
+    table = make_table()
+    table.add_route("/user/jupyter/", "http://10.0.0.10:8888",
+                    {"user": "jupyter", "server_name": ""})
+
+    rules = user_rules(table)
+    assert len(rules) == 1
+    path_pattern_config = rules[0]["Conditions"][0]["PathPatternConfig"]
+    assert path_pattern_config["Values"] == [
+        "/user/jupyter", "/user/jupyter/*"
+    ]
+    target_group_arn = rules[0]["Actions"][0]["TargetGroupArn"]
+    targets = table.elbv2_client.describe_target_health(
+        TargetGroupArn=target_group_arn
+    )["TargetHealthDescriptions"]
+    assert [target["Target"]["Id"] for target in targets] == ["10.0.0.10"]
+    assert table.get_routes()["/user/jupyter/"] == {
+        "routespec": "/user/jupyter/",
+        "target": "http://10.0.0.10:8888",
+        "data": {"user": "jupyter", "server_name": ""}
+    }
+
+
+@mock_aws
+def test_hub_route_is_not_a_rule():
+    table = make_table()
+    table.add_route("/", "http://10.0.0.2:8000", {"hub": True})
+    assert user_rules(table) == []
+    assert table.get_routes()["/"]["target"] == "http://10.0.0.2:8000"
+
+
+@mock_aws
+def test_unique_priorities_for_many_routes():
+    table = make_table()
+    for index in range(150):
+        table.add_route(f"/user/user{index}/",
+                        f"http://10.0.1.{index}:8888", {})
+
+    priorities = [int(rule["Priority"]) for rule in user_rules(table)]
+    assert len(priorities) == 150
+    assert len(set(priorities)) == 150
+
+
+@mock_aws
+def test_delete_route_reuses_priority_and_target_group():
+    table = make_table()
+    for index in range(3):
+        table.add_route(f"/user/user{index}/",
+                        f"http://10.0.1.{index}:8888", {})
+    freed = table.routes["/user/user1/"]
+    table.delete_route("/user/user1/")
+
+    assert len(user_rules(table)) == 2
+    assert table.free_target_groups == [freed.target_group_arn]
+
+    table.add_route("/user/other/", "http://10.0.2.1:8888", {})
+    route = table.routes["/user/other/"]
+    assert route.priority == freed.priority
+    assert route.target_group_arn == freed.target_group_arn
+    assert len(jupyter_target_groups(table)) == 3
+    # The target of the deleted route is not served to the new user
+    targets = table.elbv2_client.describe_target_health(
+        TargetGroupArn=route.target_group_arn
+    )["TargetHealthDescriptions"]
+    assert [target["Target"]["Id"] for target in targets] == ["10.0.2.1"]
+
+
+@mock_aws
+def test_free_target_groups_are_limited():
+    table = make_table(max_free_target_groups=1)
+    for index in range(3):
+        table.add_route(f"/user/user{index}/",
+                        f"http://10.0.1.{index}:8888", {})
+    for index in range(3):
+        table.delete_route(f"/user/user{index}/")
+
+    assert len(table.free_target_groups) == 1
+    assert len(jupyter_target_groups(table)) == 1
+
+
+@mock_aws
+def test_changed_target_is_registered():
+    table = make_table()
+    table.add_route("/user/jupyter/", "http://10.0.0.10:8888", {})
+    table.add_route("/user/jupyter/", "http://10.0.0.11:8888", {})
+
+    assert len(user_rules(table)) == 1
+    targets = table.elbv2_client.describe_target_health(
+        TargetGroupArn=table.routes["/user/jupyter/"].target_group_arn
+    )["TargetHealthDescriptions"]
+    assert [target["Target"]["Id"] for target in targets] == ["10.0.0.11"]
+
+
+@mock_aws
+def test_load_restores_routes():
+    table = make_table()
+    table.add_route("/user/jupyter/", "http://10.0.0.10:8888",
+                    {"user": "jupyter"})
+    table.add_route("/user/other/", "http://10.0.0.11:8888",
+                    {"user": "other"})
+    table.delete_route("/user/other/")
+
+    restored = ALBRouteTable(
+        table.elbv2_client, table.listener_arn, table.vpc_id
+    ).load()
+    assert restored.get_routes() == {
+        "/user/jupyter/": {
+            "routespec": "/user/jupyter/",
+            "target": "http://10.0.0.10:8888",
+            "data": {"user": "jupyter"}
+        }
+    }
+    assert restored.used_priorities == {
+        table.routes["/user/jupyter/"].priority
+    }
+    assert len(restored.free_target_groups) == 1
+
+    # New target groups do not reuse the names of the existing ones
+    restored.add_route("/user/new1/", "http://10.0.0.12:8888", {})
+    restored.add_route("/user/new2/", "http://10.0.0.13:8888", {})
+    assert len(jupyter_target_groups(restored)) == 3
+
+
+def test_tag_value_encoding():
+    shape = botocore.session.get_session().get_service_model(
+        "elbv2"
+    ).shape_for("TagValue")
+    assert shape.metadata["pattern"] == \
+        "^([\\p{L}\\p{Z}\\p{N}_.:/=+\\-@]*)$"
+    assert shape.metadata["max"] == 256
+
+    for value in ("http://10.0.0.10:8888", "/user/jupyter/",
+                  "/user/jupyter%40tudelft.nl/", '{"user":"jupyter"}',
+                  "b64:looks-encoded", "gebruiker-ë"):
+        encoded = encode_tag_value(value)
+        assert valid_tag_value(encoded)
+        assert decode_tag_value(encoded) == value
+    assert encode_tag_value("/user/jupyter/") == "/user/jupyter/"
+    with pytest.raises(ValueError):
+        encode_tag_value("{" + "x" * 200 + "}")
+
+
+@mock_aws
+def test_tag_values_are_valid():
+    table = make_table()
+    table.elbv2_client = TagRecorder(table.elbv2_client)
+    data = {"user": "jupyter@tudelft.nl", "server_name": ""}
+    table.add_route("/user/jupyter%40tudelft.nl/", "http://10.0.0.10:8888",
+                    data)
+    table.add_route("/user/jupyter%40tudelft.nl/", "http://10.0.0.11:8888",
+                    dict(data, server_name="other"))
+    assert len(table.elbv2_client.tags) == 6
+    for tag in table.elbv2_client.tags:
+        assert valid_tag_value(tag["Value"]), tag
+
+    restored = ALBRouteTable(
+        table.elbv2_client.client, table.listener_arn, table.vpc_id
+    ).load()
+    assert restored.get_routes() == {
+        "/user/jupyter%40tudelft.nl/": {
+            "routespec": "/user/jupyter%40tudelft.nl/",
+            "target": "http://10.0.0.11:8888",
+            "data": dict(data, server_name="other")
+        }
+    }
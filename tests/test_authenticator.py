@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+import asyncio
+import importlib
+import sys
+import types
+
+import pytest
+from jupyterhub.auth import LocalAuthenticator
+
+
+class FakeOAuthenticator(LocalAuthenticator):
+    """
+    LocalGenericOAuthenticator that returns auth_model instead of talking
+    to an OAuth provider
+    """
+
+    auth_model = None
+
+    async def authenticate(self, handler, data=None):
+        if isinstance(self.auth_model, Exception):
+            raise self.auth_model
+        return self.auth_model
+
+
+class FakeDirectory:
+    def is_allowed(self, username):
+        return username != "stranger"
+
+    def is_admin(self, username):
+        return username == "admin"
+
+
+class FakeSpeculativeSpawns:
+    def __init__(self):
+        self.cancelled = []
+
+    def cancel(self, username, reason):
+        self.cancelled.append((username, reason))
+
+
+class FakeHandler:
+    def __init__(self, returning_user=None):
+        self.returning_user = returning_user
+        self.cookies = {}
+
+    def get_secure_cookie(self, name, max_age_days=None):
+        return self.returning_user.encode() if self.returning_user \
+            else None
+
+    def _set_cookie(self, name, value, expires_days=None):
+        self.cookies[name] = value
+
+
+@pytest.fixture
+def authenticator(monkeypatch):
+    # oauthenticator is only installed in the hub image
+    generic = types.ModuleType("oauthenticator.generic")
+    generic.LocalGenericOAuthenticator = FakeOAuthenticator
+    oauth2 = types.ModuleType("oauthenticator.oauth2")
+    oauth2.OAuthLoginHandler = object
+    monkeypatch.setitem(
+        sys.modules, "oauthenticator", types.ModuleType("oauthenticator")
+    )
+    monkeypatch.setitem(sys.modules, "oauthenticator.generic", generic)
+    monkeypatch.setitem(sys.modules, "oauthenticator.oauth2", oauth2)
+    monkeypatch.delitem(sys.modules, "authenticator", raising=False)
+    return importlib.import_module("authenticator")
+
+
+def test_check_allowed(authenticator):
+    oauthenticator = authenticator.DirectoryOAuthenticator(
+        user_directory=FakeDirectory()
+    )
+    assert asyncio.run(oauthenticator.check_allowed("guest"))
+    assert not asyncio.run(oauthenticator.check_allowed("stranger"))
+
+
+def test_admin_from_user_directory(authenticator):
+    oauthenticator = authenticator.DirectoryOAuthenticator(
+        user_directory=FakeDirectory()
+    )
+    oauthenticator.auth_model = {"name": "admin"}
+    auth_model = asyncio.run(oauthenticator.authenticate(FakeHandler()))
+    assert auth_model == {"name": "admin", "admin": True}
+    oauthenticator.auth_model = {"name": "guest", "admin": True}
+    auth_model = asyncio.run(oauthenticator.authenticate(FakeHandler()))
+    assert auth_model["admin"] is False
+
+
+def test_speculative_spawn_of_other_user_cancelled(authenticator):
+    speculative_spawns = FakeSpeculativeSpawns()
+    oauthenticator = authenticator.DirectoryOAuthenticator(
+        user_directory=FakeDirectory(),
+        speculative_spawns=speculative_spawns
+    )
+    oauthenticator.auth_model = {"name": "guest"}
+    handler = FakeHandler(returning_user="guest")
+    asyncio.run(oauthenticator.authenticate(handler))
+    assert speculative_spawns.cancelled == []
+    assert handler.cookies == {
+        authenticator.RETURNING_USER_COOKIE: "guest"
+    }
+
+    handler = FakeHandler(returning_user="someone-else")
+    asyncio.run(oauthenticator.authenticate(handler))
+    assert speculative_spawns.cancelled == [
+        ("someone-else", "Another user logged in")
+    ]
+
+    oauthenticator.auth_model = RuntimeError("OAuth failed")
+    with pytest.raises(RuntimeError):
+        asyncio.run(oauthenticator.authenticate(FakeHandler("guest")))
+    assert speculative_spawns.cancelled[-1] == (
+        "guest", "Authentication failed"
+    )
+
+
+def test_add_system_users_quotes_usernames(authenticator, tmp_path,
+                                           monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    usernames = ["guest", "o'brien", "x; touch injected", "$(touch sub)"]
+    # One failing user does not stop the others
+    authenticator.add_system_users(
+        usernames + ["missing/user"], ["touch", "created-USERNAME"]
+    )
+    created = {path.name for path in tmp_path.iterdir()}
+    assert created == {f"created-{username}" for username in usernames} | \
+        set(usernames)
+    assert "injected" not in created
+    assert "sub" not in created
+
+
+def test_system_users_added_in_batches(authenticator, monkeypatch):
+    batches = []
+    monkeypatch.setattr(
+        authenticator, "add_system_users",
+        lambda usernames, add_user_cmd: batches.append(usernames)
+    )
+    oauthenticator = authenticator.DirectoryOAuthenticator(
+        user_directory=FakeDirectory(), create_system_users=True
+    )
+    monkeypatch.setattr(
+        oauthenticator, "system_user_exists",
+        lambda user: user.name == "existing"
+    )
+
+    async def add_users():
+        for username in ("guest2", "existing", "guest1"):
+            await oauthenticator.add_user(types.SimpleNamespace(
+                name=username
+            ))
+        await asyncio.sleep(1.2)
+
+    asyncio.run(add_users())
+    assert batches == [["guest1", "guest2"]]
+
+    oauthenticator.system_users = "skip"
+    asyncio.run(add_users())
+    assert batches == [["guest1", "guest2"]]
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+import json
+
+import boto3
+from botocore.exceptions import ClientError
+from moto import mock_aws
+
+from HubStacks.cognito_user_sync.cognito_user_sync import (
+    RateLimiter, UserPoolSync, external_users, main, on_event
+)
+
+REGION = "eu-central-1"
+
+
+def make_user_pool():
+    client = boto3.client("cognito-idp", region_name=REGION)
+    user_pool_id = client.create_user_pool(
+        PoolName="some-basename"
+    )["UserPool"]["Id"]
+    return client, user_pool_id
+
+
+def usernames(client, user_pool_id):
+    return {
+        user["Username"] for page in
+        client.get_paginator("list_users").paginate(UserPoolId=user_pool_id)
+        for user in page["Users"]
+    }
+
+
+class FlakyClient:
+    """
+    Client that is throttled once per call, and fails for one user
+    """
+
+    def __init__(self, client, failing_user):
+        self.client = client
+        self.failing_user = failing_user
+        self.throttled = set()
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def admin_create_user(self, **kwargs):
+        username = kwargs["Username"]
+        if username not in self.throttled:
+            self.throttled.add(username)
+            raise ClientError(
+                {"Error": {"Code": "TooManyRequestsException"}},
+                "AdminCreateUser"
+            )
+        if username == self.failing_user:
+            raise ClientError(
+                {"Error": {"Code": "InvalidParameterException"}},
+                "AdminCreateUser"
+            )
+        return self.client.admin_create_user(**kwargs)
+
+
+def test_external_users():
+    assert external_users(
+        {"someone@tudelft.nl", "guest@example.com"}
+    ) == {"guest@example.com"}
+
+
+def test_rate_limiter():
+    now = [0.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    limiter = RateLimiter(10, clock=lambda: now[0], sleep=sleep)
+    for _ in range(5):
+        limiter.wait()
+    assert now[0] == 0.4
+    assert len(sleeps) == 4
+
+
+@mock_aws
+def test_reconcile():
+    client, user_pool_id = make_user_pool()
+    sync = UserPoolSync(client, user_pool_id, "A-secret-1", rate=1000)
+
+    users = {f"guest{index}@example.com" for index in range(75)}
+    result = sync.reconcile(users)
+    assert result["created"] == 75
+    assert result["failed"] == 0
+    # More users than fit on one page of ListUsers
+    assert usernames(client, user_pool_id) == users
+
+    # Removed users are deleted, new users created, the others left alone
+    client.admin_create_user(UserPoolId=user_pool_id, Username="by-hand")
+    changed = (users - {"guest0@example.com"}) | {"newcomer@example.com"}
+    result = sync.reconcile(changed, previous_users=users)
+    assert result == {
+        "created": 1, "deleted": 1, "unchanged": 74, "failed": 0,
+        "failures": {}
+    }
+    assert usernames(client, user_pool_id) == changed | {"by-hand"}
+
+    result = sync.delete(changed)
+    assert result["deleted"] == 75
+    assert usernames(client, user_pool_id) == {"by-hand"}
+
+
+@mock_aws
+def test_throttling_and_failures():
+    client, user_pool_id = make_user_pool()
+    sleeps = []
+    sync = UserPoolSync(
+        FlakyClient(client, "broken"), user_pool_id, "A-secret-1",
+        rate=1000, sleep=sleeps.append
+    )
+    result = sync.reconcile({"guest", "broken"})
+    assert result["created"] == 1
+    assert result["failed"] == 1
+    assert result["failures"] == {"broken": "InvalidParameterException"}
+    assert usernames(client, user_pool_id) == {"guest"}
+    assert sleeps
+
+
+@mock_aws
+def test_custom_resource_events():
+    client, user_pool_id = make_user_pool()
+    properties = {
+        "UserPoolId": user_pool_id,
+        "Users": ["guest1", "guest2"],
+        "TemporaryPassword": "A-secret-1"
+    }
+    response = on_event({
+        "RequestType": "Create", "ResourceProperties": properties
+    }, None, client=client)
+    assert response["PhysicalResourceId"] == f"{user_pool_id}-users"
+    assert response["Data"]["Created"] == 2
+    assert json.loads(response["Data"]["Failures"]) == {}
+
+    response = on_event({
+        "RequestType": "Update",
+        "PhysicalResourceId": response["PhysicalResourceId"],
+        "ResourceProperties": dict(properties, Users=["guest2"]),
+        "OldResourceProperties": properties
+    }, None, client=client)
+    assert response["Data"]["Deleted"] == 1
+    assert usernames(client, user_pool_id) == {"guest2"}
+
+    response = on_event({
+        "RequestType": "Delete",
+        "PhysicalResourceId": response["PhysicalResourceId"],
+        "ResourceProperties": dict(properties, Users=["guest2"])
+    }, None, client=client)
+    assert response["Data"]["Deleted"] == 1
+    assert usernames(client, user_pool_id) == set()
+
+
+@mock_aws
+def test_moved_users_are_kept():
+    client, user_pool_id = make_user_pool()
+    users = ["guest1", "guest2", "guest3"]
+    old_properties = {
+        "UserPoolId": user_pool_id,
+        "Users": users,
+        "TemporaryPassword": "A-secret-1",
+        "UserShards": "0"
+    }
+    on_event({
+        "RequestType": "Create", "ResourceProperties": old_properties
+    }, None, client=client, environ={"USER_SHARDS": "0"})
+
+    # user_shards set to 2: guest3 moves to a new shard, which creates it,
+    # and the resources of the old shard layout do not delete users
+    environ = {"USER_SHARDS": "2"}
+    shard = dict(old_properties, Users=["guest3"], UserShards="2")
+    on_event({
+        "RequestType": "Create", "ResourceProperties": shard
+    }, None, client=client, environ=environ)
+    response = on_event({
+        "RequestType": "Update",
+        "PhysicalResourceId": f"{user_pool_id}-users",
+        "ResourceProperties": dict(shard, Users=["guest1", "guest2"]),
+        "OldResourceProperties": old_properties
+    }, None, client=client, environ=environ)
+    assert response["Data"]["Deleted"] == 0
+    response = on_event({
+        "RequestType": "Delete",
+        "PhysicalResourceId": f"{user_pool_id}-users",
+        "ResourceProperties": old_properties
+    }, None, client=client, environ=environ)
+    assert response["Data"]["Deleted"] == 0
+    assert response["Data"]["Unchanged"] == 3
+    assert usernames(client, user_pool_id) == set(users)
+
+    # Within the current layout, removed users are deleted
+    response = on_event({
+        "RequestType": "Delete",
+        "PhysicalResourceId": f"{user_pool_id}-users",
+        "ResourceProperties": shard
+    }, None, client=client, environ=environ)
+    assert response["Data"]["Deleted"] == 1
+    assert usernames(client, user_pool_id) == {"guest1", "guest2"}
+
+
+@mock_aws
+def test_cleanup(monkeypatch, tmp_path):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", REGION)
+    client, user_pool_id = make_user_pool()
+    admins = tmp_path / "admins"
+    admins.write_text("someone@tudelft.nl\nguest0\n")
+    allowed_users = tmp_path / "allowed_users"
+    allowed_users.write_text(
+        "".join(f"guest{index}\n" for index in range(70))
+    )
+
+    assert main([
+        "sync", "--temp-password", "A-secret-1",
+        str(admins), str(allowed_users)
+    ]) == 0
+    assert len(usernames(client, user_pool_id)) == 70
+
+    assert main(["cleanup"]) == 0
+    assert usernames(client, user_pool_id) == set()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+import copy
+
+import yaml
+
+from aws_cdk import App, Environment
+from aws_cdk.assertions import Template, Match
+
+from HubStacks.cognito_users import (
+    CognitoUserShard, user_shard, shard_users
+)
+from HubStacks.frame_stack import FrameStack
+from HubStacks.hub_stack import HubStack
+
+USERS = [f"external{index}@example.com" for index in range(200)]
+
+
+def make_hub_stack(tmp_path, user_shards, users):
+    admins_file = tmp_path / "admins"
+    admins_file.write_text("someone@tudelft.nl\n")
+    allowed_users_file = tmp_path / "allowed_users"
+    allowed_users_file.write_text("".join(f"{user}\n" for user in users))
+
+    app = App()
+    config_yaml = copy.deepcopy(yaml.load(
+        open('example_config.yaml'), Loader=yaml.FullLoader))
+    config_yaml['user_shards'] = user_shards
+    environment = Environment(account="123456789012", region="eu-central-1")
+
+    frame = FrameStack(app, "FrameStack", config_yaml, env=environment)
+    return HubStack(
+        app, "HubStack",
+        config_yaml,
+        vpc=frame.vpc,
+        load_balancer=frame.load_balancer,
+        file_system=frame.file_system,
+        ecs_service_security_group=frame.ecs_service_security_group,
+        admins_file=str(admins_file),
+        allowed_users_file=str(allowed_users_file),
+        env=environment
+    )
+
+
+def test_all_users_in_one_shard():
+    sharded = shard_users(set(USERS), 8)
+    assert len(sharded) == 8
+    assert sorted(user for users in sharded for user in users) == \
+        sorted(USERS)
+    assert all(sharded)
+
+
+def test_shards_stable_when_users_change():
+    before = {user: user_shard(user, 8) for user in USERS}
+    # Added and removed users do not move the other users
+    changed = set(USERS[50:]) | {"newcomer@example.com"}
+    for shard, users in enumerate(shard_users(changed, 8)):
+        for user in users:
+            if user in before:
+                assert before[user] == shard
+    # The shard only depends on the username, not on the Python process
+    assert user_shard("external0@example.com", 8) == \
+        user_shard("external0@example.com", 8)
+    assert user_shard("external0@example.com", 1) == 0
+
+
+def test_user_shard_nested_stacks(tmp_path):
+    users = USERS[:20]
+    hub_stack = make_hub_stack(tmp_path, 4, users)
+    template = Template.from_stack(hub_stack)
+    # CognitoTudelftStack and the shards
+    shards = [users for users in shard_users(set(users), 4) if users]
+    template.resource_count_is(
+        type="AWS::CloudFormation::Stack", count=1 + len(shards)
+    )
+    # The users are in the shards, not in the HubStack itself
+    template.resource_count_is(type="Custom::CognitoUsers", count=0)
+
+    shard_stacks = [
+        child for child in hub_stack.node.children
+        if isinstance(child, CognitoUserShard)
+    ]
+    assert len(shard_stacks) == len(shards)
+    for shard_stack in shard_stacks:
+        shard = int(shard_stack.node.id[len("some-basenameUserShard"):])
+        Template.from_stack(shard_stack).has_resource_properties(
+            "Custom::CognitoUsers", {
+                "ServiceToken": {"Ref": Match.any_value()},
+                "Users": shard_users(set(users), 4)[shard],
+                "UserShards": "4"
+            }
+        )
+    template.has_resource_properties(
+        "AWS::Lambda::Function", {
+            "Handler": "cognito_user_sync.on_event",
+            "Environment": {"Variables": {"USER_SHARDS": "4"}}
+        }
+    )
@@ -1,4 +1,7 @@
 #!/usr/bin/env python3
+import json
+
+import pytest
 import yaml
 
 from aws_cdk import App, Environment
@@ -34,55 +37,54 @@ template = Template.from_stack(hub_stack)
 
 
 def test_check_resource_counts():
-    template.resource_count_is(type="Custom::AWS", count=3)
-    template.resource_count_is(type="AWS::IAM::Policy", count=6)
-    template.resource_count_is(type="AWS::IAM::Role", count=4)
+    template.resource_count_is(type="Custom::AWS", count=1)
+    template.resource_count_is(type="Custom::CognitoUsers", count=1)
+    template.resource_count_is(type="AWS::IAM::Policy", count=8)
+    template.resource_count_is(type="AWS::IAM::Role", count=7)
     template.resource_count_is(type="AWS::ECS::Cluster", count=1)
     template.resource_count_is(type="AWS::ECS::Service", count=1)
-    template.resource_count_is(type="AWS::ECS::TaskDefinition", count=4)
-    template.resource_count_is(type="AWS::Logs::LogGroup", count=4)
-    template.resource_count_is(type="AWS::EFS::AccessPoint", count=4)
+    template.resource_count_is(type="AWS::ECS::TaskDefinition", count=1)
+    template.resource_count_is(type="AWS::Logs::LogGroup", count=2)
+    template.resource_count_is(type="AWS::EFS::AccessPoint", count=1)
+    template.resource_count_is(type="AWS::SSM::Parameter", count=2)
 
 
 def test_cognito_external_user():
     template.has_resource_properties(
-        "Custom::AWS",
-        {"Create": Match.string_like_regexp(".*adminCreateUser.*jupyter")}
+        "Custom::CognitoUsers", {
+            "UserPoolId": config_yaml["cognito_user_pool_id"],
+            "Users": ["external_user", "jupyter"],
+            "TemporaryPassword": config_yaml["temp_password"],
+            "UserShards": "0"
+        }
     )
-
-
-def test_single_user_task_definition():
     template.has_resource_properties(
-        "AWS::ECS::TaskDefinition", {
-            "ContainerDefinitions": Match.any_value(),
-            "Cpu": Match.any_value(),
-            "ExecutionRoleArn": Match.any_value(),
-            "Memory": Match.any_value(),
-            "NetworkMode": Match.string_like_regexp("awsvpc"),
-            "RequiresCompatibilities": Match.any_value(),
-            "TaskRoleArn": Match.any_value(),
-            "Volumes": Match.any_value(),
+        "AWS::Lambda::Function", {
+            "Handler": "cognito_user_sync.on_event",
+            "Timeout": 900,
+            "Environment": {"Variables": {"USER_SHARDS": "0"}}
         }
     )
-
-
-def test_single_user_container():
+    # The users of the AwsCustomResource per user of older stacks are kept
     template.has_resource_properties(
-        "AWS::ECS::TaskDefinition", {
-            "ContainerDefinitions": [{
-                "Image": Match.any_value(),
-                "Privileged": Match.exact(False),
-                "PortMappings": [{
-                    "ContainerPort": Match.exact(8888)
-                }],
-                "LogConfiguration": {
-                    "Options": {
-                        "awslogs-stream-prefix":
-                            Match.string_like_regexp(".*SingleUser")
-                    }
-                },
-                "MountPoints": Match.any_value()
-            }]
+        "AWS::IAM::Policy", {
+            "PolicyDocument": {"Statement": Match.array_with([{
+                "Action": "cognito-idp:AdminDeleteUser",
+                "Effect": "Deny",
+                "Resource": "*"
+            }])}
+        }
+    )
+    template.has_resource_properties(
+        "AWS::IAM::Policy", {
+            "PolicyDocument": {"Statement": [{
+                "Action": [
+                    "cognito-idp:ListUsers",
+                    "cognito-idp:AdminCreateUser",
+                    "cognito-idp:AdminDeleteUser"
+                ],
+                "Resource": Match.any_value()
+            }]}
         }
     )
 
@@ -93,7 +95,7 @@ def test_access_point():
             "FileSystemId": Match.any_value(),
             "PosixUser": Match.any_value(),
             "RootDirectory": {
-                "Path": Match.string_like_regexp("/jupyter"),
+                "Path": Match.string_like_regexp("/reference"),
                 "CreationInfo": {
                     "Permissions": Match.string_like_regexp("755")
                 }
@@ -102,63 +104,25 @@ def test_access_point():
     )
 
 
-def test_volume():
+def test_single_user_log_group():
     template.has_resource_properties(
-        "AWS::ECS::TaskDefinition", {
-            "Volumes": [{
-                "Name": Match.string_like_regexp(".*jupyter"),
-                "EFSVolumeConfiguration": {
-                    "AuthorizationConfig":
-                        {"IAM": Match.string_like_regexp("ENABLED")},
-                    "TransitEncryption": Match.string_like_regexp("ENABLED"),
-                    "FilesystemId": Match.any_value()
-                }
-            }, {
-                "Name": Match.string_like_regexp(".*reference"),
-                "EFSVolumeConfiguration": {
-                    "AuthorizationConfig":
-                        {"IAM": Match.string_like_regexp("ENABLED")},
-                    "TransitEncryption": Match.string_like_regexp("ENABLED"),
-                    "FilesystemId": Match.any_value()
-                }
-            }]
+        "AWS::Logs::LogGroup", {
+            "RetentionInDays": Match.exact(7)
         }
     )
 
 
-def test_mount_point():
+def test_user_directory():
     template.has_resource_properties(
-        "AWS::ECS::TaskDefinition", {
-            "ContainerDefinitions": [{
-                "MountPoints": [{
-                    "ContainerPath":
-                        Match.string_like_regexp("/home/jovyan/work"),
-                    "ReadOnly": Match.exact(False),
-                    "SourceVolume": Match.string_like_regexp(".*jupyter")
-                }, {
-                    "ContainerPath":
-                        Match.string_like_regexp("/home/jovyan/reference"),
-                    "ReadOnly": Match.exact(False),
-                    "SourceVolume": Match.string_like_regexp("efs-reference")
-                }]
-            }]
+        "AWS::SSM::Parameter", {
+            "Name": "/some-basename/user-directory",
+            "Value": Match.string_like_regexp('"shards": 1')
         }
     )
     template.has_resource_properties(
-        "AWS::ECS::TaskDefinition", {
-            "ContainerDefinitions": [{
-                "MountPoints": [{
-                    "ContainerPath":
-                        Match.string_like_regexp("/home/jovyan/work"),
-                    "ReadOnly": Match.exact(False),
-                    "SourceVolume": Match.string_like_regexp("efs-.*-volume")
-                }, {
-                    "ContainerPath":
-                        Match.string_like_regexp("/home/jovyan/reference"),
-                    "ReadOnly": Match.exact(True),
-                    "SourceVolume": Match.string_like_regexp("efs-reference")
-                }]
-            }]
+        "AWS::SSM::Parameter", {
+            "Name": "/some-basename/user-directory/0",
+            "Value": Match.string_like_regexp(".*external_user.*")
         }
     )
 
@@ -195,9 +159,11 @@ def test_hub_container():
                 },
                 "MountPoints": Match.any_value(),
                 "Environment": [{
-                    "Name": Match.string_like_regexp("ADMIN_USERS")
+                    "Name":
+                        Match.string_like_regexp("USER_DIRECTORY_BACKEND")
                 }, {
-                    "Name": Match.string_like_regexp("ALLOWED_USERS")
+                    "Name":
+                        Match.string_like_regexp("USER_DIRECTORY_LOCATION")
                 }, {
                     "Name": Match.string_like_regexp("OAUTH_CALLBACK_URL")
                 }, {
@@ -229,7 +195,7 @@ def test_hub_container():
                     "Name": Match.string_like_regexp("FARGATE_SPAWNER_CLUSTER")
                 }, {
                     "Name": Match.
-                        string_like_regexp("FARGATE_SPAWNER_TASK_DEFINITIONS")
+                        string_like_regexp("FARGATE_SPAWNER_EXECUTION_ROLE")
                 }, {
                     "Name": Match.
                         string_like_regexp("FARGATE_SPAWNER_TASK_ROLE_ARN")
@@ -241,8 +207,26 @@ def test_hub_container():
                 }, {
                     "Name": Match.
                         string_like_regexp("FARGATE_SPAWNER_CONTAINER_NAME")
+                }, {
+                    "Name": Match.
+                        string_like_regexp("FARGATE_SPAWNER_IMAGE_REPOSITORY")
+                }, {
+                    "Name":
+                        Match.string_like_regexp("FARGATE_SPAWNER_IMAGE_TAG")
+                }, {
+                    "Name":
+                        Match.string_like_regexp("FARGATE_SPAWNER_LOG_GROUP")
+                }, {
+                    "Name": Match.
+                        string_like_regexp("FARGATE_SPAWNER_LOG_STREAM_PREFIX")
+                }, {
+                    "Name": Match.
+                        string_like_regexp("FARGATE_SPAWNER_FAMILY_PREFIX")
                 }, {
                     "Name": Match.string_like_regexp("FARGATE_EFS_ID")
+                }, {
+                    "Name": Match.
+                        string_like_regexp("FARGATE_EFS_REFERENCE_ACCESS_PO")
                 }]
             }]
         }
@@ -265,6 +249,32 @@ def test_hub_service():
     )
 
 
+def test_single_hub_container():
+    multi_hub_app = App()
+    multi_hub_config = dict(config_yaml, num_containers=2)
+    multi_hub_frame = FrameStack(
+        multi_hub_app, "FrameStack",
+        multi_hub_config,
+        env=Environment(
+            account="123456789012", region="eu-central-1"
+        )
+    )
+    with pytest.raises(ValueError, match="one active hub process"):
+        HubStack(
+            multi_hub_app, "HubStack",
+            multi_hub_config,
+            vpc=multi_hub_frame.vpc,
+            load_balancer=multi_hub_frame.load_balancer,
+            file_system=multi_hub_frame.file_system,
+            ecs_service_security_group=(
+                multi_hub_frame.ecs_service_security_group
+            ),
+            env=Environment(
+                account="123456789012", region="eu-central-1"
+            )
+        )
+
+
 def test_role():
     # TaskExecutionRole
     template.has_resource_properties(
@@ -307,8 +317,6 @@ def test_policy():
                     "logs:CreateLogStream",
                     "logs:PutLogEvents"
                 ]},
-                {"Action": Match.any_value()},
-                {"Action": Match.any_value()},
                 {"Action": Match.any_value()}
             ]}
         }
@@ -331,7 +339,37 @@ def test_policy():
                     "iam:PassRole",
                     "cloudwatch:PutMetricData",
                     "cloudwatch:ListMetrics",
-                    "ec2:DescribeRegions"
+                    "ec2:DescribeRegions",
+                    "ec2:DescribeSubnets"
+                ]}, {
+                    "Action": Match.array_with(["ssm:GetParameter"])
+                }, {
+                    "Action": "ssm:DescribeParameters"
+                }, {
+                    "Action": [
+                        "ecs:RegisterTaskDefinition",
+                        "ecs:DescribeTaskDefinition",
+                        "ecr:DescribeImages"
+                    ]
+                }, {
+                    "Action": [
+                        "elasticfilesystem:CreateAccessPoint",
+                        "elasticfilesystem:DescribeAccessPoints"
+                    ]
+                }, {
+                    "Action": "elasticfilesystem:TagResource"
+                }
+            ]}
+        }
+    )
+
+    # SingleUserTaskRole policy
+    template.has_resource_properties(
+        "AWS::IAM::Policy", {
+            "PolicyDocument": {"Statement": [{
+                "Action": [
+                    "elasticfilesystem:ClientWrite",
+                    "elasticfilesystem:ClientMount"
                 ]}, {
                     "Action": "s3:ListBucket",
                     "Resource": "arn:aws:s3:::bucketname"
@@ -343,3 +381,256 @@ def test_policy():
             ]}
         }
     )
+
+
+def test_single_user_task_role():
+    # The single user tasks do not get the hub's task role
+    roles = [
+        logical_id for logical_id in template.find_resources("AWS::IAM::Role")
+        if "SingleUserTaskRole" in logical_id
+    ]
+    assert len(roles) == 1
+    template.has_resource_properties(
+        "AWS::ECS::TaskDefinition", {
+            "ContainerDefinitions": [Match.object_like({
+                "Environment": Match.array_with([{
+                    "Name": "FARGATE_SPAWNER_TASK_ROLE_ARN",
+                    "Value": {"Fn::GetAtt": [roles[0], "Arn"]}
+                }])
+            })]
+        }
+    )
+
+
+def test_user_files(tmp_path):
+    admins_file = tmp_path / "admins"
+    admins_file.write_text("someone@tudelft.nl\n")
+    allowed_users_file = tmp_path / "allowed_users"
+    allowed_users_file.write_text(
+        "external1@example.com\nexternal2@example.com\n"
+        "external3@example.com\nsomeone-else@tudelft.nl\n"
+    )
+    users_app = App()
+    users_frame = FrameStack(
+        users_app, "FrameStack",
+        config_yaml,
+        env=Environment(
+            account="123456789012", region="eu-central-1"
+        )
+    )
+    users_hub_stack = HubStack(
+        users_app, "HubStack",
+        config_yaml,
+        vpc=users_frame.vpc,
+        load_balancer=users_frame.load_balancer,
+        file_system=users_frame.file_system,
+        ecs_service_security_group=users_frame.ecs_service_security_group,
+        admins_file=str(admins_file),
+        allowed_users_file=str(allowed_users_file),
+        env=Environment(
+            account="123456789012", region="eu-central-1"
+        )
+    )
+    users_template = Template.from_stack(users_hub_stack)
+    # One resource for all external users
+    users_template.has_resource_properties(
+        "Custom::CognitoUsers", {
+            "Users": [
+                "external1@example.com", "external2@example.com",
+                "external3@example.com"
+            ]
+        }
+    )
+    users_template.has_resource_properties(
+        "AWS::SSM::Parameter", {
+            "Value": Match.string_like_regexp(
+                '"admins":\\["someone@tudelft.nl"\\]'
+            )
+        }
+    )
+
+
+def make_users_stack(tmp_path, count):
+    admins_file = tmp_path / "admins"
+    admins_file.write_text("someone@tudelft.nl\n")
+    allowed_users_file = tmp_path / "allowed_users"
+    allowed_users_file.write_text("".join(
+        f"student{number}@tudelft.nl\n" for number in range(count)
+    ))
+    users_app = App()
+    users_frame = FrameStack(
+        users_app, "FrameStack",
+        config_yaml,
+        env=Environment(
+            account="123456789012", region="eu-central-1"
+        )
+    )
+    return HubStack(
+        users_app, "HubStack",
+        config_yaml,
+        vpc=users_frame.vpc,
+        load_balancer=users_frame.load_balancer,
+        file_system=users_frame.file_system,
+        ecs_service_security_group=users_frame.ecs_service_security_group,
+        admins_file=str(admins_file),
+        allowed_users_file=str(allowed_users_file),
+        env=Environment(
+            account="123456789012", region="eu-central-1"
+        )
+    )
+
+
+def test_user_directory_shards(tmp_path):
+    users_template = Template.from_stack(make_users_stack(tmp_path, 2000))
+    parameters = users_template.find_resources("AWS::SSM::Parameter")
+    values = [
+        parameter["Properties"]["Value"]
+        for parameter in parameters.values()
+        if parameter["Properties"]["Name"] !=
+        "/some-basename/user-directory"
+    ]
+    assert len(values) > 1
+    assert max(len(value) for value in values) <= 4096
+    users_template.has_resource_properties(
+        "AWS::SSM::Parameter", {
+            "Name": "/some-basename/user-directory",
+            "Value": Match.string_like_regexp(f'"shards": {len(values)}')
+        }
+    )
+
+
+def test_user_directory_too_large(tmp_path):
+    with pytest.raises(ValueError, match="user_directory_backend"):
+        make_users_stack(tmp_path, 10000)
+
+
+def test_julia_depot():
+    depot_app = App()
+    depot_config = dict(config_yaml, julia_depot=True)
+    depot_frame = FrameStack(
+        depot_app, "FrameStack",
+        depot_config,
+        env=Environment(
+            account="123456789012", region="eu-central-1"
+        )
+    )
+    depot_hub_stack = HubStack(
+        depot_app, "HubStack",
+        depot_config,
+        vpc=depot_frame.vpc,
+        load_balancer=depot_frame.load_balancer,
+        file_system=depot_frame.file_system,
+        ecs_service_security_group=depot_frame.ecs_service_security_group,
+        env=Environment(
+            account="123456789012", region="eu-central-1"
+        )
+    )
+    depot_template = Template.from_stack(depot_hub_stack)
+    depot_template.resource_count_is(type="AWS::EFS::AccessPoint", count=2)
+    access_points = depot_template.find_resources(
+        "AWS::EFS::AccessPoint", {
+            "Properties": {"RootDirectory": {"Path": "/julia-depot"}}
+        }
+    )
+    assert len(access_points) == 1
+    depot_template.has_resource_properties(
+        "AWS::ECS::TaskDefinition", {
+            "ContainerDefinitions": [Match.object_like({
+                "Environment": Match.array_with([{
+                    "Name": "FARGATE_EFS_JULIA_DEPOT_ACCESS_POINT_ID",
+                    "Value": {"Ref": list(access_points)[0]}
+                }])
+            })]
+        }
+    )
+
+
+def test_image_digest():
+    digest_app = App()
+    digest = "sha256:" + "a" * 64
+    digest_config = dict(
+        config_yaml, single_user_container_image_digest=digest
+    )
+    digest_frame = FrameStack(
+        digest_app, "FrameStack",
+        digest_config,
+        env=Environment(
+            account="123456789012", region="eu-central-1"
+        )
+    )
+    digest_hub_stack = HubStack(
+        digest_app, "HubStack",
+        digest_config,
+        vpc=digest_frame.vpc,
+        load_balancer=digest_frame.load_balancer,
+        file_system=digest_frame.file_system,
+        ecs_service_security_group=digest_frame.ecs_service_security_group,
+        env=Environment(
+            account="123456789012", region="eu-central-1"
+        )
+    )
+    Template.from_stack(digest_hub_stack).has_resource_properties(
+        "AWS::ECS::TaskDefinition", {
+            "ContainerDefinitions": [Match.object_like({
+                "Environment": Match.array_with([{
+                    "Name": "FARGATE_SPAWNER_IMAGE_TAG",
+                    "Value": digest
+                }])
+            })]
+        }
+    )
+
+
+def test_warm_pool():
+    warm_pool_app = App()
+    warm_pool = {
+        "timezone": "Europe/Amsterdam", "default": 0,
+        "windows": [{"start": "08:30", "end": "17:30", "size": 20}]
+    }
+    warm_pool_config = dict(config_yaml, warm_pool=warm_pool)
+    warm_pool_frame = FrameStack(
+        warm_pool_app, "FrameStack",
+        warm_pool_config,
+        env=Environment(
+            account="123456789012", region="eu-central-1"
+        )
+    )
+    warm_pool_hub_stack = HubStack(
+        warm_pool_app, "HubStack",
+        warm_pool_config,
+        vpc=warm_pool_frame.vpc,
+        load_balancer=warm_pool_frame.load_balancer,
+        file_system=warm_pool_frame.file_system,
+        ecs_service_security_group=warm_pool_frame
+        .ecs_service_security_group,
+        env=Environment(
+            account="123456789012", region="eu-central-1"
+        )
+    )
+    warm_pool_template = Template.from_stack(warm_pool_hub_stack)
+    # Pooled tasks run with the users' own task definitions, so there is
+    # no task definition or access point for the whole file system
+    warm_pool_template.resource_count_is(
+        type="AWS::ECS::TaskDefinition", count=1
+    )
+    assert not warm_pool_template.find_resources(
+        "AWS::EFS::AccessPoint", {
+            "Properties": {"RootDirectory": {"Path": "/"}}
+        }
+    )
+    warm_pool_template.has_resource_properties(
+        "AWS::ECS::TaskDefinition", {
+            "ContainerDefinitions": [Match.object_like({
+                "Environment": Match.array_with([{
+                    "Name": "WARM_POOL_SCHEDULE",
+                    "Value": json.dumps(warm_pool)
+                }]),
+                "Secrets": Match.array_with([Match.object_like({
+                    "Name": "WARM_START_SECRET"
+                })])
+            })]
+        }
+    )
+    warm_pool_template.resource_count_is(
+        type="AWS::SecretsManager::Secret", count=1
+    )
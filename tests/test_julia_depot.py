@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+import os
+
+import pytest
+
+import julia_depot
+
+
+@pytest.fixture
+def depots(tmp_path, monkeypatch):
+    shared = tmp_path / "julia-depot"
+    user = tmp_path / "work" / ".julia"
+    image = tmp_path / "image" / ".julia"
+    monkeypatch.setattr(julia_depot, "SHARED_DEPOT", str(shared))
+    monkeypatch.setattr(julia_depot, "USER_DEPOT", str(user))
+    monkeypatch.setattr(julia_depot, "IMAGE_DEPOT", str(image))
+    return shared, user, image
+
+
+def test_layered_environment(depots):
+    shared, user, image = depots
+    # The shared depot is not mounted
+    assert julia_depot.layered_environment({}) == {}
+
+    shared.mkdir()
+    environment = julia_depot.layered_environment({})
+    assert environment["JULIA_DEPOT_PATH"].split(os.pathsep) == [
+        str(user), str(shared), str(image)
+    ]
+    assert environment["JULIA_LOAD_PATH"].split(os.pathsep) == [
+        "@", "@v#.#", "@shared", "@stdlib"
+    ]
+    # A depot path that is set already is kept
+    assert julia_depot.layered_environment(
+        {"JULIA_DEPOT_PATH": "/somewhere"}
+    ) == {}
+
+
+def test_prepare_user_depot(depots):
+    shared, user, image = depots
+    for version in ("v1.9", "v1.10"):
+        environment = image / "environments" / version
+        environment.mkdir(parents=True)
+        (environment / "Project.toml").write_text(f"# image {version}\n")
+        (environment / "Manifest.toml").write_text("# Pluto 0.19\n")
+
+    julia_depot.prepare_user_depot()
+    copied = user / "environments" / "v1.10"
+    assert (copied / "Project.toml").read_text() == "# image v1.10\n"
+    assert (copied / julia_depot.MANIFEST_HASH_FILE).read_text().strip() \
+        == julia_depot.manifest_hash(image / "environments" / "v1.10")
+
+    # Packages that the user adds are kept while the image does not change
+    (copied / "Project.toml").write_text("# user's own\n")
+    julia_depot.prepare_user_depot()
+    assert (copied / "Project.toml").read_text() == "# user's own\n"
+
+    # A new image Manifest is copied again, the user's environment is kept
+    (image / "environments" / "v1.10" / "Manifest.toml").write_text(
+        "# Pluto 0.20\n"
+    )
+    julia_depot.prepare_user_depot()
+    assert (copied / "Manifest.toml").read_text() == "# Pluto 0.20\n"
+    assert (copied / "Project.toml").read_text() == "# image v1.10\n"
+    assert (user / "environments" / "v1.10.old" / "Project.toml") \
+        .read_text() == "# user's own\n"
+    assert (user / "environments" / "v1.9" / "Manifest.toml").read_text() \
+        == "# Pluto 0.19\n"
+
+
+def test_environment_copied_before_hashes(depots):
+    shared, user, image = depots
+    environment = image / "environments" / "v1.10"
+    environment.mkdir(parents=True)
+    (environment / "Manifest.toml").write_text("# Pluto 0.20\n")
+    # Copied by an image that did not record the Manifest hash yet
+    stale = user / "environments" / "v1.10"
+    stale.mkdir(parents=True)
+    (stale / "Manifest.toml").write_text("# Pluto 0.19\n")
+
+    julia_depot.prepare_user_depot()
+    assert (stale / "Manifest.toml").read_text() == "# Pluto 0.20\n"
+    assert (user / "environments" / "v1.10.old" / "Manifest.toml") \
+        .read_text() == "# Pluto 0.19\n"
+
+
+def test_curation_environment(depots, monkeypatch):
+    shared, user, image = depots
+    monkeypatch.setenv("JULIA_DEPOT_PATH", "/somewhere")
+    monkeypatch.setenv("HOME", "/home/jovyan")
+    environment = julia_depot.curation_environment()
+    # Installs in the shared depot only, never in the user's depot
+    assert environment["JULIA_DEPOT_PATH"].split(os.pathsep) == [
+        str(shared), str(image)
+    ]
+    assert environment["JULIA_PROJECT"] == str(
+        shared / "environments" / "shared"
+    )
+    assert environment["JULIA_LOAD_PATH"] == os.pathsep.join(
+        ["@", "@stdlib"]
+    )
+    assert environment["JULIA_CPU_TARGET"] == julia_depot.CPU_TARGET
+    assert environment["JULIA_PKG_PRECOMPILE_AUTO"] == "0"
+    assert environment["HOME"] == "/home/jovyan"
+
+
+def test_main(depots, monkeypatch):
+    shared, user, image = depots
+    calls = []
+    monkeypatch.setattr(
+        julia_depot.subprocess, "call",
+        lambda command, env: calls.append((command, env)) or 0
+    )
+    # The shared depot is not mounted
+    with pytest.raises(SystemExit) as exit_info:
+        julia_depot.main(["status"])
+    assert exit_info.value.code == 1
+
+    shared.mkdir()
+    with pytest.raises(SystemExit):
+        julia_depot.main(["add"])
+    assert julia_depot.main(["add", "DataFrames", "CSV"]) == 0
+    command, environment = calls[-1]
+    assert command == [
+        "julia", "-e", julia_depot.COMMANDS["add"], "DataFrames", "CSV"
+    ]
+    assert environment["JULIA_PROJECT"].startswith(str(shared))
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+import os
+import sys
+import urllib.parse
+from unittest import mock
+
+import pytest
+from traitlets.config import Config
+
+CONFIG_FILE = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)),
+    "hub_docker", "jupyterhub_config.py"
+)
+
+# The hub image packages and the hub modules that talk to AWS or patch
+# JupyterHub when the configuration is loaded
+FAKE_MODULES = (
+    "boto3", "fargatespawner", "jupyter_client",
+    "jupyter_client.localinterfaces", "alb_proxy", "authenticator",
+    "spawn_dispatcher", "run_task_builder", "spawn_metrics", "spawner",
+    "speculative_spawn", "startup_timing", "task_poller", "task_registry",
+    "user_directory", "warm_pool"
+)
+
+
+@pytest.fixture
+def load_config(monkeypatch):
+    for name in FAKE_MODULES:
+        monkeypatch.setitem(sys.modules, name, mock.MagicMock())
+    sys.modules["jupyter_client.localinterfaces"].public_ips.return_value = \
+        ["10.0.0.1"]
+    # The configuration adds its directory to the module search path
+    monkeypatch.setattr(sys, "path", list(sys.path))
+    monkeypatch.setenv("OAUTH_SCOPE", "openid,profile")
+    for name in ("HUB_DB_HOST", "HUB_DB_NAME", "HUB_DB_POOL_SIZE",
+                 "HUB_DB_MAX_OVERFLOW", "WARM_POOL_SCHEDULE",
+                 "SPECULATIVE_SPAWN_TIMEOUT", "PRESPAWN_SCHEDULE",
+                 "PROXY_SERVICE_TYPE"):
+        monkeypatch.delenv(name, raising=False)
+
+    def load():
+        config = Config()
+        with open(CONFIG_FILE) as config_file:
+            code = compile(config_file.read(), CONFIG_FILE, "exec")
+        exec(code, {"__file__": CONFIG_FILE, "get_config": lambda: config})
+        return config
+
+    return load
+
+
+def test_sqlite_without_database(load_config):
+    config = load_config()
+    assert "db_url" not in config.JupyterHub
+    assert "db_kwargs" not in config.JupyterHub
+
+
+def test_shared_database(load_config, monkeypatch):
+    password = "p@ss:w/rd%"
+    monkeypatch.setenv("HUB_DB_HOST", "proxy.example.com")
+    monkeypatch.setenv("HUB_DB_USER", "hub")
+    monkeypatch.setenv("HUB_DB_PASSWORD", password)
+    monkeypatch.setenv("HUB_DB_POOL_SIZE", "3")
+    config = load_config()
+
+    db_url = config.JupyterHub.db_url
+    assert db_url == (
+        "postgresql+psycopg2://hub:p%40ss%3Aw%2Frd%25"
+        "@proxy.example.com:5432/jupyterhub"
+    )
+    # The password survives the URL quoting
+    credentials = urllib.parse.urlsplit(db_url).netloc.rsplit("@", 1)[0]
+    assert urllib.parse.unquote(credentials.split(":", 1)[1]) == password
+    assert config.JupyterHub.db_kwargs == {
+        "pool_size": 3,
+        "max_overflow": 10,
+        "pool_timeout": 10,
+        "pool_pre_ping": True,
+        "pool_recycle": 300
+    }
+
+    monkeypatch.setenv("HUB_DB_NAME", "hub_state")
+    assert load_config().JupyterHub.db_url.endswith(
+        "@proxy.example.com:5432/hub_state"
+    )
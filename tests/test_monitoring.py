@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+import copy
+
+import yaml
+
+from aws_cdk import App, Environment
+from aws_cdk.assertions import Template, Match
+
+
+from HubStacks.frame_stack import FrameStack
+from HubStacks.hub_stack import HubStack
+
+
+def make_template(monitoring, proxy_service=None, package_cache=None):
+    app = App()
+    config_yaml = copy.deepcopy(yaml.load(
+        open('example_config.yaml'), Loader=yaml.FullLoader))
+    config_yaml['monitoring'] = monitoring
+    config_yaml['proxy_service'] = proxy_service
+    config_yaml['package_cache'] = package_cache
+    environment = Environment(account="123456789012", region="eu-central-1")
+
+    frame = FrameStack(app, "FrameStack", config_yaml, env=environment)
+    hub_stack = HubStack(
+        app, "HubStack",
+        config_yaml,
+        vpc=frame.vpc,
+        load_balancer=frame.load_balancer,
+        file_system=frame.file_system,
+        ecs_service_security_group=frame.ecs_service_security_group,
+        env=environment
+    )
+    return Template.from_stack(hub_stack), Template.from_stack(frame)
+
+
+hub_template, frame_template = make_template({
+    'alarm_email': 'someone@some-domain.com',
+    'efs_burst_credit_balance': 2e12,
+    'hub_memory_percent': None
+})
+traefik_template, _ = make_template(
+    True, {'type': 'traefik'}, package_cache={
+        'pkg_server_image': 'juliapackaging/pkgserver.jl@sha256:' + '0' * 64
+    }
+)
+
+
+def alarm(template, metric_name):
+    alarms = template.find_resources("AWS::CloudWatch::Alarm", {
+        "Properties": {"MetricName": metric_name}
+    })
+    assert len(alarms) == 1
+    return list(alarms.values())[0]["Properties"]
+
+
+def test_frame_dashboard_and_alarms():
+    frame_template.resource_count_is("AWS::CloudWatch::Dashboard", 1)
+    # Response time, 5xx, burst credits, I/O limit and two NAT gateways
+    frame_template.resource_count_is("AWS::CloudWatch::Alarm", 6)
+    frame_template.has_resource_properties("AWS::SNS::Subscription", {
+        "Protocol": "email", "Endpoint": "someone@some-domain.com"
+    })
+    burst_credits = alarm(frame_template, "BurstCreditBalance")
+    assert burst_credits["Threshold"] == 2e12
+    assert burst_credits["ComparisonOperator"] == "LessThanThreshold"
+    assert alarm(frame_template, "TargetResponseTime")["Threshold"] == 2
+    frame_template.has_resource_properties("AWS::CloudWatch::Alarm", {
+        "Metrics": [Match.object_like({
+            "MetricStat": Match.object_like({"Metric": Match.object_like({
+                "MetricName": "BytesOutToDestination",
+                "Namespace": "AWS/NATGateway"
+            })})
+        })],
+        "AlarmActions": [{"Ref": Match.string_like_regexp("AlarmTopic")}]
+    })
+
+
+def test_hub_dashboard_and_alarms():
+    hub_template.has_resource_properties("AWS::ECS::Cluster", {
+        "ClusterSettings": [{"Name": "containerInsights", "Value": "enabled"}]
+    })
+    hub_template.resource_count_is("AWS::CloudWatch::Dashboard", 1)
+    # CPU, single user tasks and throttles; the memory alarm is disabled
+    hub_template.resource_count_is("AWS::CloudWatch::Alarm", 3)
+    assert alarm(hub_template, "CPUUtilization")["Threshold"] == 80
+    throttles = alarm(hub_template, "RunTaskThrottles")
+    assert throttles["Namespace"] == "JupyterHub/Spawns"
+    assert throttles["EvaluationPeriods"] == 1
+    hub_template.has_resource_properties("AWS::CloudWatch::Alarm", {
+        "Metrics": Match.array_with([Match.object_like({
+            "Expression": "tasks - FILL(service0, 0)"
+        })])
+    })
+
+
+def test_proxy_and_package_cache_tasks_are_not_single_user_tasks():
+    traefik_template.has_resource_properties("AWS::CloudWatch::Alarm", {
+        "Metrics": Match.array_with([Match.object_like({
+            "Expression":
+                "tasks - FILL(service0, 0) - FILL(service1, 0) - "
+                "FILL(service2, 0) - FILL(service3, 0)"
+        })])
+    })
+
+
+def test_no_monitoring_by_default():
+    template, frame = make_template(None)
+    template.resource_count_is("AWS::CloudWatch::Dashboard", 0)
+    frame.resource_count_is("AWS::CloudWatch::Alarm", 0)
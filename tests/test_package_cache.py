@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+import copy
+
+import pytest
+import yaml
+
+from aws_cdk import App, Environment
+from aws_cdk.assertions import Template, Match
+
+
+from HubStacks.frame_stack import FrameStack
+from HubStacks.hub_stack import HubStack
+from HubStacks.package_cache import pinned_image
+
+PKG_SERVER_IMAGE = "juliapackaging/pkgserver.jl@sha256:" + "0" * 64
+
+
+def make_template(package_cache, proxy_service=None):
+    app = App()
+    config_yaml = copy.deepcopy(yaml.load(
+        open('example_config.yaml'), Loader=yaml.FullLoader))
+    config_yaml['package_cache'] = package_cache
+    config_yaml['proxy_service'] = proxy_service
+    environment = Environment(account="123456789012", region="eu-central-1")
+
+    frame = FrameStack(app, "FrameStack", config_yaml, env=environment)
+    hub_stack = HubStack(
+        app, "HubStack",
+        config_yaml,
+        vpc=frame.vpc,
+        load_balancer=frame.load_balancer,
+        file_system=frame.file_system,
+        ecs_service_security_group=frame.ecs_service_security_group,
+        env=environment
+    )
+    return Template.from_stack(hub_stack)
+
+
+template = make_template({"pkg_server_image": PKG_SERVER_IMAGE})
+host = "package-cache.some-basename.local"
+
+
+def test_package_cache_service():
+    # hub and package cache
+    template.resource_count_is(type="AWS::ECS::Service", count=2)
+    template.resource_count_is(
+        type="AWS::ServiceDiscovery::PrivateDnsNamespace", count=1
+    )
+    template.has_resource_properties(
+        "AWS::ServiceDiscovery::Service", {"Name": "package-cache"}
+    )
+    template.has_resource_properties(
+        "AWS::ECS::TaskDefinition", {
+            "Cpu": "1024",
+            "Memory": "2048",
+            "ContainerDefinitions": [Match.object_like({
+                "Image": PKG_SERVER_IMAGE,
+                "Environment": Match.array_with([{
+                    "Name": "JULIA_PKG_SERVER_STORAGE_ROOT",
+                    "Value": "/cache"
+                }]),
+                "MountPoints": [{
+                    "ContainerPath": "/cache",
+                    "ReadOnly": False,
+                    "SourceVolume": "efs-julia-cache-volume"
+                }]
+            }), Match.object_like({
+                "Image": "epicwink/proxpi:v1.2",
+                "Environment": Match.array_with([{
+                    "Name": "PROXPI_CACHE_SIZE",
+                    "Value": str(50 * 1024 ** 3)
+                }]),
+                "MountPoints": [{
+                    "ContainerPath": "/cache",
+                    "ReadOnly": False,
+                    "SourceVolume": "efs-pypi-cache-volume"
+                }]
+            })]
+        }
+    )
+    for path in ("/package-cache/julia", "/package-cache/pypi"):
+        template.has_resource_properties(
+            "AWS::EFS::AccessPoint", {"RootDirectory": Match.object_like({
+                "Path": path
+            })}
+        )
+
+
+def test_single_user_environment():
+    template.has_resource_properties(
+        "AWS::ECS::TaskDefinition", {
+            "ContainerDefinitions": [Match.object_like({
+                "Environment": Match.array_with([{
+                    "Name": "PACKAGE_CACHE_JULIA_PKG_SERVER",
+                    "Value": f"http://{host}:8000"
+                }, {
+                    "Name": "PACKAGE_CACHE_PIP_INDEX_URL",
+                    "Value": f"http://{host}:5000/index/"
+                }, {
+                    "Name": "PACKAGE_CACHE_PIP_TRUSTED_HOST",
+                    "Value": host
+                }])
+            })]
+        }
+    )
+
+
+def test_shares_namespace_with_proxy_service():
+    shared_template = make_template(
+        {"cpu": 512, "memory": 1024, "pkg_server_image": PKG_SERVER_IMAGE},
+        proxy_service={"type": "chp"}
+    )
+    # hub, proxy and package cache
+    shared_template.resource_count_is(type="AWS::ECS::Service", count=3)
+    shared_template.resource_count_is(
+        type="AWS::ServiceDiscovery::PrivateDnsNamespace", count=1
+    )
+    shared_template.has_resource_properties(
+        "AWS::ECS::TaskDefinition", {
+            "Cpu": "512",
+            "Memory": "1024",
+            "ContainerDefinitions": Match.array_with([Match.object_like({
+                "Image": "epicwink/proxpi:v1.2"
+            })])
+        }
+    )
+
+
+def test_pinned_image():
+    assert pinned_image(PKG_SERVER_IMAGE)
+    assert pinned_image("epicwink/proxpi:v1.2")
+    assert pinned_image("localhost:5000/proxpi:v1.2")
+    assert not pinned_image("juliapackaging/pkgserver.jl")
+    assert not pinned_image("juliapackaging/pkgserver.jl:latest")
+    assert not pinned_image("localhost:5000/pkgserver")
+
+
+@pytest.mark.parametrize("package_cache", [
+    True,
+    {"pkg_server_image": "juliapackaging/pkgserver.jl:latest"},
+    {"pkg_server_image": PKG_SERVER_IMAGE,
+     "pypi_cache_image": "epicwink/proxpi"},
+])
+def test_images_must_be_pinned(package_cache):
+    with pytest.raises(ValueError, match="must be pinned"):
+        make_template(package_cache)
+
+
+def test_no_package_cache_by_default():
+    default_template = make_template(None)
+    default_template.resource_count_is(type="AWS::ECS::Service", count=1)
+    default_template.resource_count_is(
+        type="AWS::ServiceDiscovery::PrivateDnsNamespace", count=0
+    )
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+import pluto_prelaunch
+
+
+def test_server_command(tmp_path, monkeypatch):
+    sysimage = tmp_path / "pluto.so"
+    monkeypatch.setattr(pluto_prelaunch, "SYSIMAGE", str(sysimage))
+    # The sysimage is missing
+    assert pluto_prelaunch.server_command(False) == [
+        "julia", pluto_prelaunch.SERVER_SCRIPT, str(pluto_prelaunch.PORT)
+    ]
+
+    sysimage.write_bytes(b"")
+    assert pluto_prelaunch.server_command(True) == [
+        "julia", f"--sysimage={sysimage}", pluto_prelaunch.SERVER_SCRIPT,
+        str(pluto_prelaunch.PORT), "--warmup"
+    ]
+
+    # Julia's own sysimage
+    monkeypatch.setattr(pluto_prelaunch, "SYSIMAGE", "")
+    assert pluto_prelaunch.server_command(True)[:2] == [
+        "julia", pluto_prelaunch.SERVER_SCRIPT
+    ]
+
+
+def test_server_proxy_config():
+    config = pluto_prelaunch.server_proxy_config()
+    assert config["command"][-1] == "attach"
+    assert config["port"] == pluto_prelaunch.PORT
+    assert config["launcher_entry"] == {"enabled": False}
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+import asyncio
+import datetime
+import types
+
+import pytest
+
+from prespawn import (
+    CronSchedule, HubClient, Prespawner, bulk, parse_cron_field
+)
+
+UTC = datetime.timezone.utc
+
+
+class FakeHub:
+    def __init__(self, groups=None, fail=()):
+        self.groups = groups or {}
+        self.fail = fail
+        self.started = []
+        self.stopped = []
+        self.touched = []
+
+    async def group_users(self, group):
+        return self.groups[group]
+
+    async def start_server(self, username):
+        if username in self.fail:
+            raise Exception("500")
+        self.started.append(username)
+        return "pending"
+
+    async def stop_server(self, username):
+        self.stopped.append(username)
+        return "stopped"
+
+    async def touch(self, username, moment):
+        self.touched.append((username, moment))
+
+
+class FakeHTTPClient:
+    """
+    Hub API that answers with the responses in order
+    """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    async def fetch(self, request, raise_error=True):
+        self.requests.append((request.method, request.url))
+        code, body = self.responses.pop(0)
+        return types.SimpleNamespace(code=code, body=body)
+
+
+def start_server(*responses):
+    hub = HubClient("http://hub:8081/hub/api", "token",
+                    http_client=FakeHTTPClient(*responses))
+    return asyncio.run(hub.start_server("alice"))
+
+
+def test_start_server():
+    assert start_server((201, b"")) == "started"
+    assert start_server((202, b"")) == "pending"
+    assert start_server(
+        (400, b'{"message": "alice is pending spawn"}')
+    ) == "pending"
+    assert start_server(
+        (400, b'{"message": "alice is already running"}')
+    ) == "running"
+    # Users are created first if needed
+    assert start_server((404, b""), (201, b""), (201, b"")) == "started"
+    with pytest.raises(Exception, match="500"):
+        start_server((500, b""))
+
+
+def test_parse_cron_field():
+    assert parse_cron_field("*/15", 0, 59) == {0, 15, 30, 45}
+    assert parse_cron_field("1-3,5", 0, 7) == {1, 2, 3, 5}
+    with pytest.raises(ValueError):
+        parse_cron_field("60", 0, 59)
+
+
+def test_cron_schedule():
+    # Mondays and Wednesdays at 08:45
+    schedule = CronSchedule("45 8 * * 1,3")
+    assert schedule.matches(datetime.datetime(2024, 9, 2, 8, 45))
+    assert schedule.matches(datetime.datetime(2024, 9, 4, 8, 45))
+    assert not schedule.matches(datetime.datetime(2024, 9, 3, 8, 45))
+    assert not schedule.matches(datetime.datetime(2024, 9, 2, 8, 46))
+    # Sunday is 0 or 7
+    assert CronSchedule("0 0 * * 7").matches(datetime.datetime(2024, 9, 1))
+    with pytest.raises(ValueError):
+        CronSchedule("0 0 * *")
+
+
+def test_bulk_start_and_stop():
+    hub = FakeHub(fail=("bob",))
+    results = asyncio.run(
+        bulk(hub, ["alice", "bob", "carol"], "start", rate=100)
+    )
+    assert results == {
+        "alice": "pending", "bob": "error: 500", "carol": "pending"
+    }
+    asyncio.run(bulk(hub, ["alice"], "stop", rate=100))
+    assert hub.stopped == ["alice"]
+
+
+def test_prespawn_ahead_of_session():
+    hub = FakeHub(groups={"course": ["alice", "bob"]})
+    prespawner = Prespawner(hub, [{
+        "cron": "0 9 * * 1", "timezone": "Europe/Amsterdam",
+        "lead_minutes": 15, "group": "course", "users": ["carol", "alice"]
+    }], rate=100)
+    # 08:45 in Amsterdam on a Monday
+    before = datetime.datetime(2024, 9, 2, 6, 45, tzinfo=UTC)
+    session = datetime.datetime(2024, 9, 2, 7, 0, tzinfo=UTC)
+
+    asyncio.run(prespawner.tick(before - datetime.timedelta(minutes=1)))
+    assert hub.started == []
+
+    asyncio.run(prespawner.tick(before))
+    assert sorted(hub.started) == ["alice", "bob", "carol"]
+    assert set(prespawner.held) == {"alice", "bob", "carol"}
+    assert len(hub.touched) == 3
+
+    # Activity is reported every touch_interval until the session starts
+    asyncio.run(prespawner.tick(before + datetime.timedelta(minutes=1)))
+    assert len(hub.touched) == 3
+    asyncio.run(prespawner.tick(before + datetime.timedelta(minutes=5)))
+    assert len(hub.touched) == 6
+    assert hub.touched[-1][1] == before + datetime.timedelta(minutes=5)
+    asyncio.run(prespawner.tick(session))
+    assert prespawner.held == {}
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+import copy
+
+import yaml
+
+from aws_cdk import App, Environment
+from aws_cdk.assertions import Template, Match
+
+
+from HubStacks.frame_stack import FrameStack
+from HubStacks.hub_stack import HubStack
+
+
+def make_template(proxy_service):
+    app = App()
+    config_yaml = copy.deepcopy(yaml.load(
+        open('example_config.yaml'), Loader=yaml.FullLoader))
+    config_yaml['proxy_service'] = proxy_service
+    environment = Environment(account="123456789012", region="eu-central-1")
+
+    frame = FrameStack(app, "FrameStack", config_yaml, env=environment)
+    hub_stack = HubStack(
+        app, "HubStack",
+        config_yaml,
+        vpc=frame.vpc,
+        load_balancer=frame.load_balancer,
+        file_system=frame.file_system,
+        ecs_service_security_group=frame.ecs_service_security_group,
+        env=environment
+    )
+    return Template.from_stack(hub_stack), Template.from_stack(frame)
+
+
+traefik_template, traefik_frame_template = make_template(
+    {'type': 'traefik', 'min_count': 2, 'max_count': 6}
+)
+chp_template, chp_frame_template = make_template({'type': 'chp'})
+alb_template, alb_frame_template = make_template({'type': 'alb'})
+
+
+def test_traefik_services():
+    # hub, traefik and redis
+    traefik_template.resource_count_is(type="AWS::ECS::Service", count=3)
+    traefik_template.resource_count_is(
+        type="AWS::ServiceDiscovery::Service", count=3
+    )
+    traefik_template.has_resource_properties(
+        "AWS::ECS::TaskDefinition", {
+            "ContainerDefinitions": [Match.object_like({
+                "Image": "traefik:v2.10",
+                "Command": Match.array_with([
+                    Match.string_like_regexp("providers.redis.endpoints")
+                ])
+            })]
+        }
+    )
+
+
+def test_traefik_autoscaling():
+    traefik_template.has_resource_properties(
+        "AWS::ApplicationAutoScaling::ScalableTarget", {
+            "MinCapacity": 2,
+            "MaxCapacity": 6
+        }
+    )
+
+
+def test_chp_single_task():
+    chp_template.resource_count_is(type="AWS::ECS::Service", count=2)
+    chp_template.resource_count_is(
+        type="AWS::ApplicationAutoScaling::ScalableTarget", count=0
+    )
+    chp_template.has_resource_properties(
+        "AWS::ECS::TaskDefinition", {
+            "ContainerDefinitions": [Match.object_like({
+                "Image": "jupyterhub/configurable-http-proxy:4.6.1",
+                "Secrets": [Match.object_like({
+                    "Name": "CONFIGPROXY_AUTH_TOKEN"
+                })]
+            })]
+        }
+    )
+
+
+def test_hub_proxy_environment():
+    for template in (traefik_template, chp_template):
+        template.has_resource_properties(
+            "AWS::ECS::TaskDefinition", {
+                "ContainerDefinitions": [Match.object_like({
+                    "Environment": Match.array_with([
+                        {"Name": "PROXY_SERVICE_TYPE",
+                         "Value": Match.any_value()},
+                        {"Name": "PROXY_API_URL",
+                         "Value": Match.any_value()}
+                    ]),
+                    "Secrets": Match.array_with([Match.object_like({
+                        "Name": "PROXY_AUTH_TOKEN"
+                    })])
+                })]
+            }
+        )
+
+
+def test_listener_forwards_to_proxy():
+    for frame_template in (traefik_frame_template, chp_frame_template):
+        frame_template.has_resource_properties(
+            "AWS::ElasticLoadBalancingV2::TargetGroup", {
+                "Port": 8000,
+                "TargetType": "ip",
+                "HealthCheckPath": Match.string_like_regexp(
+                    "^/(ping|_chp_healthz)$"
+                )
+            }
+        )
+
+
+def test_alb_routing_has_no_proxy_service():
+    alb_template.resource_count_is(type="AWS::ECS::Service", count=1)
+    alb_template.has_resource_properties(
+        "AWS::ECS::TaskDefinition", {
+            "ContainerDefinitions": [Match.object_like({
+                "Environment": Match.array_with([
+                    {"Name": "PROXY_SERVICE_TYPE", "Value": "alb"},
+                    {"Name": "ALB_PROXY_VPC_ID", "Value": Match.any_value()},
+                    {"Name": "ALB_PROXY_TARGET_GROUP_PREFIX",
+                     "Value": Match.any_value()},
+                    {"Name": "ALB_PROXY_LISTENER_ARN",
+                     "Value": Match.any_value()}
+                ])
+            })]
+        }
+    )
+
+
+def test_alb_routing_policy():
+    alb_template.has_resource_properties(
+        "AWS::IAM::Policy", {
+            "PolicyDocument": {
+                "Statement": Match.array_with([Match.object_like({
+                    "Action": Match.array_with([
+                        "elasticloadbalancing:CreateRule",
+                        "elasticloadbalancing:DeleteRule"
+                    ])
+                })])
+            }
+        }
+    )
+
+
+def test_alb_routing_reaches_single_user_port():
+    alb_frame_template.has_resource_properties(
+        "AWS::EC2::SecurityGroupIngress", {
+            "FromPort": 8888,
+            "ToPort": 8888
+        }
+    )
+    alb_frame_template.has_resource_properties(
+        "AWS::ElasticLoadBalancingV2::TargetGroup", {
+            "HealthCheckPath": "/hub/health"
+        }
+    )
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+import threading
+
+import pytest
+
+from run_task_builder import (
+    OverridesTooLarge, RunTaskBuilder, SubnetBalancer
+)
+
+ENVIRONMENT = {
+    "FARGATE_SPAWNER_CLUSTER": "cluster",
+    "FARGATE_SPAWNER_CONTAINER_NAME": "SingleUserContainer",
+    "FARGATE_SPAWNER_TASK_ROLE_ARN": "arn:aws:iam::123456789012:role/task",
+    "FARGATE_SPAWNER_SECURITY_GROUPS": "['sg-1']",
+    "FARGATE_SPAWNER_SUBNETS": "['subnet-a', 'subnet-b']",
+}
+
+
+class FakeEC2:
+    def __init__(self, free):
+        self.free = free
+        self.calls = 0
+
+    def describe_subnets(self, SubnetIds):
+        self.calls += 1
+        return {"Subnets": [
+            {"SubnetId": subnet_id, "AvailableIpAddressCount": count}
+            for subnet_id, count in self.free.items()
+        ]}
+
+
+class FakeSpawner:
+    task_definition_arn = "td/alice"
+
+    def get_env(self):
+        return {"PATH": "/usr/bin", "JUPYTERHUB_USER": "alice"}
+
+
+def test_build_from_environment():
+    builder = RunTaskBuilder.from_environment(ENVIRONMENT)
+    run_task_args = builder(FakeSpawner())
+    assert run_task_args["taskDefinition"] == "td/alice"
+    assert run_task_args["cluster"] == "cluster"
+    overrides = run_task_args["overrides"]
+    assert overrides["taskRoleArn"] == ENVIRONMENT[
+        "FARGATE_SPAWNER_TASK_ROLE_ARN"]
+    assert overrides["containerOverrides"] == [{
+        "command": [
+            "/opt/conda/bin/jupyterhub-singleuser",
+            "--config=jupyter_server_config.py"
+        ],
+        "environment": [{"name": "JUPYTERHUB_USER", "value": "alice"}],
+        "name": "SingleUserContainer"
+    }]
+    assert run_task_args["networkConfiguration"] == {"awsvpcConfiguration": {
+        "assignPublicIp": "DISABLED",
+        "securityGroups": ["sg-1"],
+        "subnets": ["subnet-a", "subnet-b"]
+    }}
+
+
+def test_overrides_size_limit():
+    builder = RunTaskBuilder.from_environment(ENVIRONMENT)
+    with pytest.raises(OverridesTooLarge, match="BIG"):
+        builder.build("td/alice", {"BIG": "x" * 9000, "SMALL": "y"})
+
+
+def test_subnets_with_most_free_addresses():
+    ec2 = FakeEC2({"subnet-a": 3, "subnet-b": 1})
+    balancer = SubnetBalancer(
+        ec2, ["subnet-a", "subnet-b"], refresh_interval=60
+    )
+    builder = RunTaskBuilder(
+        "cluster", "SingleUserContainer", "role", ["sg-1"], balancer
+    )
+    # Spread evenly before the first refresh
+    assert [balancer.pick() for _ in range(2)] == ["subnet-a", "subnet-b"]
+
+    balancer.refresh()
+    subnets = [
+        builder.build("td", {})["networkConfiguration"][
+            "awsvpcConfiguration"]["subnets"]
+        for _ in range(4)
+    ]
+    # Counted down locally between refreshes, without calling EC2
+    assert subnets == [["subnet-a"], ["subnet-a"], ["subnet-a"],
+                       ["subnet-b"]]
+    assert ec2.calls == 1
+
+
+def test_subnets_refreshed_in_background():
+    refreshed = threading.Event()
+
+    class FlakyEC2(FakeEC2):
+        def describe_subnets(self, SubnetIds):
+            # The third call comes after the second refresh stored the
+            # counts
+            if self.calls == 2:
+                refreshed.set()
+            response = super().describe_subnets(SubnetIds)
+            # The first refresh fails, the thread keeps refreshing
+            if self.calls == 1:
+                raise RuntimeError("RequestLimitExceeded")
+            return response
+
+    ec2 = FlakyEC2({"subnet-a": 0, "subnet-b": 10})
+    balancer = SubnetBalancer(
+        ec2, ["subnet-a", "subnet-b"], refresh_interval=0.01
+    ).start()
+    try:
+        assert refreshed.wait(5)
+    finally:
+        balancer.stop()
+    assert balancer.pick() == "subnet-b"
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+import asyncio
+import io
+
+import pytest
+from tornado.httpclient import HTTPClientError, HTTPRequest, HTTPResponse
+
+from spawn_dispatcher import (
+    RunTaskFailed, SpawnDispatcher, TokenBucket, _Ticket, is_retryable,
+    is_throttle
+)
+
+TASK = {"tasks": [{"taskArn": "task/1"}], "failures": []}
+CAPACITY = {"tasks": [], "failures": [{
+    "reason": "Capacity is unavailable at this time. Please try again later"
+}]}
+
+
+def test_is_retryable():
+    assert is_retryable(Exception("ThrottlingException: Rate exceeded"))
+    assert is_retryable(RunTaskFailed(CAPACITY["failures"]))
+    assert not is_retryable(Exception("AccessDeniedException"))
+
+
+def throttling_error():
+    # As raised by fargatespawner: the error code is in the body only
+    response = HTTPResponse(
+        HTTPRequest("https://ecs.eu-central-1.amazonaws.com/"), 400,
+        buffer=io.BytesIO(
+            b'{"__type": "ThrottlingException", "message": "Rate exceeded"}'
+        )
+    )
+    return HTTPClientError(400, response=response)
+
+
+def test_is_throttle():
+    error = throttling_error()
+    assert str(error) == "HTTP 400: Bad Request"
+    assert is_throttle(error)
+    assert is_retryable(error)
+    assert not is_throttle(RunTaskFailed(CAPACITY["failures"]))
+
+
+def test_token_bucket():
+    now = [0.0]
+    bucket = TokenBucket(rate=2, burst=2, clock=lambda: now[0])
+    assert bucket.take() == 0
+    assert bucket.take() == 0
+    assert bucket.take() == pytest.approx(0.5)
+    now[0] = 0.5
+    assert bucket.take() == 0
+    bucket.drain()
+    assert bucket.take() == pytest.approx(0.5)
+
+
+def test_first_come_first_served_at_the_rate():
+    calls = []
+
+    async def burst():
+        loop = asyncio.get_running_loop()
+        dispatcher = SpawnDispatcher(rate=50, burst=1)
+
+        def make_call(index):
+            async def call():
+                calls.append((index, loop.time()))
+                return TASK
+            return call
+
+        await asyncio.gather(*(
+            dispatcher.run_task(make_call(index)) for index in range(10)
+        ))
+
+    asyncio.run(burst())
+    assert [index for index, _ in calls] == list(range(10))
+    # 9 calls after the first one need a new token, 1/50 s apart
+    assert calls[-1][1] - calls[0][1] >= 9 / 50 * 0.9
+
+
+def test_retries_capacity_errors_and_throttling():
+    responses = [
+        Exception("ThrottlingException: Rate exceeded"), throttling_error(),
+        CAPACITY, TASK
+    ]
+
+    async def call():
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    throttles = []
+
+    async def spawn():
+        dispatcher = SpawnDispatcher(
+            rate=100, burst=10, base_delay=0.01, jitter=lambda: 0,
+            on_throttle=lambda: throttles.append(1)
+        )
+        return await dispatcher.run_task(call)
+
+    assert asyncio.run(spawn()) == TASK
+    assert responses == []
+    assert throttles == [1, 1]
+
+
+def test_other_errors_are_not_retried():
+    attempts = []
+
+    async def call():
+        attempts.append(1)
+        raise Exception("AccessDeniedException")
+
+    async def spawn():
+        dispatcher = SpawnDispatcher(rate=100, base_delay=0.01)
+        await dispatcher.run_task(call)
+
+    with pytest.raises(Exception, match="AccessDenied"):
+        asyncio.run(spawn())
+    assert len(attempts) == 1
+
+
+def test_gives_up_after_max_attempts():
+    attempts = []
+
+    async def call():
+        attempts.append(1)
+        return CAPACITY
+
+    async def spawn():
+        dispatcher = SpawnDispatcher(
+            rate=100, max_attempts=3, base_delay=0.01
+        )
+        await dispatcher.run_task(call)
+
+    with pytest.raises(RunTaskFailed):
+        asyncio.run(spawn())
+    assert len(attempts) == 3
+
+
+def test_queue_position_progress():
+    positions = []
+
+    async def call():
+        return TASK
+
+    async def burst():
+        # Calls are dispatched at 0, 1.25 and 2.5 s; progress is reported
+        # at 0, 1 and 2 s
+        dispatcher = SpawnDispatcher(rate=0.8, burst=1)
+        await asyncio.gather(*(
+            dispatcher.run_task(
+                call,
+                progress=lambda position, wait, index=index:
+                    positions.append((index, position, wait))
+            ) for index in range(3)
+        ))
+
+    asyncio.run(burst())
+    assert (2, 3, 3.75) in positions
+    assert (2, 2, 2.5) in positions
+    assert (2, 1, 1.25) in positions
+
+
+def test_cancelled_spawn_leaves_the_queue():
+    started = []
+
+    async def call():
+        started.append(1)
+        return TASK
+
+    async def spawn():
+        dispatcher = SpawnDispatcher(rate=1, burst=1)
+        first = asyncio.ensure_future(dispatcher.run_task(call))
+        second = asyncio.ensure_future(dispatcher.run_task(call))
+        await first
+        second.cancel()
+        await asyncio.sleep(1.2)
+        return dispatcher
+
+    dispatcher = asyncio.run(spawn())
+    assert started == [1]
+    assert dispatcher._queue == []
+
+
+@pytest.mark.parametrize("delay", [0, 0.05])
+def test_task_of_cancelled_spawn_is_stopped(delay):
+    stopped = []
+    release = asyncio.Event()
+
+    async def call():
+        await release.wait()
+        return TASK
+
+    async def stop(task):
+        stopped.append(task["taskArn"])
+
+    async def spawn():
+        dispatcher = SpawnDispatcher(rate=100)
+        spawning = asyncio.ensure_future(
+            dispatcher.run_task(call, stop=stop)
+        )
+        await asyncio.sleep(0.1)
+        # RunTask is running when the spawn is cancelled, and returns
+        # before or after run_task handles the cancellation
+        spawning.cancel()
+        await asyncio.sleep(delay)
+        release.set()
+        await asyncio.sleep(0.1)
+
+    asyncio.run(spawn())
+    assert stopped == ["task/1"]
+
+
+def test_cancelled_spawn_is_not_retried():
+    attempts = []
+    release = asyncio.Event()
+
+    async def call():
+        attempts.append(1)
+        await release.wait()
+        return CAPACITY
+
+    async def spawn():
+        dispatcher = SpawnDispatcher(rate=100, base_delay=0.01)
+        spawning = asyncio.ensure_future(dispatcher.run_task(call))
+        await asyncio.sleep(0.1)
+        spawning.cancel()
+        await asyncio.sleep(0.05)
+        release.set()
+        await asyncio.sleep(0.2)
+        return dispatcher
+
+    dispatcher = asyncio.run(spawn())
+    assert attempts == [1]
+    assert dispatcher._queue == []
+
+
+def test_cancelled_spawn_leaves_the_retry_queue():
+    attempts = []
+
+    async def call():
+        attempts.append(1)
+        return CAPACITY
+
+    async def spawn():
+        dispatcher = SpawnDispatcher(rate=100, base_delay=0.3,
+                                     jitter=lambda: 1)
+        spawning = asyncio.ensure_future(dispatcher.run_task(call))
+        await asyncio.sleep(0.1)
+        # The ticket is queued again, waiting for its backoff
+        assert len(dispatcher._queue) == 1
+        spawning.cancel()
+        await asyncio.sleep(0.5)
+        return dispatcher
+
+    dispatcher = asyncio.run(spawn())
+    assert attempts == [1]
+    assert dispatcher._queue == []
+
+
+def test_next_ready_drops_done_tickets():
+    async def call():
+        return TASK
+
+    async def dispatch():
+        loop = asyncio.get_running_loop()
+        dispatcher = SpawnDispatcher(rate=100, clock=loop.time)
+        cancelled = _Ticket(0, call, loop.create_future())
+        cancelled.future.cancel()
+        waiting = _Ticket(1, call, loop.create_future())
+        dispatcher._queue = [cancelled, waiting]
+        return dispatcher._next_ready(), dispatcher._queue, waiting
+
+    ready, queue, waiting = asyncio.run(dispatch())
+    assert ready is waiting
+    assert queue == [waiting]
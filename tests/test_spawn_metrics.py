@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+import asyncio
+import datetime
+import json
+
+from prometheus_client import REGISTRY
+
+from spawn_metrics import (
+    SpawnMetrics, SpawnTiming, emf_line, task_definition_label
+)
+
+START = datetime.datetime(2024, 9, 2, 9, 0, tzinfo=datetime.timezone.utc)
+
+
+def seconds(value):
+    return START + datetime.timedelta(seconds=value)
+
+
+def observed(phase, task_definition, availability_zone=""):
+    return REGISTRY.get_sample_value(
+        "pluto_spawn_phase_duration_seconds_sum", {
+            "phase": phase, "task_definition": task_definition,
+            "availability_zone": availability_zone
+        }
+    ) or 0
+
+
+class FakeProxy:
+    async def add_user(self, user, server_name="", client=None):
+        user.now[0] += 0.5
+
+
+class FakeSpawner:
+    spawn_timing = None
+
+
+class FakeUser:
+    def __init__(self, now):
+        self.now = now
+        self.spawners = {"": FakeSpawner()}
+
+
+def test_task_definition_label():
+    assert task_definition_label(
+        "123.dkr.ecr.eu-west-1.amazonaws.com/pluto@sha256:abc", "large"
+    ) == "large:pluto@sha256:abc"
+
+
+def test_emf_line():
+    line = json.loads(emf_line("image_pull", 12.3456, "default:pluto",
+                               "eu-west-1a", timestamp=1700000000))
+    assert line["_aws"]["Timestamp"] == 1700000000000
+    metrics = line["_aws"]["CloudWatchMetrics"][0]
+    assert metrics["Namespace"] == "JupyterHub/Spawns"
+    assert ["Phase", "AvailabilityZone"] in metrics["Dimensions"]
+    assert line["PhaseDuration"] == 12.346
+    assert line["Phase"] == "image_pull"
+
+
+def test_phases_of_a_start():
+    lines = []
+    metrics = SpawnMetrics(emit=lines.append).instrument_proxy(FakeProxy)
+    now = [100.0]
+    user = FakeUser(now)
+    timing = SpawnTiming(metrics, "default:start", clock=lambda: now[0])
+    user.spawners[""].spawn_timing = timing
+
+    now[0] += 2
+    timing.mark("run_task")
+    timing.task({
+        "availabilityZone": "eu-west-1b",
+        "createdAt": seconds(0), "connectivityAt": seconds(20),
+        "pullStartedAt": seconds(21), "pullStoppedAt": seconds(41),
+        "startedAt": seconds(45),
+    })
+    now[0] += 45
+    timing.skip()
+    now[0] += 3
+    asyncio.run(FakeProxy().add_user(user))
+
+    assert observed("run_task", "default:start") == 2
+    assert observed("provisioning", "default:start", "eu-west-1b") == 20
+    assert observed("image_pull", "default:start", "eu-west-1b") == 20
+    assert observed("pending", "default:start", "eu-west-1b") == 25
+    assert observed("server_responding", "default:start",
+                    "eu-west-1b") == 3
+    assert observed("proxy_route", "default:start", "eu-west-1b") == 0.5
+    assert observed("total", "default:start", "eu-west-1b") == 50.5
+    assert [json.loads(line)["Phase"] for line in lines] == [
+        "run_task", "provisioning", "image_pull", "pending",
+        "server_responding", "proxy_route", "total"
+    ]
+
+    # Routes that are added again later are not part of the start
+    asyncio.run(FakeProxy().add_user(user))
+    assert observed("total", "default:start", "eu-west-1b") == 50.5
+
+
+def test_no_emf_lines():
+    lines = []
+    metrics = SpawnMetrics(emf=False, emit=lines.append)
+    metrics.observe("oauth", 1.5)
+    # Missing timestamps are not recorded
+    metrics.observe_task({"createdAt": seconds(0)}, "default:none")
+    assert observed("oauth", "") >= 1.5
+    assert observed("provisioning", "default:none") == 0
+    assert lines == []
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+import asyncio
+import importlib
+import json
+import sys
+import types
+
+import pytest
+from traitlets import Any, Bool, Integer, Unicode
+from traitlets.config import LoggingConfigurable
+
+from task_poller import TaskPoller
+from warm_pool import WarmTask
+
+
+class FakeFargateSpawner(LoggingConfigurable):
+    """
+    The parts of FargateSpawner that PlutoFargateSpawner uses
+    """
+
+    user = Any()
+    notebook_scheme = Unicode("http")
+    notebook_port = Integer(8888)
+    start_timeout = Integer(60)
+    task_arn = Unicode("")
+    task_cluster_arn = Unicode("")
+    calling_run_task = Bool(False)
+    get_run_task_args = Any(lambda spawner: {
+        "taskDefinition": spawner.task_definition_arn
+    })
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.progress_buffer = FakeProgressBuffer()
+        self.stopped = False
+
+    def get_env(self):
+        return {"PATH": "/usr/bin", "JUPYTERHUB_USER": self.user.name}
+
+    def _aws_endpoint(self):
+        return "endpoint"
+
+    async def start(self):
+        return "started by FargateSpawner"
+
+    async def stop(self, now=False):
+        self.stopped = True
+
+
+class FakeProgressBuffer:
+    def __init__(self):
+        self.messages = []
+        self.closed = False
+
+    def write(self, message):
+        self.messages.append(message)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeRegistry:
+    image = "single-user:latest"
+
+    def __init__(self):
+        self.lookups = []
+
+    def get_task_definition(self, username, admin, profile):
+        self.lookups.append((username, admin, profile))
+        return f"td/{username}/{profile}"
+
+
+class FakeDirectory:
+    def is_allowed(self, username):
+        return True
+
+    def is_admin(self, username):
+        return username == "admin"
+
+    def profile(self, username):
+        return "large" if username == "large-user" else "default"
+
+
+class FakeWarmPool:
+    def __init__(self, task=None):
+        self.task = task
+        self.released = []
+
+    def claim(self, username):
+        task, self.task = self.task, None
+        return task
+
+    def release(self, username):
+        self.released.append(username)
+
+
+class FakeHTTPClient:
+    def __init__(self, error=None):
+        self.error = error
+        self.requests = []
+
+    def __call__(self):
+        return self
+
+    async def fetch(self, request):
+        self.requests.append(request)
+        if self.error is not None:
+            raise self.error
+
+
+class FakeECS:
+    def describe_tasks(self, cluster, tasks):
+        return {"tasks": [{
+            "taskArn": arn, "lastStatus": "RUNNING",
+            "attachments": [{"details": [
+                {"name": "privateIPv4Address", "value": "10.0.0.2"}
+            ]}]
+        } for arn in tasks]}
+
+
+@pytest.fixture
+def spawner_module(monkeypatch):
+    # fargatespawner is only installed in the hub image
+    fargatespawner = types.ModuleType("fargatespawner")
+    fargatespawner.FargateSpawner = FakeFargateSpawner
+    implementation = types.ModuleType("fargatespawner.fargatespawner")
+    stopped_tasks = []
+
+    async def _ensure_stopped_task(log, endpoint, cluster_arn, task_arn):
+        stopped_tasks.append(task_arn)
+
+    async def _run_task(log, endpoint, run_task_args):
+        return {"tasks": [{"taskArn": "task/1", "clusterArn": "cluster"}]}
+
+    implementation._ensure_stopped_task = _ensure_stopped_task
+    implementation._run_task = _run_task
+    monkeypatch.setitem(sys.modules, "fargatespawner", fargatespawner)
+    monkeypatch.setitem(
+        sys.modules, "fargatespawner.fargatespawner", implementation
+    )
+    monkeypatch.delitem(sys.modules, "spawner", raising=False)
+    module = importlib.import_module("spawner")
+    module.stopped_tasks = stopped_tasks
+    return module
+
+
+def make_spawner(spawner_module, username="guest", **kwargs):
+    return spawner_module.PlutoFargateSpawner(
+        user=types.SimpleNamespace(name=username, admin=False),
+        task_definition_registry=FakeRegistry(),
+        user_directory=FakeDirectory(),
+        warm_pool_secret="some-secret",
+        **kwargs
+    )
+
+
+def warm_task():
+    task = WarmTask("task/warm", "cluster", "guest")
+    task.ip = "10.0.0.1"
+    return task
+
+
+def test_start_from_warm_pool(spawner_module, monkeypatch):
+    client = FakeHTTPClient()
+    monkeypatch.setattr(spawner_module, "AsyncHTTPClient", client)
+    spawner = make_spawner(
+        spawner_module, warm_pool=FakeWarmPool(warm_task())
+    )
+
+    assert asyncio.run(spawner.start()) == "http://10.0.0.1:8888"
+    assert spawner.task_arn == "task/warm"
+    assert spawner.task_cluster_arn == "cluster"
+    # No task definition lookup or RunTask for a pooled task
+    assert spawner.task_definition_registry.lookups == []
+
+    request, = client.requests
+    assert request.url == "http://10.0.0.1:8888/activate"
+    assert request.headers["Authorization"] == "token some-secret"
+    assert json.loads(request.body) == {
+        "username": "guest",
+        "environment": {"JUPYTERHUB_USER": "guest"}
+    }
+    assert spawner.progress_buffer.closed
+
+
+def test_failed_activation_starts_new_task(spawner_module, monkeypatch):
+    monkeypatch.setattr(spawner_module, "AsyncHTTPClient",
+                        FakeHTTPClient(error=RuntimeError("HTTP 403")))
+    spawner = make_spawner(
+        spawner_module, warm_pool=FakeWarmPool(warm_task())
+    )
+
+    assert asyncio.run(spawner.start()) == "started by FargateSpawner"
+    assert spawner_module.stopped_tasks == ["task/warm"]
+    assert spawner.task_definition_arn == "td/guest/default"
+
+
+@pytest.mark.parametrize("username", ["admin", "large-user"])
+def test_warm_pool_only_for_default_users(spawner_module, username):
+    warm_pool = FakeWarmPool(warm_task())
+    spawner = make_spawner(spawner_module, username, warm_pool=warm_pool)
+
+    assert asyncio.run(spawner.start()) == "started by FargateSpawner"
+    assert warm_pool.task is not None
+    asyncio.run(spawner.stop())
+    assert spawner.stopped
+    assert warm_pool.released == []
+
+
+def test_stop_releases_user_to_warm_pool(spawner_module):
+    warm_pool = FakeWarmPool()
+    spawner = make_spawner(spawner_module, warm_pool=warm_pool)
+    asyncio.run(spawner.stop())
+    assert spawner.stopped
+    assert warm_pool.released == ["guest"]
+
+
+def test_start_with_poller(spawner_module):
+    poller = TaskPoller(FakeECS(), fast_interval=0.01)
+    spawner = make_spawner(spawner_module, task_poller=poller)
+
+    async def start():
+        # The poller describes the task while the spawner waits for it
+        poller.start()
+        try:
+            return await spawner.start()
+        finally:
+            poller.stop()
+
+    assert asyncio.run(start()) == "http://10.0.0.2:8888"
+    assert spawner.task_arn == "task/1"
+    assert spawner.task_definition_arn == "td/guest/default"
+    assert not spawner.calling_run_task
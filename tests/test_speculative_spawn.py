@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+import asyncio
+
+from speculative_spawn import STARTED_BY, SpeculativeSpawns
+from task_poller import TaskPoller
+
+
+class FakeECS:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.started = []
+        self.stopped = []
+
+    def run_task(self, **run_task_args):
+        if self.fail:
+            return {"tasks": [], "failures": [{"reason": "RESOURCE:ENI"}]}
+        self.started.append(run_task_args)
+        arn = f"task/{len(self.started)}"
+        return {"tasks": [{"taskArn": arn, "clusterArn": "cluster"}]}
+
+    def describe_tasks(self, cluster, tasks):
+        return {"tasks": [{
+            "taskArn": arn, "lastStatus": "RUNNING",
+            "attachments": [{"details": [
+                {"name": "privateIPv4Address", "value": "10.0.0.1"}
+            ]}]
+        } for arn in tasks]}
+
+    def stop_task(self, cluster, task, reason):
+        self.stopped.append((task, reason))
+
+
+class FakeDirectory:
+    def is_allowed(self, username):
+        return username != "stranger"
+
+    def is_admin(self, username):
+        return False
+
+    def profile(self, username):
+        return "large"
+
+
+class FakeRegistry:
+    def get_task_definition(self, username, admin, profile):
+        return f"td/{username}/{profile}"
+
+
+def make_spawns(ecs, timeout=120):
+    return SpeculativeSpawns(
+        ecs_client=ecs,
+        task_definition_registry=FakeRegistry(),
+        user_directory=FakeDirectory(),
+        run_task_args=lambda username, arn: {"taskDefinition": arn},
+        task_poller=TaskPoller(ecs),
+        timeout=timeout,
+        poll_interval=0.01
+    )
+
+
+def test_claim_started_task():
+    ecs = FakeECS()
+
+    async def login():
+        spawns = make_spawns(ecs)
+        spawns.start("alice")
+        # A second login click does not start another task
+        spawns.start("alice")
+        task = await spawns.claim("alice")
+        spawns.task_poller.poll()
+        running = await spawns.wait_until_running(task, 1)
+        return spawns, task, running
+
+    spawns, task, running = asyncio.run(login())
+    assert ecs.started == [
+        {"taskDefinition": "td/alice/large", "startedBy": STARTED_BY}
+    ]
+    assert running
+    assert task.ip == "10.0.0.1"
+    assert spawns.counts == {"started": 1, "claimed": 1, "cancelled": 0}
+
+
+def test_users_that_are_not_allowed_are_not_started():
+    ecs = FakeECS()
+
+    async def login():
+        spawns = make_spawns(ecs)
+        spawns.start("stranger")
+        return await spawns.claim("stranger")
+
+    assert asyncio.run(login()) is None
+    assert ecs.started == []
+
+
+def test_cancel_stops_the_task():
+    ecs = FakeECS()
+
+    async def login():
+        spawns = make_spawns(ecs)
+        spawns.start("alice")
+        # Cancelled while RunTask is still running
+        spawns.cancel("alice", "Authentication failed")
+        await asyncio.sleep(0.2)
+        return spawns
+
+    spawns = asyncio.run(login())
+    assert ecs.stopped == [("task/1", "Authentication failed")]
+    assert spawns.task_poller.watched == {}
+    assert spawns.speculations == {}
+
+
+def test_unclaimed_task_is_stopped_after_timeout():
+    ecs = FakeECS()
+
+    async def login():
+        spawns = make_spawns(ecs, timeout=0.05)
+        spawns.start("alice")
+        await asyncio.sleep(0.3)
+        return await spawns.claim("alice")
+
+    assert asyncio.run(login()) is None
+    assert ecs.stopped == [("task/1", "Login timed out")]
+
+
+def test_failed_run_task_is_not_claimed():
+    async def login():
+        spawns = make_spawns(FakeECS(fail=True))
+        spawns.start("alice")
+        return await spawns.claim("alice")
+
+    assert asyncio.run(login()) is None
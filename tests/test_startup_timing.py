@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+import asyncio
+
+from startup_timing import StartupTimer
+
+
+class FakeLog:
+    def __init__(self):
+        self.messages = []
+
+    def info(self, message):
+        self.messages.append(message)
+
+
+class FakeHub:
+    def __init__(self, now):
+        self.now = now
+        self.log = FakeLog()
+
+    def init_db(self):
+        self.now[0] += 1
+
+    async def init_spawners(self):
+        self.now[0] += 3
+        return 12
+
+    async def start(self):
+        self.now[0] += 0.5
+
+
+def test_breakdown_is_logged_when_started():
+    now = [0.0]
+    timer = StartupTimer(clock=lambda: now[0]).instrument(
+        FakeHub, ["init_db", "init_spawners", "start"]
+    )
+    hub = FakeHub(now)
+    hub.init_db()
+
+    async def start():
+        await hub.init_spawners()
+        assert hub.log.messages == []
+        await hub.start()
+
+    asyncio.run(start())
+    assert timer.steps == {"init_db": 1, "init_spawners": 3, "start": 0.5}
+    assert hub.log.messages == [
+        "Hub started in 4.50 s, 12 servers checked: init_spawners 3.00 s, "
+        "init_db 1.00 s, start 0.50 s"
+    ]
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+from task_poller import TaskPoller, task_ip
+
+
+class FakeECS:
+    """
+    Stand-in for the ECS API: the status of each task is set by the test;
+    unknown tasks are reported as failures
+    """
+
+    def __init__(self):
+        self.tasks = {}
+        self.calls = []
+
+    def add(self, arn, status="PROVISIONING", ip=""):
+        self.tasks[arn] = {"taskArn": arn, "lastStatus": status}
+        if ip:
+            self.tasks[arn]["attachments"] = [{"details": [
+                {"name": "privateIPv4Address", "value": ip}
+            ]}]
+
+    def describe_tasks(self, cluster, tasks):
+        self.calls.append((cluster, list(tasks)))
+        return {
+            "tasks": [dict(self.tasks[arn]) for arn in tasks
+                      if arn in self.tasks],
+            "failures": [{"arn": arn, "reason": "MISSING"} for arn in tasks
+                         if arn not in self.tasks]
+        }
+
+
+def test_task_ip():
+    assert task_ip(None) == ""
+    assert task_ip({"attachments": [{"details": [
+        {"name": "subnetId", "value": "subnet-1"},
+        {"name": "privateIPv4Address", "value": "10.0.0.1"}
+    ]}]}) == "10.0.0.1"
+
+
+def test_batches_of_100_per_cluster():
+    ecs = FakeECS()
+    poller = TaskPoller(ecs)
+    for index in range(250):
+        ecs.add(f"task/{index}")
+        poller.watch("cluster-a", f"task/{index}")
+    ecs.add("task/other")
+    poller.watch("cluster-b", "task/other")
+
+    poller.poll()
+    assert sorted(
+        (cluster, len(tasks)) for cluster, tasks in ecs.calls
+    ) == [("cluster-a", 50), ("cluster-a", 100), ("cluster-a", 100),
+          ("cluster-b", 1)]
+    assert poller.api_calls == 4
+    assert poller.status("task/249") == "PROVISIONING"
+
+
+def test_adaptive_interval():
+    ecs = FakeECS()
+    poller = TaskPoller(ecs, fast_interval=2, slow_interval=30)
+    assert poller.next_interval() == 30
+
+    ecs.add("task/1")
+    poller.watch("cluster", "task/1")
+    # Not described yet
+    assert poller.next_interval() == 2
+    poller.poll()
+    assert poller.next_interval() == 2
+
+    ecs.add("task/1", status="RUNNING", ip="10.0.0.1")
+    poller.poll()
+    assert poller.next_interval() == 30
+    assert task_ip(poller.get("task/1")) == "10.0.0.1"
+
+
+def test_missing_tasks():
+    ecs = FakeECS()
+    poller = TaskPoller(ecs)
+    # A new task can be missing for a short time after RunTask
+    poller.watch("cluster", "task/new")
+    poller.poll()
+    assert poller.status("task/new") == ""
+
+    ecs.add("task/new", status="RUNNING")
+    poller.poll()
+    assert poller.status("task/new") == "RUNNING"
+
+    # A task that was seen before and is gone has stopped
+    del ecs.tasks["task/new"]
+    poller.poll()
+    assert poller.status("task/new") == "STOPPED"
+
+
+def test_stopped_tasks_are_not_described_again():
+    ecs = FakeECS()
+    poller = TaskPoller(ecs)
+    ecs.add("task/1", status="STOPPED")
+    poller.watch("cluster", "task/1")
+    poller.poll()
+    poller.poll()
+    assert len(ecs.calls) == 1
+    assert poller.status("task/1") == "STOPPED"
+
+    poller.unwatch("task/1")
+    assert poller.get("task/1") is None
+    assert poller.watched == {}
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+import boto3
+from moto import mock_aws
+
+from task_registry import (
+    TaskDefinitionRegistry, resolve_image_digest, safe_username
+)
+
+REGION = "eu-central-1"
+
+
+def make_registry(image="123.dkr.ecr/single-user@sha256:aaa",
+                  max_entries=512, file_system=None):
+    efs_client = boto3.client("efs", region_name=REGION)
+    if file_system is None:
+        file_system_id = efs_client.create_file_system(
+            CreationToken="test"
+        )["FileSystemId"]
+        reference = efs_client.create_access_point(
+            FileSystemId=file_system_id,
+            RootDirectory={"Path": "/reference"}
+        )["AccessPointId"]
+    else:
+        file_system_id, reference = file_system
+    return TaskDefinitionRegistry(
+        ecs_client=boto3.client("ecs", region_name=REGION),
+        efs_client=efs_client,
+        file_system_id=file_system_id,
+        reference_access_point_id=reference,
+        execution_role_arn="arn:aws:iam::123456789012:role/execution",
+        task_role_arn="arn:aws:iam::123456789012:role/task",
+        image=image,
+        container_name="SingleUserContainer",
+        log_group="single-user-logs",
+        log_stream_prefix="some-basenameSingleUser-",
+        region=REGION,
+        max_entries=max_entries
+    )
+
+
+def describe(registry, arn):
+    return registry.ecs_client.describe_task_definition(
+        taskDefinition=arn
+    )["taskDefinition"]
+
+
+def test_safe_username():
+    assert safe_username("jupyter<NetId>@tudelft.nl") == \
+        "jupyter<NetId>_tudelft_nl"
+
+
+@mock_aws
+def test_registers_task_definition_and_access_point():
+    registry = make_registry()
+    arn = registry.get_task_definition("jupyter@tudelft.nl")
+
+    task_definition = describe(registry, arn)
+    assert task_definition["family"] == \
+        "SingleUser-jupyter_tudelft_nl-default"
+    assert task_definition["cpu"] == "2048"
+    assert task_definition["memory"] == "5120"
+    assert task_definition["networkMode"] == "awsvpc"
+
+    container = task_definition["containerDefinitions"][0]
+    assert container["portMappings"][0]["containerPort"] == 8888
+    assert container["logConfiguration"]["options"][
+        "awslogs-stream-prefix"] == "some-basenameSingleUser-"
+    assert container["mountPoints"] == [{
+        "containerPath": "/home/jovyan/work",
+        "sourceVolume": "efs-jupyter_tudelft_nl-volume",
+        "readOnly": False
+    }, {
+        "containerPath": "/home/jovyan/reference",
+        "sourceVolume": "efs-reference-volume",
+        "readOnly": True
+    }]
+
+    access_points = registry.efs_client.describe_access_points(
+        FileSystemId=registry.file_system_id
+    )["AccessPoints"]
+    paths = [ap["RootDirectory"]["Path"] for ap in access_points]
+    assert sorted(paths) == ["/jupyter_tudelft_nl", "/reference"]
+
+
+@mock_aws
+def test_admin_can_write_reference():
+    registry = make_registry()
+    arn = registry.get_task_definition("admin", admin=True)
+    mounts = describe(registry, arn)["containerDefinitions"][0][
+        "mountPoints"]
+    assert mounts[1]["readOnly"] is False
+
+
+@mock_aws
+def test_cache_and_reuse():
+    registry = make_registry()
+    arn = registry.get_task_definition("external_user")
+    assert registry.get_task_definition("external_user") == arn
+
+    # A new registry, as after a hub restart, reuses the existing
+    # access point and task definition revision
+    restarted = make_registry(file_system=(
+        registry.file_system_id, registry.reference_access_point_id
+    ))
+    assert restarted.get_task_definition("external_user") == arn
+    access_points = registry.efs_client.describe_access_points(
+        FileSystemId=registry.file_system_id
+    )["AccessPoints"]
+    assert len(access_points) == 2
+
+
+@mock_aws
+def test_new_image_registers_new_revision():
+    registry = make_registry()
+    arn = registry.get_task_definition("external_user")
+    registry.image = "123.dkr.ecr/single-user@sha256:bbb"
+    new_arn = registry.get_task_definition("external_user")
+    assert new_arn != arn
+    assert new_arn.endswith(":2")
+
+
+@mock_aws
+def test_lru_eviction():
+    registry = make_registry(max_entries=2)
+    for user in ("a", "b", "a", "c"):
+        registry.get_task_definition(user)
+    assert [key[0] for key in registry._cache] == ["a", "c"]
+
+
+@mock_aws
+def test_julia_depot():
+    registry = make_registry()
+    registry.julia_depot_access_point_id = "fsap-julia-depot"
+    for admin in (False, True):
+        task_definition = describe(
+            registry, registry.get_task_definition("user", admin=admin)
+        )
+        assert task_definition["containerDefinitions"][0]["mountPoints"][
+            -1] == {
+            "containerPath": "/opt/julia-depot",
+            "sourceVolume": "efs-julia-depot-volume",
+            "readOnly": not admin
+        }
+        assert task_definition["volumes"][-1]["efsVolumeConfiguration"][
+            "authorizationConfig"]["accessPointId"] == "fsap-julia-depot"
+
+
+def test_resolve_image_digest():
+    repository = "123.dkr.ecr.eu-central-1.amazonaws.com/single-user"
+    # A digest is used as is, without looking it up
+    assert resolve_image_digest(None, repository, "sha256:aaa") == \
+        f"{repository}@sha256:aaa"
+    # An unknown tag falls back to the tag
+    assert resolve_image_digest(None, repository, "latest") == \
+        f"{repository}:latest"
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+import json
+
+import boto3
+from moto import mock_aws
+
+from user_directory import (
+    DynamoDBBackend, FileBackend, SSMParameterBackend, UserDirectory,
+    make_document, shard_document, shard_index
+)
+
+REGION = "eu-central-1"
+
+
+def check_directory(directory, store):
+    store(make_document({"admin"}, {"admin", "student"},
+                        {"student": "large"}))
+    assert directory.refresh()
+    assert directory.is_allowed("student")
+    assert directory.is_admin("admin")
+    assert not directory.is_admin("student")
+    assert directory.profile("student") == "large"
+    assert directory.profile("admin") == "default"
+    assert not directory.is_allowed("nobody")
+
+    # Nothing changed, so nothing to do
+    assert not directory.refresh()
+
+    store(make_document({"admin"}, {"newcomer"}))
+    assert directory.refresh()
+    assert directory.usernames() == {"admin", "newcomer"}
+    assert directory.admins() == {"admin"}
+
+
+def test_make_document():
+    assert make_document({"a"}, {"a", "b"}) == {
+        "admins": ["a"], "users": ["b"], "profiles": {}
+    }
+
+
+def test_file_backend(tmp_path):
+    backend = FileBackend(str(tmp_path / "user_directory.json"))
+    version = [0]
+
+    def store(document):
+        backend.store(document)
+        # Make sure the version changes on file systems with coarse mtimes
+        version[0] += 1
+        with open(backend.path, "a") as fp:
+            fp.write(" " * version[0])
+
+    check_directory(UserDirectory(backend), store)
+
+
+@mock_aws
+def test_ssm_backend():
+    backend = SSMParameterBackend(
+        boto3.client("ssm", region_name=REGION), "/some-basename/users"
+    )
+    check_directory(UserDirectory(backend), backend.store)
+
+
+@mock_aws
+def test_ssm_backend_shards():
+    ssm_client = boto3.client("ssm", region_name=REGION)
+    backend = SSMParameterBackend(ssm_client, "/some-basename/users")
+    directory = UserDirectory(backend)
+    students = {f"student{number}@student.tudelft.nl"
+                for number in range(1000)}
+    backend.store(make_document({"admin"}, students))
+    index = json.loads(ssm_client.get_parameter(
+        Name="/some-basename/users")["Parameter"]["Value"])
+    value = json.dumps(make_document({"admin"}, students),
+                       separators=(",", ":"))
+    assert index["shards"] == len(value) // 4096 + 1 > 1
+    assert directory.refresh()
+    assert directory.usernames() == students | {"admin"}
+
+    # A half-updated directory is read at the next refresh
+    ssm_client.put_parameter(
+        Name="/some-basename/users/0", Value="{}", Type="String",
+        Overwrite=True
+    )
+    ssm_client.put_parameter(
+        Name="/some-basename/users", Value=json.dumps(index),
+        Type="String", Overwrite=True
+    )
+    assert not directory.refresh()
+    assert len(directory.usernames()) == 1001
+
+    # The shards of the larger directory are deleted
+    backend.store(make_document({"admin"}, {"student"}))
+    assert directory.refresh()
+    assert directory.usernames() == {"admin", "student"}
+    names = [parameter["Name"] for parameter in ssm_client.describe_parameters(
+        MaxResults=50)["Parameters"]]
+    assert sorted(names) == ["/some-basename/users", "/some-basename/users/0"]
+
+
+@mock_aws
+def test_ssm_backend_reads_single_parameter():
+    ssm_client = boto3.client("ssm", region_name=REGION)
+    ssm_client.put_parameter(
+        Name="/some-basename/users", Type="String",
+        Value=json.dumps(make_document({"admin"}, {"student"}))
+    )
+    directory = UserDirectory(
+        SSMParameterBackend(ssm_client, "/some-basename/users")
+    )
+    assert directory.refresh()
+    assert directory.usernames() == {"admin", "student"}
+
+
+def test_shard_document():
+    value = json.dumps(make_document({"admin"}, {"student"}))
+    shards = shard_document(value, size=10)
+    assert "".join(shards) == value
+    assert max(len(shard) for shard in shards) == 10
+    assert shard_index(value, shards)["shards"] == len(shards)
+
+
+@mock_aws
+def test_dynamodb_backend():
+    client = boto3.client("dynamodb", region_name=REGION)
+    client.create_table(
+        TableName="users",
+        KeySchema=[{"AttributeName": "username", "KeyType": "HASH"}],
+        AttributeDefinitions=[
+            {"AttributeName": "username", "AttributeType": "S"}
+        ],
+        BillingMode="PAY_PER_REQUEST"
+    )
+    backend = DynamoDBBackend(client, "users")
+    check_directory(UserDirectory(backend), backend.store)
+
+
+@mock_aws
+def test_dynamodb_refresh_reads_only_changes():
+    client = boto3.client("dynamodb", region_name=REGION)
+    client.create_table(
+        TableName="users",
+        KeySchema=[{"AttributeName": "username", "KeyType": "HASH"}],
+        AttributeDefinitions=[
+            {"AttributeName": "username", "AttributeType": "S"}
+        ],
+        BillingMode="PAY_PER_REQUEST"
+    )
+    backend = DynamoDBBackend(client, "users")
+    users = {f"student{i}" for i in range(50)}
+    backend.store(make_document(set(), users))
+    directory = UserDirectory(backend)
+    directory.refresh()
+
+    backend.store(make_document({"student1"}, users - {"student2"}))
+    version, records, is_delta = backend.fetch(directory.version)
+    assert is_delta
+    assert records == {
+        "student1": (True, "default"),
+        "student2": None
+    }
+
+
+def test_start_survives_missing_store(tmp_path):
+    directory = UserDirectory(
+        FileBackend(str(tmp_path / "missing.json")), refresh_interval=3600
+    ).start()
+    assert not directory.is_allowed("student")
+    with open(tmp_path / "missing.json", "w") as fp:
+        json.dump(make_document({"admin"}, set()), fp)
+    assert directory.refresh()
+    assert directory.is_admin("admin")
+    directory.stop()
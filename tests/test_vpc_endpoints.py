@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+import copy
+
+import yaml
+
+from aws_cdk import App, Environment
+from aws_cdk.assertions import Template, Match
+
+from HubStacks.frame_stack import FrameStack
+
+
+def make_template(**settings):
+    app = App()
+    config_yaml = copy.deepcopy(yaml.load(
+        open('example_config.yaml'), Loader=yaml.FullLoader))
+    config_yaml.update(settings)
+    frame = FrameStack(
+        app, "FrameStack", config_yaml,
+        env=Environment(account="123456789012", region="eu-central-1")
+    )
+    return Template.from_stack(frame)
+
+
+template = make_template(vpc_endpoints=True, nat_gateways=1)
+
+
+def find_id(resource_type, props):
+    resources = template.find_resources(resource_type, {"Properties": props})
+    assert len(resources) == 1
+    return list(resources)[0]
+
+
+def test_shared_nat_gateway():
+    template.resource_count_is(type="AWS::EC2::NatGateway", count=1)
+    template.resource_count_is(type="AWS::EC2::EIP", count=1)
+    # Both private subnets route to the internet through the one NAT gateway
+    nat_gateway_id = list(template.find_resources("AWS::EC2::NatGateway"))[0]
+    template.resource_properties_count_is(
+        "AWS::EC2::Route", {
+            "DestinationCidrBlock": "0.0.0.0/0",
+            "NatGatewayId": {"Ref": nat_gateway_id}
+        }, 2
+    )
+
+
+def test_s3_gateway_endpoint_routes():
+    private_route_tables = [
+        {"Ref": route_table_id} for route_table_id in
+        template.find_resources("AWS::EC2::RouteTable", {
+            "Properties": {"Tags": [{
+                "Key": "Name",
+                "Value": Match.string_like_regexp("PrivateSubnet")
+            }]}
+        })
+    ]
+    assert len(private_route_tables) == 2
+    template.has_resource_properties(
+        "AWS::EC2::VPCEndpoint", {
+            "ServiceName": Match.object_like({}),
+            "VpcEndpointType": "Gateway",
+            "RouteTableIds": Match.array_equals(private_route_tables)
+        }
+    )
+
+
+def test_interface_endpoints():
+    endpoint_security_group = find_id(
+        "AWS::EC2::SecurityGroup",
+        {"GroupDescription": "VPC interface endpoints security group"}
+    )
+    for service in ("ecr.api", "ecr.dkr", "logs", "ecs",
+                    "elasticfilesystem"):
+        template.has_resource_properties(
+            "AWS::EC2::VPCEndpoint", {
+                "ServiceName": Match.string_like_regexp(f"\\.{service}$"),
+                "VpcEndpointType": "Interface",
+                "PrivateDnsEnabled": True,
+                "SecurityGroupIds": [{
+                    "Fn::GetAtt": [endpoint_security_group, "GroupId"]
+                }]
+            }
+        )
+    template.resource_properties_count_is(
+        "AWS::EC2::VPCEndpoint", {"VpcEndpointType": "Interface"}, 5
+    )
+
+
+def test_endpoint_security_group_only_allows_ecs_service():
+    endpoint_security_group = find_id(
+        "AWS::EC2::SecurityGroup",
+        {"GroupDescription": "VPC interface endpoints security group"}
+    )
+    service_security_group = find_id(
+        "AWS::EC2::SecurityGroup",
+        {"GroupDescription": "Hub ECS service containers security group"}
+    )
+    # No ingress rules from CIDR ranges, and no outbound traffic
+    template.has_resource_properties(
+        "AWS::EC2::SecurityGroup", {
+            "GroupDescription": "VPC interface endpoints security group",
+            "SecurityGroupIngress": Match.absent(),
+            "SecurityGroupEgress": [Match.object_like({
+                "CidrIp": "255.255.255.255/32",
+                "Description": "Disallow all traffic"
+            })]
+        }
+    )
+    ingress = template.find_resources("AWS::EC2::SecurityGroupIngress", {
+        "Properties": {
+            "GroupId": {
+                "Fn::GetAtt": [endpoint_security_group, "GroupId"]
+            }
+        }
+    })
+    assert [rule["Properties"] for rule in ingress.values()] == [{
+        "Description": "Allow HTTPS from ECS Service containers",
+        "FromPort": 443,
+        "ToPort": 443,
+        "IpProtocol": "tcp",
+        "GroupId": {"Fn::GetAtt": [endpoint_security_group, "GroupId"]},
+        "SourceSecurityGroupId": {
+            "Fn::GetAtt": [service_security_group, "GroupId"]
+        }
+    }]
+
+
+def test_no_endpoints_by_default():
+    default_template = make_template()
+    default_template.resource_count_is(type="AWS::EC2::VPCEndpoint", count=0)
+    default_template.resource_count_is(type="AWS::EC2::NatGateway", count=2)
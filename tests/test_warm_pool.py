@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+import datetime
+import json
+
+from warm_pool import (
+    STARTED_BY, WarmPool, activation_request, hub_task_id, parse_schedule,
+    target_size
+)
+
+SCHEDULE = {
+    "default": 1,
+    "windows": [
+        {"start": "08:30", "end": "17:30", "size": 5},
+        {"start": "22:00", "end": "02:00", "size": 2}
+    ]
+}
+
+
+class FakeECS:
+    """
+    Stand-in for the ECS API: tasks are RUNNING, with an IP address,
+    from the first time they are described
+    """
+
+    def __init__(self):
+        self.tasks = {}
+        self.calls = []
+
+    def run_task(self, cluster, count, startedBy, taskDefinition="generic",
+                 **kwargs):
+        self.calls.append("RunTask")
+        tasks = []
+        for _ in range(count):
+            arn = f"arn:aws:ecs:task/{len(self.tasks)}"
+            self.tasks[arn] = {
+                "taskArn": arn, "clusterArn": cluster,
+                "lastStatus": "PROVISIONING", "startedBy": startedBy,
+                "taskDefinitionArn": taskDefinition
+            }
+            tasks.append(self.tasks[arn])
+        return {"tasks": tasks, "failures": []}
+
+    def describe_tasks(self, cluster, tasks):
+        self.calls.append("DescribeTasks")
+        described = []
+        for arn in tasks:
+            task = self.tasks[arn]
+            if task["lastStatus"] == "PROVISIONING":
+                task["lastStatus"] = "RUNNING"
+                task["attachments"] = [{"details": [{
+                    "name": "privateIPv4Address",
+                    "value": "10.0.0." + arn.rsplit("/", 1)[1]
+                }]}]
+            described.append(dict(task))
+        return {"tasks": described, "failures": []}
+
+    def stop_task(self, cluster, task, reason):
+        self.calls.append("StopTask")
+        self.tasks[task]["lastStatus"] = "STOPPED"
+
+    def list_tasks(self, cluster):
+        return {"taskArns": [
+            arn for arn, task in self.tasks.items()
+            if task["lastStatus"] != "STOPPED"
+        ]}
+
+    def running(self):
+        return [task for task in self.tasks.values()
+                if task["lastStatus"] != "STOPPED"]
+
+
+def run_task_args(username):
+    return {"cluster": "cluster", "count": 1, "taskDefinition": username}
+
+
+def make_pool(ecs, hour=9, candidates=10):
+    now = [datetime.datetime(2024, 1, 1, hour, 0)]
+    pool = WarmPool(
+        ecs, "cluster", run_task_args, SCHEDULE,
+        probe=lambda ip: True, hub_task_id="hub", clock=lambda: now[0]
+    )
+    for number in range(candidates):
+        pool.release(f"user{number}")
+    return pool, now
+
+
+def task_definitions(ecs):
+    return sorted(task["taskDefinitionArn"] for task in ecs.running())
+
+
+def test_target_size():
+    schedule = parse_schedule(SCHEDULE)
+    day = datetime.datetime(2024, 1, 1)
+    assert target_size(schedule, day.replace(hour=8, minute=29)) == 1
+    assert target_size(schedule, day.replace(hour=8, minute=30)) == 5
+    assert target_size(schedule, day.replace(hour=17, minute=30)) == 1
+    assert target_size(schedule, day.replace(hour=23)) == 2
+    assert target_size(schedule, day.replace(hour=1)) == 2
+
+
+def test_refill_and_claim():
+    ecs = FakeECS()
+    pool, _ = make_pool(ecs)
+    pool.refill()
+    # The most recently stopped users, with their own task definitions
+    assert task_definitions(ecs) == [
+        "user5", "user6", "user7", "user8", "user9"
+    ]
+    assert pool.ready_count() == 0
+
+    # The tasks are RUNNING and the agents respond
+    pool.refill()
+    assert pool.ready_count() == 5
+
+    # Tasks are only claimed by their own user
+    assert pool.claim("user0") is None
+    task = pool.claim("user9")
+    assert task.username == "user9"
+    assert task.ip.startswith("10.0.0.")
+    assert pool.ready_count() == 4
+
+    # The claimed user is no longer a candidate, the next one is started
+    pool.refill()
+    assert len(pool.tasks) == 5
+    assert "user4" in task_definitions(ecs)
+    assert pool.claim("user9") is None
+
+
+def test_claim_of_starting_task():
+    ecs = FakeECS()
+    pool, _ = make_pool(ecs)
+    pool.refill()
+    assert pool.claim("user9") is None
+    # The task that was not ready is stopped by the next refill
+    pool.refill()
+    assert "user9" not in task_definitions(ecs)
+    assert len(pool.tasks) == 5
+
+
+def test_release_moves_user_to_front():
+    ecs = FakeECS()
+    pool, _ = make_pool(ecs)
+    pool.release("user0")
+    pool.refill()
+    assert task_definitions(ecs) == [
+        "user0", "user6", "user7", "user8", "user9"
+    ]
+
+
+def test_scale_down_after_window():
+    ecs = FakeECS()
+    pool, now = make_pool(ecs, hour=17)
+    pool.refill()
+    pool.refill()
+    now[0] = now[0].replace(minute=45)
+    pool.refill()
+    assert len(pool.tasks) == 1
+    assert task_definitions(ecs) == ["user9"]
+
+
+def test_unclaimed_tasks_are_stopped():
+    ecs = FakeECS()
+    pool, now = make_pool(ecs)
+    pool.refill()
+    now[0] += datetime.timedelta(minutes=30)
+    pool.refill()
+    assert pool.ready_count() == 5
+
+    # The users did not log in again; their tasks are not restarted
+    now[0] += datetime.timedelta(minutes=30)
+    pool.refill()
+    assert "user9" not in pool.candidates
+    assert task_definitions(ecs) == [
+        "user0", "user1", "user2", "user3", "user4"
+    ]
+    assert ecs.calls.count("StopTask") == 5
+
+    # A user whose server stops again is a candidate again
+    pool.release("user9")
+    pool.refill()
+    assert "user9" in task_definitions(ecs)
+
+
+def test_fewer_candidates_than_target():
+    ecs = FakeECS()
+    pool, _ = make_pool(ecs, candidates=2)
+    pool.refill()
+    assert len(pool.tasks) == 2
+
+
+def test_stopped_tasks_are_replaced():
+    ecs = FakeECS()
+    pool, _ = make_pool(ecs)
+    pool.refill()
+    first = next(iter(pool.tasks))
+    ecs.tasks[first]["lastStatus"] = "STOPPED"
+    pool.refill()
+    assert first not in pool.tasks
+    assert len(pool.tasks) == 5
+
+
+def test_run_task_args_failure():
+    ecs = FakeECS()
+
+    def failing_run_task_args(username):
+        if username == "user9":
+            raise Exception("RegisterTaskDefinition failed")
+        return run_task_args(username)
+
+    pool, _ = make_pool(ecs)
+    pool.run_task_args = failing_run_task_args
+    pool.refill()
+    assert len(pool.tasks) == 4
+
+
+def test_stop_orphans():
+    ecs = FakeECS()
+    # A running hub, with its pool, and the pool of a stopped hub
+    ecs.run_task("cluster", 1, "ecs-svc")
+    running_hub = "0"
+    ecs.run_task("cluster", 2, f"{STARTED_BY}-{running_hub}")
+    ecs.run_task("cluster", 2, f"{STARTED_BY}-stopped")
+    pool, _ = make_pool(ecs)
+    pool.refill()
+    pool.stop_orphans()
+    assert sorted(task["startedBy"] for task in ecs.running()) == [
+        "ecs-svc", "warm-pool-0", "warm-pool-0"
+    ] + ["warm-pool-hub"] * 5
+
+
+def test_hub_task_id():
+    def fetch(url):
+        assert url == "http://169.254.170.2/v4/abc/task"
+        return {"TaskARN": "arn:aws:ecs:eu-central-1:1:task/cluster/0123"}
+
+    environ = {"ECS_CONTAINER_METADATA_URI_V4": "http://169.254.170.2/v4/abc"}
+    assert hub_task_id(environ, fetch) == "0123"
+    assert len(hub_task_id({})) == 32
+
+
+def test_activation_request():
+    headers, body = activation_request(
+        "secret", "jupyter@tudelft.nl", {"JUPYTERHUB_USER": "jupyter"}
+    )
+    assert headers["Authorization"] == "token secret"
+    assert json.loads(body) == {
+        "username": "jupyter@tudelft.nl",
+        "environment": {"JUPYTERHUB_USER": "jupyter"}
+    }
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+import json
+import threading
+import urllib.error
+import urllib.request
+from http.server import HTTPServer
+
+import pytest
+
+import warm_start
+from warm_pool import activation_request
+
+SECRET = "some-secret"
+
+
+@pytest.fixture
+def agent(monkeypatch):
+    monkeypatch.setenv("WARM_POOL_SECRET", SECRET)
+    warm_start.activation.clear()
+    server = HTTPServer(("127.0.0.1", 0), warm_start.ActivationHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+    warm_start.activation.clear()
+
+
+def request(url, method="GET", headers=None, body=None):
+    try:
+        with urllib.request.urlopen(urllib.request.Request(
+            url, method=method, headers=headers or {},
+            data=body.encode() if body is not None else None
+        )) as response:
+            return response.status
+    except urllib.error.HTTPError as error:
+        return error.code
+
+
+def activate(agent, secret=SECRET, body=None):
+    headers, default_body = activation_request(
+        secret, "guest", {"JUPYTERHUB_API_TOKEN": "token"}
+    )
+    return request(f"{agent}/activate", "POST", headers,
+                   default_body if body is None else body)
+
+
+def test_ready(agent):
+    assert request(f"{agent}/ready") == 200
+    assert request(f"{agent}/other") == 404
+
+
+def test_wrong_secret(agent):
+    assert activate(agent, secret="wrong") == 403
+    assert request(f"{agent}/activate", "POST", body="{}") == 403
+    assert warm_start.activation == {}
+
+
+def test_bad_request(agent):
+    assert activate(agent, body="not json") == 400
+    assert activate(agent, body=json.dumps({"username": "guest"})) == 400
+    assert activate(agent, body=json.dumps(
+        {"username": "", "environment": {}}
+    )) == 400
+    assert activate(agent, body=json.dumps(
+        {"username": "guest", "environment": ["JUPYTERHUB_API_TOKEN"]}
+    )) == 400
+    assert warm_start.activation == {}
+
+
+def test_activate_once(agent):
+    assert activate(agent) == 200
+    assert warm_start.activation == {
+        "username": "guest",
+        "environment": {"JUPYTERHUB_API_TOKEN": "token"}
+    }
+    # A task is only activated for one user
+    assert activate(agent) == 404
+
+
+def test_no_secret_configured(agent, monkeypatch):
+    monkeypatch.delenv("WARM_POOL_SECRET")
+    assert activate(agent, secret="") == 403
+
+
+def test_main(monkeypatch):
+    monkeypatch.setenv("WARM_POOL_SECRET", SECRET)
+    warm_start.activation.clear()
+
+    class FakeServer:
+        def __init__(self, address, handler):
+            self.requests = 0
+
+        def handle_request(self):
+            # The first request is a readiness probe
+            self.requests += 1
+            if self.requests == 2:
+                warm_start.activation.update(
+                    username="guest", environment={"JUPYTERHUB_USER": "guest"}
+                )
+
+        def server_close(self):
+            pass
+
+    executed = []
+    monkeypatch.setattr(warm_start, "HTTPServer", FakeServer)
+    monkeypatch.setattr(warm_start.os, "chdir", executed.append)
+    monkeypatch.setattr(
+        warm_start.os, "execve",
+        lambda path, args, environment: executed.append(environment)
+    )
+    warm_start.main()
+    warm_start.activation.clear()
+
+    directory, environment = executed
+    assert directory == warm_start.WORK_DIRECTORY
+    assert environment["JUPYTERHUB_USER"] == "guest"
+    # The secret is not passed on to the single user server
+    assert "WARM_POOL_SECRET" not in environment